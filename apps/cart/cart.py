@@ -1,7 +1,13 @@
 from apps.container import container
+from apps.money import Money
+from apps.money import line_totals
+from apps.pricing.engine import get_pricing_plan
 from django.conf import settings
+from .storage import SessionCartStorage
+from .storage import get_cart_storage
 
 CART_SESSION_ID = settings.CART_SESSION_ID 
+COUPON_SESSION_ID = f'{CART_SESSION_ID}_coupon'
 class Cart:
     """
     Represents a cart in the system.
@@ -12,16 +18,29 @@ class Cart:
     
     Attributes:
         session: session variable to handle products in browser
-        cart: dictionnary that stores users's product items
+        storage: backend persisting the cart (see apps/cart/storage.py)
+        cart: dictionnary that stores users's product items, loaded lazily
         items_count: number of distinct items within the cart
         total_items : number of all items (quantity) in the cart
-        taxes: VAT (20%)
+        discount : amount taken off by promotions and coupon
+        taxes: VAT, rate of the shipping country
         shipping_fee : delivering fee
         total_amount : amount of what user will pay for checkout
+        user : authenticated user, whose address gives the shipping country
+        coupon : coupon code entered by the user
+
+    Amounts are computed in integer cents (see apps/money.py) with the pricing
+    plan (see apps/pricing/engine.py), the float attributes and summary values
+    are derived from them.
+
+    Line aggregates (distinct items, total items, subtotal) are computed in a
+    single pass on first use, then updated incrementally by add(), remove(),
+    update_product_quantity() and clear(). The summary is cached until a change
+    of the cart marks it dirty.
         
     Methods:
         add(), save(), remove(), update_product_quantity(),
-        clear(), get_cart_summary()
+        clear(), reprice(), apply_coupon(), get_cart_summary()
         
     Example:
         >>> cart = Cart(session_data={}))
@@ -33,28 +52,108 @@ class Cart:
         
     """
     
-    def __init__(self, session_data):
+    def __init__(self, session_data, storage=None):
         """
         Initialize the cart 
 
         Args:
             session_data (dict): session for handling products in browser
+            storage (CartStorage, optional): cart storage backend. Defaults to
+                the session storage of session_data.
         """
         self.session = session_data
-        cart = self.session.get(CART_SESSION_ID)
-        if not cart:
-            cart = self.session[CART_SESSION_ID] = {}
-        self.cart = cart
+        self.storage = storage if storage is not None else SessionCartStorage(session_data)
+        self._cart = None
+        self._aggregates = None # {'count', 'total_items', 'subtotal'} of the lines
+        self._summary = None # cached summary, None when dirty
+        self._pricing = None # cached pricing of the lines, None when dirty
+        self.user = None
+        self.country = None
+        self.coupon = self.session.get(COUPON_SESSION_ID)
         self.items_count = 0
         self.total_items = 0
         self.taxes = 0.0
         self.shipping_fee = 0.0
         self.subtotal = 0.0
         self.total_amount = 0.0
+        self.discount = 0.0
+        self._subtotal = self._discount = self._taxes = self._shipping = self._total = Money()
         
-    def save(self):
-        """ Save cart modification into session and cart attribute"""
-        self.session[CART_SESSION_ID] = self.cart
+    @property
+    def cart(self):
+        """ Lines of the cart {sku : line}, read from the storage on first access """
+        if self._cart is None:
+            self._cart = self.storage.load()
+        return self._cart
+
+    @cart.setter
+    def cart(self, value):
+        self._cart = value
+        self._invalidate()
+
+    def _invalidate(self):
+        """ Forget aggregates and summary, they are recomputed on next use """
+        self._aggregates = None
+        self._mark_dirty()
+
+    def _mark_dirty(self):
+        """ Forget the summary and the pricing of the lines """
+        self._summary = None
+        self._pricing = None
+
+    @staticmethod
+    def unit_cents(item):
+        """ Unit price of a line in cents, lines stored before price_cents use their price """
+        if 'price_cents' in item:
+            return item['price_cents']
+        return Money.of(item['price']).cents
+
+    def _line_totals(self, sku):
+        """ (count, quantity, amount in cents) contribution of a line to the aggregates """
+        item = self.cart.get(sku)
+        if item is None:
+            return (0, 0, 0)
+        return (1, item['quantity'], self.unit_cents(item) * item['quantity'])
+
+    def _update_aggregates(self, sku, before):
+        """
+        Apply the change of a line to the running aggregates.
+
+        Args:
+            sku (str): sku of the changed line
+            before (tuple): _line_totals() of the line before the change
+        """
+        self._mark_dirty()
+        if self._aggregates is None:
+            return
+        after = self._line_totals(sku)
+        self._aggregates['count'] += after[0] - before[0]
+        self._aggregates['total_items'] += after[1] - before[1]
+        self._aggregates['subtotal'] += after[2] - before[2]
+
+    def _get_aggregates(self):
+        """ Aggregates of the lines, computed in a single pass if unknown """
+        if self._aggregates is None:
+            lines = list(self.cart.values())
+            quantities = [item['quantity'] for item in lines]
+            self._aggregates = {
+                'count' : len(lines),
+                'total_items' : sum(quantities),
+                'subtotal' : sum(line_totals(map(self.unit_cents, lines), quantities))
+            }
+        return self._aggregates
+
+    def save(self, changed=None):
+        """
+        Save cart modification into the storage
+
+        Args:
+            changed (iterable, optional): skus of the modified lines. Defaults to
+                None, every line is saved and the aggregates are recomputed.
+        """
+        if changed is None:
+            self._invalidate()
+        self.storage.write(self.cart, changed)
         self.modified = True 
     
     def add(self, product_sku, quantity=1):
@@ -94,44 +193,58 @@ class Cart:
         """
         
         try:
-            product_dict = container.product_repo.get_by_sku(product_sku)
+            line = container.cart_hydration.hydrate_line(product_sku)
         except ValueError as error:
             return error 
         
-        product = product_dict['product']
-        attributes = container.product_repo.get_variant_attribute(product)
+        sku = line['sku']
         quantity = int(quantity)
+        before = self._line_totals(sku)
         
-        if product.sku not in self.cart:
-            self.cart[product.sku] = {
-                'sku' : product.sku,
-                'category' : str(product.category) if product_dict['product_type'] == 'base' else str(product.product.category),
-                'title' : product.name if product_dict['product_type'] == 'base' else product.identifiant,
-                'price' : float(product.price),
-                'old_price' : float(product.old_price),
-                'stock' : int(product.stock),
-                'image' : container.product_repo.get_product_image(product.sku),
-                'quantity' : quantity if quantity > 0 else 1
-            }
+        if sku not in self.cart:
+            self.cart[sku] = dict(line, quantity=quantity if quantity > 0 else 1)
         else:
-            self.cart[product.sku]['quantity'] += quantity
+            self.cart[sku]['quantity'] += quantity
                 
-        if self.cart[product.sku]['quantity'] > int(product.stock): # product quantity will never exceed stock quantity
-            self.cart[product.sku]['quantity'] = int(product.stock)
+        if self.cart[sku]['quantity'] > line['stock']: # product quantity will never exceed stock quantity
+            self.cart[sku]['quantity'] = line['stock']
 
-        if len(attributes) > 0:
-            self.cart[product.sku]['attributes'] = attributes # attributes for variant products
-        
-        if float(product.old_price) > 0:
-            self.cart[product.sku]['discount'] = f'{product.discount:.2f}'
+        self._update_aggregates(sku, before)
+        self.save([sku])
+
+    def reprice(self):
+        """
+        Refresh price, stock and display data of every line from the catalog.
+        All lines are hydrated together with a constant number of queries.
+
+        Returns:
+            list : skus of lines whose product no longer exists
+        """
+        lines = container.cart_hydration.hydrate(self.cart.keys())
+        missing, changed = [], []
+        for sku, item in self.cart.items():
+            line = lines.get(sku)
+            if line is None:
+                missing.append(sku)
+                continue
+            item.pop('attributes', None)
+            item.pop('discount', None)
+            item.update(line)
+            if item['quantity'] > line['stock']:
+                item['quantity'] = line['stock']
+                changed.append(sku)
+
+        self._invalidate() # prices may have changed
+        self.save(changed)
+        return missing
 
-        self.save()
-        
     def clear(self):
-        """ Clear cart session and cart attribute """
-        self.session[CART_SESSION_ID] = {}
-        self.cart = {}
-        self.save()
+        """ Clear cart storage and cart attribute """
+        self.storage.clear()
+        self._cart = {}
+        self._aggregates = {'count' : 0, 'total_items' : 0, 'subtotal' : 0}
+        self._mark_dirty()
+        self.modified = True
 
     def remove(self, product_sku):
         """
@@ -143,12 +256,52 @@ class Cart:
         """
         product_sku = str(product_sku).strip()
         if product_sku in self.cart:
+            before = self._line_totals(product_sku)
             del self.cart[product_sku]
-            self.save()
+            self._update_aggregates(product_sku, before)
+            self.save([product_sku])
             return f'Product with sku "{product_sku}" deleted successfully !'
         else:
             return f'Product with sku "{product_sku}" doesn\'t exist !'
     
+    def apply_coupon(self, code):
+        """
+        Use a coupon code for the pricing of the cart
+
+        Args:
+            code (str): coupon code, an empty code removes the coupon
+
+        Returns:
+            bool : False if the code is unknown, the coupon is then left unchanged
+        """
+        code = str(code or '').strip()
+        if code and not get_pricing_plan().is_coupon(code):
+            return False
+        self.coupon = code or None
+        self.session[COUPON_SESSION_ID] = self.coupon
+        self._mark_dirty()
+        return True
+
+    def _get_country(self):
+        """ Shipping country, read from the address of the user once """
+        if self.country is None and self.user is not None:
+            address = container.user_service.get_user_address(self.user)
+            self.country = getattr(address, 'country', None) or ''
+        return self.country
+
+    def _get_pricing(self):
+        """ Discounts, taxes and shipping fee of the lines, from the pricing plan """
+        if self._pricing is None:
+            self._pricing = get_pricing_plan().price(
+                (
+                    (item['sku'], item.get('category'), self.unit_cents(item), item['quantity'])
+                    for item in self.cart.values()
+                ),
+                country=self._get_country(),
+                coupon=self.coupon
+            )
+        return self._pricing
+
     def get_shipping_fee(self):
         """
         Shipping_fee 
@@ -166,7 +319,8 @@ class Cart:
         Returns:
             subtotal (float) : sum of all products multiplied by its quantity
         """
-        self.subtotal = sum([item['price'] * item['quantity'] for item in self.cart.values()])
+        self._subtotal = Money(self._get_aggregates()['subtotal'])
+        self.subtotal = float(self._subtotal)
         return self.subtotal
     
     def set_items_count(self):
@@ -176,17 +330,30 @@ class Cart:
             items_count (int): number of all distinct items
 
         """
-        self.items_count = len(self.cart)
+        self.items_count = self._get_aggregates()['count']
         return self.items_count
 
+    def set_discount(self):
+        """
+        Calculate and returns the discount of promotions and coupon
+        Returns:
+            discount (float) attribute
+
+        """
+        self._discount = Money(self._get_pricing()['discount_cents'])
+        self.discount = float(self._discount)
+        return self.discount
+
     def set_taxes(self):
         """
-        Calculate and returns taxes
+        Calculate and returns taxes : VAT rate of the shipping country applied
+        to the discounted subtotal, rounded half up to the cent
         Returns:
             taxes (float) attribute 
 
         """
-        self.taxes = (self.subtotal * 20) / 100
+        self._taxes = Money(self._get_pricing()['taxes_cents'])
+        self.taxes = float(self._taxes)
         return self.taxes
     
     def set_total_items(self):
@@ -197,7 +364,7 @@ class Cart:
             total_items (float) , number of all items
 
         """
-        self.total_items = sum(item['quantity'] for item in self.cart.values() if isinstance(item, dict))
+        self.total_items = self._get_aggregates()['total_items']
         return self.total_items
     
     def set_shipping_fee(self, amount):
@@ -210,7 +377,8 @@ class Cart:
         Returns:
             shipping_fee for cart summary 
         """
-        self.shipping_fee = amount 
+        self._shipping = Money.of(amount)
+        self.shipping_fee = float(self._shipping)
         return self.shipping_fee
 
     def set_total_amount(self):
@@ -221,7 +389,8 @@ class Cart:
             total_amount (float): amount of money that will be paid when checkout
 
         """
-        self.total_amount =  self.subtotal + self.taxes + self.shipping_fee
+        self._total = self._subtotal - self._discount + self._taxes + self._shipping
+        self.total_amount = float(self._total)
         return self.total_amount
     
     def get_cart_summary(self):
@@ -232,28 +401,50 @@ class Cart:
             summary (dict) => a dictionnary that contains the following pair key-value items : 
                 - count : number of distinct items 
                 - total_items : number of all items
+                - discount : amount taken off by promotions
                 - taxes : vat of all products
                 - shipping_fee : delivery costs
                 - total_amount : amount of money for checkout
+                - subtotal_cents, discount_cents, taxes_cents, shipping_fee_cents,
+                  total_cents : the exact amounts in cents
+                - tax_rate : VAT rate applied, in percent
+                - promotions : names of the applied promotions
+                - coupon : coupon code, if it applied
+
+            The summary is computed once and served from cache until the cart changes.
 
         """
+        if self._summary is not None:
+            return dict(self._summary)
+
         self.set_items_count()
         self.set_total_items()
         self.set_subtotal_price()
+        self.set_discount()
         self.set_taxes()
-        self.set_shipping_fee(120) if self.items_count > 0 else self.set_shipping_fee(0)
+        self.set_shipping_fee(Money(self._get_pricing()['shipping_fee_cents']))
         self.set_total_amount()
 
         summary =  {
             'count':self.items_count,
             'total_items' : self.total_items,
             'subtotal_price' : self.subtotal,
+            'discount' : self.discount,
             'taxes' : self.taxes,
             'shipping_fee' : self.shipping_fee,
-            'total_price' : self.total_amount
+            'total_price' : self.total_amount,
+            'subtotal_cents' : self._subtotal.cents,
+            'discount_cents' : self._discount.cents,
+            'taxes_cents' : self._taxes.cents,
+            'shipping_fee_cents' : self._shipping.cents,
+            'total_cents' : self._total.cents,
+            'tax_rate' : self._get_pricing()['tax_rate'],
+            'promotions' : self._get_pricing()['promotions'],
+            'coupon' : self._get_pricing()['coupon']
         }
+        self._summary = summary
 
-        return summary
+        return dict(summary)
 
     def update_product_quantity(self, product_sku, product_quantity):
         """
@@ -271,26 +462,31 @@ class Cart:
         product_name = str(product_sku).strip()
         cart = self.cart
         if product_name in cart:
-            cart[product_sku]['quantity'] = product_quantity
-            self.save()
+            before = self._line_totals(product_name)
+            cart[product_name]['quantity'] = product_quantity
+            self._update_aggregates(product_name, before)
+            self.save([product_name])
 
         message = 1 if product_name in self.cart else None
 
-        self.save()
-
         return message
     
     @classmethod
     def from_request(cls, request):
-        """_summary_
+        """
+        Cart of a request, stored following the CART_STORAGE setting
 
         Args:
-            request (): _description_
+            request (HttpRequest): user's request
 
         Returns:
-            (class) : _description_
+            Cart : cart of the user or of the anonymous session
         """
-        return cls(request.session)
+        cart = cls(request.session, storage=get_cart_storage(request))
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            cart.user = user
+        return cart
 
     def __len__(self):
         """
@@ -300,7 +496,9 @@ class Cart:
             int : size of cart attribute
 
         """
-        return len(self.cart)
+        if self._cart is None:
+            return self.storage.count() # no need to load the lines
+        return len(self._cart)
 
     def __str__(self):
         """ String representation of Cart class """
@@ -1,3 +1,24 @@
 from django.db import models
 
-# Create your models here.
+class CartItem(models.Model):
+    """
+    Quantity of a product in a cart stored server side.
+
+    Used by DatabaseCartStorage (see apps/cart/storage.py) : only the sku and the
+    quantity are stored, display and pricing data are hydrated from the catalog
+    when the cart is read. A cart is identified by its owner :
+        - 'user:<user id>' for authenticated users
+        - 'anonymous:<token>' for visitors, the token living in their session
+    """
+    cart_key = models.CharField(max_length=64)
+    sku = models.CharField(max_length=100)
+    quantity = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart_key', 'sku'], name='cart_item_unique_sku')
+        ]
+
+    def __str__(self):
+        return f'{self.quantity} x {self.sku} ({self.cart_key})'
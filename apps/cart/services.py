@@ -0,0 +1,122 @@
+from apps.money import Money
+
+class CartHydrationService:
+    """
+    Service building denormalized cart lines for a batch of SKUs.
+
+    Every cart line carries display and pricing data (title, category, price,
+    stock, image url and attributes). Instead of resolving each SKU and its
+    images and attributes one by one, this service resolves the whole batch
+    through the ProductRepository with a constant number of queries.
+
+    Attributes:
+        repository (ProductRepository) : The repository instance used for
+            database interactions.
+
+    Methods:
+        hydrate(skus : list, include_media : bool) -> dict :
+            Returns cart lines of every known SKU
+
+        hydrate_line(sku : str) -> dict :
+            Returns the cart line of a single SKU
+
+    """
+    def __init__(self, product_repo):
+        self.repository = product_repo
+
+    def hydrate(self, skus, include_media : bool = True) -> dict:
+        """
+        Build cart lines for a batch of SKUs.
+
+        Args:
+            skus (iterable): products' skus
+            include_media (bool, optional): load image url and attributes.
+                Defaults to True. Pricing and stock checks can skip them and
+                resolve the batch with a single query.
+
+        Returns:
+            dict : {sku : line} where line contains sku, category, title, price,
+                price_cents, old_price, stock and, if include_media, image and attributes.
+                Unknown SKUs are left out of the mapping.
+        """
+        products = self.repository.get_many_by_sku(skus)
+        attributes = {}
+        if include_media:
+            attributes = self.repository.prefetch_line_details(products.values())
+
+        return {
+            sku : self.build_line(product_dict, include_media, attributes)
+            for sku, product_dict in products.items()
+        }
+
+    def hydrate_line(self, sku : str) -> dict:
+        """
+        Build the cart line of a single SKU.
+
+        Args:
+            sku (str): product' sku
+
+        Returns:
+            dict : cart line of the product
+
+        Raises:
+            ValueError : if there is no product found
+        """
+        sku = str(sku).strip()
+        line = self.hydrate([sku]).get(sku)
+        if line is None:
+            raise ValueError(f"Product with SKU '{sku}' not found")
+        return line
+
+    def build_line(self, product_dict : dict, include_media : bool = True, attributes : dict | None = None) -> dict:
+        """
+        Build a cart line from a resolved product.
+
+        Args:
+            product_dict (dict): product and product_type as returned by get_by_sku
+            include_media (bool, optional): add image url and attributes. Defaults to True.
+            attributes (dict, optional): {variant_id : attributes} as returned by
+                ProductRepository.get_variant_attributes_map()
+
+        Returns:
+            dict : cart line without quantity
+        """
+        product = product_dict['product']
+        is_variant = product_dict['product_type'] == 'variant'
+        line = {
+            'sku' : product.sku,
+            'category' : str(product.product.category if is_variant else product.category),
+            'title' : product.identifiant if is_variant else product.name,
+            'price' : float(product.price),
+            'price_cents' : Money.of(product.price).cents,
+            'old_price' : float(product.old_price),
+            'stock' : int(product.stock),
+        }
+        if include_media:
+            line['image'] = self.image_url(product, is_variant)
+            variant_attributes = (attributes or {}).get(product.id, {}) if is_variant else {}
+            if len(variant_attributes) > 0:
+                line['attributes'] = variant_attributes # attributes for variant products
+
+        if float(product.old_price) > 0:
+            line['discount'] = f'{product.discount:.2f}'
+
+        return line
+
+    def image_url(self, product, is_variant : bool) -> str:
+        """
+        Url of the main image of a product, read from prefetched images.
+        Variants without their own image fall back to the base product image.
+
+        Returns:
+            str : image url or an empty string if the product has no image
+        """
+        images = list(product.variant_image.all()) if is_variant else []
+        if not images:
+            base_product = product.product if is_variant else product
+            images = list(base_product.images.all())
+
+        for item in images:
+            if item.image:
+                return str(item.image.url)
+        return ''
@@ -0,0 +1,9 @@
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+from .storage import merge_anonymous_cart
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    """ Move the anonymous cart stored in database into the cart of the user """
+    if request is not None and hasattr(request, 'session'):
+        merge_anonymous_cart(request.session, user)
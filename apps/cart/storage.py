@@ -0,0 +1,213 @@
+"""
+Storage backends of the cart.
+
+The Cart class (apps/cart/cart.py) works on a dict of lines {sku : line} and
+delegates persistence to a storage backend, chosen with the CART_STORAGE setting :
+
+    - 'session' : SessionCartStorage, the whole denormalized cart (titles,
+      images, attributes...) lives in the session.
+    - 'database' : DatabaseCartStorage, only sku -> quantity is stored in the
+      CartItem table. Lines are hydrated from the catalog when the cart is read
+      and only changed lines are written, the session only holds a cart token.
+
+A line whose product was deleted is kept by both backends (the session keeps its
+last copy, the database an unavailable line), the cart validation chain of the
+checkout reports and removes it.
+"""
+import uuid
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from apps.container import container
+from .models import CartItem
+
+CART_SESSION_ID = settings.CART_SESSION_ID
+CART_TOKEN_SESSION_ID = f'{CART_SESSION_ID}_token'
+
+class CartStorage:
+    """
+    Interface of cart storage backends.
+
+    Methods:
+        load() -> dict :
+            Returns the lines of the cart {sku : line}, each line having a quantity
+
+        count() -> int :
+            Returns the number of distinct lines, without loading them if possible
+
+        write(cart : dict, changed : iterable | None) :
+            Persist lines of the cart, only the changed skus if given
+
+        clear() :
+            Remove every line of the cart
+    """
+    def load(self) -> dict:
+        raise NotImplementedError
+
+    def count(self) -> int:
+        return len(self.load())
+
+    def write(self, cart : dict, changed=None) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+class SessionCartStorage(CartStorage):
+    """ Denormalized cart stored in the session (or any dict) """
+    def __init__(self, session):
+        self.session = session
+
+    def load(self) -> dict:
+        if not self.session.get(CART_SESSION_ID):
+            self.session[CART_SESSION_ID] = {}
+        return self.session[CART_SESSION_ID]
+
+    def count(self) -> int:
+        # read only : counting doesn't create a session for a visitor without cart
+        return len(self.session.get(CART_SESSION_ID) or {})
+
+    def write(self, cart : dict, changed=None) -> None:
+        # the session is serialized as a whole, changed lines can't be written alone
+        self.session[CART_SESSION_ID] = cart
+
+    def clear(self) -> None:
+        self.session[CART_SESSION_ID] = {}
+
+class DatabaseCartStorage(CartStorage):
+    """
+    Cart stored as sku -> quantity rows of the CartItem table.
+
+    Args:
+        cart_key (str | None): key of the cart, None for a visitor without cart yet
+        session (dict, optional): session of the visitor, receives the token of
+            an anonymous cart on its first write
+    """
+    def __init__(self, cart_key : str | None, session=None):
+        self.cart_key = cart_key
+        self.session = session
+
+    @classmethod
+    def from_request(cls, request):
+        """ Cart of the authenticated user, or the anonymous cart of the session """
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return cls(user_cart_key(user))
+        token = request.session.get(CART_TOKEN_SESSION_ID)
+        return cls(anonymous_cart_key(token) if token else None, session=request.session)
+
+    def quantities(self) -> dict:
+        """ {sku : quantity} of the cart, a single query """
+        if self.cart_key is None:
+            return {}
+        return dict(CartItem.objects.filter(cart_key=self.cart_key).values_list('sku', 'quantity'))
+
+    def load(self) -> dict:
+        quantities = self.quantities()
+        lines = container.cart_hydration.hydrate(quantities.keys())
+        return {
+            sku : dict(lines[sku], quantity=quantity) if sku in lines else unavailable_line(sku, quantity)
+            for sku, quantity in quantities.items()
+        }
+
+    def count(self) -> int:
+        if self.cart_key is None:
+            return 0
+        return CartItem.objects.filter(cart_key=self.cart_key).count()
+
+    def write(self, cart : dict, changed=None) -> None:
+        if self.cart_key is None:
+            if not cart:
+                return
+            token = uuid.uuid4().hex
+            self.session[CART_TOKEN_SESSION_ID] = token
+            self.cart_key = anonymous_cart_key(token)
+
+        items = CartItem.objects.filter(cart_key=self.cart_key)
+        skus = cart.keys() if changed is None else set(changed)
+        with transaction.atomic():
+            if changed is None:
+                items.exclude(sku__in=list(skus)).delete()
+            else:
+                items.filter(sku__in=[sku for sku in skus if sku not in cart]).delete()
+            for sku in skus:
+                if sku in cart:
+                    CartItem.objects.update_or_create(
+                        cart_key=self.cart_key,
+                        sku=sku,
+                        defaults={'quantity' : cart[sku]['quantity']}
+                    )
+
+    def clear(self) -> None:
+        if self.cart_key is not None:
+            CartItem.objects.filter(cart_key=self.cart_key).delete()
+
+def unavailable_line(sku : str, quantity : int) -> dict:
+    """
+    Line of a stored SKU the catalog no longer resolves.
+
+    It has no price nor stock, the sku stands for the unknown title.
+
+    Args:
+        sku (str): stored sku
+        quantity (int): stored quantity
+
+    Returns:
+        dict : cart line flagged as unavailable
+    """
+    return {
+        'sku' : sku,
+        'category' : '',
+        'title' : sku,
+        'price' : 0.0,
+        'price_cents' : 0,
+        'old_price' : 0.0,
+        'stock' : 0,
+        'image' : '',
+        'quantity' : quantity,
+        'unavailable' : True,
+    }
+
+def user_cart_key(user) -> str:
+    return f'user:{user.pk}'
+
+def anonymous_cart_key(token : str) -> str:
+    return f'anonymous:{token}'
+
+def get_cart_storage(request) -> CartStorage:
+    """
+    Storage backend of the cart of a request, following the CART_STORAGE setting.
+
+    Raises:
+        ValueError : if CART_STORAGE is not 'session' or 'database'
+    """
+    backend = getattr(settings, 'CART_STORAGE', 'session')
+    if backend == 'session':
+        return SessionCartStorage(request.session)
+    if backend == 'database':
+        return DatabaseCartStorage.from_request(request)
+    raise ValueError(f"Unknown cart storage '{backend}'")
+
+def merge_anonymous_cart(session, user) -> None:
+    """
+    Move the anonymous cart of a session into the cart of a user who just logged in.
+    Quantities of products found in both carts are added up.
+
+    Args:
+        session (dict): session of the request, holding the anonymous cart token
+        user (User): authenticated user
+    """
+    token = session.pop(CART_TOKEN_SESSION_ID, None)
+    if not token:
+        return
+
+    source = CartItem.objects.filter(cart_key=anonymous_cart_key(token))
+    target_key = user_cart_key(user)
+    with transaction.atomic():
+        for sku, quantity in source.values_list('sku', 'quantity'):
+            updated = CartItem.objects.filter(cart_key=target_key, sku=sku).update(
+                quantity=F('quantity') + quantity
+            )
+            if not updated:
+                CartItem.objects.create(cart_key=target_key, sku=sku, quantity=quantity)
+        source.delete()
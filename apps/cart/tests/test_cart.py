@@ -144,3 +144,46 @@ class TestCart:
 
 
     
+class TestCartSummaryCache:
+    def full_pass(self, cart):
+        return {
+            'count' : len(cart.cart),
+            'total_items' : sum(item['quantity'] for item in cart.cart.values()),
+            'subtotal_price' : round(sum(item['price'] * item['quantity'] for item in cart.cart.values()), 2)
+        }
+
+    def assert_summary(self, cart):
+        summary = cart.get_cart_summary()
+        assert {key : summary[key] for key in ('count', 'total_items', 'subtotal_price')} == self.full_pass(cart)
+
+    def test_aggregates_follow_changes(self, sku, variant_sku, product, variant_product, cart):
+        self.assert_summary(cart)
+        cart.add(sku, quantity=3)
+        self.assert_summary(cart)
+        cart.add(variant_sku, quantity=2)
+        cart.add(sku)
+        self.assert_summary(cart)
+        cart.update_product_quantity(variant_sku, 1)
+        self.assert_summary(cart)
+        cart.remove(sku)
+        self.assert_summary(cart)
+        cart.clear()
+        assert cart.get_cart_summary()['total_price'] == 0
+
+    def test_summary_served_from_cache(self, mocker, sku, product, cart):
+        cart.add(sku, quantity=2)
+        subtotal = mocker.spy(cart, 'set_subtotal_price')
+        first = cart.get_cart_summary()
+        first['total_price'] = 0 # callers get a copy
+        assert cart.get_cart_summary()['total_price'] > 0
+        assert subtotal.call_count == 1
+        cart.add(sku)
+        assert cart.get_cart_summary()['total_items'] == 3
+        assert subtotal.call_count == 2
+
+    def test_save_without_changed_lines_recomputes(self, sku, product, cart):
+        cart.add(sku)
+        cart.get_cart_summary()
+        cart.cart[sku]['quantity'] = 6
+        cart.save()
+        assert cart.get_cart_summary()['total_items'] == 6
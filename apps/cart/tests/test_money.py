@@ -0,0 +1,114 @@
+import pytest
+from decimal import Decimal
+from hypothesis import given
+from hypothesis import settings
+from hypothesis import strategies as st
+from apps.cart.cart import Cart
+from apps.container import container
+from apps.money import Money
+from apps.money import line_totals
+from apps.conftest import (
+    checkout_user,
+    product,
+    sku,
+    pytestmark
+)
+
+prices = st.decimals(min_value=Decimal('0.01'), max_value=Decimal('9999.99'), places=2)
+cart_lines = st.lists(st.tuples(prices, st.integers(min_value=1, max_value=25)), min_size=1, max_size=15)
+
+def build_cart(lines):
+    cart = Cart({})
+    cart.cart = {
+        f'SKU-{index}' : {
+            'sku' : f'SKU-{index}',
+            'title' : f'Product {index}',
+            'price' : float(price),
+            'price_cents' : Money.of(price).cents,
+            'quantity' : quantity
+        }
+        for index, (price, quantity) in enumerate(lines)
+    }
+    return cart
+
+class TestMoney:
+    @pytest.mark.parametrize('value, cents', [
+        ('19.99', 1999),
+        (19.99, 1999),
+        (Decimal('0.005'), 1),
+        (Decimal('0.004'), 0),
+        (12, 1200),
+        (' 7.5 ', 750),
+    ])
+    def test_of(self, value, cents):
+        assert Money.of(value).cents == cents
+
+    @pytest.mark.parametrize('value', ['abc', 'NaN', 'Infinity', None])
+    def test_of_invalid(self, value):
+        with pytest.raises(ValueError) as exc_info:
+            Money.of(value)
+        assert str(exc_info.value) == f"Invalid amount '{value}'"
+
+    def test_arithmetic(self):
+        price = Money.of('19.99')
+        assert price * 3 == 3 * price == Money(5997)
+        assert price + Money(1) - Money(100) == Money(1900)
+        assert sum([price, price]) == Money(3998)
+        assert (price * 3).percent(20) == Money(1199) # 1199.4 cents
+        assert Money(1).percent(50) == Money(1) # half up
+        assert Money(1999).to_decimal() == Decimal('19.99')
+        assert (str(price), float(price)) == ('19.99', 19.99)
+
+    def test_immutable_integer_cents(self):
+        with pytest.raises(AttributeError):
+            Money(1).cents = 2
+        with pytest.raises(ValueError):
+            Money(1.5)
+
+    def test_line_totals(self):
+        assert line_totals([1999, 500], [3, 2]) == [5997, 1000]
+
+class TestCheckoutTotals:
+    def test_cart_line_has_price_cents(self, sku, product):
+        cart = Cart({})
+        cart.add(sku, quantity=3)
+        assert cart.cart[sku]['price_cents'] == 1200
+        assert cart.get_cart_summary()['subtotal_cents'] == 3600
+
+    def test_totals_use_settings(self, settings, sku, product):
+        settings.CART_VAT_RATE = '5.5'
+        settings.CART_SHIPPING_FEE = '9.90'
+        cart = Cart({})
+        cart.add(sku, quantity=3)
+        summary = cart.get_cart_summary()
+        assert (summary['taxes_cents'], summary['shipping_fee_cents']) == (198, 990)
+        assert summary['total_price'] == 47.88
+
+    @given(lines=cart_lines)
+    @settings(max_examples=200, deadline=None)
+    def test_summary_is_exact(self, lines):
+        summary = build_cart(lines).get_cart_summary()
+        subtotal = sum(price * quantity for price, quantity in lines)
+        assert Money(summary['subtotal_cents']).to_decimal() == subtotal
+        assert summary['total_cents'] == summary['subtotal_cents'] + summary['taxes_cents'] + summary['shipping_fee_cents']
+        assert summary['total_price'] == float(Money(summary['total_cents']).to_decimal())
+
+    def test_cart_order_and_stripe_agree(self):
+        buyer = checkout_user('Money', '21th Street')
+
+        @given(lines=cart_lines)
+        @settings(max_examples=60, deadline=None)
+        def check(lines):
+            cart = build_cart(lines)
+            summary = cart.get_cart_summary()
+            line_items = container.payment_service.create_cart_checkout(cart)
+            stripe_total = sum(item['price_data']['unit_amount'] * item['quantity'] for item in line_items)
+            order = container.checkout_service.order_creation(cart=cart, user=buyer)
+            order.refresh_from_db()
+
+            assert stripe_total == summary['total_cents']
+            assert order.final_total == Money(stripe_total).to_decimal()
+            assert order.subtotal + order.vat + order.shipping_cost == order.final_total
+            assert order.vat == Money(summary['taxes_cents']).to_decimal()
+
+        check()
@@ -0,0 +1,110 @@
+import pytest
+import factory
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from apps.container import container
+from apps.cart.cart import Cart
+from apps.factories import (
+    ProductFactory,
+    ProductVariantFactory,
+    ProductImageFactory,
+    VariantAttributeFactory,
+    CategoryFactory
+)
+from apps.conftest import (
+    product,
+    variant_product,
+    sku,
+    variant_sku,
+    pytestmark
+)
+
+def catalog(size):
+    """Create `size` base products and `size` variants, all with images and attributes"""
+    skus = []
+    category = CategoryFactory(name='Catalog', slug='catalog')
+    for index in range(size):
+        base = ProductFactory(name=f'Product {index}', slug=f'product-{index}', category=category, status='published')
+        ProductImageFactory(product=base, image=factory.django.ImageField(color='red'))
+        variant = ProductVariantFactory(product=base, identifiant=f'Variant {index}')
+        VariantAttributeFactory(variant=variant)
+        skus += [base.sku, variant.sku]
+    return skus
+
+def count_queries(func, *args, **kwargs):
+    with CaptureQueriesContext(connection) as context:
+        func(*args, **kwargs)
+    return len(context.captured_queries)
+
+class TestCartHydrationService:
+    def test_hydrate_base_product(self, sku, product):
+        lines = container.cart_hydration.hydrate([sku])
+        line = lines[sku]
+        assert line['title'] == product.name
+        assert line['category'] == str(product.category)
+        assert line['price'] == float(product.price)
+        assert line['stock'] == product.stock
+        assert line['image'] == product.images.first().image.url
+        assert 'attributes' not in line
+
+    def test_hydrate_variant_product(self, variant_sku, variant_product):
+        line = container.cart_hydration.hydrate_line(variant_sku)
+        assert line['title'] == variant_product.identifiant
+        assert line['category'] == str(variant_product.product.category)
+        assert line['image'] == variant_product.variant_image.first().image.url
+        assert line['attributes'] == {'Color':'Red', 'Size':'XL', 'Material':'Coton'}
+
+    def test_hydrate_variant_without_image(self, product):
+        variant = ProductVariantFactory(product=product)
+        line = container.cart_hydration.hydrate_line(variant.sku)
+        assert line['image'] == product.images.first().image.url
+
+    def test_hydrate_unknown_sku(self, sku, product):
+        assert list(container.cart_hydration.hydrate([sku, 'invalid_sku']).keys()) == [sku]
+        with pytest.raises(ValueError) as exc_info:
+            container.cart_hydration.hydrate_line('invalid_sku')
+        assert "Product with SKU 'invalid_sku' not found" == str(exc_info.value)
+
+    def test_hydrate_without_media_single_query(self, django_assert_num_queries, sku, product, variant_sku, variant_product):
+        with django_assert_num_queries(1):
+            lines = container.cart_hydration.hydrate([sku, variant_sku], include_media=False)
+        assert lines[variant_sku]['stock'] == variant_product.stock
+        assert 'image' not in lines[sku]
+
+    def test_hydrate_constant_queries(self):
+        skus = catalog(16)
+        small = count_queries(container.cart_hydration.hydrate, skus[:2])
+        large = count_queries(container.cart_hydration.hydrate, skus)
+        assert small == large <= 5
+
+    def test_cart_add_constant_queries(self):
+        skus = catalog(16)
+        cart = Cart({})
+        first = count_queries(cart.add, skus[1])
+        last = count_queries(cart.add, skus[-1])
+        assert first == last <= 4
+
+    def test_cart_reprice(self, sku, product):
+        cart = Cart({})
+        cart.add(sku, quantity=3)
+        product.price = 99
+        product.stock = 2
+        product.save()
+        assert cart.reprice() == []
+        assert cart.cart[sku]['price'] == 99.0
+        assert cart.cart[sku]['quantity'] == 2
+
+    def test_cart_reprice_constant_queries(self):
+        skus = catalog(16)
+        small_cart, large_cart = Cart({}), Cart({})
+        small_cart.add(skus[0])
+        small_cart.add(skus[1])
+        for item_sku in skus:
+            large_cart.add(item_sku)
+        assert count_queries(small_cart.reprice) == count_queries(large_cart.reprice)
+
+    def test_cart_reprice_missing_product(self, sku, product):
+        cart = Cart({})
+        cart.add(sku)
+        product.delete()
+        assert cart.reprice() == [sku]
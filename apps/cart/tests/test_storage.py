@@ -0,0 +1,102 @@
+import pytest
+from django.urls import reverse
+from apps.cart.cart import Cart
+from apps.cart.models import CartItem
+from apps.cart.storage import DatabaseCartStorage
+from apps.cart.storage import CART_TOKEN_SESSION_ID
+from apps.container import container
+from apps.conftest import (
+    product,
+    variant_product,
+    sku,
+    variant_sku,
+    checkout_user,
+    pytestmark
+)
+
+@pytest.fixture
+def database_storage(settings):
+    settings.CART_STORAGE = 'database'
+
+def stored_quantities():
+    return dict(CartItem.objects.values_list('sku', 'quantity'))
+
+class TestSessionCartStorage:
+    def test_session_holds_denormalized_lines(self, sku, product):
+        session = {}
+        Cart(session).add(sku, quantity=2)
+        assert session['cart'][sku]['title'] == 'Blue Jeans'
+        assert session['cart'][sku]['quantity'] == 2
+        assert not CartItem.objects.exists()
+
+class TestDatabaseCartStorage:
+    def test_only_quantities_are_stored(self, sku, product, variant_sku, variant_product):
+        session = {}
+        cart = Cart(session, storage=DatabaseCartStorage(None, session=session))
+        cart.add(sku, quantity=2)
+        cart.add(variant_sku)
+        assert stored_quantities() == {sku : 2, variant_sku : 1}
+        assert list(session.keys()) == [CART_TOKEN_SESSION_ID]
+
+    def test_lines_are_hydrated_lazily(self, django_assert_num_queries, sku, product, variant_sku, variant_product):
+        CartItem.objects.create(cart_key='user:1', sku=sku, quantity=3)
+        CartItem.objects.create(cart_key='user:1', sku=variant_sku, quantity=1)
+        cart = Cart({}, storage=DatabaseCartStorage('user:1'))
+        with django_assert_num_queries(1):
+            assert len(cart) == 2
+        assert cart.cart[sku]['quantity'] == 3
+        assert cart.cart[variant_sku]['attributes']['Size'] == 'XL'
+        assert cart.get_cart_summary()['total_items'] == 4
+
+    def test_only_changed_lines_are_written(self, sku, product, variant_sku, variant_product):
+        cart = Cart({}, storage=DatabaseCartStorage('user:1'))
+        cart.add(sku)
+        cart.add(variant_sku)
+        CartItem.objects.filter(sku=sku).update(quantity=5) # concurrent change of another line
+        cart.update_product_quantity(variant_sku, 2)
+        assert stored_quantities() == {sku : 5, variant_sku : 2}
+        cart.remove(sku)
+        assert stored_quantities() == {variant_sku : 2}
+        cart.clear()
+        assert stored_quantities() == {}
+
+    def test_unknown_skus_are_unavailable(self, sku, product):
+        CartItem.objects.create(cart_key='user:1', sku=sku, quantity=1)
+        CartItem.objects.create(cart_key='user:1', sku='SKU-REMOVED', quantity=2)
+        cart = Cart({}, storage=DatabaseCartStorage('user:1'))
+        assert list(cart.cart.keys()) == [sku, 'SKU-REMOVED']
+        assert cart.cart['SKU-REMOVED']['unavailable']
+        assert cart.get_cart_summary()['subtotal_cents'] == cart.cart[sku]['price_cents']
+
+    def test_unknown_skus_removed_by_validation(self, sku, product):
+        CartItem.objects.create(cart_key='user:1', sku=sku, quantity=1)
+        CartItem.objects.create(cart_key='user:1', sku='SKU-REMOVED', quantity=2)
+        cart = Cart({}, storage=DatabaseCartStorage('user:1'))
+        changes = container.checkout_service.revalidate_cart(cart)
+        assert changes['removed'] == [{'sku' : 'SKU-REMOVED', 'title' : 'SKU-REMOVED', 'reason' : 'deleted'}]
+        assert stored_quantities() == {sku : 1}
+
+class TestDatabaseCartViews:
+    def test_anonymous_cart_merged_at_login(self, client, database_storage, sku, product, variant_sku, variant_product):
+        user = checkout_user('Merge', '12th Street')
+        CartItem.objects.create(cart_key=f'user:{user.pk}', sku=sku, quantity=1)
+        client.post(reverse('cart-add', kwargs={'product_sku' : sku, 'product_quantity' : 2}))
+        client.post(reverse('cart-add', kwargs={'product_sku' : variant_sku, 'product_quantity' : 1}))
+        assert client.get(reverse('cart-count')).json()['count'] == 2
+        assert 'cart' not in client.session
+
+        client.login(username='Merge', password='password')
+        assert CART_TOKEN_SESSION_ID not in client.session
+        assert dict(CartItem.objects.values_list('cart_key', 'quantity').filter(sku=sku)) == {f'user:{user.pk}' : 3}
+        assert CartItem.objects.filter(cart_key=f'user:{user.pk}').count() == 2
+        assert client.get(reverse('cart-count')).json()['count'] == 2
+
+    @pytest.mark.parametrize('view', ['products', 'product-detail'])
+    def test_product_pages_count_stored_lines(self, client, database_storage, view, sku, product, variant_sku, variant_product):
+        user = checkout_user('Nina', '12 Baker Street')
+        CartItem.objects.create(cart_key=f'user:{user.pk}', sku=sku, quantity=3)
+        CartItem.objects.create(cart_key=f'user:{user.pk}', sku=variant_sku, quantity=1)
+        client.force_login(user)
+        kwargs = {'slug' : product.slug} if view == 'product-detail' else {}
+        response = client.get(reverse(view, kwargs=kwargs))
+        assert response.context.get('count') == 2
@@ -4,13 +4,15 @@ from .views import (
     cart_count,
     cart_detail,
     update_quantity,
-    delete_product
+    delete_product,
+    apply_coupon
 )
 urlpatterns = [
     path('', cart_detail, name='cart'),
     path('add/<product_sku>/<product_quantity>', add_to_cart, name='cart-add'),
     path('count/', cart_count, name='cart-count'),
     path('update-quantity/<product_sku>&<product_quantity>', update_quantity, name='update-quantity'),
-    path('delete/<product_sku>', delete_product, name='delete-product')
+    path('delete/<product_sku>', delete_product, name='delete-product'),
+    path('coupon/', apply_coupon, name='apply-coupon')
     
 ]
\ No newline at end of file
@@ -14,11 +14,8 @@ def cart_count(request : HttpRequest) -> dict:
         A json dict that contains the number of distinct items
 
     """
-    cart = request.session.get('cart', {})
-    if not isinstance(cart, dict):
-        cart = {}
-    total_items = len(cart.values())    
-    return JsonResponse({'count' : total_items})
+    cart = Cart.from_request(request)
+    return JsonResponse({'count' : len(cart)})
 
 def add_to_cart(request : HttpRequest, product_sku : str, product_quantity : int) -> dict:
     """
@@ -58,7 +55,8 @@ def add_to_cart(request : HttpRequest, product_sku : str, product_quantity : int
         
 def cart_detail(request : HttpRequest):
     """
-    List all products inside the cart with cart' summary
+    List all products inside the cart with cart' summary.
+    Lines are re-priced against the catalog before rendering.
     
     Args:
         request (HttpRequest) : request that calls  cart_detail view
@@ -71,6 +69,7 @@ def cart_detail(request : HttpRequest):
         
     """
     cart = Cart.from_request(request)
+    cart.reprice()
     return render(
         request, 
         'cart.html', 
@@ -150,4 +149,32 @@ def delete_product(request : HttpRequest, product_sku : str) -> dict:
         return JsonResponse({
             'status' : status,
             'message' : message
-        })
\ No newline at end of file
+        })
+def apply_coupon(request : HttpRequest) -> dict:
+    """
+    Use a coupon code for the cart, an empty code removes the coupon
+
+    Args:
+        request (HttpRequest): a request that calls apply_coupon view, with the code parameter
+
+    Returns:
+        JsonResponse (dict) : a json dict that contains the following :
+            if success:
+                - status => success
+                - cart_summary : summary of the cart, with the discount of the coupon
+
+            if failed (unknown code):
+                - status => error
+                - message => tells that the code is unknown
+    """
+    cart = Cart.from_request(request)
+    code = request.GET.get('code', '')
+    if not cart.apply_coupon(code):
+        return JsonResponse({
+            'status' : 'error',
+            'message' : f"Unknown coupon code '{code}'"
+        }, status=400)
+    return JsonResponse({
+        'status' : 'success',
+        'cart_summary' : cart.get_cart_summary()
+    })
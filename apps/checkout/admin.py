@@ -1,5 +1,7 @@
 from django.contrib import admin
 from .models import Payment
+from .models import StockReservation
+from .models import WebhookEvent
 from apps.orders.models import Order
 from apps.orders.models import OrderItem
 
@@ -22,4 +24,15 @@ class PaymentAdmin(admin.ModelAdmin):
     list_display = ['order', 'method', 'status', 'amount']
     list_filter = ['method', 'status']
     search_fields = ['order', 'method']
-    
\ No newline at end of file
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ['order', 'sku', 'quantity', 'status', 'expires_at']
+    list_filter = ['status']
+    search_fields = ['sku', 'order__order_number']
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ['event_id', 'type', 'order_number', 'status', 'attempts', 'created_at']
+    list_filter = ['status', 'type']
+    search_fields = ['event_id', 'order_number']
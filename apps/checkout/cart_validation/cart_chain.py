@@ -1,7 +1,10 @@
 from apps.cart.cart import Cart
+from .cart_context import ValidationContext
 from .cart_handlers import (
+    AvailabilityHandler,
     EmptyCartHandler,
-    OutOfStockHandler
+    OutOfStockHandler,
+    PriceDriftHandler
 )
 class CartValidationChain:
     """
@@ -9,6 +12,8 @@ class CartValidationChain:
     """
     def __init__(self):
         handlers = [
+            AvailabilityHandler,
+            PriceDriftHandler,
             EmptyCartHandler,
             OutOfStockHandler
         ]
@@ -16,6 +21,21 @@ class CartValidationChain:
         for handler_class in reversed(handlers):
             self.chain = handler_class(next_handler=self.chain)
         
-    def validate(self, cart : Cart):
-        return self.chain.handle(cart)
+    def validate(self, cart : Cart, context : ValidationContext | None = None):
+        """
+        Run every handler on the cart, with a context shared by the handlers.
+        Lines rewritten by the handlers are saved, even if a later handler fails.
+
+        Args:
+            cart (Cart): cart to validate
+            context (ValidationContext, optional): receives the changes made to the cart
+
+        Raises:
+            EmptyCartError, OutOfStockError : on the first failing handler
+        """
+        context = context or ValidationContext(cart)
+        try:
+            return self.chain.handle(cart, context)
+        finally:
+            context.save()
 
@@ -0,0 +1,68 @@
+from apps.container import container
+from apps.cart.cart import Cart
+
+class ValidationContext:
+    """
+    State shared by the handlers of one cart validation.
+
+    The stock snapshot of every cart SKU is read once, with a single query,
+    the first time a handler needs it. Handlers then check the cart against
+    the same rows instead of querying the products again.
+
+    Handlers rewriting the cart record their changes here, the cart is saved
+    once at the end of the validation and the changes are returned as a diff.
+
+    Attributes:
+        cart (Cart): the cart being validated
+        removed (list): lines removed, {'sku', 'title', 'reason'}
+        prices (list): lines repriced, {'sku', 'title', 'before', 'after'}
+        modified (bool): whether a line of the cart was rewritten
+
+    Methods:
+        rows -> dict :
+            {sku : row} stock snapshot, see ProductRepository.get_stock_snapshot()
+
+        row(sku : str) -> dict | None :
+            Snapshot row of a SKU, None for a deleted product
+
+        lines() -> list :
+            (cart line, snapshot row) of every cart line
+
+        save()
+            Save the rewritten cart, once
+
+        diff() -> dict :
+            Changes made to the cart, for the frontend
+    """
+    def __init__(self, cart : Cart):
+        self.cart = cart
+        self.removed = []
+        self.prices = []
+        self.modified = False
+        self._rows = None
+
+    @property
+    def rows(self) -> dict:
+        if self._rows is None:
+            self._rows = container.product_repo.get_stock_snapshot(
+                [line.get('sku') for line in self.cart.cart.values()]
+            )
+        return self._rows
+
+    def row(self, sku : str) -> dict | None:
+        return self.rows.get(str(sku).strip())
+
+    def lines(self) -> list:
+        return [(line, self.row(line.get('sku'))) for line in self.cart.cart.values()]
+
+    def save(self) -> None:
+        if self.modified:
+            self.cart.save() # every line, the totals are recomputed
+            self.modified = False
+
+    def diff(self) -> dict:
+        return {
+            'changed' : bool(self.removed or self.prices),
+            'removed' : self.removed,
+            'prices' : self.prices,
+        }
@@ -1,40 +1,94 @@
-from apps.container import container
 from apps.cart.cart import Cart
+from apps.money import Money
 from apps.checkout.cart_validation.cart_exceptions import (
     EmptyCartError,
     OutOfStockError
 )
+from .cart_context import ValidationContext
+
 class BaseHandler:
+    """
+    Link of the validation chain. Handlers share a ValidationContext, so
+    that the products are read once per validation.
+    """
     def __init__(self, next_handler=None):
         self.next_handler = next_handler
 
-    def handle(self, cart : Cart):
+    def handle(self, cart : Cart, context : ValidationContext | None = None):
         if self.next_handler:
-            return self.next_handler.handle(cart)
+            return self.next_handler.handle(cart, context or ValidationContext(cart))
         return cart
     
 class EmptyCartHandler(BaseHandler):
-    def handle(self, cart : Cart):
+    def handle(self, cart : Cart, context : ValidationContext | None = None):
         if len(cart.cart) == 0:
             raise EmptyCartError()
     
-        return super().handle(cart)
+        return super().handle(cart, context)
+
+class AvailabilityHandler(BaseHandler):
+    """ Remove the lines of deleted or unpublished products """
+    def handle(self, cart : Cart, context : ValidationContext | None = None):
+        context = context or ValidationContext(cart)
+        for sku, line in list(cart.cart.items()):
+            row = context.row(line.get('sku'))
+            if row is None:
+                reason = 'deleted'
+            elif row['status'] != 'published':
+                reason = 'unpublished'
+            else:
+                continue
+            del cart.cart[sku]
+            context.removed.append({'sku' : line.get('sku'), 'title' : line.get('title'), 'reason' : reason})
+            context.modified = True
+
+        return super().handle(cart, context)
+
+class PriceDriftHandler(BaseHandler):
+    """ Reprice the lines, frozen when added to the cart, from the current products """
+    def handle(self, cart : Cart, context : ValidationContext | None = None):
+        context = context or ValidationContext(cart)
+        for line, row in context.lines():
+            if row is None:
+                continue
+            price_cents = Money.of(row['price']).cents
+            if Cart.unit_cents(line) != price_cents:
+                context.prices.append({
+                    'sku' : line.get('sku'),
+                    'title' : row['title'],
+                    'before' : float(Money(Cart.unit_cents(line))),
+                    'after' : float(row['price'])
+                })
+            current = {
+                'title' : row['title'],
+                'price' : float(row['price']),
+                'price_cents' : price_cents,
+                'old_price' : float(row['old_price']),
+                'stock' : int(row['stock']),
+            }
+            if row['old_price'] > 0:
+                current['discount'] = f"{row['discount'] or 0:.2f}"
+            if any(line.get(key) != value for key, value in current.items()) or ('discount' in line) != ('discount' in current):
+                line.pop('discount', None)
+                line.update(current)
+                context.modified = True
+
+        return super().handle(cart, context)
 
 class OutOfStockHandler(BaseHandler):
-    def handle(self, cart : Cart):
+    def handle(self, cart : Cart, context : ValidationContext | None = None):
         # Check for stock availability
+        context = context or ValidationContext(cart)
         invalid_products = []
-        for key, value in cart.cart.items():
+        for value, row in context.lines():
             product_quantity = value.get('quantity')
-            product_sku = value.get('sku')
-            product_dict = container.product_repo.get_by_sku(product_sku)
-            product = product_dict.get('product')
+            stock = row['stock'] if row else 0 # deleted products have no stock left
             
-            if int(product_quantity) > product.stock:
+            if int(product_quantity) > stock:
                 invalid_products.append(
                     {
                         'product_name' : value.get('title'),
-                        'stock_quantity' : product.stock
+                        'stock_quantity' : stock
                     }
                 )
         
@@ -44,5 +98,4 @@ class OutOfStockHandler(BaseHandler):
                 message += f"\n Not enough stock for \"{product.get('product_name')}\" . Only {product.get('stock_quantity')} left."
             raise OutOfStockError(message)
         
-        return super().handle(cart)
-            
\ No newline at end of file
+        return super().handle(cart, context)
@@ -17,4 +17,11 @@ class OrderNotFoundError(Exception):
     """Exception raised when an order is not found in the repository."""
     def __init__(self, order_id : str):
         self.message = f"Order with ID {order_id} not found."
-        super().__init__(self.message)
\ No newline at end of file
+        super().__init__(self.message)
+### Stripe Payment Service Custom Exceptions ###
+
+class CheckoutSessionError(Exception):
+    """Exception raised when Stripe fails to create the checkout session of an order."""
+    def __init__(self, order_id : str):
+        self.message = f"Checkout session of order {order_id} could not be created."
+        super().__init__(self.message)
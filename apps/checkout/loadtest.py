@@ -0,0 +1,201 @@
+"""
+Load test of the checkout against the Stripe simulator.
+
+Each simulated user goes through the checkout as a browser would :
+
+    login           sign in
+    cart            add the skus to the cart
+    confirm         confirmation page
+    payment         order, payment, stock reservation and Stripe session
+    webhook         customer pays, Stripe delivers checkout.session.completed
+    payment_status  customer comes back to the success url
+
+Users run concurrently, while webhook workers process the delivered
+events. The report gives, per stage, the throughput and the p50/p95/p99
+latencies.
+
+    python manage.py checkout_loadtest --users 50 --concurrency 10 --sku TSHIRT-RED
+"""
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from .stripe_simulator import StripeSimulator
+from .webhooks import WebhookWorker
+
+STAGES = ['login', 'cart', 'confirm', 'payment', 'webhook', 'payment_status']
+
+def percentile(values : list, percent : float) -> float:
+    """ Nearest-rank percentile of values, 0 without values """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+class StageError(Exception):
+    """ A stage of a checkout didn't get the expected response """
+
+class LoadTestReport:
+    """
+    Latencies and errors of the stages of a load test.
+
+    Methods:
+        record(stage : str, seconds : float, error : str)
+            Record a run of a stage
+
+        summary() -> dict :
+            {stage : {count, errors, throughput, p50, p95, p99}}, latencies in milliseconds
+
+        format() -> str :
+            Summary as a table
+    """
+    def __init__(self):
+        self.latencies = {stage : [] for stage in STAGES}
+        self.errors = {stage : [] for stage in STAGES}
+        self.checkouts = 0
+        self.duration = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, stage : str, seconds : float, error : str = None) -> None:
+        with self._lock:
+            if error is None:
+                self.latencies[stage].append(seconds)
+            else:
+                self.errors[stage].append(error)
+
+    def summary(self) -> dict:
+        duration = self.duration or 1.0
+        return {
+            stage : {
+                'count' : len(self.latencies[stage]),
+                'errors' : len(self.errors[stage]),
+                'throughput' : len(self.latencies[stage]) / duration,
+                'p50' : percentile(self.latencies[stage], 50) * 1000,
+                'p95' : percentile(self.latencies[stage], 95) * 1000,
+                'p99' : percentile(self.latencies[stage], 99) * 1000,
+            }
+            for stage in STAGES
+        }
+
+    def format(self) -> str:
+        lines = [f"{'stage':<16}{'ok':>6}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+        for stage, stats in self.summary().items():
+            lines.append(
+                f"{stage:<16}{stats['count']:>6}{stats['errors']:>8}{stats['throughput']:>9.1f}"
+                f"{stats['p50']:>10.1f}{stats['p95']:>10.1f}{stats['p99']:>10.1f}"
+            )
+        lines.append(f'{self.checkouts} checkout(s) in {self.duration:.2f} s : {self.checkouts / (self.duration or 1.0):.1f} checkouts/s')
+        return '\n'.join(lines)
+
+class CheckoutLoadTest:
+    """
+    Drives the checkout of several users at once against the Stripe simulator.
+
+    Args:
+        simulator (StripeSimulator): Stripe stand-in
+        cart (dict): {sku : quantity} bought by every user
+        concurrency (int): users checking out at the same time
+        webhook_workers (int): threads processing the delivered webhook events, 0 to
+            process them in the webhook stage of each checkout
+
+    Methods:
+        checkout(user) -> bool :
+            Run the checkout of a user, stage by stage
+
+        run(users : list) -> LoadTestReport :
+            Run the checkout of every user
+    """
+    def __init__(self, simulator : StripeSimulator, cart : dict, concurrency : int = 10, webhook_workers : int = 1):
+        self.simulator = simulator
+        self.cart = cart
+        self.concurrency = concurrency
+        self.webhook_workers = webhook_workers
+        self.report = LoadTestReport()
+
+    def _stage(self, stage : str, step):
+        start = time.perf_counter()
+        try:
+            result = step()
+        except Exception as error:
+            self.report.record(stage, time.perf_counter() - start, f'{type(error).__name__}: {error}')
+            raise StageError(stage) from error
+        self.report.record(stage, time.perf_counter() - start)
+        return result
+
+    @staticmethod
+    def _expect(response, *status_codes):
+        if response.status_code not in status_codes:
+            raise StageError(f'HTTP {response.status_code} : {response.content[:200]!r}')
+        return response
+
+    def _add_to_cart(self, client : Client) -> None:
+        for sku, quantity in self.cart.items():
+            response = self._expect(client.get(reverse('cart-add', args=[sku, quantity])), 200)
+            if response.json().get('status') != 'success':
+                raise StageError(response.json().get('message'))
+
+    def _pay(self, session_id : str) -> str:
+        success_url = self.simulator.pay(session_id)
+        self.simulator.deliver(self.simulator.event('checkout.session.completed', session_id))
+        if not self.webhook_workers:
+            WebhookWorker().drain()
+        return success_url
+
+    def checkout(self, user) -> bool:
+        """
+        Run the checkout of a user, stage by stage.
+
+        Returns:
+            bool : whether every stage succeeded
+        """
+        client = Client()
+        try:
+            self._stage('login', lambda : client.force_login(user))
+            self._stage('cart', lambda : self._add_to_cart(client))
+            self._stage('confirm', lambda : self._expect(client.get(reverse('confirm')), 200))
+            response = self._stage('payment', lambda : self._expect(client.get(reverse('create-checkout-session')), 302, 303))
+            session_id = self.simulator.session_id(response['Location'])
+            success_url = self._stage('webhook', lambda : self._pay(session_id))
+            self._stage('payment_status', lambda : self._expect(client.get(success_url, follow=True), 200))
+        except StageError:
+            return False
+        finally:
+            # threads have their own database connection
+            connection.close()
+        return True
+
+    def _process_webhooks(self, stop : threading.Event) -> None:
+        worker = WebhookWorker(workers=self.webhook_workers)
+        try:
+            while not stop.is_set():
+                if not worker.run_once():
+                    stop.wait(0.05)
+            worker.drain()
+        finally:
+            connection.close()
+
+    def run(self, users : list) -> LoadTestReport:
+        """
+        Run the checkout of every user, concurrency users at a time.
+
+        Returns:
+            LoadTestReport : latencies and errors per stage
+        """
+        stop = threading.Event()
+        with self.simulator.installed():
+            webhook_thread = threading.Thread(target=self._process_webhooks, args=(stop,))
+            if self.webhook_workers:
+                webhook_thread.start()
+            start = time.perf_counter()
+            try:
+                with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                    self.report.checkouts = sum(executor.map(self.checkout, users))
+                self.report.duration = time.perf_counter() - start
+            finally:
+                stop.set()
+                if self.webhook_workers:
+                    webhook_thread.join()
+        return self.report
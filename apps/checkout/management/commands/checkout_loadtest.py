@@ -0,0 +1,72 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.conf import settings
+from django.test import override_settings
+from apps.checkout.loadtest import CheckoutLoadTest
+from apps.checkout.stripe_simulator import StripeSimulator
+from apps.users.models import Address
+
+class Command(BaseCommand):
+    """
+    Load test the checkout against the Stripe simulator, offline.
+
+    Orders are placed in the configured database and take stock : run it
+    against a development database.
+
+        python manage.py checkout_loadtest --users 50 --concurrency 10 --sku TSHIRT-RED --latency 0.1
+    """
+    help = 'Load test the checkout against a simulated Stripe'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sku', action='append', required=True, help='sku bought by every user, repeat for more')
+        parser.add_argument('--quantity', type=int, default=1, help='quantity of each sku')
+        parser.add_argument('--users', type=int, default=20, help='users checking out')
+        parser.add_argument('--concurrency', type=int, default=5, help='users checking out at the same time')
+        parser.add_argument('--webhook-workers', type=int, default=1, help='threads processing the webhooks, 0 to process them inline')
+        parser.add_argument('--latency', type=float, default=0.0, help='seconds each Stripe call takes')
+        parser.add_argument('--jitter', type=float, default=0.0, help='extra random seconds each Stripe call takes, at most')
+        parser.add_argument('--failure-rate', type=float, default=0.0, help='probability of a Stripe call to fail')
+        parser.add_argument('--webhook-failure-rate', type=float, default=0.0, help='probability of a webhook delivery to be lost')
+        parser.add_argument('--seed', type=int, help='seed of the simulated latencies and failures')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--users and --concurrency must be positive')
+        users = [self.load_test_user(f'loadtest-{index}') for index in range(options['users'])]
+        simulator = StripeSimulator(
+            latency=options['latency'],
+            jitter=options['jitter'],
+            failure_rate=options['failure_rate'],
+            webhook_failure_rate=options['webhook_failure_rate'],
+            seed=options['seed']
+        )
+        load_test = CheckoutLoadTest(
+            simulator,
+            cart={sku : options['quantity'] for sku in options['sku']},
+            concurrency=options['concurrency'],
+            webhook_workers=options['webhook_workers']
+        )
+        # the test client talks to the views as 'testserver'
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            report = load_test.run(users)
+        self.stdout.write(report.format())
+        for stage, errors in report.errors.items():
+            for error in sorted(set(errors))[:5]:
+                self.stderr.write(f'{stage} : {error}')
+
+    @staticmethod
+    def load_test_user(username : str) -> User:
+        """ User with a shipping address, created the first time """
+        user, created = User.objects.get_or_create(username=username, defaults={'email' : f'{username}@example.com'})
+        if created:
+            Address.objects.create(
+                user=user,
+                address_type='shipping',
+                street_address='1 Load Test Street',
+                city='New York',
+                state='New York',
+                country='US',
+                zip_code='10028'
+            )
+        return user
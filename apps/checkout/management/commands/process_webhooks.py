@@ -0,0 +1,33 @@
+import time
+from django.core.management.base import BaseCommand
+from apps.checkout.webhooks import WebhookWorker
+
+class Command(BaseCommand):
+    """
+    Process the Stripe webhook events stored by the webhook view.
+
+        python manage.py process_webhooks --workers 4
+        python manage.py process_webhooks --once
+    """
+    help = 'Process the stored Stripe webhook events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help='threads processing the events')
+        parser.add_argument('--batch', type=int, default=50, help='events claimed at once')
+        parser.add_argument('--interval', type=float, default=1.0, help='seconds between polls when idle')
+        parser.add_argument('--once', action='store_true', help='process the due events and exit')
+
+    def handle(self, *args, **options):
+        worker = WebhookWorker(workers=options['workers'])
+        if options['once']:
+            processed = worker.drain(options['batch'])
+            self.stdout.write(f'{processed} event(s) processed')
+            return
+
+        self.stdout.write(f"Processing webhook events with {options['workers']} worker(s)")
+        try:
+            while True:
+                if not worker.run_once(options['batch']):
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('Stopped')
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from apps.checkout.reconciliation import MIN_AGE
+from apps.checkout.reconciliation import PaymentReconciler
+
+class Command(BaseCommand):
+    """
+    Apply the Stripe state of the payments left pending by a lost webhook.
+
+    Run it periodically (cron), so that the repair doesn't wait for the
+    customer to come back to the payment status page :
+
+        python manage.py reconcile_payments --concurrency 4
+    """
+    help = 'Reconcile the Stripe payments stuck in pending'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=50, help='payments whose sessions are read per batch')
+        parser.add_argument('--concurrency', type=int, default=4, help='Stripe reads at the same time')
+        parser.add_argument('--min-age', type=int, default=MIN_AGE, help='seconds a payment stays pending before being reconciled')
+        parser.add_argument('--limit', type=int, default=1000, help='payments reconciled at most in this run')
+
+    def handle(self, *args, **options):
+        reconciler = PaymentReconciler(
+            batch_size=options['batch'],
+            concurrency=options['concurrency'],
+            min_age=options['min_age']
+        )
+        counts = reconciler.run(limit=options['limit'])
+        self.stdout.write(', '.join(f'{count} {outcome}' for outcome, count in counts.items()))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from apps.container import container
+
+class Command(BaseCommand):
+    """
+    Give back the stock of unpaid orders whose reservation expired.
+
+    The checkout.session.expired webhook releases reservations as sessions
+    expire, run this command periodically (cron) in case a webhook is lost :
+
+        python manage.py release_expired_reservations
+    """
+    help = 'Give back the stock held by expired reservations'
+
+    def handle(self, *args, **options):
+        released = container.checkout_repo.release_expired_reservations()
+        self.stdout.write(f'{released} reservation(s) released')
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkout', '0004_webhookevent'),
+        ('orders', '0004_access_pattern_indexes'),
+        ('products', '0033_productsearchdocument'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['id', 'created_at'], name='payment_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockreservation',
+            index=models.Index(fields=['order', 'status'], name='reservation_order_idx'),
+        ),
+    ]
@@ -28,10 +28,89 @@ class Payment(models.Model):
     currency = models.CharField(max_length=10, default='USD')
     created_at = models.DateTimeField(auto_now_add=True)
     paied_at = models.DateTimeField(null=True, blank=True)
-    
+
+    class Meta:
+        indexes = [
+            # batches of the payments stuck in pending (see apps/checkout/reconciliation.py) :
+            # only the few pending rows are indexed
+            models.Index(fields=['id', 'created_at'], condition=models.Q(status='pending'), name='payment_pending_idx')
+        ]
+
 class Shipping(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
     address_line = models.CharField(max_length=255)
     zip_code = models.CharField(max_length=255)
     country = models.CharField(max_length=255)
-    status = models.CharField(max_length=255)
\ No newline at end of file
+    status = models.CharField(max_length=255)
+class StockReservation(models.Model):
+    """
+    Stock taken from a product or a variant for an order awaiting payment.
+
+    Held reservations are committed when the payment succeeds, or released
+    (their stock given back) when the payment fails or the reservation
+    expires with the Stripe checkout session.
+    """
+    STATUS_CHOICES = [
+        ('held', 'Held'),
+        ('committed', 'Committed'),
+        ('released', 'Released')
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    sku = models.CharField(max_length=100)
+    product = models.ForeignKey('products.Product', on_delete=models.CASCADE, null=True, blank=True)
+    variant = models.ForeignKey('products.ProductVariant', on_delete=models.CASCADE, null=True, blank=True)
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='held')
+    expires_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # release of expired reservations
+            models.Index(fields=['status', 'expires_at'], name='reservation_expiry_idx'),
+            # commit and release of the reservations of an order
+            models.Index(fields=['order', 'status'], name='reservation_order_idx')
+        ]
+
+    def __str__(self):
+        return f'{self.quantity} x {self.sku} ({self.status})'
+
+class WebhookEvent(models.Model):
+    """
+    Stripe webhook event, stored when received and processed later by the
+    webhook worker (see apps/checkout/webhooks.py).
+
+    Events are unique per Stripe event id : Stripe deliveries of an event
+    already stored are acknowledged without being processed again.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed')
+    ]
+
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=255)
+    order_number = models.CharField(max_length=255, blank=True) # events of an order are processed in order
+    stripe_created = models.PositiveBigIntegerField(default=0) # creation timestamp of the event at Stripe
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(auto_now_add=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # claim of the events due
+            models.Index(fields=['status', 'next_attempt_at'], name='webhook_due_idx'),
+            # earlier unfinished events of an order
+            models.Index(fields=['order_number', 'status'], name='webhook_order_idx')
+        ]
+
+    def __str__(self):
+        return f'{self.type} {self.event_id} ({self.status})'
@@ -1,18 +1,32 @@
 from apps.cart.cart import Cart
+from apps.money import Money
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.http import JsonResponse
+import json
 import stripe
 from .custom_exceptions import (
+    CheckoutSessionError,
     InvalidPayloadException,
     InvalidSignatureException
 )
 import logging
 from .models import Payment
+from .repositories import RESERVATION_TTL
+from .webhooks import record_event
 from apps.orders.models import Order
 
 logger = logging.getLogger(__name__)
 
+SESSION_EVENTS = ('checkout.session.completed', 'checkout.session.expired')
+# Stripe rejects a checkout session expiring less than 30 minutes or more than
+# 24 hours after its creation. The expiry is counted from the creation of the
+# order, so that a retried request sends the same parameters : the margin
+# covers the time until the request reaches Stripe and the clock skew, it stays
+# below RESERVATION_GRACE so that the reserved stock outlives the session
+STRIPE_SESSION_MAX_TTL = 24 * 60 * 60
+SESSION_EXPIRY_MARGIN = 2 * 60
+
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
 class StripePaymentService:
@@ -56,13 +70,14 @@ class StripePaymentService:
                     'product_data': {
                         'name': item_data.get('title'),
                     },
-                    'unit_amount': int(float(item_data.get('price')) * 100), # Price in cents
+                    'unit_amount': Cart.unit_cents(item_data), # Price in cents
                 },
                 'quantity': item_data.get('quantity'),
             })
         
-        shipping_fee = int(float(cart.get_cart_summary().get('shipping_fee')) * 100)
-        vat = int(float(cart.get_cart_summary().get('taxes')) * 100)
+        cart_summary = cart.get_cart_summary()
+        shipping_fee = cart_summary['shipping_fee_cents']
+        vat = cart_summary['taxes_cents']
         # Shipping_fee as a separate line item
         line_items.append({
             'price_data' : {
@@ -87,6 +102,31 @@ class StripePaymentService:
     
         return line_items    
         
+    def create_discounts(self, cart : Cart, order : Order) -> list:
+        """
+        Stripe discounts of the cart : promotions and coupon are sent as a
+        single amount off coupon, so that Stripe charges the total of the cart.
+        An order gets a single coupon, created again it's the same one.
+
+        Args:
+            cart (Cart): The shopping cart to create a checkout session for.
+            order (Order): The order of the cart.
+
+        Returns:
+            list : discounts parameter of the checkout session, empty without discount
+        """
+        cart_summary = cart.get_cart_summary()
+        if not cart_summary.get('discount_cents'):
+            return []
+        coupon = stripe.Coupon.create(
+            amount_off=cart_summary['discount_cents'],
+            currency='usd',
+            duration='once',
+            name=', '.join(cart_summary['promotions'])[:40] or 'Discount',
+            idempotency_key=f'checkout-coupon-{order.order_number}'
+        )
+        return [{'coupon' : coupon.id}]
+
     def create_session(self, cart : Cart, user : User, order : Order, payment : Payment):
         """
         Create a Stripe checkout session for the given cart.
@@ -96,16 +136,27 @@ class StripePaymentService:
         
         Returns :
             stripe.checkout.Session: The created Stripe checkout session.
-            
+
+        Raises:
+            CheckoutSessionError : If Stripe failed to create the session
         """
         if len(cart.cart) == 0:
             raise ValueError("Cart is empty. Cannot create checkout session.")  
         
         line_items = self.create_cart_checkout(cart)
-            
+        ttl = min(RESERVATION_TTL + SESSION_EXPIRY_MARGIN, STRIPE_SESSION_MAX_TTL - SESSION_EXPIRY_MARGIN)
+
         try:
+            discounts = self.create_discounts(cart, order)
+            extra_params = {'discounts' : discounts} if discounts else {}
             # Create the checkout session
             checkout_session = stripe.checkout.Session.create(
+                **extra_params,
+                # the stock of the order is reserved until then
+                expires_at=int(order.created_at.timestamp()) + ttl,
+                # a retried request, with the same parameters, gets the session
+                # already created for the order
+                idempotency_key=f'checkout-session-{order.order_number}',
                 payment_method_types=['card'],
                 line_items=line_items,
                 mode='payment',
@@ -117,29 +168,34 @@ class StripePaymentService:
                         'payment_id' : payment.id,
                     }
                 )
+            from apps.container import container
+            container.stripe_gateway.count_call(checkout_session.id, 'checkout.Session.create')
             return checkout_session
-        except Exception as error:
-            return 'An error occured while creating Stripe checkout session. '
+        except stripe.StripeError as error:
+            logger.error(f'Checkout session of order {order.order_number} not created : {type(error).__name__}: {error}')
+            raise CheckoutSessionError(order.order_number) from error
     
     def payment_details(self, payment : Payment):
         """
         Retrieve payment details from database
         Args:
-            payment (str): The Stripe checkout session ID.
-            
+            payment (Payment): The payment of the order.
+
         Returns:
-            dict: A dictionary containing payment details.
-            
+            dict: A dictionary containing payment details, the amount both in
+                integer cents and formatted for display.
+
         """
-        
+
         transaction_id = payment.transaction_id
-        amount_paid = payment.amount / 100  # Convert cents to dollars
+        amount = Money.of(payment.amount)
         date = payment.paied_at
         payment_method = payment.method
         status = payment.status        
         details = {
             'transaction_id' : transaction_id,
-            'amount_paid' : amount_paid,
+            'amount_cents' : amount.cents,
+            'amount_paid' : str(amount),
             'date' : date,
             'payment_method' : payment_method,
             'status' : status
@@ -150,7 +206,7 @@ class StripePaymentService:
     @classmethod
     def handle_webhook(cls, payload, sig_header):
         """
-        Handle Stripe webhook events.
+        Handle Stripe webhook events synchronously.
 
         Args:
             payload (bytes): The raw payload from the webhook.
@@ -159,8 +215,36 @@ class StripePaymentService:
         Returns:
             stripe.Event: The processed Stripe event.
         """
-        # 1 Verify the webhook signature and construct the event
-        
+        event = cls.verify_webhook(payload, sig_header)
+        cls.dispatch_event(event)
+        return event
+
+    @classmethod
+    def receive_webhook(cls, payload, sig_header):
+        """
+        Verify a Stripe webhook event and store it for the webhook worker,
+        without processing it : the webhook is acknowledged right away.
+
+        Args:
+            payload (bytes): The raw payload from the webhook.
+            sig_header (str): The signature header from the webhook request.
+
+        Returns:
+            WebhookEvent : the stored event, the existing one for a redelivery
+        """
+        cls.verify_webhook(payload, sig_header)
+        webhook_event, created = record_event(json.loads(payload))
+        return webhook_event
+
+    @classmethod
+    def verify_webhook(cls, payload, sig_header):
+        """
+        Verify the signature of a Stripe webhook and construct its event.
+
+        Raises:
+            InvalidPayloadException : if the payload isn't a Stripe event
+            InvalidSignatureException : if the signature doesn't match
+        """
         try:
             event = stripe.Webhook.construct_event(
                 payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
@@ -173,24 +257,22 @@ class StripePaymentService:
         except stripe.SignatureVerificationError as e:
             logger.error("Invalid signature in Stripe webhook.")
             raise InvalidSignatureException(e)
+        return event
 
-        # 2 Handle event types as needed
-        
+    @classmethod
+    def dispatch_event(cls, event):
+        """
+        Update orders, payments and stock after a Stripe event.
+
+        Args:
+            event (stripe.Event): verified Stripe event
+        """
         # Lazy import
         from apps.container import container
 
-        if event.type == 'checkout.session.completed':
-            # Retrieve session variable
-            session = event['data']['object']
-            order_number = session.get('metadata')['order_id']
-            user_id = session.get('metadata')['user_id']
-            
-            container.checkout_service.handle_success_payment_status(
-                session_id=session.id,
-                order_id=order_number,
-                user_id=User.objects.get(id=int(user_id))
-            )
-            
+        if event.type in SESSION_EVENTS:
+            cls.apply_session_event(event.type, event['data']['object'])
+
         elif event.type == 'payment_intent.succeeded':
             pass
             #cls.handle_payment_intent_succeeded(event.data.object)
@@ -207,5 +289,28 @@ class StripePaymentService:
             
         else:
             logger.info(f"Unhandled event type {event.type}")
-        
-        return event
\ No newline at end of file
+
+    @classmethod
+    def apply_session_event(cls, event_type : str, session):
+        """
+        Update order, payment and stock for a checkout session event, sent
+        by Stripe or found by the reconciliation of the pending payments.
+
+        Args:
+            event_type (str): checkout.session.completed or checkout.session.expired
+            session (stripe.checkout.Session): the session of the event
+        """
+        # Lazy import
+        from apps.container import container
+
+        metadata = session.get('metadata')
+        if event_type == 'checkout.session.completed':
+            # the event carries the session : no need to read it again
+            container.stripe_gateway.remember_session(session)
+            container.checkout_service.handle_success_payment_status(
+                session_id=session.id,
+                order_id=metadata['order_id'],
+                user_id=User.objects.get(id=int(metadata['user_id']))
+            )
+        elif event_type == 'checkout.session.expired':
+            container.checkout_service.handle_expired_session(order_id=metadata['order_id'])
@@ -0,0 +1,132 @@
+"""
+Reconciliation of the payments left pending, when a webhook was lost.
+
+PaymentReconciler reads the Stripe session of every Stripe payment
+pending for more than PAYMENT_RECONCILE_MIN_AGE seconds, a batch at a
+time with a bounded number of concurrent Stripe reads, and applies what
+the lost webhook would have :
+
+    - paid session     -> checkout.session.completed : order paid, stock committed
+    - expired session  -> checkout.session.expired : order cancelled, stock released
+    - open session     -> nothing, the customer may still pay
+
+The transitions go through StripePaymentService.apply_session_event, as
+the webhooks do. Schedule it (cron) :
+
+    python manage.py reconcile_payments --concurrency 4
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from .models import Payment
+
+logger = logging.getLogger(__name__)
+
+MIN_AGE = getattr(settings, 'PAYMENT_RECONCILE_MIN_AGE', 10 * 60)
+
+def session_event_type(session) -> str | None:
+    """ Checkout session event matching the state of a session, None while it's open """
+    if session.payment_status in ('paid', 'no_payment_required'):
+        return 'checkout.session.completed'
+    if session.status == 'expired':
+        return 'checkout.session.expired'
+    return None
+
+class PaymentReconciler:
+    """
+    Applies the Stripe state of the pending payments.
+
+    Args:
+        batch_size (int): payments whose sessions are read per batch
+        concurrency (int): Stripe reads at the same time
+        min_age (int): seconds a payment stays pending before being reconciled
+
+    Methods:
+        stuck_payments(now : datetime) -> QuerySet :
+            Stripe payments pending for more than min_age seconds
+
+        reconcile(payment : Payment, session) -> str :
+            Apply the state of a session to its payment
+
+        run(limit : int, now : datetime) -> dict :
+            Reconcile the stuck payments, batch by batch
+    """
+    def __init__(self, batch_size : int = 50, concurrency : int = 4, min_age : int = MIN_AGE):
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.min_age = min_age
+
+    def stuck_payments(self, now=None):
+        """ Stripe payments pending for more than min_age seconds, oldest first """
+        now = now or timezone.now()
+        return (
+            Payment.objects
+            .filter(status='pending', provider='stripe', created_at__lte=now - timedelta(seconds=self.min_age))
+            .exclude(stripe_session_id='')
+            .select_related('order')
+            .order_by('pk')
+        )
+
+    def _read_session(self, payment : Payment):
+        from apps.container import container
+        try:
+            return container.stripe_gateway.get_session(payment.stripe_session_id, fresh=True)
+        except Exception as error:
+            logger.warning(f'Reconciliation : session {payment.stripe_session_id} of payment {payment.pk} unreadable : {error}')
+            return error
+
+    def read_sessions(self, payments : list) -> list:
+        """ Sessions of payments, the error instead when Stripe fails """
+        if self.concurrency <= 1 or len(payments) <= 1:
+            return [self._read_session(payment) for payment in payments]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return list(executor.map(self._read_session, payments))
+
+    def reconcile(self, payment : Payment, session) -> str:
+        """
+        Apply the state of a session to its payment.
+
+        Returns:
+            str : 'paid', 'expired' or 'open'
+        """
+        from apps.container import container
+        event_type = session_event_type(session)
+        if event_type is None:
+            return 'open'
+        # a webhook may have arrived since the payment was selected
+        if not Payment.objects.filter(pk=payment.pk, status='pending').exists():
+            return 'done'
+        container.payment_service.apply_session_event(event_type, session)
+        logger.info(f'Reconciliation : payment {payment.pk} of order {payment.order.order_number} applied {event_type}')
+        return 'paid' if event_type == 'checkout.session.completed' else 'expired'
+
+    def run(self, limit : int = 1000, now=None) -> dict:
+        """
+        Reconcile the stuck payments, batch by batch.
+
+        Args:
+            limit (int): payments reconciled at most, the rest waits for the next run
+
+        Returns:
+            dict : {'paid', 'expired', 'open', 'done', 'errors'} number of payments
+        """
+        counts = dict.fromkeys(['paid', 'expired', 'open', 'done', 'errors'], 0)
+        payments = self.stuck_payments(now)
+        last_pk, seen = 0, 0
+        while seen < limit:
+            batch = list(payments.filter(pk__gt=last_pk)[:min(self.batch_size, limit - seen)])
+            if not batch:
+                break
+            last_pk, seen = batch[-1].pk, seen + len(batch)
+            for payment, session in zip(batch, self.read_sessions(batch)):
+                if isinstance(session, Exception):
+                    counts['errors'] += 1
+                    continue
+                try:
+                    counts[self.reconcile(payment, session)] += 1
+                except Exception as error:
+                    counts['errors'] += 1
+                    logger.error(f'Reconciliation of payment {payment.pk} failed : {type(error).__name__}: {error}')
+        return counts
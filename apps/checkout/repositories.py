@@ -1,5 +1,18 @@
+from datetime import datetime
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case
+from django.db.models import F
+from django.db.models import PositiveIntegerField
+from django.db.models import Value
+from django.db.models import When
+from django.utils import timezone
 from apps.container import container
+from apps.money import Money
+from apps.products.cache import invalidate_products
 from .models import Payment
+from .models import StockReservation
 from apps.orders.models import Order
 from apps.orders.models import OrderItem
 from apps.products.models import (
@@ -10,30 +23,53 @@ from .custom_exceptions import OrderNotFoundError
 from apps.users.models import User
 from typing import Union
 
+# lifetime of the Stripe checkout session (30 minutes at least), in seconds
+RESERVATION_TTL = max(getattr(settings, 'STOCK_RESERVATION_TTL', 30 * 60), 30 * 60)
+# held stock outlives the session a little : the checkout.session.expired
+# webhook normally releases it, release_expired_reservations is the fallback
+RESERVATION_GRACE = 5 * 60
+
 class CheckoutRepository:
-    def create_order(self, user : User, cart_data : dict, total_amount : float) -> Order:
+    def create_order(
+        self,
+        user : User,
+        cart_data : dict,
+        total_amount : Money | float,
+        cart : dict | None = None,
+        idempotency_key : str | None = None
+        ) -> Order:
         """
-        Create a new order in the repository.
+        Create a new order in the repository, with a single insert.
+
+        Amounts are stored from the exact cents of the cart summary when present.
 
         Args:
             user: The user placing the order.
             cart_data (dict): The data of the cart being ordered.
-            total_amount (float): The total amount for the order.
+            total_amount (Money | float): The total amount for the order.
+            cart (dict, optional): The cart lines, stored on the order.
+            idempotency_key (str, optional): see CheckoutService.idempotency_key()
 
         Returns:
             Order: The created order object.
         """
+        def amount(key, cents_key):
+            if cents_key in cart_data:
+                return Money(cart_data[cents_key]).to_decimal()
+            return Money.of(cart_data.get(key) or 0).to_decimal()
 
         order = Order.objects.create(
             customer_id=user,
             status='pending',
-            subtotal=cart_data.get('subtotal_price'),
-            final_total=total_amount,
-            vat=cart_data.get('taxes', 0),
-            shipping_cost=cart_data.get('shipping_fee', 0),
-            shipping_address=container.user_service.get_user_address(user_instance=user.id)
+            subtotal=amount('subtotal_price', 'subtotal_cents'),
+            final_total=Money.of(total_amount).to_decimal(),
+            discount_amount=amount('discount', 'discount_cents'),
+            vat=amount('taxes', 'taxes_cents'),
+            shipping_cost=amount('shipping_fee', 'shipping_fee_cents'),
+            shipping_address=container.user_service.get_user_address(user_instance=user.id),
+            cart=cart if cart is not None else {},
+            idempotency_key=idempotency_key
         )
-        order.save()
         return order
     
     def create_payment(self, order : Order, payment_provider : str, amount : float) -> Payment:
@@ -52,9 +88,9 @@ class CheckoutRepository:
             order=order,
             provider=payment_provider,
             status='pending',
-            amount=amount
+            amount=amount,
+            stripe_session_id='' # set once the Stripe checkout session is created
         )
-        payment.save()
         return payment
     
     def update_order_status(self, order_number : str, status : str) -> Order:
@@ -101,6 +137,43 @@ class CheckoutRepository:
         except Payment.DoesNotExist:
             raise OrderNotFoundError(order_number)
     
+    def set_payment_session(self, payment : Payment, session) -> None:
+        """
+        Store the Stripe checkout session of a payment with a single update.
+
+        The amounts of the order and payment follow the amount charged by
+        Stripe, which only differs from them if the cart changed meanwhile.
+
+        Args:
+            payment (Payment): pending payment
+            session (stripe.checkout.Session): its checkout session
+        """
+        payment.stripe_session_id = session.id
+        payment.stripe_payment_intent_id = session.payment_intent
+        fields = {'stripe_session_id' : session.id, 'stripe_payment_intent_id' : session.payment_intent}
+        amount_total = getattr(session, 'amount_total', None)
+        if isinstance(amount_total, int) and amount_total != Money.of(payment.amount).cents:
+            payment.amount = payment.order.final_total = Money(amount_total).to_decimal()
+            fields['amount'] = payment.amount
+            Order.objects.filter(pk=payment.order_id).update(final_total=payment.amount)
+        Payment.objects.filter(pk=payment.pk).update(**fields)
+
+    def get_pending_order(self, idempotency_key : str) -> Order | None:
+        """
+        Pending order of an idempotency key, with its payment.
+
+        Args:
+            idempotency_key (str): see CheckoutService.idempotency_key()
+
+        Returns:
+            Order | None : the order, None if there's no pending order for the key
+        """
+        return (
+            Order.objects.select_related('payment')
+            .filter(idempotency_key=idempotency_key, status='pending')
+            .first()
+        )
+
     def retrieve_user_order(self, order_number : str, user_id : User) -> Order:
         """
         Retrieve user that belongs to any particular user
@@ -116,15 +189,190 @@ class CheckoutRepository:
     
     def decrease_stock(self, product_sku : str, quantity : int = 1):
         """
-        Decrease stock of purchased product
+        Decrease stock of purchased product, with a conditional update that
+        can't go below zero whatever the concurrent purchases.
         """
-        product = container.product_repo.get_by_sku(product_sku)['product']
-        if quantity > product.stock:
-            raise ValueError(f'Not enough stock for product "{product.name}", only {product.stock} available')
-        product.stock -= quantity
-        product.save()
+        product_dict = container.product_repo.get_by_sku(product_sku)
+        self._take_stock({product_sku : (product_dict, quantity)})
+        product = product_dict['product']
+        product.refresh_from_db(fields=['stock'])
         return product
-        
+
+    def _take_stock(self, lines : dict) -> None:
+        """
+        Take the stock of many lines with one conditional update per model :
+
+            UPDATE ... SET stock = stock - q WHERE id IN (...) AND stock >= q
+
+        Args:
+            lines (dict): {sku : (product_dict, quantity)}, product_dict as returned by get_many_by_sku
+
+        Raises:
+            ValueError : if a line lacks stock, nothing is taken then
+        """
+        with transaction.atomic():
+            for model, quantities in self._stock_quantities(lines).items():
+                # lock the rows in a fixed order, concurrent orders sharing
+                # products would otherwise deadlock
+                list(model.objects.select_for_update().filter(pk__in=quantities).order_by('pk').values_list('pk'))
+                needed = self._per_row(quantities)
+                updated = model.objects.filter(pk__in=quantities, stock__gte=needed).update(stock=F('stock') - needed)
+                if updated != len(quantities):
+                    for product in model.objects.filter(pk__in=quantities):
+                        if product.stock < quantities[product.pk]:
+                            raise ValueError(f'Not enough stock for product "{product}", only {product.stock} available')
+                    raise ValueError('Product not found')
+        self._invalidate_stock(lines)
+
+    def _give_back_stock(self, lines : dict) -> None:
+        """ Add the quantities of lines ({sku : (product_dict, quantity)}) back to the stock """
+        for model, quantities in self._stock_quantities(lines).items():
+            given_back = self._per_row(quantities)
+            model.objects.filter(pk__in=quantities).update(stock=F('stock') + given_back)
+        self._invalidate_stock(lines)
+
+    @staticmethod
+    def _stock_quantities(lines : dict) -> dict:
+        """ {model : {primary key : quantity}} of lines """
+        quantities = {}
+        for product_dict, quantity in lines.values():
+            product = product_dict['product']
+            rows = quantities.setdefault(type(product), {})
+            rows[product.pk] = rows.get(product.pk, 0) + int(quantity)
+        return quantities
+
+    @staticmethod
+    def _per_row(quantities : dict) -> Case:
+        """ Quantity of each row as a SQL expression """
+        return Case(
+            *[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+            default=Value(0),
+            output_field=PositiveIntegerField()
+        )
+
+    @staticmethod
+    def _invalidate_stock(lines : dict) -> None:
+        """ Queryset updates send no signal : cached product details show the old stock """
+        invalidate_products(
+            product_dict['product'].product_id if product_dict['product_type'] == 'variant' else product_dict['product'].pk
+            for product_dict, _ in lines.values()
+        )
+
+    def reserve_stock(self, order : Order, cart : dict, status : str = 'held') -> datetime | None:
+        """
+        Reserve the stock of every line of a cart for an order, in one transaction.
+
+        Args:
+            order (Order): order the stock is reserved for
+            cart (dict): cart lines, {sku : line}
+            status (str): 'held' until the payment, 'committed' for a paid order
+
+        Returns:
+            datetime | None : expiry of the reservations, None for an empty cart
+
+        Raises:
+            ValueError : if a product is unknown or lacks stock, nothing is reserved then
+        """
+        quantities = {}
+        for item in cart.values():
+            sku = str(item.get('sku')).strip()
+            quantities[sku] = quantities.get(sku, 0) + int(item.get('quantity'))
+        if not quantities:
+            return None
+
+        products = container.product_repo.get_many_by_sku(quantities)
+        for sku in quantities:
+            if sku not in products:
+                raise ValueError(f"Product with SKU '{sku}' not found")
+        lines = {sku : (products[sku], quantity) for sku, quantity in quantities.items()}
+        expires_at = timezone.now() + timedelta(seconds=RESERVATION_TTL + RESERVATION_GRACE)
+
+        with transaction.atomic():
+            self._take_stock(lines)
+            StockReservation.objects.bulk_create([
+                StockReservation(
+                    order=order,
+                    sku=sku,
+                    product=product_dict['product'] if product_dict['product_type'] == 'base' else None,
+                    variant=product_dict['product'] if product_dict['product_type'] == 'variant' else None,
+                    quantity=quantity,
+                    status=status,
+                    expires_at=expires_at
+                )
+                for sku, (product_dict, quantity) in lines.items()
+            ])
+        return expires_at
+
+    def commit_reservations(self, order : Order) -> int:
+        """
+        Keep the stock reserved for a paid order.
+
+        The stock of an order without held reservations (released meanwhile,
+        or created before reservations) is taken now. Committing twice is a no-op.
+
+        Args:
+            order (Order): paid order
+
+        Returns:
+            int : number of committed reservations
+
+        Raises:
+            ValueError : if the stock has to be taken again and is missing
+        """
+        with transaction.atomic():
+            committed = StockReservation.objects.filter(order=order, status='held').update(status='committed')
+            if committed or StockReservation.objects.filter(order=order, status='committed').exists():
+                return committed
+            self.reserve_stock(order, order.cart, status='committed')
+            return len(order.cart)
+
+    def release_reservations(self, order : Order) -> int:
+        """
+        Give back the stock held for an order. Releasing twice is a no-op.
+
+        Args:
+            order (Order): unpaid order
+
+        Returns:
+            int : number of released reservations
+        """
+        with transaction.atomic():
+            reservations = list(
+                StockReservation.objects.select_for_update()
+                .filter(order=order, status='held')
+                .select_related('product', 'variant')
+            )
+            if not reservations:
+                return 0
+            self._give_back_stock({
+                reservation.pk : (
+                    {'product_type' : 'variant', 'product' : reservation.variant} if reservation.variant_id
+                    else {'product_type' : 'base', 'product' : reservation.product},
+                    reservation.quantity
+                )
+                for reservation in reservations
+            })
+            StockReservation.objects.filter(pk__in=[reservation.pk for reservation in reservations]).update(status='released')
+        return len(reservations)
+
+    def release_expired_reservations(self, now : datetime | None = None) -> int:
+        """
+        Give back the stock of held reservations past their expiry.
+
+        Args:
+            now (datetime, optional): current date
+
+        Returns:
+            int : number of released reservations
+        """
+        order_ids = (
+            StockReservation.objects
+            .filter(status='held', expires_at__lte=now or timezone.now())
+            .values_list('order_id', flat=True)
+            .distinct()
+        )
+        return sum(self.release_reservations(order) for order in Order.objects.filter(pk__in=list(order_ids)))
+
     def add_order_item(
         self, 
         order : Order,
@@ -140,8 +388,10 @@ class CheckoutRepository:
         """
         Create an order item record
         """
-        order_item = OrderItem.objects.create(
+        return OrderItem.objects.create(
             order_id=order.id,
+            product=product if product_type != 'variant' else None,
+            variant=product if product_type == 'variant' else None,
             product_name=product_name,
             attributes=product_attributes,
             unit_price=unit_price,
@@ -149,10 +399,29 @@ class CheckoutRepository:
             total_price=total_price,
             image_url=img_src
         )
-        if product_type == 'variant':
-            order_item.variant = product
-        else:
-            order_item.product = product
-        order_item.save()
-        
-        return order_item
\ No newline at end of file
+
+    def add_order_items(self, order : Order, items : list) -> list:
+        """
+        Create the order items of an order with a single insert.
+
+        Args:
+            order (Order): order of the items
+            items (list): dicts with the arguments of add_order_item() but order
+
+        Returns:
+            list : the created OrderItem objects
+        """
+        return OrderItem.objects.bulk_create([
+            OrderItem(
+                order_id=order.id,
+                product=item['product'] if item['product_type'] != 'variant' else None,
+                variant=item['product'] if item['product_type'] == 'variant' else None,
+                product_name=item['product_name'],
+                attributes=item['product_attributes'],
+                unit_price=item['unit_price'],
+                quantity=item['quantity'],
+                total_price=item['total_price'],
+                image_url=item['img_src']
+            )
+            for item in items
+        ])
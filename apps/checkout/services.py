@@ -1,13 +1,24 @@
 from apps.container import container
 from ..cart.cart import Cart
+from apps.money import Money
+from .cart_validation.cart_context import ValidationContext
+from .stripe_gateway import intent_id
+from .custom_exceptions import CheckoutSessionError
 from .models import (
     Order,
     Payment
 )
 from apps.users.models import User
+import hashlib
+import json
+import logging
 import stripe
+from django.db import IntegrityError
+from django.db import transaction
 from datetime import timezone, datetime
 
+logger = logging.getLogger(__name__)
+
 class CheckoutService:
     """
         Service for handling the checkout process in an e-commerce platform.
@@ -40,6 +51,25 @@ class CheckoutService:
         validated_cart = self.validation_chain.validate(cart)
         return validated_cart
 
+    def revalidate_cart(self, cart : Cart) -> dict:
+        """
+        Validate the cart against the current products : lines of deleted or
+        unpublished products are removed and prices are refreshed, in the
+        stored cart too.
+
+        Args:
+            cart (Cart): the cart to revalidate
+
+        Returns:
+            dict : {'changed' : bool, 'removed' : [...], 'prices' : [...]} changes made to the cart
+
+        Raises:
+            EmptyCartError, OutOfStockError : if the cart can't be checked out
+        """
+        context = ValidationContext(cart)
+        self.validation_chain.validate(cart, context)
+        return context.diff()
+
     def handle_order_status(self, order_number : str, payment_status : str):
         """
         Responsible for updating order status based on payment outcome.
@@ -55,19 +85,24 @@ class CheckoutService:
 
         return order        
     
-    def order_creation(self, cart : Cart, user):
+    def order_creation(self, cart : Cart, user, idempotency_key : str | None = None):
         """
         Responsible for creating an order from the cart.
 
         Args:
             cart (Cart): The shopping cart to create an order from.
             user: The user placing the order.
+            idempotency_key (str, optional): see idempotency_key()
         """
-        total_price = cart.get_cart_summary().get('total_price')
-        order = self.repo.create_order(user, cart.get_cart_summary(), total_price)
-        order.cart = cart.cart
-        order.save()
-        return order
+        cart_summary = cart.get_cart_summary()
+        total_price = Money(cart_summary['total_cents'])
+        return self.repo.create_order(
+            user,
+            cart_summary,
+            total_price,
+            cart=cart.cart,
+            idempotency_key=idempotency_key
+        )
     
     def payment_creation(self, order : Order, payment_provider : str):
         """
@@ -81,27 +116,153 @@ class CheckoutService:
         payment = self.repo.create_payment(order, payment_provider, amount)
         return payment
     
-    def add_order_items(self, order : Order, cart : dict):
+    def add_order_items(self, order : Order, cart : dict) -> list:
         """
-        Attach order items to a particular order
+        Attach order items to a particular order.
+        Products and variant attributes of every item are loaded in bulk and
+        the items are inserted at once : a constant number of queries whatever
+        the size of the cart.
+
+        Returns:
+            list : the created order items
         """
+        products = container.product_repo.get_many_by_sku(item.get('sku') for item in cart.values())
+        attributes = container.product_repo.get_variant_attributes_map(
+            product_dict['product'].id for product_dict in products.values()
+            if product_dict['product_type'] == 'variant'
+        )
+        items = []
         for sku, item in cart.items():
-            product_dict = container.product_repo.get_by_sku(item.get('sku'))
+            product_dict = products.get(str(item.get('sku')).strip())
+            if product_dict is None:
+                raise ValueError(f"Product with SKU '{item.get('sku')}' not found")
             product = product_dict['product']
-            total_price = item.get('quantity') * item.get('price')
-            order_item = self.repo.add_order_item(
-                order=order,
-                product=product,
-                product_type=product_dict['product_type'],
-                product_name=item.get('title'),
-                product_attributes=item.get('attributes', {}),
-                unit_price=item.get('price'),
-                quantity=item.get('quantity'),
-                total_price=total_price,
-                img_src=item.get('image')    
-            )
-        return order_item
-    
+            unit_price = Money(Cart.unit_cents(item))
+            items.append({
+                'product' : product,
+                'product_type' : product_dict['product_type'],
+                'product_name' : item.get('title'),
+                'product_attributes' : attributes.get(product.id, {}) if product_dict['product_type'] == 'variant' else {},
+                'unit_price' : unit_price.to_decimal(),
+                'quantity' : item.get('quantity'),
+                'total_price' : (unit_price * item.get('quantity')).to_decimal(),
+                'img_src' : item.get('image')
+            })
+        return self.repo.add_order_items(order, items)
+
+    def place_order(self, cart : Cart, user, idempotency_key : str | None = None) -> Order:
+        """
+        Create the order of a cart with its items, in one transaction.
+
+        Args:
+            cart (Cart): The shopping cart to create an order from.
+            user: The user placing the order.
+            idempotency_key (str, optional): see idempotency_key()
+
+        Returns:
+            Order : the created order
+        """
+        with transaction.atomic():
+            order = self.order_creation(cart, user, idempotency_key)
+            self.add_order_items(order, cart.cart)
+        return order
+
+    @staticmethod
+    def idempotency_key(cart : Cart, user) -> str:
+        """
+        Key of a checkout : hash of the user, the cart lines, their prices and
+        the coupon. Submitting the same cart twice gives the same key.
+        """
+        lines = sorted(
+            (str(item['sku']), int(item['quantity']), Cart.unit_cents(item))
+            for item in cart.cart.values()
+        )
+        content = json.dumps([user.pk, lines, cart.coupon], separators=(',', ':'))
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def start_checkout(self, cart : Cart, user):
+        """
+        Atomic and idempotent checkout of a cart.
+
+        The order, its items, its payment and the stock reservation are
+        created in one transaction, then the Stripe checkout session. Checking
+        out the same cart again (double-click, back button) while its order is
+        pending gives back that order and its session, which is still open.
+
+        Args:
+            cart (Cart): The shopping cart to check out.
+            user: The user placing the order.
+
+        Returns:
+            tuple : (Order, Payment, stripe.checkout.Session)
+
+        Raises:
+            ValueError : if the cart is empty, a product lacks stock, or the
+                same checkout is being created by another request
+            CheckoutSessionError : if Stripe failed to create the session, the
+                order is then cancelled
+        """
+        if not cart.cart:
+            raise ValueError('Cart is empty. Cannot create checkout session.')
+        key = self.idempotency_key(cart, user)
+
+        order = self.repo.get_pending_order(key)
+        if order is not None:
+            session = self._open_session(order)
+            if session is not None:
+                return order, order.payment, session
+
+        try:
+            with transaction.atomic():
+                order = self.place_order(cart, user, key)
+                payment = self.payment_creation(order=order, payment_provider='stripe')
+                self.repo.reserve_stock(order, cart.cart)
+        except IntegrityError:
+            raise ValueError('A checkout of this cart is already in progress')
+
+        try:
+            checkout_session = container.payment_service.create_session(cart, user, order, payment)
+        except CheckoutSessionError as error:
+            self.cancel_order(order, str(error))
+            raise
+        self.repo.set_payment_session(payment, checkout_session)
+        return order, payment, checkout_session
+
+    def _open_session(self, order : Order):
+        """
+        Open Stripe checkout session of a pending order.
+
+        Returns:
+            stripe.checkout.Session | None : None if the order has no open
+                session, it's then cancelled
+
+        Raises:
+            ValueError : if the session of the order is still being created
+        """
+        payment = getattr(order, 'payment', None)
+        if payment is None or not payment.stripe_session_id:
+            raise ValueError('A checkout of this cart is already in progress')
+        session = container.stripe_gateway.get_session(payment.stripe_session_id, fresh=True)
+        if session.status == 'open':
+            return session
+        self.cancel_order(order, 'Checkout session expired')
+        return None
+
+    def cancel_order(self, order : Order, reason : str) -> Order:
+        """
+        Cancel an unpaid order, fail its pending payment and give back its
+        reserved stock.
+
+        Args:
+            order (Order): pending order
+            reason (str): failure reason stored on the order
+        """
+        self.repo.release_reservations(order)
+        Order.objects.filter(pk=order.pk, status='pending').update(status='cancelled', failure_reason=reason)
+        Payment.objects.filter(order=order, status='pending').update(status='failed')
+        order.refresh_from_db(fields=['status', 'failure_reason'])
+        return order
+
     def handle_success_payment_status(self, session_id : str, order_id : str, user_id : User):
         """
         Handle a successful Stripe checkout and persist payment/order updates.
@@ -123,52 +284,61 @@ class CheckoutService:
 
         Side effects:
             - Calls CheckoutRepository().retrieve_user_order() to fetch the order.
-            - Updates order status to 'paid'.
-            - Retrieves the Stripe PaymentIntent and updates the corresponding Payment
-            model fields (transaction id, status, amount, paid timestamp, method,
-            stripe_payment_intent_id, currency) and saves it.
-            - Decreases product stock based on quantities recorded in the order's cart.
-            - Persists all changes to the database.
+            - Reads the session and its PaymentIntent through the Stripe gateway (a
+            session already read or received with the webhook isn't read again).
+            - In one transaction : updates the order status to 'paid', the
+            corresponding Payment fields (transaction id, status, amount, paid timestamp,
+            method, stripe_payment_intent_id, currency), and commits the stock reserved
+            for the order, or takes it now if the reservations were released meanwhile.
+            - Stores the receipt of the paid order once the transaction commits
+            (see OrderService.generate_receipt()).
 
         Raises:
             - django.core.exceptions.ObjectDoesNotExist: if the Order or Payment cannot be found.
-            - stripe.error.StripeError (or subclasses): on Stripe API failures.
-            - Any repository-specific exceptions raised by CheckoutRepository.
+            - stripe.error.StripeError (or subclasses): on Stripe API failures, nothing is written.
+            - ValueError: if released stock can't be taken back, nothing is written.
 
         Notes:
-            - Amount conversions assume session.amount_total is in cents (divide by 100).
+            - session.amount_total is in integer cents, stored exactly through Money.
             - Timestamps are converted to UTC.
-            - This method performs multiple DB writes; callers may want to run it inside
-            a transaction if atomicity is required.
     """
         # retrieve user's order
         order = self.repo.retrieve_user_order(order_id, user_id=user_id)
-        paid_order = self.repo.update_order_status(order_id, 'paid')
         payment = Payment.objects.get(order=order.id)
-        
-        # retrieve stripe payment intent 
-        session = stripe.checkout.Session.retrieve(session_id)
-        pi = stripe.PaymentIntent.retrieve(session.payment_intent)
-        # Update payment model
-        payment.transaction_id = pi.latest_charge
-        payment.status = 'success'
-        payment.amount = session.amount_total / 100
-        payment.paied_at = datetime.fromtimestamp(pi.created, tz=timezone.utc)
-        payment.method = session.payment_method_types[0]
-        payment.stripe_payment_intent_id = session.payment_intent
-        payment.currency = session.currency.upper()
-        payment.stripe_session_id = session.id
-        payment.save()
-        
-        ayment_details = container.payment_service.payment_details(payment)
-        
-        # Decrease stock
-        cart = order.cart
-        for sku, product in cart.items():
-            container.checkout_repo.decrease_stock(product_sku=sku, quantity=product.get('quantity'))
-            
+
+        # retrieve stripe session and payment intent, at most once per checkout,
+        # before any write
+        session = container.stripe_gateway.get_session(session_id)
+        pi = container.stripe_gateway.get_payment_intent(session)
+
+        with transaction.atomic():
+            paid_order = self.repo.update_order_status(order_id, 'paid')
+            # Update payment model
+            payment.transaction_id = pi.latest_charge
+            payment.status = 'success'
+            payment.amount = Money(session.amount_total).to_decimal()
+            payment.paied_at = datetime.fromtimestamp(pi.created, tz=timezone.utc)
+            payment.method = session.payment_method_types[0]
+            payment.stripe_payment_intent_id = intent_id(session)
+            payment.currency = session.currency.upper()
+            payment.stripe_session_id = session.id
+            payment.save()
+            # Keep the stock reserved at payment processing
+            self.repo.commit_reservations(order)
+            # the order won't change anymore : its receipt is rendered once, when it's paid
+            transaction.on_commit(lambda : self._store_receipt(order_id))
+
         return paid_order
-         
+
+    @staticmethod
+    def _store_receipt(order_id : str) -> None:
+        """ Render the receipt of a paid order, a failure doesn't fail the payment """
+        try:
+            container.order_service.generate_receipt(order_id)
+        except Exception as error:
+            # generated again when the receipt is first opened
+            logger.error(f'Receipt of order {order_id} not generated : {type(error).__name__}: {error}')
+
     def handle_failure_payment_status(self, order_id : str, user_id : str, error_message : str):
         """
         Handle a failed payment for a given order.
@@ -178,6 +348,7 @@ class CheckoutService:
             - Locate the order owned by the given user and order identifier.
             - Mark the order as cancelled and persist the provided failure reason.
             - Update the related payment record status to 'failed' and save it.
+            - Give back the stock reserved for the order.
         
         Args:
             order_id (str): The order identifier (order number) to update.
@@ -191,12 +362,24 @@ class CheckoutService:
         updated_order.save()
         payment = self.repo.update_payment_status(order.order_number, 'failed')
         payment.save()
+        self.repo.release_reservations(order)
         return updated_order
+
+    def handle_expired_session(self, order_id : str):
+        """
+        Cancel an unpaid order whose Stripe checkout session expired and give
+        back its reserved stock.
+
+        Args:
+            order_id (str): The order identifier (order number).
+        """
+        order = Order.objects.get(order_number=order_id)
+        return self.cancel_order(order, 'Checkout session expired')
     
     def handle_webhook_fallback(self, session_id : str, order_id : str, user_id : User):
         """
         Handle webhook issues. Update database for payment and order when webhook endpoint
-        is down. 
+        is down. The session read by fetch_checkout_context() is reused.
         """
         order = Order.objects.get(order_number=order_id)
         payment = Payment.objects.get(order=order)
@@ -225,7 +408,7 @@ class CheckoutService:
             - On failure, returns a string error message describing the issue.    
         """
         try:
-            session = stripe.checkout.Session.retrieve(session_id, expand=['payment_intent'])
+            session = container.stripe_gateway.get_session(session_id, fresh=True)
             order = Order.objects.get(order_number=order_id)
             payment = Payment.objects.get(order=order)
             return [session, order, payment]
@@ -0,0 +1,150 @@
+"""
+Reads of the Stripe API made by the checkout.
+
+A checkout completes with a single Stripe read : the checkout session is
+retrieved with its payment intent expanded, and kept for a short time so
+that the rest of the success path (payment_status view, webhook fallback,
+webhook handler) reuses it. A session received with a webhook is kept the
+same way.
+
+Stripe calls are counted per checkout session in the cache :
+
+    stripe-calls:<session_id> -> number of Stripe API calls for the session
+
+Both need the cache shared by the web workers and the process_webhooks and
+reconcile_payments commands (CACHES setting), so that they add up the calls
+and reuse the reads of each other.
+"""
+import logging
+import threading
+import time
+import stripe
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+SESSION_CACHE_TIMEOUT = getattr(settings, 'STRIPE_SESSION_CACHE_TIMEOUT', 60)
+CALLS_TIMEOUT = 24 * 60 * 60
+
+def calls_key(session_id : str) -> str:
+    return f'stripe-calls:{session_id}'
+
+def intent_id(session) -> str | None:
+    """ Id of the payment intent of a session, expanded or not """
+    payment_intent = session.payment_intent
+    if payment_intent is None or isinstance(payment_intent, str):
+        return payment_intent
+    return payment_intent.id
+
+class StripeGateway:
+    """
+    Stripe checkout sessions and payment intents, cached per session.
+
+    Methods:
+        get_session(session_id : str, fresh : bool) -> stripe.checkout.Session :
+            Session with its payment intent expanded
+
+        remember_session(session)
+            Keep a session received with a webhook
+
+        get_payment_intent(session) -> stripe.PaymentIntent :
+            Payment intent of a session, retrieved only if not expanded nor known
+
+        count_call(session_id : str, operation : str)
+            Count a Stripe API call made outside the gateway (session creation)
+
+        calls(session_id : str) -> int :
+            Number of Stripe API calls made for a session
+
+        reset()
+    """
+    def __init__(self, timeout : int = SESSION_CACHE_TIMEOUT):
+        self.timeout = timeout
+        self._sessions = {} # {session_id : (expiry, session, payment_intent)}
+        self._lock = threading.Lock()
+
+    def _get(self, session_id : str):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry[0] < time.monotonic():
+                self._sessions.pop(session_id, None)
+                return None
+            return entry
+
+    def _put(self, session, payment_intent=None) -> None:
+        with self._lock:
+            now = time.monotonic()
+            # drop the expired sessions
+            for session_id in [key for key, entry in self._sessions.items() if entry[0] < now]:
+                del self._sessions[session_id]
+            if payment_intent is None and session.id in self._sessions:
+                payment_intent = self._sessions[session.id][2]
+            self._sessions[session.id] = (now + self.timeout, session, payment_intent)
+
+    def count_call(self, session_id : str, operation : str) -> None:
+        """ Count a Stripe API call made for a session """
+        key = calls_key(session_id)
+        cache.add(key, 0, timeout=CALLS_TIMEOUT)
+        try:
+            calls = cache.incr(key)
+        except ValueError:
+            # evicted meanwhile
+            cache.set(key, 1, timeout=CALLS_TIMEOUT)
+            calls = 1
+        logger.info(f'Stripe {operation} for session {session_id} (call {calls})')
+
+    def get_session(self, session_id : str, fresh : bool = False):
+        """
+        Checkout session with its payment intent expanded.
+
+        Args:
+            session_id (str): id of the checkout session
+            fresh (bool): read Stripe even if the session is known, for a status check
+
+        Returns:
+            stripe.checkout.Session : the session
+        """
+        if not fresh:
+            entry = self._get(session_id)
+            if entry is not None:
+                return entry[1]
+        self.count_call(session_id, 'checkout.Session.retrieve')
+        session = stripe.checkout.Session.retrieve(session_id, expand=['payment_intent'])
+        self._put(session)
+        return session
+
+    def remember_session(self, session) -> None:
+        """ Keep a session received with a webhook, it's as fresh as a read """
+        self._put(session)
+
+    def get_payment_intent(self, session):
+        """
+        Payment intent of a session : the expanded one, the one already
+        retrieved, or retrieved now.
+
+        Args:
+            session (stripe.checkout.Session): the session
+
+        Returns:
+            stripe.PaymentIntent : the payment intent
+        """
+        payment_intent = session.payment_intent
+        if payment_intent is not None and not isinstance(payment_intent, str):
+            return payment_intent
+        entry = self._get(session.id)
+        if entry is not None and entry[2] is not None:
+            return entry[2]
+        self.count_call(session.id, 'PaymentIntent.retrieve')
+        payment_intent = stripe.PaymentIntent.retrieve(payment_intent)
+        self._put(entry[1] if entry is not None else session, payment_intent)
+        return payment_intent
+
+    def calls(self, session_id : str) -> int:
+        """ Number of Stripe API calls made for a session """
+        return cache.get(calls_key(session_id), 0)
+
+    def reset(self) -> None:
+        """ Forget the known sessions """
+        with self._lock:
+            self._sessions.clear()
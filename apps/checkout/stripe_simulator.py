@@ -0,0 +1,283 @@
+"""
+In-process stand-in for the Stripe API, to run the checkout offline.
+
+StripeSimulator implements the Stripe calls made by the checkout :
+
+    stripe.Coupon.create
+    stripe.checkout.Session.create / retrieve (expand=['payment_intent'])
+    stripe.PaymentIntent.retrieve
+
+and the customer side of a checkout : paying or expiring a session, then
+delivering the matching webhook event, signed with the webhook secret as
+Stripe signs it. Every API call waits `latency` seconds (plus up to
+`jitter`) and fails with stripe.APIConnectionError at `failure_rate`.
+A create call repeated with its idempotency key gets the object already
+created, or stripe.IdempotencyError if its parameters changed.
+A webhook delivery is lost at `webhook_failure_rate` and redelivered, as
+Stripe does, up to `webhook_attempts` times.
+
+    simulator = StripeSimulator(latency=0.05, failure_rate=0.01)
+    with simulator.installed():
+        ...  # stripe.* calls go to the simulator
+"""
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+import stripe
+from django.test import Client
+from django.test import override_settings
+from django.urls import reverse
+
+SIMULATOR_URL = 'https://checkout.stripe.test/c/pay/'
+
+class StripeSimulator:
+    """
+    Stripe API stand-in keeping its objects in memory.
+
+    Args:
+        latency (float): seconds each API call takes
+        jitter (float): extra random seconds each API call takes, at most
+        failure_rate (float): probability of an API call to fail
+        webhook_failure_rate (float): probability of a webhook delivery to be lost
+        webhook_attempts (int): deliveries of a webhook event before giving up
+        webhook_secret (str): secret the webhooks are signed with
+        seed (int, optional): seed of the random failures and latencies
+
+    Methods:
+        installed() :
+            Context manager routing the stripe calls to the simulator
+
+        pay(session_id : str) -> str :
+            Pay a session as the customer would, returns the success url
+
+        expire(session_id : str)
+            Expire an open session
+
+        event(event_type : str, session_id : str) -> dict :
+            Webhook event of a session
+
+        deliver(event : dict) -> int :
+            Deliver a signed webhook event, returns the number of attempts
+
+        session_id(url : str) -> str :
+            Id of the session of a checkout url
+    """
+    def __init__(
+        self, latency : float = 0.0, jitter : float = 0.0, failure_rate : float = 0.0,
+        webhook_failure_rate : float = 0.0, webhook_attempts : int = 3,
+        webhook_secret : str = 'whsec_simulator', seed=None
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.webhook_failure_rate = webhook_failure_rate
+        self.webhook_attempts = webhook_attempts
+        self.webhook_secret = webhook_secret
+        self.sessions = {}
+        self.payment_intents = {}
+        self.coupons = {}
+        self.calls = {} # {operation : number of calls}
+        self._idempotency_keys = {} # {key : (object id, parameters)}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    #### Stripe API ####
+
+    def _call(self, operation : str) -> None:
+        """ Count a call, wait its latency and fail it at the failure rate """
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            failing = self._random.random() < self.failure_rate
+        if delay:
+            time.sleep(delay)
+        if failing:
+            raise stripe.APIConnectionError(f'Simulated Stripe failure of {operation}')
+
+    def _idempotent(self, idempotency_key, params : dict):
+        """ Id of the object created with the key, None if it's new (called under the lock) """
+        if idempotency_key not in self._idempotency_keys:
+            return None
+        object_id, first_params = self._idempotency_keys[idempotency_key]
+        if params != first_params:
+            raise stripe.IdempotencyError(
+                f'Keys for idempotent requests can only be used with the same parameters they were first used with. '
+                f'Try using a key other than {idempotency_key!r} if you meant to execute a different request.'
+            )
+        return object_id
+
+    def create_coupon(self, idempotency_key=None, **params):
+        self._call('Coupon.create')
+        with self._lock:
+            coupon_id = self._idempotent(idempotency_key, params)
+            if coupon_id is None:
+                coupon_id = f'co_sim_{uuid.uuid4().hex[:14]}'
+                self.coupons[coupon_id] = dict(params, id=coupon_id, object='coupon')
+                if idempotency_key:
+                    self._idempotency_keys[idempotency_key] = (coupon_id, params)
+            return stripe.Coupon.construct_from(self.coupons[coupon_id], stripe.api_key)
+
+    def create_session(self, idempotency_key=None, **params):
+        self._call('checkout.Session.create')
+        with self._lock:
+            session_id = self._idempotent(idempotency_key, params)
+            if session_id is not None:
+                return self._construct_session(session_id)
+            amount_total = sum(
+                item['price_data']['unit_amount'] * item['quantity'] for item in params.get('line_items', [])
+            ) - sum(
+                self.coupons[discount['coupon']]['amount_off'] for discount in params.get('discounts', [])
+            )
+            session_id = f'cs_sim_{uuid.uuid4().hex}'
+            self.sessions[session_id] = {
+                'id' : session_id,
+                'object' : 'checkout.session',
+                'url' : SIMULATOR_URL + session_id,
+                'status' : 'open',
+                'payment_status' : 'unpaid',
+                'amount_total' : amount_total,
+                'currency' : 'usd',
+                'payment_intent' : None,
+                'payment_method_types' : params.get('payment_method_types', ['card']),
+                'metadata' : {key : str(value) for key, value in params.get('metadata', {}).items()},
+                'expires_at' : params.get('expires_at'),
+                'success_url' : params['success_url'].replace('{CHECKOUT_SESSION_ID}', session_id),
+                'cancel_url' : params['cancel_url'].replace('{CHECKOUT_SESSION_ID}', session_id),
+            }
+            if idempotency_key:
+                self._idempotency_keys[idempotency_key] = (session_id, params)
+            return self._construct_session(session_id)
+
+    def retrieve_session(self, session_id : str, expand=None):
+        self._call('checkout.Session.retrieve')
+        with self._lock:
+            if session_id not in self.sessions:
+                raise stripe.InvalidRequestError(f'No such checkout.session: {session_id}', 'id')
+            return self._construct_session(session_id, expand='payment_intent' in (expand or []))
+
+    def retrieve_payment_intent(self, payment_intent_id : str):
+        self._call('PaymentIntent.retrieve')
+        with self._lock:
+            if payment_intent_id not in self.payment_intents:
+                raise stripe.InvalidRequestError(f'No such payment_intent: {payment_intent_id}', 'id')
+            return stripe.PaymentIntent.construct_from(dict(self.payment_intents[payment_intent_id]), stripe.api_key)
+
+    def _construct_session(self, session_id : str, expand : bool = False):
+        session = dict(self.sessions[session_id])
+        if expand and session['payment_intent']:
+            session['payment_intent'] = dict(self.payment_intents[session['payment_intent']])
+        return stripe.checkout.Session.construct_from(session, stripe.api_key)
+
+    @contextmanager
+    def installed(self):
+        """ Route the stripe calls of the checkout to the simulator, and sign webhooks with its secret """
+        patches = [
+            (stripe.Coupon, 'create', self.create_coupon),
+            (stripe.checkout.Session, 'create', self.create_session),
+            (stripe.checkout.Session, 'retrieve', self.retrieve_session),
+            (stripe.PaymentIntent, 'retrieve', self.retrieve_payment_intent),
+        ]
+        originals = [(owner, name, owner.__dict__[name]) for owner, name, _ in patches]
+        for owner, name, method in patches:
+            setattr(owner, name, staticmethod(method))
+        try:
+            with override_settings(STRIPE_WEBHOOK_SECRET=self.webhook_secret):
+                yield self
+        finally:
+            for owner, name, original in originals:
+                setattr(owner, name, original)
+
+    #### Customer side ####
+
+    def pay(self, session_id : str) -> str:
+        """
+        Pay an open session with a card.
+
+        Returns:
+            str : success url of the session, where Stripe redirects the customer
+        """
+        with self._lock:
+            session = self.sessions[session_id]
+            if session['status'] != 'open':
+                raise ValueError(f'Checkout session {session_id} is {session["status"]}')
+            payment_intent_id = f'pi_sim_{uuid.uuid4().hex[:24]}'
+            self.payment_intents[payment_intent_id] = {
+                'id' : payment_intent_id,
+                'object' : 'payment_intent',
+                'amount' : session['amount_total'],
+                'currency' : session['currency'],
+                'status' : 'succeeded',
+                'latest_charge' : f'ch_sim_{uuid.uuid4().hex[:24]}',
+                'created' : int(time.time()),
+            }
+            session.update(status='complete', payment_status='paid', payment_intent=payment_intent_id)
+            return session['success_url']
+
+    def expire(self, session_id : str) -> None:
+        """ Expire an open session """
+        with self._lock:
+            session = self.sessions[session_id]
+            if session['status'] == 'open':
+                session['status'] = 'expired'
+
+    def session_id(self, url : str) -> str:
+        """ Id of the session of a checkout url """
+        return url.rsplit('/', 1)[-1]
+
+    #### Webhooks ####
+
+    def event(self, event_type : str, session_id : str) -> dict:
+        """ Webhook event of a session, e.g. checkout.session.completed """
+        with self._lock:
+            return {
+                'id' : f'evt_sim_{uuid.uuid4().hex[:24]}',
+                'object' : 'event',
+                'type' : event_type,
+                'created' : int(time.time()),
+                'data' : {'object' : dict(self.sessions[session_id])},
+            }
+
+    def sign(self, payload : bytes) -> str:
+        """ Stripe-Signature header of a payload """
+        timestamp = int(time.time())
+        signature = hmac.new(
+            self.webhook_secret.encode(), f'{timestamp}.{payload.decode()}'.encode(), hashlib.sha256
+        ).hexdigest()
+        return f't={timestamp},v1={signature}'
+
+    def deliver(self, event : dict, client : Client = None) -> int:
+        """
+        Deliver a webhook event to the webhook view, again while it's lost or
+        refused.
+
+        Args:
+            event (dict): the event
+            client (Client, optional): client posting the event
+
+        Returns:
+            int : number of attempts
+
+        Raises:
+            ValueError : if the event couldn't be delivered in webhook_attempts attempts
+        """
+        client = client or Client()
+        payload = json.dumps(event).encode()
+        for attempt in range(1, self.webhook_attempts + 1):
+            with self._lock:
+                lost = self._random.random() < self.webhook_failure_rate
+            if lost:
+                continue
+            response = client.post(
+                reverse('stripe_webhook'),
+                data=payload,
+                content_type='application/json',
+                HTTP_STRIPE_SIGNATURE=self.sign(payload)
+            )
+            if response.status_code == 200:
+                return attempt
+        raise ValueError(f'Webhook event {event["id"]} not delivered after {self.webhook_attempts} attempts')
@@ -0,0 +1,130 @@
+import os
+import pytest
+import stripe
+from django.core.management import call_command
+from apps.checkout.loadtest import CheckoutLoadTest
+from apps.checkout.loadtest import STAGES
+from apps.checkout.loadtest import percentile
+from apps.checkout.models import WebhookEvent
+from apps.checkout.stripe_simulator import StripeSimulator
+from apps.conftest import checkout_user
+from apps.conftest import pytestmark
+from apps.factories import ProductFactory
+from apps.orders.models import Order
+
+LINE_ITEMS = [
+    {'price_data' : {'currency' : 'usd', 'product_data' : {'name' : 'Jeans'}, 'unit_amount' : 1200}, 'quantity' : 2},
+    {'price_data' : {'currency' : 'usd', 'product_data' : {'name' : 'Shipping Fee'}, 'unit_amount' : 500}, 'quantity' : 1},
+]
+
+def create_session(idempotency_key=None, **params):
+    return stripe.checkout.Session.create(
+        idempotency_key=idempotency_key,
+        line_items=LINE_ITEMS,
+        success_url='http://testserver/checkout/success/?order_id=ORD-1&session_id={CHECKOUT_SESSION_ID}',
+        cancel_url='http://testserver/checkout/cancel/?order_id=ORD-1&session_id={CHECKOUT_SESSION_ID}',
+        metadata={'order_id' : 'ORD-1', 'user_id' : 1},
+        **params
+    )
+
+class TestStripeSimulator:
+    def test_session_lifecycle(self):
+        simulator = StripeSimulator()
+        with simulator.installed():
+            coupon = stripe.Coupon.create(amount_off=400, currency='usd', duration='once')
+            session = create_session(discounts=[{'coupon' : coupon.id}])
+            assert (session.status, session.payment_status, session.amount_total) == ('open', 'unpaid', 2500)
+            assert simulator.session_id(session.url) == session.id
+
+            success_url = simulator.pay(session.id)
+            assert success_url.endswith(f'session_id={session.id}')
+            paid = stripe.checkout.Session.retrieve(session.id, expand=['payment_intent'])
+            assert (paid.status, paid.payment_status, paid.payment_intent.amount) == ('complete', 'paid', 2500)
+            assert stripe.PaymentIntent.retrieve(paid.payment_intent.id).latest_charge.startswith('ch_sim_')
+            assert simulator.calls == {
+                'Coupon.create' : 1, 'checkout.Session.create' : 1,
+                'checkout.Session.retrieve' : 1, 'PaymentIntent.retrieve' : 1
+            }
+        # uninstalled : the stripe library is back
+        assert not isinstance(stripe.checkout.Session.__dict__['create'], staticmethod)
+
+    def test_idempotent_session_creation(self):
+        with StripeSimulator().installed():
+            assert create_session('checkout-session-ORD-1').id == create_session('checkout-session-ORD-1').id
+            assert create_session('checkout-session-ORD-2').id != create_session('checkout-session-ORD-1').id
+            with pytest.raises(stripe.IdempotencyError):
+                create_session('checkout-session-ORD-1', expires_at=1_000_000)
+
+    def test_failure_rate(self):
+        with StripeSimulator(failure_rate=1).installed():
+            with pytest.raises(stripe.APIConnectionError):
+                create_session()
+
+    def test_expire(self):
+        simulator = StripeSimulator()
+        with simulator.installed():
+            session = create_session()
+            simulator.expire(session.id)
+            assert stripe.checkout.Session.retrieve(session.id).status == 'expired'
+            with pytest.raises(ValueError):
+                simulator.pay(session.id)
+
+    def test_signed_webhook_delivery(self):
+        simulator = StripeSimulator()
+        with simulator.installed():
+            session = create_session()
+            simulator.pay(session.id)
+            event = simulator.event('checkout.session.completed', session.id)
+            assert simulator.deliver(event) == 1
+        stored = WebhookEvent.objects.get()
+        assert (stored.event_id, stored.order_number) == (event['id'], 'ORD-1')
+
+    def test_lost_webhooks(self):
+        simulator = StripeSimulator(webhook_failure_rate=1)
+        with simulator.installed():
+            session = create_session()
+            with pytest.raises(ValueError):
+                simulator.deliver(simulator.event('checkout.session.completed', session.id))
+        assert not WebhookEvent.objects.exists()
+
+def test_percentile():
+    assert percentile([], 95) == 0.0
+    assert percentile([3, 1, 2, 4], 50) == 2
+    assert percentile(list(range(1, 101)), 95) == 95
+    assert percentile(list(range(1, 101)), 99) == 99
+
+@pytest.mark.django_db(transaction=True)
+def test_checkout_load_test():
+    product = ProductFactory(stock=10, status='published', price=12)
+    users = [checkout_user(f'buyer{index}', 'street') for index in range(3)]
+    load_test = CheckoutLoadTest(StripeSimulator(), {product.sku : 2}, concurrency=1, webhook_workers=0)
+    report = load_test.run(users)
+
+    assert report.checkouts == 3, report.errors
+    summary = report.summary()
+    assert [summary[stage]['count'] for stage in STAGES] == [3] * 6
+    assert all(summary[stage]['p50'] <= summary[stage]['p95'] <= summary[stage]['p99'] for stage in STAGES)
+    assert set(Order.objects.values_list('status', flat=True)) == {'paid'}
+    product.refresh_from_db()
+    assert product.stock == 4
+
+@pytest.mark.django_db(transaction=True)
+def test_checkout_loadtest_command(capsys):
+    product = ProductFactory(stock=10, status='published', price=12)
+    call_command('checkout_loadtest', '--sku', product.sku, '--users', '2', '--concurrency', '1', '--webhook-workers', '0')
+    assert '2 checkout(s)' in capsys.readouterr().out
+    assert Order.objects.filter(status='paid').count() == 2
+
+@pytest.mark.skipif(not os.getenv('CHECKOUT_LOADTEST'), reason='set CHECKOUT_LOADTEST=1 to run the checkout load test')
+@pytest.mark.django_db(transaction=True)
+def test_checkout_load_test_concurrent():
+    """ 40 users, 8 at a time, against a Stripe answering in 20 to 50 ms """
+    product = ProductFactory(stock=1000, status='published', price=12)
+    users = [checkout_user(f'buyer{index}', 'street') for index in range(40)]
+    load_test = CheckoutLoadTest(StripeSimulator(latency=0.02, jitter=0.03, seed=1), {product.sku : 1}, concurrency=8)
+    report = load_test.run(users)
+    print('\n' + report.format())
+    # SQLite takes one writer at a time, most checkouts fail on locked tables :
+    # run it against PostgreSQL for figures, the stock stays consistent anyway
+    product.refresh_from_db()
+    assert product.stock == 1000 - Order.objects.filter(status__in=['pending', 'paid']).count()
@@ -13,10 +13,13 @@ from apps.conftest import (
 from django.conf import settings
 import stripe
 from apps.checkout.custom_exceptions import (
+    CheckoutSessionError,
     InvalidPayloadException,
     InvalidSignatureException
 )
 from apps.checkout.payment_service import StripePaymentService
+from apps.money import Money
+from apps.checkout.payment_service import STRIPE_SESSION_MAX_TTL
 from apps.checkout.repositories import CheckoutRepository
 from apps.conftest import pytestmark
 
@@ -158,26 +161,42 @@ class TestStripePaymentService:
         stripe.APIConnectionError("network error"),
         stripe.RateLimitError("too many requests"),
         stripe.APIError("stripe internal error"),
-        Exception("generic failure")
     ])
     def test_create_session_failed(self, mocker, cart_data, order_data, payment_data, exception):
-        mocker.patch('stripe.checkout.Session.create', side_effect=exception)#Exception('Stripe is down'))
-        
-        # ---- 2. Call the function under test ----
-        response = container.payment_service.create_session(
-            cart=cart_data,
-            user=order_data.customer_id,
-            order=order_data,
-            payment=payment_data
-        )
-    
-        assert response == 'An error occured while creating Stripe checkout session. '
+        mocker.patch('stripe.checkout.Session.create', side_effect=exception)
+        with pytest.raises(CheckoutSessionError) as exc_info:
+            container.payment_service.create_session(
+                cart=cart_data,
+                user=order_data.customer_id,
+                order=order_data,
+                payment=payment_data
+            )
+        assert exc_info.value.__cause__ is exception
+        assert order_data.order_number in str(exc_info.value)
+
+    def test_create_session_unexpected_error(self, mocker, cart_data, order_data, payment_data):
+        mocker.patch('stripe.checkout.Session.create', side_effect=KeyError('generic failure'))
+        with pytest.raises(KeyError):
+            container.payment_service.create_session(cart_data, order_data.customer_id, order_data, payment_data)
+
+    @pytest.mark.parametrize('reservation_ttl, ttl', [
+        (30 * 60, 32 * 60), # Stripe minimum, with the margin
+        (2 * 60 * 60, 2 * 60 * 60 + 2 * 60),
+        (48 * 60 * 60, STRIPE_SESSION_MAX_TTL - 2 * 60), # Stripe maximum
+    ])
+    def test_create_session_expires_at(self, mocker, cart_data, order_data, payment_data, fake_session, reservation_ttl, ttl):
+        mocker.patch('apps.checkout.payment_service.RESERVATION_TTL', reservation_ttl)
+        create = mocker.patch('stripe.checkout.Session.create', return_value=fake_session)
+        container.payment_service.create_session(cart_data, order_data.customer_id, order_data, payment_data)
+        # counted from the order, a retry sends the same expiry
+        assert create.call_args.kwargs['expires_at'] == int(order_data.created_at.timestamp()) + ttl
         
     def test_payment_details(self, payment_data):
         output = container.payment_service.payment_details(payment=payment_data)
         assert isinstance(output, dict)
         assert output.get('transaction_id') == 'SDQSA'
-        assert output.get('amount_paid') == payment_data.amount / 100
+        assert output.get('amount_cents') == Money.of(payment_data.amount).cents
+        assert output.get('amount_paid') == f'{payment_data.amount:.2f}'
         assert output.get('date') == payment_data.paied_at
         assert output.get('payment_method') == payment_data.method
         assert output.get('status') == payment_data.status
@@ -0,0 +1,102 @@
+import pytest
+from datetime import timedelta
+from django.db import connection
+from django.utils import timezone
+from apps.checkout.models import Payment
+from apps.checkout.models import StockReservation
+from apps.checkout.reconciliation import PaymentReconciler
+from apps.conftest import checkout_user
+from apps.conftest import pytestmark
+from apps.container import container
+from apps.orders.models import Order
+from apps.orders.models import OrderItem
+from apps.query_plans import assert_no_full_scans
+from apps.query_plans import full_scans
+
+CUSTOMERS = 20
+ORDERS = 2000 # per table, enough for the planner to prefer the indexes over a scan
+
+@pytest.fixture
+def seeded(product):
+    """
+    Order tables filled like in production : most orders paid with their
+    items and committed reservations, a few still pending
+    """
+    customers = [checkout_user(f'customer{index}', f'{index} Main Street') for index in range(CUSTOMERS)]
+    now = timezone.now()
+    orders = Order.objects.bulk_create([
+        Order(
+            order_number=f'ORD-SEED-{index:05}', customer_id=customers[index % CUSTOMERS],
+            status='pending' if index % 50 == 0 else 'paid', final_total=30,
+            idempotency_key=f'key-{index}'
+        )
+        for index in range(ORDERS)
+    ])
+    Payment.objects.bulk_create([
+        Payment(order=order, status='success' if order.status == 'paid' else 'pending', amount=30, stripe_session_id=f'cs_{order.pk}')
+        for order in orders
+    ])
+    Payment.objects.filter(status='pending').update(created_at=now - timedelta(hours=1))
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=product, product_name=product.name, attributes={}, unit_price=10, quantity=1, total_price=10)
+        for order in orders for _ in range(3)
+    ])
+    StockReservation.objects.bulk_create([
+        StockReservation(
+            order=order, sku=product.sku, product=product, quantity=1,
+            status='held' if order.status == 'pending' else 'committed', expires_at=now + timedelta(minutes=30)
+        )
+        for order in orders
+    ])
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    return {'customers' : customers, 'orders' : orders, 'pending' : orders[50]}
+
+def test_full_scan_detected(seeded):
+    assert full_scans("SELECT * FROM orders_orderitem WHERE quantity = 2") == ['orders_orderitem']
+    assert full_scans(f"SELECT * FROM orders_orderitem WHERE order_id = {seeded['pending'].pk}") == []
+    assert full_scans("SELECT * FROM checkout_payment WHERE id > 10 AND currency = 'EUR'") == ['checkout_payment']
+
+def test_assert_no_full_scans_fails():
+    with pytest.raises(AssertionError, match='orders_order scanned'):
+        with assert_no_full_scans():
+            Order.objects.filter(final_total=30).count()
+
+class TestCheckoutRepositoryPlans:
+    def test_order_and_payment_status(self, seeded):
+        order_number = seeded['pending'].order_number
+        with assert_no_full_scans():
+            container.checkout_repo.update_order_status(order_number, 'pending')
+            container.checkout_repo.update_payment_status(order_number, 'pending')
+            container.checkout_repo.retrieve_user_order(order_number, seeded['pending'].customer_id)
+
+    def test_pending_order(self, seeded):
+        with assert_no_full_scans():
+            assert container.checkout_repo.get_pending_order('key-50') == seeded['pending']
+
+    def test_reservations(self, seeded):
+        # the only product of the seed is read whole, like any one-row table
+        with assert_no_full_scans(ignore=('products_product',)):
+            container.checkout_repo.commit_reservations(seeded['pending'])
+            container.checkout_repo.release_reservations(seeded['orders'][100])
+            container.checkout_repo.release_expired_reservations()
+
+    def test_stuck_payments(self, seeded):
+        reconciler = PaymentReconciler()
+        with assert_no_full_scans():
+            batch = list(reconciler.stuck_payments().filter(pk__gt=0)[:reconciler.batch_size])
+        assert len(batch) == ORDERS // 50
+
+class TestOrderRepositoryPlans:
+    def test_order_history(self, seeded):
+        customer = seeded['customers'][0]
+        with assert_no_full_scans():
+            page = container.order_repo.retrieve_order_history(customer)
+            container.order_repo.retrieve_order_history(customer, cursor=page['next_cursor'])
+
+    def test_order_details(self, seeded):
+        order = seeded['pending']
+        with assert_no_full_scans():
+            order = container.order_repo.retrieve_order_details(order.order_number, user=order.customer_id)
+            list(container.order_repo.retrieve_user_order_items(order))
+        assert len(order.items.all()) == 3
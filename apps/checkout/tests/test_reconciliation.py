@@ -0,0 +1,93 @@
+import pytest
+from datetime import timedelta
+from django.core.management import call_command
+from django.utils import timezone
+from apps.cart.cart import Cart
+from apps.checkout.models import Payment
+from apps.checkout.reconciliation import PaymentReconciler
+from apps.checkout.stripe_simulator import StripeSimulator
+from apps.conftest import checkout_user
+from apps.conftest import pytestmark
+from apps.container import container
+
+@pytest.fixture
+def simulator():
+    simulator = StripeSimulator()
+    with simulator.installed():
+        yield simulator
+
+@pytest.fixture
+def checkout(simulator, sku, product):
+    """ Start the checkout of a user buying 2 units of the product, the payment looks an hour old """
+    def start(username='Nina'):
+        cart = Cart({})
+        cart.add(sku, quantity=2)
+        order, payment, session = container.checkout_service.start_checkout(cart, checkout_user(username, '80th Street'))
+        Payment.objects.filter(pk=payment.pk).update(created_at=timezone.now() - timedelta(hours=1))
+        return order, payment, session
+    return start
+
+def stock(product):
+    product.refresh_from_db()
+    return product.stock
+
+class TestPaymentReconciler:
+    def test_paid_session(self, simulator, checkout, product):
+        order, payment, session = checkout()
+        simulator.pay(session.id) # the webhook is lost
+        assert PaymentReconciler().run()['paid'] == 1
+        order.refresh_from_db()
+        payment.refresh_from_db()
+        assert (order.status, payment.status) == ('paid', 'success')
+        assert payment.stripe_payment_intent_id.startswith('pi_sim_')
+        assert order.reservations.get().status == 'committed'
+        assert stock(product) == 10
+
+    def test_expired_session(self, simulator, checkout, product):
+        order, payment, session = checkout()
+        simulator.expire(session.id)
+        assert PaymentReconciler().run()['expired'] == 1
+        order.refresh_from_db()
+        payment.refresh_from_db()
+        assert (order.status, order.failure_reason, payment.status) == ('cancelled', 'Checkout session expired', 'failed')
+        assert stock(product) == 12
+
+    def test_open_session_left_pending(self, checkout, product):
+        order, payment, session = checkout()
+        assert PaymentReconciler().run()['open'] == 1
+        payment.refresh_from_db()
+        assert payment.status == 'pending'
+        assert stock(product) == 10
+
+    def test_recent_payments_left_to_the_webhook(self, simulator, checkout):
+        order, payment, session = checkout()
+        simulator.pay(session.id)
+        Payment.objects.filter(pk=payment.pk).update(created_at=timezone.now())
+        assert sum(PaymentReconciler().run().values()) == 0
+
+    def test_stripe_failure_counted(self, simulator, checkout):
+        order, payment, session = checkout()
+        simulator.pay(session.id)
+        simulator.failure_rate = 1
+        assert PaymentReconciler().run()['errors'] == 1
+        payment.refresh_from_db()
+        assert payment.status == 'pending'
+
+    def test_batches_and_limit(self, simulator, checkout, mocker):
+        sessions = [checkout(f'buyer{index}')[2] for index in range(3)]
+        for session in sessions:
+            simulator.pay(session.id)
+        reconciler = PaymentReconciler(batch_size=2, concurrency=2)
+        read_sessions = mocker.spy(reconciler, 'read_sessions')
+        assert reconciler.run(limit=2)['paid'] == 2
+        assert reconciler.run()['paid'] == 1
+        assert [len(call.args[0]) for call in read_sessions.call_args_list] == [2, 1]
+        assert not Payment.objects.filter(status='pending').exists()
+
+    def test_reconcile_payments_command(self, simulator, checkout, capsys):
+        order, payment, session = checkout()
+        simulator.pay(session.id)
+        call_command('reconcile_payments', '--concurrency', '1')
+        assert '1 paid' in capsys.readouterr().out
+        order.refresh_from_db()
+        assert order.status == 'paid'
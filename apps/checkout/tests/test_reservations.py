@@ -0,0 +1,156 @@
+import random
+import threading
+import time
+import pytest
+from datetime import timedelta
+from unittest.mock import Mock
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
+from apps.cart.cart import Cart
+from apps.checkout.models import StockReservation
+from apps.conftest import checkout_user
+from apps.conftest import pytestmark
+from apps.container import container
+from apps.factories import ProductFactory
+from apps.orders.models import Order
+
+@pytest.fixture
+def buyer():
+    return checkout_user('Nina', '12 Baker Street')
+
+def reserve_order(buyer, cart_lines):
+    """ Order of a {sku : quantity} cart with its stock reserved """
+    cart = Cart({})
+    for sku, quantity in cart_lines.items():
+        cart.add(sku, quantity=quantity)
+    order = container.checkout_service.order_creation(cart=cart, user=buyer)
+    container.checkout_repo.reserve_stock(order, cart.cart)
+    return order
+
+def stocks(*products):
+    for product in products:
+        product.refresh_from_db()
+    return [product.stock for product in products]
+
+class TestReserveStock:
+    def test_reserve_stock(self, buyer, sku, variant_sku, product, variant_product):
+        variant_product.stock = 10
+        variant_product.save()
+        order = reserve_order(buyer, {sku : 4, variant_sku : 3})
+        assert stocks(product, variant_product) == [8, 7]
+        reservations = StockReservation.objects.filter(order=order).order_by('sku')
+        assert [(reservation.sku, reservation.quantity, reservation.status) for reservation in reservations] == [
+            (sku, 4, 'held'), (variant_sku, 3, 'held')
+        ]
+        assert reservations[0].expires_at > timezone.now() + timedelta(minutes=30)
+
+    def test_reserve_stock_all_or_nothing(self, buyer, sku, variant_sku, product, variant_product):
+        variant_product.stock = 10
+        variant_product.save()
+        cart = Cart({})
+        cart.add(sku, quantity=4)
+        cart.add(variant_sku, quantity=3)
+        order = container.checkout_service.order_creation(cart=cart, user=buyer)
+        variant_product.stock = 2 # sold meanwhile
+        variant_product.save()
+        with pytest.raises(ValueError) as exc_info:
+            container.checkout_repo.reserve_stock(order, cart.cart)
+        assert str(exc_info.value) == 'Not enough stock for product "Red T-Shirt Coton", only 2 available'
+        assert stocks(product, variant_product) == [12, 2]
+        assert not StockReservation.objects.exists()
+
+    def test_reserve_stock_batched(self, django_assert_max_num_queries, buyer):
+        products = [ProductFactory(stock=5, status='published') for _ in range(20)]
+        cart = Cart({})
+        for product in products:
+            cart.add(product.sku, quantity=2)
+        order = container.checkout_service.order_creation(cart=cart, user=buyer)
+        # sku lookup, row locks, conditional update, reservations insert
+        with django_assert_max_num_queries(8):
+            container.checkout_repo.reserve_stock(order, cart.cart)
+        assert set(stocks(*products)) == {3}
+
+class TestReservationLifecycle:
+    def test_commit_reservations(self, buyer, sku, product):
+        order = reserve_order(buyer, {sku : 4})
+        assert container.checkout_repo.commit_reservations(order) == 1
+        assert container.checkout_repo.commit_reservations(order) == 0
+        assert container.checkout_repo.release_reservations(order) == 0
+        assert stocks(product) == [8]
+
+    def test_commit_released_reservations(self, buyer, sku, product):
+        order = reserve_order(buyer, {sku : 4})
+        container.checkout_repo.release_reservations(order)
+        assert stocks(product) == [12]
+        # paid after the expiry of the reservation : the stock is taken again
+        container.checkout_repo.commit_reservations(order)
+        assert stocks(product) == [8]
+        assert StockReservation.objects.filter(order=order, status='committed').count() == 1
+
+    def test_release_reservations(self, buyer, sku, product):
+        order = reserve_order(buyer, {sku : 4})
+        assert container.checkout_repo.release_reservations(order) == 1
+        assert container.checkout_repo.release_reservations(order) == 0
+        assert stocks(product) == [12]
+
+    def test_release_expired_reservations(self, buyer, sku, product):
+        order = reserve_order(buyer, {sku : 4})
+        assert container.checkout_repo.release_expired_reservations() == 0
+        assert container.checkout_repo.release_expired_reservations(timezone.now() + timedelta(hours=1)) == 1
+        assert stocks(product) == [12]
+
+    def test_release_expired_reservations_command(self, buyer, sku, product):
+        order = reserve_order(buyer, {sku : 4})
+        StockReservation.objects.filter(order=order).update(expires_at=timezone.now())
+        call_command('release_expired_reservations')
+        assert stocks(product) == [12]
+
+    def test_session_expired_webhook(self, mocker, buyer, sku, product):
+        order = reserve_order(buyer, {sku : 4})
+        event = Mock(type='checkout.session.expired')
+        event.__getitem__ = lambda self, key : {'data' : {'object' : {'metadata' : {'order_id' : order.order_number}}}}[key]
+        mocker.patch('stripe.Webhook.construct_event', return_value=event)
+        container.payment_service.handle_webhook(b'{}', 'signature')
+        order.refresh_from_db()
+        assert (order.status, order.failure_reason) == ('cancelled', 'Checkout session expired')
+        assert stocks(product) == [12]
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_reservations_never_oversell():
+    """ 20 buyers race for the last 5 units of a sku """
+    product = ProductFactory(stock=5, status='published')
+    orders = [Order.objects.create(customer_id=checkout_user(f'buyer{index}', 'street'), final_total=0) for index in range(20)]
+    cart = {product.sku : {'sku' : product.sku, 'quantity' : 1}}
+    start, results = threading.Barrier(len(orders)), []
+
+    def buy(order):
+        try:
+            start.wait()
+            for _ in range(500):
+                try:
+                    container.checkout_repo.reserve_stock(order, cart)
+                    results.append('reserved')
+                    return
+                except ValueError:
+                    results.append('sold out')
+                    return
+                except Exception as error:
+                    # SQLite allows one writer at a time : retry when the table is locked
+                    if 'locked' not in str(error):
+                        results.append(error)
+                        return
+                    time.sleep(random.random() / 100)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=buy, args=(order,)) for order in orders]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    product.refresh_from_db()
+    assert (results.count('reserved'), results.count('sold out')) == (5, 15)
+    assert product.stock == 0
+    assert StockReservation.objects.filter(status='held').count() == 5
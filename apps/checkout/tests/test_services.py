@@ -1,5 +1,6 @@
 from apps.container import container
 import pytest
+from decimal import Decimal
 from apps.conftest import (
     cart_data,
     cart_summary_test,
@@ -13,9 +14,18 @@ from apps.checkout.cart_validation.cart_exceptions import (
     EmptyCartError,
     OutOfStockError
 )
+from apps.cart.cart import CART_SESSION_ID
+from apps.checkout.custom_exceptions import CheckoutSessionError
 from apps.checkout.models import Payment
+from apps.orders.models import Order
 from apps.orders.models import OrderItem
+from apps.factories import ProductFactory
+from django.db import connection
+from django.db import IntegrityError
+from django.db import transaction
+from django.test.utils import CaptureQueriesContext
 from unittest.mock import MagicMock
+import stripe
 from datetime import datetime, timezone
 from apps.conftest import pytestmark
 class TestCheckoutService:
@@ -37,6 +47,46 @@ class TestCheckoutService:
     def test_cart_validation_valid_cart(self, cart_data):
         valid_cart = container.checkout_service.cart_validation(cart_data)
         assert isinstance(valid_cart.cart, dict)
+
+    def test_cart_validation_single_query(self, django_assert_num_queries, cart_data):
+        for product in ProductFactory.create_batch(20, stock=5, status='published'):
+            cart_data.add(product.sku, quantity=2)
+        with django_assert_num_queries(1):
+            container.checkout_service.cart_validation(cart_data)
+
+    def test_revalidate_cart_unchanged(self, cart_data):
+        assert container.checkout_service.revalidate_cart(cart_data) == {'changed' : False, 'removed' : [], 'prices' : []}
+
+    def test_revalidate_cart_price_drift(self, django_assert_num_queries, cart_data, sku, product, variant_sku):
+        product.price = 15
+        product.old_price = 20
+        product.save()
+        with django_assert_num_queries(1):
+            changes = container.checkout_service.revalidate_cart(cart_data)
+        assert changes == {
+            'changed' : True,
+            'removed' : [],
+            'prices' : [{'sku' : sku, 'title' : 'Blue Jeans', 'before' : 12.0, 'after' : 15.0}]
+        }
+        line = cart_data.cart[sku]
+        assert (line['price'], line['price_cents'], line['old_price'], line['discount']) == (15.0, 1500, 20.0, '25.00')
+        assert cart_data.session[CART_SESSION_ID][sku]['price_cents'] == 1500
+        # the summary follows the new price
+        assert cart_data.get_cart_summary()['subtotal_cents'] == 4 * 1500 + 2 * cart_data.cart[variant_sku]['price_cents']
+
+    def test_revalidate_cart_removes_unavailable(self, cart_data, product, variant_product):
+        product.status = 'archived'
+        product.save()
+        variant_product.delete()
+        with pytest.raises(EmptyCartError):
+            container.checkout_service.revalidate_cart(cart_data)
+        assert cart_data.cart == {}
+
+    def test_revalidate_cart_keeps_available_lines(self, cart_data, sku, product, variant_sku):
+        product.delete()
+        changes = container.checkout_service.revalidate_cart(cart_data)
+        assert changes['removed'] == [{'sku' : sku, 'title' : 'Blue Jeans', 'reason' : 'deleted'}]
+        assert list(cart_data.cart) == [variant_sku]
         
     @pytest.mark.parametrize('payment_status, expected_output', [
         ('paid', 'paid'),
@@ -77,6 +127,34 @@ class TestCheckoutService:
         with pytest.raises(AttributeError) as exc_info:
             order_items = container.checkout_service.add_order_items("qsdqsdqsd", cart_data.cart)
         assert "'str' object has no attribute 'id'" == str(exc_info.value)
+
+    def test_add_order_items_constant_queries(self, django_assert_max_num_queries, cart_data):
+        user = checkout_user('Rams', '48th Street Elizabeth')
+        small_order = container.checkout_service.order_creation(cart=cart_data, user=user)
+        large_cart = Cart({})
+        for product in ProductFactory.create_batch(20, stock=5, status='published'):
+            large_cart.add(product.sku, quantity=2)
+        large_order = container.checkout_service.order_creation(cart=large_cart, user=user)
+
+        with CaptureQueriesContext(connection) as small:
+            container.checkout_service.add_order_items(small_order, cart_data.cart)
+        # 20 base products vs a base product and a variant (whose attributes are loaded)
+        with django_assert_max_num_queries(len(small.captured_queries)):
+            items = container.checkout_service.add_order_items(large_order, large_cart.cart)
+        assert len(items) == 20
+        assert OrderItem.objects.filter(order=large_order, product__isnull=False).count() == 20
+
+    def test_place_order(self, cart_data):
+        user = checkout_user('Rams', '48th Street Elizabeth')
+        order = container.checkout_service.place_order(cart_data, user)
+        assert OrderItem.objects.filter(order=order).count() == 2
+
+    def test_place_order_rolls_back(self, cart_data):
+        user = checkout_user('Rams', '48th Street Elizabeth')
+        cart_data.cart['SKU-UNKNOWN'] = dict(next(iter(cart_data.cart.values())), sku='SKU-UNKNOWN')
+        with pytest.raises(ValueError):
+            container.checkout_service.place_order(cart_data, user)
+        assert not Order.objects.filter(customer_id=user).exists()
     
     def test_handle_success_payment_status(self, mocker, sku, product):
         cart = Cart({})
@@ -93,7 +171,7 @@ class TestCheckoutService:
                 
         mock_session = MagicMock()
         mock_session.id = "sess_123"
-        mock_session.amount_total = 2000
+        mock_session.amount_total = 1999
         mock_session.payment_intent = "pi_123"
         mock_session.currency = "usd"
         mock_session.payment_method_types = ["card"]
@@ -124,7 +202,7 @@ class TestCheckoutService:
         # After successful payment
         assert order.status == 'paid'
         assert payment.status == 'success'
-        assert float(payment.amount) == float(mock_session.amount_total / 100)
+        assert payment.amount == Decimal('19.99')
         assert payment.method == mock_session.payment_method_types[0]
         assert payment.currency == 'USD'
         assert payment.stripe_session_id == mock_session.id
@@ -135,7 +213,30 @@ class TestCheckoutService:
         assert len(cart.cart) > 0 # We don't clear cart yet here
         # Inventory stock decrease
         assert product.stock == 8 # 12 - 4 = 8
-    
+
+    @pytest.mark.parametrize('failing', ['stripe', 'stock'])
+    def test_handle_success_payment_status_atomic(self, mocker, sku, product, failing):
+        cart = Cart({})
+        cart.add(sku, quantity=4)
+        user = checkout_user('Malm', '99th Street')
+        order = container.checkout_service.order_creation(cart=cart, user=user)
+        payment = container.checkout_service.payment_creation(order, 'stripe')
+        session = MagicMock(id='cs_1', amount_total=4800, payment_intent='pi_1', currency='usd', payment_method_types=['card'])
+        mocker.patch('stripe.checkout.Session.retrieve', return_value=session)
+        if failing == 'stripe':
+            mocker.patch('stripe.PaymentIntent.retrieve', side_effect=stripe.APIConnectionError('network error'))
+            error = stripe.APIConnectionError
+        else:
+            mocker.patch('stripe.PaymentIntent.retrieve', return_value=MagicMock(latest_charge='ch_1', created=1700000000))
+            # released reservations whose stock was sold meanwhile
+            mocker.patch.object(container.checkout_repo, 'commit_reservations', side_effect=ValueError('Not enough stock'))
+            error = ValueError
+        with pytest.raises(error):
+            container.checkout_service.handle_success_payment_status('cs_1', order.order_number, user)
+        order.refresh_from_db()
+        payment.refresh_from_db()
+        assert (order.status, payment.status) == ('pending', 'pending')
+
     def test_handle_failure_payment_status(self, mocker, sku, variant_product, variant_sku):
         variant_product.stock = 15
         variant_product.save()
@@ -235,4 +336,87 @@ class TestCheckoutService:
         order.refresh_from_db()
         payment.refresh_from_db()
         product.refresh_from_db()
-    
\ No newline at end of file
+    
+class TestStartCheckout:
+    @pytest.fixture
+    def stripe_session(self, mocker):
+        session = MagicMock(id='cs_123', payment_intent='pi_123', url='https://checkout.stripe.com/cs_123', status='open')
+        create = mocker.patch('stripe.checkout.Session.create', return_value=session)
+        mocker.patch('stripe.checkout.Session.retrieve', return_value=session)
+        return session, create
+
+    def test_idempotency_key(self, cart_data):
+        user, other_user = checkout_user('Nina', '80th Street'), checkout_user('Rams', '48th Street')
+        key = container.checkout_service.idempotency_key(cart_data, user)
+        assert len(key) == 64
+        assert container.checkout_service.idempotency_key(Cart(dict(cart_data.session)), user) == key
+        assert container.checkout_service.idempotency_key(cart_data, other_user) != key
+        cart_data.update_product_quantity(next(iter(cart_data.cart)), 1)
+        assert container.checkout_service.idempotency_key(cart_data, user) != key
+
+    def test_start_checkout(self, stripe_session, cart_data, sku, product):
+        user = checkout_user('Nina', '80th Street')
+        order, payment, session = container.checkout_service.start_checkout(cart_data, user)
+        payment.refresh_from_db()
+        product.refresh_from_db()
+        assert session is stripe_session[0]
+        assert (payment.stripe_session_id, payment.stripe_payment_intent_id) == ('cs_123', 'pi_123')
+        assert OrderItem.objects.filter(order=order).count() == 2
+        assert order.reservations.filter(status='held').count() == 2
+        assert product.stock == 8
+
+    def test_start_checkout_writes(self, stripe_session, cart_data):
+        user = checkout_user('Nina', '80th Street')
+        with CaptureQueriesContext(connection) as context:
+            container.checkout_service.start_checkout(cart_data, user)
+        writes = [query['sql'] for query in context.captured_queries if query['sql'].startswith(('INSERT', 'UPDATE'))]
+        # order, items, payment, stock of the product and of the variant, reservations, session of the payment
+        assert len(writes) == 7
+
+    def test_start_checkout_twice(self, stripe_session, cart_data, sku, product):
+        user = checkout_user('Nina', '80th Street')
+        first = container.checkout_service.start_checkout(cart_data, user)
+        second = container.checkout_service.start_checkout(cart_data, user)
+        product.refresh_from_db()
+        assert second[0] == first[0]
+        stripe_session[1].assert_called_once()
+        assert Order.objects.filter(customer_id=user).count() == 1
+        assert product.stock == 8
+
+    def test_start_checkout_expired_session(self, stripe_session, cart_data, sku, product):
+        user = checkout_user('Nina', '80th Street')
+        first, _, _ = container.checkout_service.start_checkout(cart_data, user)
+        stripe_session[0].status = 'expired'
+        second, _, _ = container.checkout_service.start_checkout(cart_data, user)
+        first.refresh_from_db()
+        product.refresh_from_db()
+        assert second != first
+        assert (first.status, first.failure_reason) == ('cancelled', 'Checkout session expired')
+        assert product.stock == 8
+
+    def test_start_checkout_in_progress(self, stripe_session, cart_data):
+        user = checkout_user('Nina', '80th Street')
+        key = container.checkout_service.idempotency_key(cart_data, user)
+        order = container.checkout_service.place_order(cart_data, user, key)
+        container.checkout_service.payment_creation(order, 'stripe')
+        with pytest.raises(ValueError) as exc_info:
+            container.checkout_service.start_checkout(cart_data, user)
+        assert str(exc_info.value) == 'A checkout of this cart is already in progress'
+
+    def test_start_checkout_pending_order_unique(self, cart_data):
+        user = checkout_user('Nina', '80th Street')
+        key = container.checkout_service.idempotency_key(cart_data, user)
+        container.checkout_service.place_order(cart_data, user, key)
+        with pytest.raises(IntegrityError):
+            with transaction.atomic():
+                container.checkout_service.place_order(cart_data, user, key)
+
+    def test_start_checkout_stripe_failure(self, mocker, cart_data, sku, product):
+        mocker.patch('stripe.checkout.Session.create', side_effect=stripe.APIConnectionError('Stripe is down'))
+        user = checkout_user('Nina', '80th Street')
+        with pytest.raises(CheckoutSessionError):
+            container.checkout_service.start_checkout(cart_data, user)
+        order = Order.objects.get(customer_id=user)
+        product.refresh_from_db()
+        assert order.status == 'cancelled'
+        assert product.stock == 12
@@ -0,0 +1,78 @@
+from unittest.mock import MagicMock
+from apps.cart.cart import Cart
+from apps.checkout.models import Payment
+from apps.checkout.stripe_gateway import StripeGateway
+from apps.checkout.stripe_gateway import intent_id
+from apps.conftest import checkout_user
+from apps.conftest import pytestmark
+from apps.container import container
+
+def fake_session(session_id='cs_1', payment_intent='pi_1', amount_total=2000):
+    return MagicMock(
+        id=session_id, payment_intent=payment_intent, amount_total=amount_total,
+        currency='usd', payment_method_types=['card']
+    )
+
+def fake_intent(intent_id='pi_1'):
+    return MagicMock(id=intent_id, latest_charge='ch_1', created=1700000000)
+
+class TestStripeGateway:
+    def test_session_read_once(self, mocker, stripe_gateway):
+        retrieve = mocker.patch('stripe.checkout.Session.retrieve', return_value=fake_session())
+        assert stripe_gateway.get_session('cs_1') is stripe_gateway.get_session('cs_1')
+        retrieve.assert_called_once_with('cs_1', expand=['payment_intent'])
+        assert stripe_gateway.calls('cs_1') == 1
+
+    def test_fresh_session_read_again(self, mocker, stripe_gateway):
+        retrieve = mocker.patch('stripe.checkout.Session.retrieve', return_value=fake_session())
+        stripe_gateway.get_session('cs_1')
+        stripe_gateway.get_session('cs_1', fresh=True)
+        assert retrieve.call_count == 2
+        assert stripe_gateway.calls('cs_1') == 2
+
+    def test_expired_session_read_again(self, mocker):
+        retrieve = mocker.patch('stripe.checkout.Session.retrieve', return_value=fake_session())
+        stripe_gateway = StripeGateway(timeout=-1)
+        stripe_gateway.get_session('cs_1')
+        stripe_gateway.get_session('cs_1')
+        assert retrieve.call_count == 2
+
+    def test_expanded_payment_intent_not_read(self, mocker, stripe_gateway):
+        payment_intent = fake_intent()
+        retrieve = mocker.patch('stripe.PaymentIntent.retrieve')
+        session = fake_session(payment_intent=payment_intent)
+        assert stripe_gateway.get_payment_intent(session) is payment_intent
+        assert intent_id(session) == 'pi_1'
+        retrieve.assert_not_called()
+
+    def test_payment_intent_read_once(self, mocker, stripe_gateway):
+        retrieve = mocker.patch('stripe.PaymentIntent.retrieve', return_value=fake_intent())
+        session = fake_session()
+        stripe_gateway.remember_session(session)
+        stripe_gateway.get_payment_intent(session)
+        stripe_gateway.get_payment_intent(stripe_gateway.get_session('cs_1'))
+        retrieve.assert_called_once_with('pi_1')
+        assert intent_id(session) == 'pi_1'
+        assert stripe_gateway.calls('cs_1') == 1
+
+def test_payment_success_single_stripe_read(mocker, stripe_gateway, sku, product):
+    """ payment_status view then webhook fallback : one Stripe read for the checkout """
+    cart = Cart({})
+    cart.add(sku, quantity=4)
+    user = checkout_user('Malm', '99th Street')
+    order = container.checkout_service.place_order(cart, user)
+    payment = container.checkout_service.payment_creation(order, 'stripe')
+    container.checkout_repo.reserve_stock(order, cart.cart)
+    session = fake_session(payment_intent=fake_intent(), amount_total=int(order.final_total * 100))
+    session_retrieve = mocker.patch('stripe.checkout.Session.retrieve', return_value=session)
+    intent_retrieve = mocker.patch('stripe.PaymentIntent.retrieve')
+
+    for _ in range(2):
+        container.checkout_service.handle_success_payment_status(session_id='cs_1', order_id=order.order_number, user_id=user)
+
+    session_retrieve.assert_called_once_with('cs_1', expand=['payment_intent'])
+    intent_retrieve.assert_not_called()
+    assert stripe_gateway.calls('cs_1') == 1
+    payment.refresh_from_db()
+    assert (payment.status, payment.stripe_payment_intent_id, payment.transaction_id) == ('success', 'pi_1', 'ch_1')
+    assert Payment.objects.count() == 1
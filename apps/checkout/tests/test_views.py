@@ -14,13 +14,14 @@ from apps.conftest import (
     valid_user,
     payment_process_cart,
     mock_session,
-    
+    checkout_user,
 )
 import json
 from apps.cart.cart import Cart
 from apps.checkout.models import Payment
 from apps.orders.models import Order
 from apps.orders.models import OrderItem
+from apps.orders.models import Receipt
 from apps.checkout.custom_exceptions import (
     InvalidPayloadException,
     InvalidSignatureException
@@ -28,6 +29,9 @@ from apps.checkout.custom_exceptions import (
 from unittest.mock import Mock
 from django.conf import settings
 from apps.conftest import pytestmark
+from apps.pricing.models import Promotion
+from apps.pricing.models import TaxRate
+from decimal import Decimal
 
 @pytest.fixture
 def home_url():
@@ -128,6 +132,19 @@ class TestCartReviewView:
         success_message = json.loads(response.content.decode()).get('message')
         assert success_message == 'cart is valid'
 
+    def test_cart_review_price_drift(self, client, cart_url, log_user, product, sku):
+        client.post(reverse('cart-add', kwargs={'product_sku' : sku, 'product_quantity' : 2}))
+        product.price = 10
+        product.save()
+        response = client.get(cart_url)
+        assert response.status_code == 200
+        content = json.loads(response.content.decode())
+        assert content['status'] == 'changed'
+        assert content['changes']['prices'] == [{'sku' : sku, 'title' : 'Blue Jeans', 'before' : 12.0, 'after' : 10.0}]
+        assert content['cart_summary']['subtotal_cents'] == 2000
+        # the session cart was rewritten : the next review is clean
+        assert json.loads(client.get(cart_url).content.decode())['status'] == 'success'
+
 ### Payment fixtures ###
 
 @pytest.fixture
@@ -135,7 +152,6 @@ def cart_session(client, payment_process_cart):
     cart = client.session['cart']
     cart_class = Cart(cart)
     cart_class.cart = cart
-    del cart_class.cart['cart']
     return cart_class
 
 @pytest.fixture
@@ -152,9 +168,10 @@ def fake_session(cart_session):
 class TestPaymentProcessingView:
     def test_payment_empty_cart(self, client, valid_user):
         login_response = client.post(reverse('login'), data={'identifier':'test', 'password':'mypassword', 'next':reverse('create-checkout-session')})
-        with pytest.raises(ValueError) as exc_info:
-            response = client.get(reverse('create-checkout-session'))
-        assert 'Cart is empty. Cannot create checkout session.' == str(exc_info.value)
+        response = client.get(reverse('create-checkout-session'))
+        assert response.status_code == 400
+        assert json.loads(response.content.decode()) == {'status' : 'error', 'error' : 'Your cart is empty. Add items to proceed.'}
+        assert not Order.objects.exists()
     
     def test_payment_success(self, mocker ,client, cart_session, valid_user, fake_session):
         client.force_login(valid_user)        
@@ -178,6 +195,26 @@ class TestPaymentProcessingView:
         order_items = OrderItem.objects.all()
         for order_item in order_items:
             assert order_item.order == order
+    def test_payment_cart_changed(self, mocker, client, cart_session, valid_user, product):
+        client.force_login(valid_user)
+        create = mocker.patch('stripe.checkout.Session.create')
+        product.status = 'archived'
+        product.save()
+        response = client.get(reverse('create-checkout-session'))
+        assert response.status_code == 409
+        content = json.loads(response.content.decode())
+        assert content['changes']['removed'] == [{'sku' : product.sku, 'title' : 'Blue Jeans', 'reason' : 'unpublished'}]
+        create.assert_not_called()
+        assert not Order.objects.exists()
+
+    def test_payment_stripe_failure(self, mocker, client, cart_session, valid_user):
+        client.force_login(valid_user)
+        mocker.patch('stripe.checkout.Session.create', side_effect=stripe.APIConnectionError('network error'))
+        response = client.get(reverse('create-checkout-session'))
+        assert response.status_code == 400
+        assert json.loads(response.content.decode())['status'] == 'error'
+        assert Order.objects.get(customer_id=valid_user).status == 'cancelled'
+
 class TestStripeWebhookView:
     def test_webhook_success(self, mocker, client):
         fake_payload = {
@@ -189,7 +226,7 @@ class TestStripeWebhookView:
             }
         }
         fake_payload_bytes = json.dumps(fake_payload).encode('utf-8')
-        mocker.patch('apps.checkout.payment_service.StripePaymentService.handle_webhook', return_value=True)
+        mocker.patch('apps.checkout.payment_service.StripePaymentService.receive_webhook', return_value=True)
         response = client.post(
             reverse('stripe_webhook'), 
             data=fake_payload_bytes,
@@ -215,7 +252,7 @@ class TestStripeWebhookView:
             }
         }
         fake_payload_bytes = json.dumps(fake_payload).encode('utf-8')
-        mocker.patch('apps.checkout.payment_service.StripePaymentService.handle_webhook', side_effect=exception(msg))
+        mocker.patch('apps.checkout.payment_service.StripePaymentService.receive_webhook', side_effect=exception(msg))
         response = client.post(
             reverse('stripe_webhook'), 
             data=fake_payload_bytes,
@@ -240,6 +277,21 @@ class TestConfirmPageView:
         for key in keys:
             assert key in context 
         
+    def test_confirm_page_pricing(self, client, sku, product):
+        user = checkout_user('Nina', '80th Street') # shipped to the US
+        TaxRate.objects.create(country='US', rate='8.5')
+        Promotion.objects.create(name='Jeans sale', value=25, sku=sku)
+        client.force_login(user)
+        client.post(reverse('cart-add', kwargs={'product_sku' : sku, 'product_quantity' : 4}))
+        response = client.get(reverse('confirm'))
+        context = response.context
+        assert context['vat_rate'] == Decimal('8.5')
+        assert context['discount'] == Decimal('12.00') # 25% of 4 x 12$
+        assert context['promotions'] == ['Jeans sale']
+        assert context['subtotal'] - context['discount'] + context['vat_total'] + context['shipping_fee'] == context['total']
+        assert 'Discount (Jeans sale)' in response.content.decode()
+        assert 'VAT (8.5%)' in response.content.decode()
+
     def test_confirm_page_post(self, client):
         response = client.post(reverse('confirm'))
         assert response.status_code == 302
@@ -302,25 +354,28 @@ class TestPaymentStatusView:
         fake_orders, 
         fake_payments, 
         fake_session, 
-        fakes_pi
+        fakes_pi,
+        django_capture_on_commit_callbacks
     ): 
         client.force_login(valid_user)
         mocker.patch("stripe.checkout.Session.retrieve", return_value=fake_session)
         mocker.patch("stripe.PaymentIntent.retrieve", return_value=fakes_pi)
         
-        
-        response = client.get(
-            reverse('payment-status') + f'?order_id={fake_orders.order_number}&session_id={fake_session.id}'
-        )
-        template_name = response.templates[0].name
-        context = response.context[0]
+        with django_capture_on_commit_callbacks(execute=True):
+            response = client.get(
+                reverse('payment-status') + f'?order_id={fake_orders.order_number}&session_id={fake_session.id}'
+            )
+        template_names = [template.name for template in response.templates]
+        context = response.context
         assert response.status_code == 200
-        assert template_name == 'payment_status.html'
+        assert 'payment_status.html' in template_names
+        assert Receipt.objects.filter(order=fake_orders).exists() # the receipt is stored once paid
         assert context['payment_status'] == 'paid'
         assert context['payment'] == fake_payments
         assert context['order'] == fake_orders
         assert context['count'] == 0
         assert client.session.get('cart') == {} # cart is cleared
+        assert container.order_repo.retrieve_receipt(fake_orders.order_number) is not None
         
     def test_payment_status_failure(
         self, 
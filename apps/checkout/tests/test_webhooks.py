@@ -0,0 +1,199 @@
+import hashlib
+import hmac
+import json
+import time
+import pytest
+from datetime import timedelta
+from unittest.mock import MagicMock
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from apps.cart.cart import Cart
+from apps.checkout.models import Payment
+from apps.checkout.models import WebhookEvent
+from apps.checkout.webhooks import WebhookWorker
+from apps.checkout.webhooks import record_event
+from apps.conftest import checkout_user
+from apps.conftest import pytestmark
+from apps.container import container
+
+WEBHOOK_SECRET = 'whsec_test'
+
+def stripe_event(event_id, event_type, order_number='', created=1700000000, **data_object):
+    """ Payload of a Stripe event """
+    return {
+        'id' : event_id,
+        'object' : 'event',
+        'type' : event_type,
+        'created' : created,
+        'data' : {'object' : dict(data_object, metadata={'order_id' : order_number} if order_number else {})}
+    }
+
+def sign(payload : bytes, secret : str = WEBHOOK_SECRET) -> str:
+    """ Stripe-Signature header of a payload, as Stripe computes it """
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f'{timestamp}.{payload.decode()}'.encode(), hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
+
+@pytest.fixture
+def webhook_secret(settings):
+    settings.STRIPE_WEBHOOK_SECRET = WEBHOOK_SECRET
+
+class Recorder:
+    """ Webhook handler keeping the ids of the events, failing on the ids in failing """
+    def __init__(self, failing=()):
+        self.handled, self.failing = [], set(failing)
+
+    def __call__(self, event):
+        if event.id in self.failing:
+            raise RuntimeError('Stripe is down')
+        self.handled.append(event.id)
+
+class TestWebhookView:
+    def post(self, client, payload, signature=None):
+        body = json.dumps(payload).encode()
+        return client.post(
+            reverse('stripe_webhook'),
+            data=body,
+            content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=signature or sign(body)
+        )
+
+    def test_webhook_stored_not_processed(self, mocker, client, webhook_secret):
+        dispatch = mocker.patch('apps.checkout.payment_service.StripePaymentService.dispatch_event')
+        response = self.post(client, stripe_event('evt_1', 'checkout.session.completed', 'ORD-1', id='cs_1'))
+        assert response.status_code == 200
+        event = WebhookEvent.objects.get()
+        assert (event.event_id, event.type, event.order_number, event.status) == ('evt_1', 'checkout.session.completed', 'ORD-1', 'pending')
+        dispatch.assert_not_called()
+
+    def test_webhook_redelivery(self, client, webhook_secret):
+        payload = stripe_event('evt_1', 'checkout.session.completed', 'ORD-1')
+        assert self.post(client, payload).status_code == 200
+        assert self.post(client, payload).status_code == 200
+        assert WebhookEvent.objects.count() == 1
+
+    def test_webhook_invalid_signature(self, client, webhook_secret):
+        body = json.dumps(stripe_event('evt_1', 'checkout.session.completed')).encode()
+        response = self.post(client, json.loads(body), signature=sign(body, 'whsec_other'))
+        assert response.status_code == 400
+        assert not WebhookEvent.objects.exists()
+
+class TestWebhookWorker:
+    def test_claim_in_order_per_order(self):
+        record_event(stripe_event('evt_2', 'checkout.session.completed', 'ORD-1', created=2))
+        record_event(stripe_event('evt_1', 'checkout.session.expired', 'ORD-1', created=1))
+        record_event(stripe_event('evt_3', 'checkout.session.completed', 'ORD-2', created=3))
+        record_event(stripe_event('evt_4', 'customer.created', created=4))
+        handler = Recorder()
+        worker = WebhookWorker(handler)
+        # evt_2 waits for the earlier event of its order
+        assert [event.event_id for event in worker.claim()] == ['evt_1', 'evt_3', 'evt_4']
+        assert worker.claim() == []
+        WebhookEvent.objects.filter(event_id='evt_1').update(status='done')
+        assert [event.event_id for event in worker.claim()] == ['evt_2']
+
+    def test_drain(self):
+        for index in range(3):
+            record_event(stripe_event(f'evt_{index}', 'checkout.session.completed', 'ORD-1', created=index))
+        handler = Recorder()
+        assert WebhookWorker(handler).drain() == 3
+        assert handler.handled == ['evt_0', 'evt_1', 'evt_2']
+        assert set(WebhookEvent.objects.values_list('status', flat=True)) == {'done'}
+
+    def test_retry_with_backoff(self):
+        record_event(stripe_event('evt_1', 'checkout.session.completed', 'ORD-1', created=1))
+        record_event(stripe_event('evt_2', 'checkout.session.completed', 'ORD-1', created=2))
+        worker = WebhookWorker(Recorder(failing={'evt_1'}))
+        assert worker.drain() == 0
+        event = WebhookEvent.objects.get(event_id='evt_1')
+        assert (event.status, event.attempts, event.last_error) == ('pending', 1, 'RuntimeError: Stripe is down')
+        assert event.next_attempt_at > timezone.now()
+        # the later event of the order waits for the retry
+        assert worker.claim(now=timezone.now() + timedelta(seconds=3)) == []
+        worker.handler = Recorder()
+        assert [event.event_id for event in worker.claim(now=timezone.now() + timedelta(seconds=10))] == ['evt_1']
+
+    def test_failed_after_max_attempts(self, mocker):
+        mocker.patch('apps.checkout.webhooks.MAX_ATTEMPTS', 2)
+        record_event(stripe_event('evt_1', 'checkout.session.completed', 'ORD-1'))
+        worker = WebhookWorker(Recorder(failing={'evt_1'}))
+        for _ in range(2):
+            for event in worker.claim(now=timezone.now() + timedelta(hours=2)):
+                worker.process(event)
+        event = WebhookEvent.objects.get()
+        assert (event.status, event.attempts) == ('failed', 2)
+
+    def test_stale_processing_claimed_again(self):
+        record_event(stripe_event('evt_1', 'checkout.session.completed', 'ORD-1'))
+        worker = WebhookWorker(Recorder())
+        assert len(worker.claim()) == 1
+        assert worker.claim() == []
+        assert len(worker.claim(now=timezone.now() + timedelta(hours=1))) == 1
+
+    def test_failing_handler_rolled_back(self):
+        record_event(stripe_event('evt_1', 'customer.created'))
+        user = checkout_user('Nina', '80th Street')
+
+        def handler(event):
+            user.first_name = 'Half processed'
+            user.save()
+            raise RuntimeError('Stripe is down')
+
+        worker = WebhookWorker(handler)
+        assert worker.drain() == 0
+        user.refresh_from_db()
+        assert user.first_name == ''
+        assert WebhookEvent.objects.get().status == 'pending'
+
+    def test_claim_taken_over(self):
+        record_event(stripe_event('evt_1', 'customer.created'))
+        slow, other = WebhookWorker(Recorder()), WebhookWorker(Recorder())
+        [event] = slow.claim()
+        # the slow worker went past the lock timeout
+        [taken_over] = other.claim(now=timezone.now() + timedelta(hours=1))
+        assert slow.process(event) is False
+        assert slow.handler.handled == []
+        assert other.process(taken_over) is True
+        assert other.handler.handled == ['evt_1']
+        stored = WebhookEvent.objects.get()
+        assert (stored.status, stored.attempts) == ('done', 1)
+
+    def test_process_webhooks_command(self, mocker):
+        record_event(stripe_event('evt_1', 'customer.created'))
+        dispatch = mocker.patch('apps.checkout.payment_service.StripePaymentService.dispatch_event')
+        call_command('process_webhooks', '--once')
+        dispatch.assert_called_once()
+        assert WebhookEvent.objects.get().status == 'done'
+
+    def test_session_completed_end_to_end(self, mocker, client, webhook_secret, sku, product):
+        """ Stripe stub : signed webhook, then the session and payment intent the worker retrieves """
+        cart = Cart({})
+        cart.add(sku, quantity=4)
+        user = checkout_user('Nina', '80th Street')
+        order = container.checkout_service.place_order(cart, user)
+        payment = container.checkout_service.payment_creation(order, 'stripe')
+        container.checkout_repo.reserve_stock(order, cart.cart)
+        session_retrieve = mocker.patch('stripe.checkout.Session.retrieve')
+        intent_retrieve = mocker.patch('stripe.PaymentIntent.retrieve', return_value=MagicMock(latest_charge='ch_1', created=1700000000))
+
+        payload = stripe_event(
+            'evt_1', 'checkout.session.completed', order.order_number, id='cs_1', payment_intent='pi_1',
+            amount_total=int(order.final_total * 100), payment_method_types=['card'], currency='usd'
+        )
+        payload['data']['object']['metadata']['user_id'] = str(user.id)
+        body = json.dumps(payload).encode()
+        client.post(reverse('stripe_webhook'), data=body, content_type='application/json', HTTP_STRIPE_SIGNATURE=sign(body))
+        order.refresh_from_db()
+        assert order.status == 'pending'
+
+        assert WebhookWorker().drain() == 1
+        order.refresh_from_db()
+        product.refresh_from_db()
+        assert order.status == 'paid'
+        assert Payment.objects.get(order=order).status == 'success'
+        assert order.reservations.get().status == 'committed'
+        assert product.stock == 8
+        # the session comes with the event : only the payment intent is read
+        session_retrieve.assert_not_called()
+        intent_retrieve.assert_called_once_with('pi_1')
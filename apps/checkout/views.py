@@ -16,6 +16,7 @@ from .cart_validation.cart_exceptions import (
     OutOfStockError
 )
 from .custom_exceptions import (
+    CheckoutSessionError,
     InvalidPayloadException,
     InvalidSignatureException,
 )
@@ -45,22 +46,32 @@ def home(request):
     )
 
 def review_cart(request):
+    """
+    Revalidate the cart against the current products. Removed lines and new
+    prices are returned with the updated summary, the frontend shows them
+    without reloading the cart.
+    """
     cart = Cart.from_request(request)
     try:
-        cart_validation = container.checkout_service.cart_validation(cart)
-        return JsonResponse({
-            'status':'success',
-            'message' : 'cart is valid',
-            
-        },status=200)
+        changes = container.checkout_service.revalidate_cart(cart)
     except (EmptyCartError, OutOfStockError) as error:
         return JsonResponse({'status':'error', 'error': str(error)}, status=400)
+    return JsonResponse({
+        'status' : 'changed' if changes['changed'] else 'success',
+        'message' : 'your cart was updated' if changes['changed'] else 'cart is valid',
+        'changes' : changes,
+        'count' : len(cart),
+        'cart_summary' : cart.get_cart_summary(),
+    }, status=200)
 
 @login_required
 def payment_processing(request):
     """
     Handle payment processing via Stripe.
-    1. Create order and payment records.
+    0. Revalidate the cart : an empty or out of stock cart is refused (400), a
+       cart changed by the revalidation is sent back (409).
+    1. Create order, order items, payment and stock reservation in one transaction,
+       or reuse the pending order of the same cart (double-click, back button).
     2. Create Stripe checkout session.
     3. Redirect user to Stripe checkout page.
     4. Handle errors appropriately.
@@ -74,20 +85,23 @@ def payment_processing(request):
         
     """ 
     cart = Cart.from_request(request)
-    # Order and payment initialization
-    order = container.checkout_service.order_creation(cart, request.user)
-    payment = container.checkout_service.payment_creation(order=order, payment_provider="stripe")
-    checkout_session = container.payment_service.create_session(cart, request.user, order, payment)
-    
-    if isinstance(checkout_session, str):
-        return JsonResponse({'status':'error', 'error': checkout_session}, status=400)
-    
-    payment.stripe_payment_intent_id = checkout_session.payment_intent
-    payment.stripe_session_id = checkout_session.id
-    payment.save()
-    order.final_total = checkout_session.amount_total / 100
-    order.save()
-    container.checkout_service.add_order_items(order, cart=cart.cart)
+    try:
+        changes = container.checkout_service.revalidate_cart(cart)
+    except (EmptyCartError, OutOfStockError) as error:
+        return JsonResponse({'status':'error', 'error': str(error)}, status=400)
+    if changes['changed']:
+        # the customer confirms the new cart before paying
+        return JsonResponse({
+            'status' : 'changed',
+            'error' : 'your cart was updated',
+            'changes' : changes,
+            'count' : len(cart),
+            'cart_summary' : cart.get_cart_summary(),
+        }, status=409)
+    try:
+        order, payment, checkout_session = container.checkout_service.start_checkout(cart, request.user)
+    except (ValueError, CheckoutSessionError) as error:
+        return JsonResponse({'status':'error', 'error': str(error)}, status=400)
 
     return redirect(checkout_session.url, code=303)
     
@@ -95,7 +109,8 @@ def payment_processing(request):
 @require_POST
 def stripe_webhook(request):
     """
-    Handle Stripe webhook events.
+    Receive Stripe webhook events : verified events are stored and
+    acknowledged right away, the process_webhooks worker processes them.
     
     Args:
         request (HttpRequest): The incoming HTTP request containing the webhook payload.
@@ -106,7 +121,7 @@ def stripe_webhook(request):
     """
     payload = request.body
     try:
-        event = container.payment_service.handle_webhook(payload, request.META.get('HTTP_STRIPE_SIGNATURE'))
+        event = container.payment_service.receive_webhook(payload, request.META.get('HTTP_STRIPE_SIGNATURE'))
     except InvalidPayloadException as e:
         return JsonResponse({'error':str(e)}, status=400)
     except InvalidSignatureException as e:  
@@ -146,7 +161,7 @@ def payment_status(request):
     order, payment = checkout_context[1], checkout_context[2]
 
     if session.payment_status == 'paid':
-        request.session['cart'] = {} # Clear user cart
+        cart.clear() # Clear user cart
         cart_len = 0
         if payment.status == 'pending':
             updated_order, updated_payment = container.checkout_service.handle_webhook_fallback(
@@ -193,7 +208,9 @@ class PaymentConfirmView(DetailView):
         context = {
             'count' : len(cart.cart),
             'subtotal' : cart_summary.get('subtotal_price'),
-            'vat_rate' : 20,
+            'discount' : cart_summary['discount'],
+            'promotions' : cart_summary['promotions'],
+            'vat_rate' : cart_summary['tax_rate'],
             'vat_total' : cart_summary['taxes'],
             'shipping_fee' : cart_summary['shipping_fee'],
             'total' : cart_summary.get('total_price'),
@@ -0,0 +1,242 @@
+"""
+Durable queue of the Stripe webhook events.
+
+The webhook view only verifies and stores events (WebhookEvent), so that
+Stripe gets its acknowledgement whatever the time taken to process them.
+WebhookWorker then processes the stored events :
+
+    - events are deduplicated on their Stripe event id
+    - events of an order are processed one at a time, in the order Stripe
+      created them : an event waits while an earlier event of its order is
+      pending or processing
+    - a failed event is retried with an exponential backoff, and marked
+      failed after WEBHOOK_MAX_ATTEMPTS attempts
+    - an event left processing by a stopped worker is claimed again after
+      WEBHOOK_LOCK_TIMEOUT seconds
+    - the handler and the completion of its event run in one transaction,
+      with the event row locked : a failing handler leaves nothing behind,
+      and a worker whose claim was taken over by another one (locked_at
+      replaced) doesn't process the event
+
+Run the worker with : python manage.py process_webhooks --workers 4
+"""
+import logging
+import random
+import stripe
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError
+from django.db import connection
+from django.db import transaction
+from django.db.models import Exists
+from django.db.models import OuterRef
+from django.db.models import Q
+from django.utils import timezone
+from .models import WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = getattr(settings, 'WEBHOOK_MAX_ATTEMPTS', 8)
+LOCK_TIMEOUT = getattr(settings, 'WEBHOOK_LOCK_TIMEOUT', 5 * 60)
+# backoff after the nth failure : BACKOFF_BASE * 2 ** (n - 1) seconds, capped
+BACKOFF_BASE = 5
+BACKOFF_MAX = 60 * 60
+
+def event_order_number(payload : dict) -> str:
+    """ Order number of an event, from the metadata of its object """
+    data_object = (payload.get('data') or {}).get('object') or {}
+    return str((data_object.get('metadata') or {}).get('order_id') or '')
+
+def record_event(payload : dict):
+    """
+    Store a verified Stripe event, once.
+
+    Args:
+        payload (dict): the event as sent by Stripe
+
+    Returns:
+        tuple : (WebhookEvent, created), created is False for a redelivery
+    """
+    try:
+        with transaction.atomic():
+            return WebhookEvent.objects.get_or_create(
+                event_id=payload['id'],
+                defaults={
+                    'type' : payload.get('type', ''),
+                    'order_number' : event_order_number(payload),
+                    'stripe_created' : int(payload.get('created') or 0),
+                    'payload' : payload
+                }
+            )
+    except IntegrityError:
+        # delivered twice at the same time
+        return WebhookEvent.objects.get(event_id=payload['id']), False
+
+def backoff(attempts : int) -> timedelta:
+    """ Delay before the next attempt of an event that failed attempts times, with jitter """
+    delay = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+class WebhookWorker:
+    """
+    Processes the stored webhook events.
+
+    Args:
+        handler (callable, optional): processes a stripe.Event, the dispatch of the payment service by default
+        workers (int): number of threads processing the events of a batch
+
+    Methods:
+        claim(limit : int, now : datetime) -> list :
+            Take due events, at most one per order
+
+        process(event : WebhookEvent, now : datetime) -> bool :
+            Process a claimed event, schedule a retry if it fails
+
+        run_once(limit : int) -> int :
+            Claim and process one batch of events
+
+        drain(limit : int) -> int :
+            Process batches until no event is due
+    """
+    def __init__(self, handler=None, workers : int = 1):
+        if handler is None:
+            from apps.container import container
+            handler = container.payment_service.dispatch_event
+        self.handler = handler
+        self.workers = workers
+
+    @staticmethod
+    def due_events(now):
+        """ Pending events due, and processing events whose worker stopped """
+        stale = now - timedelta(seconds=LOCK_TIMEOUT)
+        return WebhookEvent.objects.filter(
+            Q(status='pending', next_attempt_at__lte=now) | Q(status='processing', locked_at__lt=stale)
+        )
+
+    def claim(self, limit : int = 50, now=None) -> list:
+        """
+        Take due events, oldest first. An event is skipped while an earlier
+        event of its order is unfinished.
+
+        Returns:
+            list : claimed events, marked processing
+        """
+        now = now or timezone.now()
+        earlier = WebhookEvent.objects.filter(
+            order_number=OuterRef('order_number'),
+            status__in=['pending', 'processing']
+        ).filter(
+            Q(stripe_created__lt=OuterRef('stripe_created'))
+            | Q(stripe_created=OuterRef('stripe_created'), pk__lt=OuterRef('pk'))
+        )
+        candidates = (
+            self.due_events(now)
+            .annotate(blocked=Exists(earlier))
+            .filter(Q(order_number='') | Q(blocked=False))
+            .order_by('stripe_created', 'pk')[:limit]
+        )
+        claimed = []
+        for event in candidates:
+            # another worker may have claimed it since the select
+            taken = self.due_events(now).filter(pk=event.pk).update(status='processing', locked_at=now)
+            if taken:
+                event.status, event.locked_at = 'processing', now
+                claimed.append(event)
+        return claimed
+
+    def process(self, event : WebhookEvent, now=None) -> bool:
+        """
+        Process a claimed event. The writes of the handler are committed with
+        the done status of the event, or not at all.
+
+        Returns:
+            bool : whether the event was processed, it's retried later otherwise
+        """
+        claimed_at = event.locked_at
+        try:
+            with transaction.atomic():
+                if not self._owned(event, claimed_at, lock=True):
+                    logger.warning(f'Webhook event {event.event_id} was claimed by another worker, skipped')
+                    return False
+                self.handler(stripe.Event.construct_from(event.payload, stripe.api_key))
+                self._release(
+                    event, claimed_at,
+                    status='done', processed_at=timezone.now(), locked_at=None, attempts=event.attempts + 1
+                )
+                return True
+        except Exception as error:
+            now = now or timezone.now()
+            attempts = event.attempts + 1
+            fields = {'attempts' : attempts, 'last_error' : f'{type(error).__name__}: {error}', 'locked_at' : None}
+            if attempts >= MAX_ATTEMPTS:
+                fields['status'] = 'failed'
+            else:
+                fields.update(status='pending', next_attempt_at=now + backoff(attempts))
+            if not self._release(event, claimed_at, **fields):
+                logger.warning(f'Webhook event {event.event_id} was claimed by another worker, failure not recorded')
+            elif event.status == 'failed':
+                logger.error(f'Webhook event {event.event_id} failed {event.attempts} times : {event.last_error}')
+            else:
+                logger.warning(f'Webhook event {event.event_id} failed, retry at {event.next_attempt_at} : {event.last_error}')
+            return False
+
+    @staticmethod
+    def _owned(event : WebhookEvent, claimed_at, lock : bool = False) -> bool:
+        """ Whether the event is still processing under the claim of this worker, locking its row """
+        events = WebhookEvent.objects.filter(pk=event.pk, status='processing', locked_at=claimed_at)
+        if lock:
+            events = events.select_for_update()
+        return bool(list(events.values_list('pk', flat=True)))
+
+    @staticmethod
+    def _release(event : WebhookEvent, claimed_at, **fields) -> bool:
+        """
+        Save the outcome of an event, if this worker's claim still holds.
+
+        Returns:
+            bool : False if another worker claimed the event since
+        """
+        released = WebhookEvent.objects.filter(
+            pk=event.pk, status='processing', locked_at=claimed_at
+        ).update(**fields)
+        if released:
+            for field, value in fields.items():
+                setattr(event, field, value)
+        return bool(released)
+
+    def _process_in_thread(self, event : WebhookEvent) -> bool:
+        try:
+            return self.process(event)
+        finally:
+            # threads of the pool have their own database connection
+            connection.close()
+
+    def run_once(self, limit : int = 50) -> int:
+        """
+        Claim and process one batch of events.
+
+        Returns:
+            int : number of processed events
+        """
+        return self._process_batch(self.claim(limit))
+
+    def drain(self, limit : int = 50) -> int:
+        """
+        Process batches until no event is due.
+
+        Returns:
+            int : number of processed events
+        """
+        processed = 0
+        while True:
+            events = self.claim(limit)
+            if not events:
+                return processed
+            processed += self._process_batch(events)
+
+    def _process_batch(self, events : list) -> int:
+        if self.workers <= 1 or len(events) <= 1:
+            return sum(self.process(event) for event in events)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return sum(executor.map(self._process_in_thread, events))
@@ -12,6 +12,7 @@ from apps.factories import \
     CategoryFactory
 )
 from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth.models import User
 from apps.users.models import Address
 from apps.cart.cart import Cart
@@ -19,6 +20,8 @@ import tempfile
 import shutil
 from django.urls import reverse
 from apps.container import container
+from apps.products.search import get_search_backend
+from apps.products.facets import get_facet_index
 
 pytestmark = pytest.mark.django_db
 
@@ -35,6 +38,46 @@ def media_tmp_dir():
     # Cleanup: restore original MEDIA_ROOT and remove temp folder
     settings.MEDIA_ROOT = original_media_root
     shutil.rmtree(tmp_dir)
+
+@pytest.fixture(autouse=True)
+def receipt_root(tmp_path, settings):
+    """ Receipts of paid orders are written to a directory of their test """
+    settings.RECEIPT_ROOT = tmp_path / 'receipts'
+    return settings.RECEIPT_ROOT
+
+@pytest.fixture(autouse=True)
+def search_index():
+    """
+    The in-memory search index lives as long as the process, while the test
+    database is rolled back after each test : start every test with a fresh index.
+    """
+    backend = get_search_backend()
+    backend.reset()
+    yield backend
+    backend.reset()
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """ Cached pages would otherwise outlive the test database they were built from """
+    cache.clear()
+    yield
+    cache.clear()
+
+@pytest.fixture(autouse=True)
+def stripe_gateway():
+    """ Same as search_index for the Stripe sessions kept by the gateway """
+    from apps.container import container
+    container.stripe_gateway.reset()
+    yield container.stripe_gateway
+    container.stripe_gateway.reset()
+
+@pytest.fixture(autouse=True)
+def facet_index():
+    """ Same as search_index for the in-memory facet index """
+    loader = get_facet_index()
+    loader.reset()
+    yield loader
+    loader.reset()
     
 @pytest.fixture
 def sample_products():
@@ -82,7 +125,7 @@ def variant_product(variant_sku):
         - Color : Red
         - Material : Coton 
     """
-    product = ProductFactory(name='T-Shirt', sku='SKU7845AAM')
+    product = ProductFactory(name='T-Shirt', sku='SKU7845AAM', status='published')
     variant_product = ProductVariantFactory(product=product, identifiant='Red T-Shirt Coton', sku=variant_sku)
     color_attribute = AttributeFactory(name='Color')
     size_attribute =  AttributeFactory(name='Size')
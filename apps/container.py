@@ -8,6 +8,9 @@ class ServiceContainer:
         self._payment_service = None
         self._checkout_service = None
         self._cart_validation = None
+        self._stripe_gateway = None
+        # Cart init
+        self._cart_hydration = None
         # Product init
         self._product_repo = None
         self._product_service = None
@@ -43,6 +46,13 @@ class ServiceContainer:
             self._payment_service = StripePaymentService(self.checkout_repo)
         return self._payment_service
     
+    @property
+    def stripe_gateway(self):
+        if self._stripe_gateway is None:
+            from apps.checkout.stripe_gateway import StripeGateway
+            self._stripe_gateway = StripeGateway()
+        return self._stripe_gateway
+
     @property
     def cart_validation(self):
         if self._cart_validation is None:
@@ -50,6 +60,14 @@ class ServiceContainer:
             self._cart_validation = CartValidationChain()
         return self._cart_validation
     
+    # Cart app
+    @property
+    def cart_hydration(self):
+        if self._cart_hydration is None:
+            from apps.cart.services import CartHydrationService
+            self._cart_hydration = CartHydrationService(self.product_repo)
+        return self._cart_hydration
+    
     # Product app
     @property
     def product_repo(self):
@@ -18,8 +18,8 @@ import uuid
 class CategoryFactory(factory.django.DjangoModelFactory):
     class Meta:
         model = Category
-    name = Faker('word')
-    slug = Faker('word')
+    name = factory.Sequence(lambda n : f'category-{n}')
+    slug = factory.Sequence(lambda n : f'category-{n}')
     
 class ProductFactory(factory.django.DjangoModelFactory):
     class Meta:
@@ -29,7 +29,7 @@ class ProductFactory(factory.django.DjangoModelFactory):
     price = Faker('pydecimal', left_digits=3, right_digits=2, max_value=100)
     stock = Faker('pyint', min_value=1, max_value=100)
     category = factory.SubFactory(CategoryFactory)
-    slug = Faker('word')
+    slug = factory.Sequence(lambda n : f'product-{n}')
     sku = factory.LazyAttribute(lambda obj : f'SKU-{uuid.uuid4().hex[:8].upper()}')
     
 class ProductVariantFactory(factory.django.DjangoModelFactory):
@@ -0,0 +1,166 @@
+"""
+Exact money amounts stored as integer cents.
+
+Prices are entered as decimals (Product.price, ProductVariant.price) and paid
+in cents (Stripe unit_amount / amount_total). Every total of the checkout is
+computed in integer cents with Money, and converted back to Decimal only when
+it is stored (Order, OrderItem), so that the cart, the order and Stripe always
+agree on the same amounts.
+
+Example:
+    >>> price = Money.of('19.99')
+    >>> price * 3
+    Money('59.97')
+    >>> (price * 3).percent(20)
+    Money('11.99')
+"""
+import operator
+from decimal import Decimal
+from decimal import InvalidOperation
+from decimal import ROUND_HALF_UP
+
+CENT = Decimal('0.01')
+
+class Money:
+    """
+    Amount of money as an integer number of cents.
+
+    Money is immutable. Adding and subtracting two amounts, or multiplying an
+    amount by an integer quantity, is exact. percent() is the only operation
+    that rounds, half up to the cent.
+
+    Attributes:
+        cents (int) : amount in cents
+
+    Methods:
+        of(value) -> Money :
+            Amount of a decimal value (Decimal, str, int or float)
+
+        percent(rate) -> Money :
+            rate percent of the amount, rounded half up to the cent
+
+        to_decimal() -> Decimal :
+            Amount as a Decimal with two decimal places
+    """
+    __slots__ = ('cents',)
+
+    def __init__(self, cents : int = 0):
+        if isinstance(cents, bool) or not isinstance(cents, int):
+            raise ValueError(f"Money cents must be an integer, got '{cents}'")
+        object.__setattr__(self, 'cents', cents)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Money is immutable')
+
+    @classmethod
+    def of(cls, value) -> 'Money':
+        """
+        Amount of a decimal value, rounded half up to the cent.
+
+        Floats are read through their shortest repr (19.99 -> '19.99'), not
+        their binary value.
+
+        Args:
+            value (Money | Decimal | str | int | float): amount in currency units
+
+        Returns:
+            Money : the amount
+
+        Raises:
+            ValueError : if value is not a finite number
+        """
+        if isinstance(value, Money):
+            return value
+        try:
+            amount = Decimal(repr(value)) if isinstance(value, float) else Decimal(str(value).strip())
+        except InvalidOperation:
+            raise ValueError(f"Invalid amount '{value}'")
+        if not amount.is_finite():
+            raise ValueError(f"Invalid amount '{value}'")
+        return cls(int((amount / CENT).quantize(Decimal(1), rounding=ROUND_HALF_UP)))
+
+    def percent(self, rate) -> 'Money':
+        """
+        rate percent of the amount, rounded half up to the cent.
+
+        Args:
+            rate (Decimal | str | int): percentage, 20 for 20%
+
+        Returns:
+            Money : the share of the amount
+        """
+        share = Decimal(self.cents) * Decimal(str(rate)) / 100
+        return Money(int(share.quantize(Decimal(1), rounding=ROUND_HALF_UP)))
+
+    def to_decimal(self) -> Decimal:
+        """ Amount as a Decimal with two decimal places """
+        return (Decimal(self.cents) * CENT).quantize(CENT)
+
+    def __add__(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        return Money(self.cents + other.cents)
+
+    def __radd__(self, other):
+        # sum() starts from 0
+        if other == 0:
+            return self
+        return NotImplemented
+
+    def __sub__(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        return Money(self.cents - other.cents)
+
+    def __mul__(self, quantity):
+        if isinstance(quantity, bool) or not isinstance(quantity, int):
+            return NotImplemented
+        return Money(self.cents * quantity)
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return Money(-self.cents)
+
+    def __eq__(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        return self.cents == other.cents
+
+    def __lt__(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        return self.cents < other.cents
+
+    def __le__(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        return self.cents <= other.cents
+
+    def __hash__(self):
+        return hash(self.cents)
+
+    def __bool__(self):
+        return self.cents != 0
+
+    def __float__(self):
+        return self.cents / 100
+
+    def __str__(self):
+        return str(self.to_decimal())
+
+    def __repr__(self):
+        return f"Money('{self.to_decimal()}')"
+
+def line_totals(unit_cents, quantities) -> list:
+    """
+    Totals in cents of many lines at once.
+
+    Args:
+        unit_cents (iterable): unit prices in cents
+        quantities (iterable): quantities, in the same order
+
+    Returns:
+        list : unit price * quantity of each line
+    """
+    return list(map(operator.mul, unit_cents, quantities))
@@ -0,0 +1,53 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from apps.orders.models import Order
+from apps.orders.receipts import RECEIPT_STATUSES
+from apps.orders.receipts import regenerate_receipts
+
+def setup_worker():
+    """ Worker processes started with spawn import Django from scratch """
+    django.setup()
+
+class Command(BaseCommand):
+    """
+    Store the receipts of the paid orders, to backfill the orders paid before
+    receipts were stored or after a change of the receipt template :
+
+        python manage.py regenerate_receipts --workers 4
+        python manage.py regenerate_receipts --all --workers 4
+
+    Rendering is CPU bound (templates, PDF) : batches of orders are rendered
+    by a pool of processes, each with its own database connection.
+    """
+    help = 'Render and store the receipts of the paid orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='render again the receipts already stored')
+        parser.add_argument('--workers', type=int, default=4, help='worker processes, 0 renders in this process')
+        parser.add_argument('--batch', type=int, default=100, help='orders rendered per task')
+        parser.add_argument('--limit', type=int, default=None, help='orders rendered at most in this run')
+
+    def handle(self, *args, **options):
+        orders = Order.objects.filter(status__in=RECEIPT_STATUSES)
+        if not options['all']:
+            orders = orders.filter(receipt__isnull=True)
+        order_numbers = list(orders.order_by('pk').values_list('order_number', flat=True)[:options['limit']])
+        size = max(options['batch'], 1)
+        batches = [order_numbers[start:start + size] for start in range(0, len(order_numbers), size)]
+
+        if options['workers'] <= 0:
+            results = list(map(regenerate_receipts, batches, repeat(options['all'])))
+        else:
+            # forked workers must not share the connection of this process
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=setup_worker) as pool:
+                results = list(pool.map(regenerate_receipts, batches, repeat(options['all'])))
+
+        counts = {'generated' : 0, 'errors' : 0}
+        for result in results:
+            for outcome, count in result.items():
+                counts[outcome] += count
+        self.stdout.write(', '.join(f'{count} {outcome}' for outcome, count in counts.items()))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_order_history_index'),
+        ('products', '0033_productsearchdocument'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['order', 'id'], name='order_item_order_idx'),
+        ),
+    ]
@@ -31,6 +31,22 @@ class Order(models.Model):
     final_total = models.DecimalField(max_digits=10, decimal_places=2)
     cart = models.JSONField(default=dict)
     failure_reason = models.CharField(max_length=300, null=True)
+    # hash of the user and the cart contents, see CheckoutService.idempotency_key()
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # keyset pagination of the order history of a customer
+            models.Index(fields=['customer_id', '-created_at', '-id'], name='order_history_idx')
+        ]
+        constraints = [
+            # a double-click can't create a second pending order of the same cart
+            models.UniqueConstraint(
+                fields=['idempotency_key'],
+                condition=models.Q(status='pending'),
+                name='order_pending_idempotency_key'
+            )
+        ]
     
     def save(self, force_insert = False , *args, **kwargs):
         year = datetime.now().year
@@ -51,3 +67,24 @@ class OrderItem(models.Model):
     quantity = models.IntegerField(default=1)
     total_price = models.DecimalField(decimal_places=2, max_digits=10)
     image_url = models.CharField(max_length=500, null=True)
+
+    class Meta:
+        indexes = [
+            # items of an order in the order they were added (detail, thumbnails)
+            models.Index(fields=['order', 'id'], name='order_item_order_idx')
+        ]
+
+class Receipt(models.Model):
+    """
+    Receipt of a paid order, rendered once and stored as immutable files
+    named after the sha256 of their content (see apps/orders/receipts.py).
+
+    The digests are the ETags the receipt is served with.
+    """
+    order = models.OneToOneField('orders.Order', on_delete=models.CASCADE, related_name='receipt')
+    html_digest = models.CharField(max_length=64)
+    pdf_digest = models.CharField(max_length=64, blank=True) # empty when PDF receipts are off
+    generated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f'Receipt of {self.order_id} ({self.html_digest[:12]})'
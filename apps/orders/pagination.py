@@ -0,0 +1,44 @@
+"""
+Keyset (cursor) pagination of the order history.
+
+The history is ordered by creation date (newest first) with the primary key
+as a stable tiebreaker. A cursor encodes the (created_at, id) pair of the last
+order of a page, so the next page is read with an indexed range filter
+instead of an OFFSET that grows with the number of orders of the customer.
+"""
+from datetime import datetime
+from apps import pagination
+
+DEFAULT_PAGE_SIZE = 10
+
+def encode_cursor(created_at : datetime, pk : int) -> str:
+    """
+    Encode the position of an order inside the history.
+
+    Args:
+        created_at (datetime): order creation date
+        pk (int): order primary key
+
+    Returns:
+        str : url-safe cursor
+    """
+    return pagination.encode_cursor(created_at.isoformat(), pk)
+
+def decode_cursor(cursor : str) -> tuple:
+    """
+    Decode a cursor built by encode_cursor.
+
+    Args:
+        cursor (str): cursor sent by the client
+
+    Returns:
+        tuple : (created_at as datetime, primary key)
+
+    Raises:
+        ValueError : if the cursor is malformed
+    """
+    created_at, pk = pagination.decode_cursor(cursor, 2)
+    try:
+        return (datetime.fromisoformat(created_at), int(pk))
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid cursor '{cursor}'")
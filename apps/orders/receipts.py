@@ -0,0 +1,118 @@
+"""
+Receipts of paid orders, stored as immutable files.
+
+A paid order never changes : its receipt is rendered once, when the order is
+paid, and served from disk afterwards. Files are content-addressed, named after
+the sha256 of their content :
+
+    RECEIPT_ROOT/html/3f/3f9a...e1.html
+    RECEIPT_ROOT/pdf/b0/b07c...4d.pdf
+
+so a file is never rewritten, an identical rendering is stored once and the
+digest is a strong ETag. The PDF is optional (RECEIPT_PDF setting) and needs
+WeasyPrint, receipts stay HTML only without it.
+"""
+import hashlib
+import logging
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+
+logger = logging.getLogger(__name__)
+
+# orders whose receipt doesn't change anymore
+RECEIPT_STATUSES = ('paid', 'shipped', 'completed')
+CONTENT_TYPES = {
+    'html' : 'text/html; charset=utf-8',
+    'pdf' : 'application/pdf',
+}
+
+def receipt_storage() -> FileSystemStorage:
+    """ Local storage of the receipts, read from the settings at each call """
+    return FileSystemStorage(location=getattr(settings, 'RECEIPT_ROOT', settings.BASE_DIR / 'receipts'))
+
+def receipt_path(digest : str, kind : str) -> str:
+    """
+    Name of a stored receipt file.
+
+    Args:
+        digest (str): sha256 of the content
+        kind (str): 'html' or 'pdf'
+
+    Returns:
+        str : path relative to RECEIPT_ROOT
+    """
+    return f'{kind}/{digest[:2]}/{digest}.{kind}'
+
+def store_receipt(content : bytes, kind : str) -> str:
+    """
+    Store a rendered receipt under its digest. Storing the same content twice
+    writes it once.
+
+    Args:
+        content (bytes): rendered receipt
+        kind (str): 'html' or 'pdf'
+
+    Returns:
+        str : sha256 of the content
+    """
+    digest = hashlib.sha256(content).hexdigest()
+    storage = receipt_storage()
+    name = receipt_path(digest, kind)
+    if not storage.exists(name):
+        saved = storage.save(name, ContentFile(content))
+        if saved != name: # written meanwhile by another worker
+            storage.delete(saved)
+    return digest
+
+def open_receipt(digest : str, kind : str):
+    """
+    Open a stored receipt file.
+
+    Raises:
+        FileNotFoundError : If the file was removed from RECEIPT_ROOT
+    """
+    return receipt_storage().open(receipt_path(digest, kind), 'rb')
+
+def render_pdf(html : str) -> bytes | None:
+    """
+    PDF version of a receipt, when enabled.
+
+    Args:
+        html (str): rendered receipt
+
+    Returns:
+        bytes | None : the PDF, None if RECEIPT_PDF is off or WeasyPrint isn't installed
+    """
+    if not getattr(settings, 'RECEIPT_PDF', False):
+        return None
+    try:
+        import weasyprint
+    except ImportError:
+        logger.warning('RECEIPT_PDF is on but WeasyPrint is not installed : receipts are stored as HTML only')
+        return None
+    base_url = getattr(settings, 'DOMAIN_URL', None)
+    return weasyprint.HTML(string=html, base_url=base_url).write_pdf()
+
+def regenerate_receipts(order_numbers : list, force : bool = False) -> dict:
+    """
+    Generate the receipts of a batch of orders. Runs in the worker processes
+    of the regenerate_receipts command.
+
+    Args:
+        order_numbers (list): orders of the batch
+        force (bool, optional): render again the receipts already stored
+
+    Returns:
+        dict : {'generated', 'errors'} number of orders
+    """
+    from apps.container import container
+    counts = {'generated' : 0, 'errors' : 0}
+    for order_number in order_numbers:
+        try:
+            container.order_service.generate_receipt(order_number, force=force)
+            counts['generated'] += 1
+        except Exception as error:
+            counts['errors'] += 1
+            logger.error(f'Receipt of order {order_number} not generated : {type(error).__name__}: {error}')
+    return counts
@@ -1,30 +1,131 @@
 from django.contrib.auth.models import User
+from django.db.models import Count
+from django.db.models import Prefetch
+from django.db.models import Q
+from django.db.models import Sum
+from django.utils import timezone
 from apps.orders.models import Order
 from apps.orders.models import OrderItem
+from apps.orders.models import Receipt
+from apps.orders.pagination import DEFAULT_PAGE_SIZE
+from apps.orders.pagination import decode_cursor
+from apps.orders.pagination import encode_cursor
+from apps.products.pagination import clean_page_size
+
+THUMBNAILS = 3
+
 class OrderRepository:
     """
     Repository for managing order data.
-    Order-related database operations are handled here. 
-    
+    Order-related database operations are handled here.
+
     Methods:
         - retrieve_user_orders: Fetch orders for a specific user.
+        - retrieve_order_history: Fetch a page of the order history of a user.
         - retrieve_user_order_items: Fetch order items for a specific order.
         - retrieve_order_details: Fetch detailed information for a specific order.
+        - retrieve_receipt: Fetch the stored receipt of an order.
+        - save_receipt: Record the stored receipt of an order.
     """
     def retrieve_user_orders(self, user : User):
         """
         Retrieve all orders associated with a given user.
         """
         return Order.objects.filter(customer_id=user)
-        
+
+    def retrieve_order_history(self, user : User, cursor : str | None = None, page_size : int = DEFAULT_PAGE_SIZE) -> dict:
+        """
+        One page of the orders of a user, newest first, read with keyset
+        pagination (see apps/orders/pagination.py).
+
+        The number of items and of units is annotated on the orders and the
+        first items (for thumbnails) are prefetched : a page costs two queries
+        whatever the number of orders of the user.
+
+        Args:
+            user (User): the customer
+            cursor (str, optional): next_cursor of the previous page
+            page_size (int, optional): number of orders per page
+
+        Returns:
+            dict : {
+                'orders' : Order objects with extra `item_count`, `unit_count` and
+                    `thumbnails` (first items) attributes,
+                'next_cursor' : cursor of the next page or None on the last page
+            }
+
+        Raises:
+            ValueError : If the cursor is malformed
+        """
+        page_size = clean_page_size(page_size)
+        orders = (
+            Order.objects.filter(customer_id=user)
+            .annotate(item_count=Count('items'), unit_count=Sum('items__quantity'))
+            .order_by('-created_at', '-id')
+        )
+        if cursor:
+            created_at, pk = decode_cursor(cursor)
+            orders = orders.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+        orders = orders.prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.order_by('id')[:THUMBNAILS], to_attr='thumbnails')
+        )
+        rows = list(orders[:page_size + 1])
+        page = rows[:page_size]
+        next_cursor = None
+        if len(rows) > page_size:
+            next_cursor = encode_cursor(page[-1].created_at, page[-1].id)
+        return {'orders' : page, 'next_cursor' : next_cursor}
+
     def retrieve_user_order_items(self, order : Order):
         """
         Retrieve all order items associated with a given order.
         """
         return OrderItem.objects.filter(order=order)
-    
-    def retrieve_order_details(self, order_number : str):
+
+    def retrieve_order_details(self, order_number : str, user : User | None = None):
         """
         Retrieve detailed information for a specific order by its order number.
+        The order comes with its customer, payment and shipping address (one
+        join) and its items (one prefetch query).
+
+        Args:
+            order_number (str): the order number
+            user (User, optional): only look among the orders of this customer
+
+        Raises:
+            Order.DoesNotExist : if the order doesn't exist (or isn't the user's)
+        """
+        orders = Order.objects.select_related('customer_id', 'payment', 'shipping_address').prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.order_by('id'))
+        )
+        if user is not None:
+            orders = orders.filter(customer_id=user)
+        return orders.get(order_number=order_number)
+
+    def retrieve_receipt(self, order_number : str) -> Receipt | None:
+        """
+        Retrieve the stored receipt of an order.
+
+        Returns:
+            Receipt | None : the receipt, None if it wasn't generated yet
+        """
+        return Receipt.objects.select_related('order').filter(order__order_number=order_number).first()
+
+    def save_receipt(self, order : Order, html_digest : str, pdf_digest : str = '') -> Receipt:
+        """
+        Record the files of the receipt of an order, replacing the previous ones.
+
+        Args:
+            order (Order): the paid order
+            html_digest (str): sha256 of the HTML receipt
+            pdf_digest (str, optional): sha256 of the PDF receipt
+
+        Returns:
+            Receipt : the receipt
         """
-        return Order.objects.get(order_number=order_number)
\ No newline at end of file
+        receipt, _ = Receipt.objects.update_or_create(
+            order=order,
+            defaults={'html_digest' : html_digest, 'pdf_digest' : pdf_digest, 'generated_at' : timezone.now()}
+        )
+        return receipt
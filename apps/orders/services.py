@@ -1,12 +1,18 @@
+from django.template.loader import render_to_string
 from .models import Order
 from .models import OrderItem
+from .models import Receipt
+from .receipts import RECEIPT_STATUSES
+from .receipts import render_pdf
+from .receipts import store_receipt
 from apps.users.models import User
 from apps.container import container
 from apps.checkout.custom_exceptions import OrderNotFoundError
 class OrderService:
     """
     Service responsible for processing order-related business logic.
-    Handles operations such as processing receipts.
+    Handles operations such as processing receipts and storing the receipts
+    of paid orders.
     
     Attributes:
         repo : (OrderRepository): Single source of truth for all order data.
@@ -14,6 +20,12 @@ class OrderService:
     Methods:
         processing_receipt(order_id: str) -> dict:
             Processes the receipt for a given order ID and returns the context data.    
+
+        generate_receipt(order_id : str, force : bool = False) -> Receipt:
+            Render and store the receipt of a paid order.
+
+        get_receipt(order_id : str) -> Receipt | None:
+            Stored receipt of an order, generated on first access for paid orders.
     """
     def __init__(self, order_repo):
         """
@@ -51,4 +63,59 @@ class OrderService:
             'order_items':order_items
         }
         
-        return context
\ No newline at end of file
+        return context
+
+    def generate_receipt(self, order_id : str, force : bool = False) -> Receipt:
+        """
+        Render the receipt of a paid order once and store it (HTML, and PDF
+        when enabled), see apps/orders/receipts.py.
+
+        Args:
+            order_id (str): The unique identifier of the order.
+            force (bool, optional): render again a receipt already stored
+
+        Returns:
+            Receipt : the stored receipt
+
+        Raises:
+            OrderNotFoundError : If the order doesn't exist
+            ValueError : If the order isn't paid, its receipt can still change
+        """
+        if not force:
+            receipt = self.repo.retrieve_receipt(order_id)
+            if receipt is not None:
+                return receipt
+
+        context = self.processing_receipt(order_id)
+        order = context['order']
+        if order.status not in RECEIPT_STATUSES:
+            raise ValueError(f'Order {order_id} is {order.status}, only the receipts of paid orders are stored')
+        html = render_to_string('receipt_document.html', context)
+        pdf = render_pdf(html)
+        return self.repo.save_receipt(
+            order,
+            html_digest=store_receipt(html.encode(), 'html'),
+            pdf_digest=store_receipt(pdf, 'pdf') if pdf else ''
+        )
+
+    def get_receipt(self, order_id : str) -> Receipt | None:
+        """
+        Stored receipt of an order. Receipts of orders paid before receipts were
+        stored (or whose generation failed) are generated on first access.
+
+        Args:
+            order_id (str): The unique identifier of the order.
+
+        Returns:
+            Receipt | None : the receipt, None if the order isn't paid
+
+        Raises:
+            OrderNotFoundError : If the order doesn't exist
+        """
+        receipt = self.repo.retrieve_receipt(order_id)
+        if receipt is not None:
+            return receipt
+        try:
+            return self.generate_receipt(order_id, force=True)
+        except ValueError:
+            return None
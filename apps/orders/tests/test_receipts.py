@@ -0,0 +1,135 @@
+import hashlib
+import sys
+import pytest
+from types import SimpleNamespace
+from django.core.management import call_command
+from django.urls import reverse
+from apps.conftest import pytestmark
+from apps.container import container
+from apps.orders.models import Order
+from apps.orders.models import Receipt
+from apps.orders.receipts import receipt_path
+from apps.orders.receipts import store_receipt
+
+@pytest.fixture
+def paid_order(order_data, order_items):
+    Order.objects.filter(pk=order_data.pk).update(status='paid')
+    order_data.refresh_from_db()
+    return order_data
+
+@pytest.fixture
+def weasyprint(mocker, settings):
+    """ PDF receipts on, with a stand-in for WeasyPrint """
+    settings.RECEIPT_PDF = True
+    html = mocker.Mock(return_value=SimpleNamespace(write_pdf=lambda: b'%PDF-1.7 receipt'))
+    mocker.patch.dict(sys.modules, {'weasyprint' : SimpleNamespace(HTML=html)})
+    return html
+
+class TestReceiptStorage:
+    def test_content_addressed(self, receipt_root):
+        digest = store_receipt(b'<p>receipt</p>', 'html')
+        assert digest == hashlib.sha256(b'<p>receipt</p>').hexdigest()
+        assert (receipt_root / receipt_path(digest, 'html')).read_bytes() == b'<p>receipt</p>'
+        assert store_receipt(b'<p>receipt</p>', 'html') == digest
+        assert len(list((receipt_root / 'html').rglob('*.html'))) == 1
+
+class TestGenerateReceipt:
+    def test_paid_order(self, paid_order, receipt_root):
+        receipt = container.order_service.generate_receipt(paid_order.order_number)
+        html = (receipt_root / receipt_path(receipt.html_digest, 'html')).read_text()
+        assert paid_order.order_number in html
+        assert 'navbar' not in html
+        assert receipt.pdf_digest == ''
+
+    def test_rendered_once(self, paid_order, mocker):
+        receipt = container.order_service.generate_receipt(paid_order.order_number)
+        processing_receipt = mocker.spy(container.order_service, 'processing_receipt')
+        assert container.order_service.generate_receipt(paid_order.order_number) == receipt
+        assert processing_receipt.call_count == 0
+        regenerated = container.order_service.generate_receipt(paid_order.order_number, force=True)
+        assert regenerated.html_digest == receipt.html_digest
+        assert Receipt.objects.count() == 1
+
+    def test_unpaid_order(self, order_data):
+        with pytest.raises(ValueError):
+            container.order_service.generate_receipt(order_data.order_number)
+        assert container.order_service.get_receipt(order_data.order_number) is None
+
+    def test_pdf(self, paid_order, weasyprint, receipt_root):
+        receipt = container.order_service.generate_receipt(paid_order.order_number)
+        assert (receipt_root / receipt_path(receipt.pdf_digest, 'pdf')).read_bytes() == b'%PDF-1.7 receipt'
+        assert paid_order.order_number in weasyprint.call_args.kwargs['string']
+
+    def test_pdf_without_weasyprint(self, paid_order, settings, mocker):
+        settings.RECEIPT_PDF = True
+        mocker.patch.dict(sys.modules, {'weasyprint' : None}) # import fails
+        receipt = container.order_service.generate_receipt(paid_order.order_number)
+        assert receipt.html_digest and receipt.pdf_digest == ''
+
+class TestReceiptViews:
+    def test_stored_receipt(self, client, paid_order):
+        receipt = container.order_service.generate_receipt(paid_order.order_number)
+        response = client.get(reverse('process-receipt', kwargs={'order_id':paid_order.order_number}))
+        assert response.status_code == 200
+        assert response.templates == [] # served from the file
+        assert response['ETag'] == f'"{receipt.html_digest}"'
+        assert 'Last-Modified' in response
+        assert paid_order.order_number in b''.join(response.streaming_content).decode()
+
+    def test_generated_on_first_access(self, client, paid_order):
+        response = client.get(reverse('process-receipt', kwargs={'order_id':paid_order.order_number}))
+        assert response.status_code == 200
+        assert response['ETag'] == f'"{paid_order.receipt.html_digest}"'
+
+    def test_not_modified(self, client, paid_order, django_assert_num_queries):
+        receipt = container.order_service.generate_receipt(paid_order.order_number)
+        with django_assert_num_queries(1):
+            response = client.get(
+                reverse('process-receipt', kwargs={'order_id':paid_order.order_number}),
+                HTTP_IF_NONE_MATCH=f'"{receipt.html_digest}"'
+            )
+        assert response.status_code == 304
+
+    def test_pdf(self, client, paid_order, weasyprint):
+        receipt = container.order_service.generate_receipt(paid_order.order_number)
+        response = client.get(reverse('process-receipt-pdf', kwargs={'order_id':paid_order.order_number}))
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'application/pdf'
+        assert response['ETag'] == f'"{receipt.pdf_digest}"'
+
+    def test_no_pdf(self, client, paid_order):
+        response = client.get(reverse('process-receipt-pdf', kwargs={'order_id':paid_order.order_number}))
+        assert response.status_code == 404
+
+class InlinePool:
+    """ ProcessPoolExecutor running its tasks in the test process (in-memory test database) """
+    def __init__(self, max_workers, initializer):
+        initializer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def map(self, function, *iterables):
+        return map(function, *iterables)
+
+class TestRegenerateReceiptsCommand:
+    def test_missing_receipts(self, paid_order, order_items, capsys):
+        call_command('regenerate_receipts', '--workers', '0')
+        assert '1 generated, 0 errors' in capsys.readouterr().out
+        call_command('regenerate_receipts', '--workers', '0')
+        assert '0 generated' in capsys.readouterr().out
+        call_command('regenerate_receipts', '--workers', '0', '--all')
+        assert '1 generated' in capsys.readouterr().out
+
+    def test_process_pool(self, paid_order, mocker, capsys):
+        pool = mocker.patch(
+            'apps.orders.management.commands.regenerate_receipts.ProcessPoolExecutor',
+            side_effect=InlinePool
+        )
+        call_command('regenerate_receipts', '--workers', '3', '--batch', '10')
+        assert pool.call_args.kwargs['max_workers'] == 3
+        assert '1 generated' in capsys.readouterr().out
+        assert Receipt.objects.filter(order=paid_order).exists()
@@ -8,7 +8,10 @@ from apps.conftest import (
     pytestmark
 )
 from apps.orders.models import Order
+from apps.orders.models import OrderItem
 from apps.container import container
+from apps.pagination import decode_cursor
+from apps.pagination import encode_cursor
 
 class TestOrderRepository:
     def test_retrieve_user_orders_success(self, order_data):
@@ -45,4 +48,50 @@ class TestOrderRepository:
     def test_retrieve_user_order_items_empty(self, order_data):
         order_items = container.order_repo.retrieve_user_order_items(order_data)
         assert isinstance(order_items, QuerySet)
-        assert len(order_items) == 0
\ No newline at end of file
+        assert len(order_items) == 0
+class TestOrderHistory:
+    def orders(self, user, count):
+        orders = [Order.objects.create(customer_id=user, final_total=10) for _ in range(count)]
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order, product_name=f'item {index}', attributes={}, unit_price=5,
+                quantity=2, total_price=10, image_url=f'/media/{index}.png'
+            )
+            for order in orders for index in range(5)
+        ])
+        return orders
+
+    def test_history_pages(self, valid_user):
+        orders = self.orders(valid_user, 5)
+        first = container.order_repo.retrieve_order_history(valid_user, page_size=2)
+        second = container.order_repo.retrieve_order_history(valid_user, cursor=first['next_cursor'], page_size=2)
+        last = container.order_repo.retrieve_order_history(valid_user, cursor=second['next_cursor'], page_size=2)
+        assert first['orders'] + second['orders'] + last['orders'] == orders[::-1]
+        assert last['next_cursor'] is None
+
+    def test_history_aggregates(self, valid_user):
+        self.orders(valid_user, 1)
+        order = container.order_repo.retrieve_order_history(valid_user)['orders'][0]
+        assert (order.item_count, order.unit_count) == (5, 10)
+        assert [item.image_url for item in order.thumbnails] == ['/media/0.png', '/media/1.png', '/media/2.png']
+
+    def test_history_constant_queries(self, django_assert_num_queries, valid_user):
+        self.orders(valid_user, 40)
+        with django_assert_num_queries(2):
+            page = container.order_repo.retrieve_order_history(valid_user, page_size=20)
+            [(order.item_count, list(order.thumbnails)) for order in page['orders']]
+        assert len(page['orders']) == 20
+
+    @pytest.mark.parametrize('cursor', [
+        'not-a-cursor',
+        encode_cursor('not a date', 1),
+        encode_cursor('2025-01-31T10:00:00+00:00'),
+    ])
+    def test_history_invalid_cursor(self, valid_user, cursor):
+        with pytest.raises(ValueError):
+            container.order_repo.retrieve_order_history(valid_user, cursor=cursor)
+
+    def test_cursor_codec(self):
+        cursor = encode_cursor(None, '2025-01-31T10:00:00+00:00', 42)
+        assert '=' not in cursor
+        assert decode_cursor(cursor, 3) == (None, '2025-01-31T10:00:00+00:00', 42)
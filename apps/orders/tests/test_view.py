@@ -13,6 +13,7 @@ from apps.conftest import (
 )
 from apps.container import container
 from apps.users.models import User
+from apps.orders.models import Order
 from apps.checkout.custom_exceptions import OrderNotFoundError
 
 class TestOrderListView:
@@ -39,8 +40,24 @@ class TestOrderListView:
         context = response.context
         orders = context.get('orders')
         assert str(context.get('user')) == 'Paul'
-        assert isinstance(orders, QuerySet)
-        assert orders[0] == order_data 
+        assert orders == [order_data]
+        assert context.get('next_cursor') is None
+
+    def test_order_listview_pages(self, client, login_user, paul_user, order_data):
+        for _ in range(11):
+            Order.objects.create(customer_id=paul_user, final_total=10)
+        response = client.get(reverse('orders'))
+        first_page = response.context.get('orders')
+        assert len(first_page) == 10
+        response = client.get(reverse('orders'), {'cursor' : response.context.get('next_cursor')})
+        assert len(response.context.get('orders')) == 2
+        assert response.context.get('next_cursor') is None
+        assert response.context.get('orders')[-1] == order_data
+
+    def test_order_listview_invalid_cursor(self, client, login_user):
+        response = client.get(reverse('orders'), {'cursor' : 'not-a-cursor'})
+        assert response.status_code == 302
+        assert response.url == reverse('orders')
     
 class TestOrderDetailView:
     def test_order_detailview_not_authenticated(self, client):
@@ -58,6 +75,19 @@ class TestOrderDetailView:
         assert context.get('user') == paul_user
         assert context.get('order') == order
         assert context.get('shipping_address') == address
+
+    def test_order_detailview_constant_queries(self, client, login_user, paul_user, order_items, django_assert_max_num_queries):
+        order = container.order_repo.retrieve_user_orders(paul_user)[0]
+        # session, user, order with payment and address, items, profile of the navbar
+        with django_assert_max_num_queries(5):
+            response = client.get(reverse('order_detail', kwargs={'order_number':order.order_number}))
+        assert response.status_code == 200
+        assert len(response.context.get('order').items.all()) == 2
+
+    def test_order_detailview_other_customer(self, client, valid_user, order_data):
+        client.force_login(valid_user)
+        response = client.get(reverse('order_detail', kwargs={'order_number':order_data.order_number}))
+        assert response.status_code == 404
         
 class TestProcessReceiptView:
     def test_process_receipt_order_not_found(self, client):
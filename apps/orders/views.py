@@ -1,24 +1,35 @@
+from django.shortcuts import redirect
 from django.shortcuts import render
+from django.http import Http404
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import FileResponse
 from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date
+from django.utils.http import quote_etag
 from django.views.generic import (
     ListView,
     DetailView
 )
 from apps.container import container
+from apps.orders.pagination import DEFAULT_PAGE_SIZE
 from apps.checkout.models import Order
 from apps.checkout.custom_exceptions import OrderNotFoundError
+from apps.orders.receipts import CONTENT_TYPES
+from apps.orders.receipts import open_receipt
 
 # Create your views here.
 
 class OrderListView(LoginRequiredMixin, ListView):
     """
-    Handle displaying a list of orders for the logged-in user.
-    1. Retrieve orders associated with the user.
+    Handle displaying the order history of the logged-in user, a page at a time.
+    1. Retrieve a page of the orders associated with the user.
     2. Render the order list template with the retrieved orders.
 
     Methods:
         get(self, request): Handle GET requests to display the order list.
+            Accepts `cursor` and `page_size` query parameters.
         
     """
     model = Order
@@ -32,14 +43,24 @@ class OrderListView(LoginRequiredMixin, ListView):
             request: The HTTP request object.   
         
         Returns:
-            Rendered order list template with user orders.
+            Rendered order list template with a page of user orders,
+            redirect to the first page for an invalid cursor.
             
         """
         user = request.user
-        orders = container.order_repo.retrieve_user_orders(user)
+        try:
+            history = container.order_repo.retrieve_order_history(
+                user,
+                cursor=request.GET.get('cursor'),
+                page_size=request.GET.get('page_size', DEFAULT_PAGE_SIZE)
+            )
+        except ValueError:
+            return redirect('orders')
         context = {
             'user':user,
-            'orders':orders,
+            'orders':history['orders'],
+            'next_cursor':history['next_cursor'],
+            'is_first_page':not request.GET.get('cursor'),
         }
         return render(
             request,
@@ -71,10 +92,17 @@ class OrderDetailView(LoginRequiredMixin, DetailView):
         
         Returns:
             Rendered order detail template with order information.
+
+        Raises:
+            Http404 : if the order isn't one of the user's
         """
-        order = container.order_repo.retrieve_order_details(order_number)
         user = request.user
-        shipping_address = container.user_service.get_user_address(user)
+        try:
+            order = container.order_repo.retrieve_order_details(order_number, user=user)
+        except Order.DoesNotExist:
+            raise Http404(f'Order {order_number} not found')
+        # orders keep the address they were shipped to
+        shipping_address = order.shipping_address or container.user_service.get_user_address(user)
         context = {
             'user':user,
             'order' : order,
@@ -85,19 +113,52 @@ class OrderDetailView(LoginRequiredMixin, DetailView):
 
 #### Receipt view ####
 
+def serve_receipt(request, receipt, kind : str = 'html'):
+    """
+    Serve a stored receipt file. The digest of the file is its ETag : browsers
+    revalidate their copy and get a 304 without the file being read.
+
+    Args:
+        request: The HTTP request object.
+        receipt (Receipt): stored receipt of the order
+        kind (str, optional): 'html' or 'pdf'
+
+    Returns:
+        FileResponse, or an empty 304 response if the browser copy is current
+    """
+    digest = receipt.html_digest if kind == 'html' else receipt.pdf_digest
+    etag = quote_etag(digest)
+    last_modified = int(receipt.generated_at.timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        try:
+            response = FileResponse(open_receipt(digest, kind), content_type=CONTENT_TYPES[kind])
+        except FileNotFoundError:
+            raise Http404(f'Receipt of order {receipt.order.order_number} not found')
+        if kind == 'pdf':
+            response.headers['Content-Disposition'] = f'inline; filename="{receipt.order.order_number}.pdf"'
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
 def process_receipt(request, order_id : str):
     """
     Handle receipt processing and rendering.
-    Retrieve the necessary context for the receipt and render the receipt template.
+    The receipt of a paid order is served as stored when it was paid, the
+    receipt of another order is rendered from its current state.
     
     Args:
         request: The HTTP request object.
         order_id (str): The identifier of the order for which to generate the receipt.
         
     Returns:
-        Rendered receipt template with order context.
+        Stored receipt, or rendered receipt template with order context.
     """
     try:
+        receipt = container.order_service.get_receipt(order_id)
+        if receipt is not None:
+            return serve_receipt(request, receipt)
         context = container.order_service.processing_receipt(order_id)
     except OrderNotFoundError as error:
         return JsonResponse({'status':'error', 'message':str(error)}, status=404)
@@ -107,3 +168,22 @@ def process_receipt(request, order_id : str):
         'receipt.html',
         context=context
     )
+
+def process_receipt_pdf(request, order_id : str):
+    """
+    Serve the stored PDF receipt of a paid order.
+
+    Args:
+        request: The HTTP request object.
+        order_id (str): The identifier of the order.
+
+    Raises:
+        Http404 : If the order isn't paid or PDF receipts are off
+    """
+    try:
+        receipt = container.order_service.get_receipt(order_id)
+    except OrderNotFoundError as error:
+        return JsonResponse({'status':'error', 'message':str(error)}, status=404)
+    if receipt is None or not receipt.pdf_digest:
+        raise Http404(f'No PDF receipt for order {order_id}')
+    return serve_receipt(request, receipt, 'pdf')
@@ -0,0 +1,52 @@
+"""
+Cursors of the keyset paginations.
+
+A keyset page is read from the sort key of the last row of the previous page
+(products : discount and id, orders : creation date and id). A cursor carries
+those values to the client as an opaque, url-safe token :
+
+    >>> cursor = encode_cursor('2025-01-31T10:00:00+00:00', 42)
+    >>> decode_cursor(cursor, 2)
+    ('2025-01-31T10:00:00+00:00', 42)
+
+The values are JSON encoded, each app converts them back to its own types.
+"""
+import base64
+import binascii
+import json
+
+def encode_cursor(*values) -> str:
+    """
+    Encode the sort key of a row into a cursor.
+
+    Args:
+        *values: JSON serializable values of the sort key
+
+    Returns:
+        str : url-safe cursor
+    """
+    payload = json.dumps(list(values))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor : str, size : int) -> tuple:
+    """
+    Decode a cursor built by encode_cursor.
+
+    Args:
+        cursor (str): cursor sent by the client
+        size (int): number of values of the sort key
+
+    Returns:
+        tuple : values of the sort key
+
+    Raises:
+        ValueError : if the cursor is malformed
+    """
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    return tuple(values)
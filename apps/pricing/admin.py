@@ -0,0 +1,20 @@
+from django.contrib import admin
+from .models import TaxRate
+from .models import ShippingRate
+from .models import Promotion
+
+@admin.register(TaxRate)
+class TaxRateAdmin(admin.ModelAdmin):
+    list_display = ['country', 'rate']
+    search_fields = ['country']
+
+@admin.register(ShippingRate)
+class ShippingRateAdmin(admin.ModelAdmin):
+    list_display = ['name', 'country', 'min_subtotal', 'fee']
+    list_filter = ['country']
+
+@admin.register(Promotion)
+class PromotionAdmin(admin.ModelAdmin):
+    list_display = ['name', 'code', 'kind', 'value', 'min_subtotal', 'sku', 'category', 'is_active']
+    list_filter = ['kind', 'is_active', 'category']
+    search_fields = ['name', 'code', 'sku']
@@ -0,0 +1,296 @@
+"""
+Pricing plan of the cart : taxes, shipping fees and promotions.
+
+Rules (TaxRate, ShippingRate, Promotion) are compiled once into a PricingPlan,
+a set of lookup tables built for the evaluation of a cart :
+
+    - taxes : {country : rate}
+    - shipping : per country, fees sorted by minimum subtotal (bisect)
+    - line promotions : indexed by sku and by category name
+    - cart promotions : sorted by minimum subtotal with the best percent and
+      the best fixed amount reached at each threshold (bisect)
+    - coupons : indexed by code
+
+Pricing a cart is then a few dict lookups per line, whatever the number of
+rules. The plan of the current process is kept by PricingPlanLoader and
+compiled again when the rules change (the version token in the cache is
+replaced by apps/pricing/signals.py) or when a promotion starts or ends. The
+other processes only see a new token through a shared cache (CACHES setting).
+
+Policy : each line gets its best line promotion, then the best cart promotion
+applies to the discounted subtotal. A valid coupon is one more candidate.
+Minimum subtotals of promotions are compared to the subtotal before discounts,
+taxes and shipping fees to the subtotal after discounts.
+"""
+import threading
+import uuid
+from bisect import bisect_right
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from apps.money import Money
+from .models import TaxRate
+from .models import ShippingRate
+from .models import Promotion
+
+RULES_VERSION_KEY = 'pricing-rules-version'
+
+def basis_points(percent) -> int:
+    """ Percentage as an integer number of basis points, 20 -> 2000 """
+    return int(Decimal(str(percent)) * 100)
+
+def apply_rate(cents : int, points : int) -> int:
+    """ points basis points of an amount in cents, rounded half up """
+    return (cents * points + 5000) // 10000
+
+def normalize(text) -> str:
+    return str(text or '').strip().casefold()
+
+class PricingPlan:
+    """
+    Compiled pricing rules.
+
+    Args:
+        tax_rates (iterable): dicts with country and rate (percent)
+        shipping_rates (iterable): dicts with country, min_subtotal and fee
+        promotions (iterable): dicts with name, code, kind, value, min_subtotal,
+            sku and category (name), already filtered on their active window
+        valid_until (datetime, optional): next start or end of a promotion
+        version (str, optional): version of the rules the plan was compiled from
+
+    Methods:
+        price(lines, country : str, coupon : str) -> dict :
+            Discounts, taxes, shipping fee and total of cart lines
+
+        is_coupon(code : str) -> bool :
+            Whether a coupon code exists
+
+        expired(now : datetime) -> bool :
+            Whether a promotion started or ended since the compilation
+    """
+    def __init__(self, tax_rates=(), shipping_rates=(), promotions=(), valid_until=None, version=None):
+        self.version = version
+        self.valid_until = valid_until
+        self.default_tax = basis_points(getattr(settings, 'CART_VAT_RATE', 20))
+        self.default_shipping = Money.of(getattr(settings, 'CART_SHIPPING_FEE', 120)).cents
+        self.taxes = {normalize(rate['country']) : basis_points(rate['rate']) for rate in tax_rates}
+
+        shipping = {}
+        for rate in shipping_rates:
+            shipping.setdefault(normalize(rate['country']), []).append(
+                (Money.of(rate['min_subtotal']).cents, Money.of(rate['fee']).cents)
+            )
+        self.shipping = {
+            country : ([rate[0] for rate in sorted(rates)], [rate[1] for rate in sorted(rates)])
+            for country, rates in shipping.items()
+        }
+
+        self.by_sku, self.by_category, self.coupons = {}, {}, {}
+        cart_promotions = []
+        for promotion in promotions:
+            compiled = self._compile(promotion)
+            if promotion.get('code'):
+                self.coupons[normalize(promotion['code'])] = compiled
+            elif compiled[0] == 'sku':
+                self.by_sku.setdefault(compiled[1], []).append(compiled)
+            elif compiled[0] == 'category':
+                self.by_category.setdefault(compiled[1], []).append(compiled)
+            else:
+                cart_promotions.append(compiled)
+        self._compile_cart_promotions(cart_promotions)
+
+    @staticmethod
+    def _compile(promotion) -> tuple:
+        """ (target, key, name, is_percent, amount, min_subtotal) of a promotion """
+        is_percent = promotion['kind'] == 'percent'
+        amount = basis_points(promotion['value']) if is_percent else Money.of(promotion['value']).cents
+        if promotion.get('sku'):
+            target, key = 'sku', str(promotion['sku']).strip()
+        elif promotion.get('category'):
+            target, key = 'category', str(promotion['category'])
+        else:
+            target, key = 'cart', None
+        return (target, key, promotion['name'], is_percent, amount, Money.of(promotion['min_subtotal'] or 0).cents)
+
+    def _compile_cart_promotions(self, promotions) -> None:
+        """ Best percent and best fixed amount reached at each minimum subtotal """
+        promotions = sorted(promotions, key=lambda promotion : promotion[5])
+        self.cart_thresholds = [promotion[5] for promotion in promotions]
+        self.best_percent, self.best_fixed = [], []
+        percent, fixed = None, None
+        for promotion in promotions:
+            if promotion[3] and (percent is None or promotion[4] > percent[4]):
+                percent = promotion
+            if not promotion[3] and (fixed is None or promotion[4] > fixed[4]):
+                fixed = promotion
+            self.best_percent.append(percent)
+            self.best_fixed.append(fixed)
+
+    def expired(self, now) -> bool:
+        return self.valid_until is not None and now >= self.valid_until
+
+    def is_coupon(self, code : str) -> bool:
+        return normalize(code) in self.coupons
+
+    @staticmethod
+    def _line_discount(promotion, unit_cents : int, quantity : int) -> int:
+        if promotion[3]:
+            return apply_rate(unit_cents * quantity, promotion[4])
+        return min(promotion[4], unit_cents) * quantity
+
+    def price(self, lines, country : str | None = None, coupon : str | None = None) -> dict:
+        """
+        Price cart lines.
+
+        Args:
+            lines (iterable): (sku, category, unit price in cents, quantity) of each line
+            country (str, optional): shipping country, the default tax rate applies if unknown
+            coupon (str, optional): coupon code, ignored if unknown
+
+        Returns:
+            dict : subtotal_cents, discount_cents, taxes_cents, shipping_fee_cents,
+                total_cents, tax_rate (percent applied, Decimal), promotions
+                (names of the applied promotions) and coupon (the code if it applied)
+        """
+        coupon_rule = self.coupons.get(normalize(coupon)) if coupon else None
+        lines = list(lines)
+        subtotal = sum(unit_cents * quantity for _, _, unit_cents, quantity in lines)
+        applied = {}
+
+        line_discount = 0
+        if self.by_sku or self.by_category or (coupon_rule and coupon_rule[0] != 'cart'):
+            for sku, category, unit_cents, quantity in lines:
+                best, best_rule = 0, None
+                for rule in self._line_rules(sku, category, coupon_rule):
+                    if rule[5] <= subtotal:
+                        discount = self._line_discount(rule, unit_cents, quantity)
+                        if discount > best:
+                            best, best_rule = discount, rule
+                if best_rule is not None:
+                    line_discount += best
+                    applied[best_rule[2]] = best_rule
+
+        discounted = subtotal - line_discount
+        cart_discount, cart_rule = 0, None
+        position = bisect_right(self.cart_thresholds, subtotal)
+        candidates = [] if position == 0 else [self.best_percent[position - 1], self.best_fixed[position - 1]]
+        if coupon_rule and coupon_rule[0] == 'cart' and coupon_rule[5] <= subtotal:
+            candidates.append(coupon_rule)
+        for rule in candidates:
+            if rule is None:
+                continue
+            discount = apply_rate(discounted, rule[4]) if rule[3] else min(rule[4], discounted)
+            if discount > cart_discount:
+                cart_discount, cart_rule = discount, rule
+        if cart_rule is not None:
+            applied[cart_rule[2]] = cart_rule
+
+        discounted -= cart_discount
+        tax_points = self.taxes.get(normalize(country), self.default_tax)
+        taxes = apply_rate(discounted, tax_points)
+        shipping_fee = self._shipping_fee(discounted, country) if lines else 0
+        return {
+            'subtotal_cents' : subtotal,
+            'discount_cents' : subtotal - discounted,
+            'taxes_cents' : taxes,
+            'shipping_fee_cents' : shipping_fee,
+            'total_cents' : discounted + taxes + shipping_fee,
+            'tax_rate' : Decimal(tax_points) / 100,
+            'promotions' : list(applied),
+            'coupon' : coupon if coupon_rule is not None and coupon_rule in applied.values() else None
+        }
+
+    def _line_rules(self, sku, category, coupon_rule):
+        yield from self.by_sku.get(sku, ())
+        yield from self.by_category.get(category, ())
+        if coupon_rule is not None and (
+            (coupon_rule[0] == 'sku' and coupon_rule[1] == sku)
+            or (coupon_rule[0] == 'category' and coupon_rule[1] == category)
+        ):
+            yield coupon_rule
+
+    def _shipping_fee(self, subtotal : int, country : str | None) -> int:
+        rates = self.shipping.get(normalize(country)) or self.shipping.get('')
+        if rates is None:
+            return self.default_shipping
+        position = bisect_right(rates[0], subtotal)
+        # below the lowest threshold, the lowest rate still applies
+        return rates[1][max(position - 1, 0)]
+
+def compile_plan(version=None, now=None) -> PricingPlan:
+    """
+    Compile the rules stored in the database.
+
+    Args:
+        version (str, optional): version token of the rules
+        now (datetime, optional): promotions are filtered on their window at this date
+
+    Returns:
+        PricingPlan : plan valid until the next start or end of a promotion
+    """
+    now = now or timezone.now()
+    promotions = Promotion.objects.filter(is_active=True)
+    active = promotions.filter(
+        Q(starts_at__isnull=True) | Q(starts_at__lte=now),
+        Q(ends_at__isnull=True) | Q(ends_at__gt=now)
+    ).values('name', 'code', 'kind', 'value', 'min_subtotal', 'sku', 'category__name')
+    boundaries = [
+        date for dates in promotions.filter(Q(starts_at__gt=now) | Q(ends_at__gt=now)).values_list('starts_at', 'ends_at')
+        for date in dates if date is not None and date > now
+    ]
+    return PricingPlan(
+        tax_rates=TaxRate.objects.values('country', 'rate'),
+        shipping_rates=ShippingRate.objects.values('country', 'min_subtotal', 'fee'),
+        promotions=[dict(promotion, category=promotion['category__name']) for promotion in active],
+        valid_until=min(boundaries, default=None),
+        version=version
+    )
+
+def rules_version() -> str:
+    """ Version token of the pricing rules, created if missing """
+    version = cache.get(RULES_VERSION_KEY)
+    if version is None:
+        cache.add(RULES_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+        version = cache.get(RULES_VERSION_KEY)
+    return version
+
+def invalidate_rules() -> None:
+    """ Make every compiled plan stale once the current transaction commits """
+    transaction.on_commit(lambda : cache.set(RULES_VERSION_KEY, uuid.uuid4().hex, timeout=None))
+
+class PricingPlanLoader:
+    """
+    PricingPlan of the current process, compiled again when the rules change.
+
+    Methods:
+        plan -> PricingPlan : the current plan
+        reset()
+    """
+    def __init__(self):
+        self._plan = None
+        self._lock = threading.Lock()
+
+    @property
+    def plan(self) -> PricingPlan:
+        version = rules_version()
+        plan = self._plan
+        if plan is None or plan.version != version or plan.expired(timezone.now()):
+            with self._lock:
+                plan = self._plan
+                if plan is None or plan.version != version or plan.expired(timezone.now()):
+                    plan = self._plan = compile_plan(version)
+        return plan
+
+    def reset(self) -> None:
+        """ Drop the plan, it's compiled again on next use """
+        self._plan = None
+
+
+_pricing_plan = PricingPlanLoader()
+
+def get_pricing_plan() -> PricingPlan:
+    """ Pricing plan of the current process """
+    return _pricing_plan.plan
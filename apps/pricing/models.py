@@ -0,0 +1,66 @@
+from django.db import models
+from apps.products.models import Category
+
+class TaxRate(models.Model):
+    """
+    VAT rate of a country, matched against Address.country (case insensitive).
+    Countries without a row use the CART_VAT_RATE setting.
+    """
+    country = models.CharField(max_length=100, unique=True)
+    rate = models.DecimalField(max_digits=5, decimal_places=2) # percent
+
+    def __str__(self):
+        return f'{self.country} : {self.rate}%'
+
+class ShippingRate(models.Model):
+    """
+    Shipping fee of carts whose subtotal, after discounts, reaches min_subtotal.
+
+    The rate with the highest min_subtotal reached applies : a 0 fee with a
+    min_subtotal gives free shipping above a threshold. Rates of a country
+    replace the rates without country. Without any rate, the CART_SHIPPING_FEE
+    setting applies.
+    """
+    name = models.CharField(max_length=100)
+    country = models.CharField(max_length=100, blank=True) # blank for every country
+    min_subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    fee = models.DecimalField(max_digits=10, decimal_places=2)
+
+    def __str__(self):
+        return self.name
+
+class Promotion(models.Model):
+    """
+    Discount rule.
+
+    A promotion with a sku or a category discounts the matching cart lines,
+    otherwise it discounts the whole cart. Promotions with a code are coupons
+    and only apply once the code is entered, the others apply automatically.
+    """
+    KIND_CHOICES = [
+        ('percent', 'Percent'),
+        ('fixed', 'Fixed amount')
+    ]
+
+    name = models.CharField(max_length=100)
+    code = models.CharField(max_length=50, blank=True) # coupon code, blank for automatic promotions
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default='percent')
+    value = models.DecimalField(max_digits=10, decimal_places=2) # percent, or amount off (per unit for line promotions)
+    min_subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    sku = models.CharField(max_length=100, blank=True)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, related_name='promotions')
+    starts_at = models.DateTimeField(null=True, blank=True)
+    ends_at = models.DateTimeField(null=True, blank=True)
+    is_active = models.BooleanField(default=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['code'],
+                condition=~models.Q(code=''),
+                name='promotion_unique_code'
+            )
+        ]
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,21 @@
+from django.db.models.signals import post_save
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from apps.products.models import Category
+from .models import TaxRate
+from .models import ShippingRate
+from .models import Promotion
+from .engine import invalidate_rules
+
+@receiver([post_save, post_delete], sender=TaxRate)
+@receiver([post_save, post_delete], sender=ShippingRate)
+@receiver([post_save, post_delete], sender=Promotion)
+def rules_changed(sender, instance, **kwargs):
+    """ Compile the pricing plan again after a change of its rules """
+    invalidate_rules()
+
+@receiver(post_save, sender=Category)
+def category_renamed(sender, instance, created, **kwargs):
+    """ Category promotions are indexed by category name """
+    if not created and instance.promotions.exists():
+        invalidate_rules()
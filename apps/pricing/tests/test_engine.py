@@ -0,0 +1,250 @@
+import os
+import json
+import random
+import time
+import pytest
+from datetime import timedelta
+from decimal import Decimal
+from django.urls import reverse
+from django.utils import timezone
+from apps.cart.cart import Cart
+from apps.checkout.stripe_simulator import StripeSimulator
+from apps.container import container
+from apps.money import Money
+from apps.conftest import pytestmark
+from apps.factories import CategoryFactory
+from apps.pricing.engine import PricingPlan
+from apps.pricing.engine import compile_plan
+from apps.pricing.engine import get_pricing_plan
+from apps.pricing.models import TaxRate
+from apps.pricing.models import ShippingRate
+from apps.pricing.models import Promotion
+
+def promotion(name, value, kind='percent', **fields):
+    return dict({'name' : name, 'code' : '', 'kind' : kind, 'value' : value, 'min_subtotal' : 0, 'sku' : '', 'category' : None}, **fields)
+
+@pytest.fixture
+def plan():
+    """
+    Rules of a small shop :
+        - VAT of 20% (default), 10% in France
+        - shipping : 5$, free from 50$
+        - 10% off the 'SKU-A' line, 3$ off each unit of the 'Shoes' category
+        - 5% off carts from 100$, 15$ off carts from 200$
+        - 'WELCOME' coupon : 30% off the cart
+    """
+    return PricingPlan(
+        tax_rates=[{'country' : 'France', 'rate' : '10'}],
+        shipping_rates=[
+            {'country' : '', 'min_subtotal' : 0, 'fee' : 5},
+            {'country' : '', 'min_subtotal' : 50, 'fee' : 0}
+        ],
+        promotions=[
+            promotion('Sku sale', 10, sku='SKU-A'),
+            promotion('Shoes sale', 3, kind='fixed', category='Shoes'),
+            promotion('Big cart', 5, min_subtotal=100),
+            promotion('Huge cart', 15, kind='fixed', min_subtotal=200),
+            promotion('Welcome', 30, code='WELCOME')
+        ]
+    )
+
+class TestPricingPlan:
+    def test_price_without_promotion(self, plan):
+        pricing = plan.price([('SKU-Z', 'Food', 1000, 2)])
+        assert pricing == {
+            'subtotal_cents' : 2000,
+            'discount_cents' : 0,
+            'taxes_cents' : 400,
+            'shipping_fee_cents' : 500,
+            'total_cents' : 2900,
+            'tax_rate' : Decimal('20'),
+            'promotions' : [],
+            'coupon' : None
+        }
+
+    def test_price_country_tax_rate(self, plan):
+        assert plan.price([('SKU-Z', 'Food', 1000, 2)], country=' france')['taxes_cents'] == 200
+        assert plan.price([('SKU-Z', 'Food', 1000, 2)], country='Spain')['taxes_cents'] == 400
+
+    def test_price_free_shipping_threshold(self, plan):
+        assert plan.price([('SKU-Z', 'Food', 4999, 1)])['shipping_fee_cents'] == 500
+        assert plan.price([('SKU-Z', 'Food', 5000, 1)])['shipping_fee_cents'] == 0
+        assert plan.price([])['shipping_fee_cents'] == 0
+
+    def test_price_line_promotions(self, plan):
+        pricing = plan.price([('SKU-A', 'Food', 1000, 2), ('SKU-B', 'Shoes', 200, 3), ('SKU-C', 'Shoes', 2000, 1)])
+        # 10% of 20$, 2$ (capped to the unit price) * 3 and 3$
+        assert pricing['discount_cents'] == 200 + 600 + 300
+        assert pricing['promotions'] == ['Sku sale', 'Shoes sale']
+
+    def test_price_best_cart_promotion(self, plan):
+        assert plan.price([('SKU-Z', 'Food', 10000, 1)])['discount_cents'] == 500
+        # from 200$, 15$ off beats 5% (10$)
+        assert plan.price([('SKU-Z', 'Food', 20000, 1)])['promotions'] == ['Huge cart']
+        # from 400$, 5% (20$) beats 15$ off
+        assert plan.price([('SKU-Z', 'Food', 40000, 1)])['discount_cents'] == 2000
+
+    def test_price_coupon(self, plan):
+        pricing = plan.price([('SKU-Z', 'Food', 10000, 1)], coupon='welcome')
+        assert (pricing['discount_cents'], pricing['coupon']) == (3000, 'welcome')
+        assert plan.price([('SKU-Z', 'Food', 10000, 1)], coupon='UNKNOWN')['coupon'] is None
+        assert (plan.is_coupon('Welcome'), plan.is_coupon('Big cart')) == (True, False)
+
+    def test_price_default_rules(self, settings):
+        settings.CART_VAT_RATE = '5.5'
+        settings.CART_SHIPPING_FEE = '7.99'
+        pricing = PricingPlan().price([('SKU-Z', 'Food', 1000, 1)])
+        assert (pricing['taxes_cents'], pricing['shipping_fee_cents'], pricing['total_cents']) == (55, 799, 1854)
+
+class TestCompilePlan:
+    def test_compile_plan_window(self):
+        now = timezone.now()
+        Promotion.objects.create(name='Current', value=10, ends_at=now + timedelta(days=2))
+        Promotion.objects.create(name='Future', value=20, starts_at=now + timedelta(days=1))
+        Promotion.objects.create(name='Disabled', value=50, is_active=False)
+        plan = compile_plan(now=now)
+        assert plan.price([('SKU-Z', None, 1000, 1)])['promotions'] == ['Current']
+        assert plan.valid_until == now + timedelta(days=1)
+        assert plan.expired(now + timedelta(days=1))
+        assert compile_plan(now=now + timedelta(days=1)).price([('SKU-Z', None, 1000, 1)])['promotions'] == ['Future']
+
+    def test_compile_plan_category_promotion(self):
+        category = CategoryFactory(name='Shoes')
+        Promotion.objects.create(name='Shoes sale', value=10, category=category)
+        assert compile_plan().price([('SKU-Z', 'Shoes', 1000, 1)])['discount_cents'] == 100
+
+    def test_plan_compiled_once(self, django_assert_num_queries):
+        get_pricing_plan()
+        with django_assert_num_queries(0):
+            get_pricing_plan()
+
+    def test_plan_follows_rule_changes(self, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            rate = TaxRate.objects.create(country='France', rate=10)
+        assert get_pricing_plan().price([('SKU-Z', None, 1000, 1)], country='France')['taxes_cents'] == 100
+        with django_capture_on_commit_callbacks(execute=True):
+            rate.rate = 5
+            rate.save()
+        assert get_pricing_plan().price([('SKU-Z', None, 1000, 1)], country='France')['taxes_cents'] == 50
+
+    def test_plan_follows_category_rename(self, django_capture_on_commit_callbacks):
+        category = CategoryFactory(name='Shoes')
+        with django_capture_on_commit_callbacks(execute=True):
+            Promotion.objects.create(name='Shoes sale', value=10, category=category)
+        get_pricing_plan()
+        with django_capture_on_commit_callbacks(execute=True):
+            category.name = 'Sneakers'
+            category.save()
+        assert get_pricing_plan().price([('SKU-Z', 'Sneakers', 1000, 1)])['discount_cents'] == 100
+
+class TestCartPricing:
+    @pytest.fixture
+    def rules(self):
+        TaxRate.objects.create(country='Switzerland', rate='8.1')
+        ShippingRate.objects.create(name='Free shipping', min_subtotal=0, fee=0)
+        Promotion.objects.create(name='Jeans sale', value=25, sku='SKU-A27DE69D')
+        Promotion.objects.create(name='Welcome', value=10, kind='fixed', code='WELCOME')
+
+    def test_cart_summary_discount(self, rules, sku, product, valid_user):
+        cart = Cart({})
+        cart.user = valid_user
+        cart.add(sku, quantity=4)
+        summary = cart.get_cart_summary()
+        # 48$ - 25%, VAT of Switzerland
+        assert (summary['discount_cents'], summary['taxes_cents'], summary['shipping_fee_cents']) == (1200, 292, 0)
+        assert summary['total_cents'] == 4800 - 1200 + 292
+        assert summary['promotions'] == ['Jeans sale']
+
+    def test_cart_apply_coupon(self, rules, sku, product):
+        session = {}
+        cart = Cart(session)
+        cart.add(sku, quantity=4)
+        cart.get_cart_summary()
+        assert cart.apply_coupon('nope') is False
+        assert cart.apply_coupon('welcome') is True
+        summary = Cart(session).get_cart_summary()
+        assert (summary['discount_cents'], summary['coupon']) == (1200 + 1000, 'welcome')
+        cart.apply_coupon('')
+        assert cart.get_cart_summary()['discount_cents'] == 1200
+
+    def test_apply_coupon_view(self, client, rules, sku, product):
+        client.get(reverse('cart-add', args=[sku, 1]))
+        response = client.get(reverse('apply-coupon'), {'code' : 'WELCOME'})
+        json_response = json.loads(response.content.decode())
+        assert json_response['cart_summary']['coupon'] == 'WELCOME'
+        response = client.get(reverse('apply-coupon'), {'code' : 'nope'})
+        assert response.status_code == 400
+        assert json.loads(response.content.decode())['message'] == "Unknown coupon code 'nope'"
+
+    def test_order_discount_amount(self, rules, sku, product, valid_user):
+        cart = Cart({})
+        cart.add(sku, quantity=4)
+        summary = cart.get_cart_summary()
+        order = container.checkout_repo.create_order(valid_user, summary, Money(summary['total_cents']))
+        assert order.discount_amount == Decimal('12.00')
+
+    def test_stripe_discounts(self, mocker, rules, sku, product, valid_user):
+        coupon = mocker.patch('stripe.Coupon.create', return_value=mocker.Mock(id='coupon_1'))
+        cart = Cart({})
+        cart.add(sku, quantity=4)
+        summary = cart.get_cart_summary()
+        order = container.checkout_repo.create_order(valid_user, summary, Money(summary['total_cents']))
+        assert container.payment_service.create_discounts(cart, order) == [{'coupon' : 'coupon_1'}]
+        assert coupon.call_args.kwargs['amount_off'] == 1200
+        assert coupon.call_args.kwargs['idempotency_key'] == f'checkout-coupon-{order.order_number}'
+        cart.remove(sku)
+        assert container.payment_service.create_discounts(cart, order) == []
+
+    def test_stripe_session_retry(self, rules, sku, product, valid_user):
+        cart = Cart({})
+        cart.add(sku, quantity=4)
+        summary = cart.get_cart_summary()
+        order = container.checkout_repo.create_order(valid_user, summary, Money(summary['total_cents']))
+        payment = container.checkout_repo.create_payment(order, 'stripe', summary['total_price'])
+        simulator = StripeSimulator()
+        with simulator.installed():
+            session = container.payment_service.create_session(cart, valid_user, order, payment)
+            # the retry sends the same parameters, with the same coupon
+            assert container.payment_service.create_session(cart, valid_user, order, payment).id == session.id
+        assert len(simulator.coupons) == 1
+        assert session.amount_total == summary['total_cents']
+
+@pytest.mark.skipif(
+    not os.getenv('PRICING_BENCHMARK'),
+    reason='benchmark, run with PRICING_BENCHMARK=1'
+)
+def test_pricing_latency_benchmark():
+    """
+    p95 latency of the pricing of a 50 lines cart against 200 promotions.
+
+    Run with : PRICING_BENCHMARK=1 pytest apps/pricing/tests/test_engine.py -k benchmark -s
+    """
+    randomizer = random.Random(42)
+    categories = [f'Category {index}' for index in range(20)]
+    promotions = []
+    for index in range(200):
+        target = randomizer.choice(['sku', 'category', 'cart'])
+        promotions.append(promotion(
+            f'Promotion {index}',
+            randomizer.randint(1, 30),
+            kind=randomizer.choice(['percent', 'fixed']),
+            min_subtotal=randomizer.randint(0, 500),
+            sku=f'SKU-{randomizer.randrange(100)}' if target == 'sku' else '',
+            category=randomizer.choice(categories) if target == 'category' else None,
+            code=f'CODE{index}' if randomizer.random() < 0.1 else ''
+        ))
+    plan = PricingPlan(promotions=promotions)
+    lines = [
+        (f'SKU-{randomizer.randrange(100)}', randomizer.choice(categories), randomizer.randint(100, 10_000), randomizer.randint(1, 5))
+        for _ in range(50)
+    ]
+
+    latencies = []
+    for _ in range(1000):
+        start = time.perf_counter()
+        plan.price(lines, country='France', coupon='CODE1')
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000
+    print(f'\n50 lines, 200 promotions : p95 = {p95:.3f} ms, max = {latencies[-1] * 1000:.3f} ms')
+    assert p95 < 1
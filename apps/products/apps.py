@@ -3,5 +3,6 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.products'
- 
-    
\ No newline at end of file
+
+    def ready(self):
+        import apps.products.signals
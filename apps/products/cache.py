@@ -0,0 +1,212 @@
+"""
+Versioned read-through cache of the product detail page and variant picker.
+
+Entries are tagged with the version of their product :
+
+    product-detail:<slug> -> {'product_id', 'version', 'detail'}
+    product-variants:<product_id> -> {'version', 'payloads'}
+    product-sku:<sku> -> product_id
+    product-version:<product_id> -> version token
+    facet-epoch -> token of the facet changelog (apps/products/facets.py)
+    facet-sequence -> number of the last facet change
+    facet-change:<epoch>:<sequence> -> {'variants', 'values'} ids changed
+
+Any change to a product, its variants, their attributes or its images replaces
+the version token of the product (see apps/products/signals.py), which makes
+every cached entry of that product stale at once, whatever its slug. Stale
+entries are simply overwritten on the next miss. Any change to a variant, its
+attributes or a product status is appended to the facet changelog, that every
+process replays on its in-memory facet index.
+
+The cache must be shared by all the processes (CACHES setting : Redis or the
+database cache). With a cache per process, a new version token would only be
+seen by the process that replaced it.
+"""
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+DETAIL_CACHE_TIMEOUT = getattr(settings, 'PRODUCT_DETAIL_CACHE_TIMEOUT', 60 * 60)
+
+def detail_key(slug : str) -> str:
+    return f'product-detail:{slug}'
+
+def payloads_key(product_id : int) -> str:
+    return f'product-variants:{product_id}'
+
+def sku_key(sku : str) -> str:
+    return f'product-sku:{sku}'
+
+def version_key(product_id : int) -> str:
+    return f'product-version:{product_id}'
+
+FACET_EPOCH_KEY = 'facet-epoch'
+FACET_SEQUENCE_KEY = 'facet-sequence'
+# facet changes are kept a day, a process further behind loads its whole index
+FACET_CHANGE_TIMEOUT = 24 * 60 * 60
+
+def facet_change_key(epoch : str, sequence : int) -> str:
+    return f'facet-change:{epoch}:{sequence}'
+
+def _current_token(key : str) -> str:
+    token = cache.get(key)
+    if token is None:
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        token = cache.get(key)
+    return token
+
+def current_version(product_id : int) -> str:
+    """
+    Version token of a product, created if missing.
+
+    Versions are random tokens rather than counters : a version evicted from the
+    cache can't come back with the value of an older entry.
+    """
+    return _current_token(version_key(product_id))
+
+def current_facet_position() -> tuple:
+    """
+    Position of the facet changelog.
+
+    Returns:
+        tuple : (epoch, sequence), the sequence is 0 before the first change of the epoch
+    """
+    position = cache.get_many([FACET_EPOCH_KEY, FACET_SEQUENCE_KEY])
+    if FACET_SEQUENCE_KEY not in position:
+        _new_facet_epoch()
+        position = cache.get_many([FACET_EPOCH_KEY, FACET_SEQUENCE_KEY])
+    epoch = position.get(FACET_EPOCH_KEY) or _current_token(FACET_EPOCH_KEY)
+    return epoch, position.get(FACET_SEQUENCE_KEY, 0)
+
+def _new_facet_epoch() -> None:
+    """
+    Start the facet changelog, or start it again after its sequence was
+    evicted : the new epoch makes every process load its index again, the
+    numbers of the changes being reused.
+    """
+    cache.set(FACET_EPOCH_KEY, uuid.uuid4().hex, timeout=None)
+    cache.add(FACET_SEQUENCE_KEY, 0, timeout=None)
+
+def facet_changes(epoch : str, start : int, end : int) -> list | None:
+    """
+    Facet changes following a position of the changelog.
+
+    Args:
+        epoch (str): epoch of the changelog
+        start (int): last change already applied
+        end (int): last change to apply
+
+    Returns:
+        list | None : {'variants', 'values'} of the changes start + 1 to end,
+            None if one of them is missing (expired, evicted or still being written)
+    """
+    keys = [facet_change_key(epoch, sequence) for sequence in range(start + 1, end + 1)]
+    changes = cache.get_many(keys)
+    if len(changes) != len(keys):
+        return None
+    return [changes[key] for key in keys]
+
+def get_product_detail(slug : str, load) -> dict:
+    """
+    Read-through lookup of the detail of a product.
+
+    Args:
+        slug (str): product slug
+        load (callable): builds the detail dict of a slug from the database on a miss
+
+    Returns:
+        dict : product detail, from the cache when its version is current
+    """
+    entry = cache.get(detail_key(slug))
+    version = None
+    if entry is not None:
+        version = cache.get(version_key(entry['product_id']))
+        if version is not None and version == entry['version']:
+            return entry['detail']
+        # read the version before the database : a change committed meanwhile
+        # replaces it, so the entry stored below can't outlive that change
+        version = current_version(entry['product_id'])
+
+    detail = load(slug)
+    if entry is None or entry['product_id'] != detail['id']:
+        version = current_version(detail['id'])
+    cache.set(
+        detail_key(slug),
+        {'product_id' : detail['id'], 'version' : version, 'detail' : detail},
+        timeout=DETAIL_CACHE_TIMEOUT
+    )
+    return detail
+
+def get_variant_payloads(product_id : int, load) -> dict:
+    """
+    Read-through lookup of the variant picker payloads of a product.
+
+    Args:
+        product_id (int): primary key of the product
+        load (callable): builds the {sku : payload} dict of a product from the database on a miss
+
+    Returns:
+        dict : variant payloads, from the cache when their version is current
+    """
+    values = cache.get_many([version_key(product_id), payloads_key(product_id)])
+    version = values.get(version_key(product_id))
+    entry = values.get(payloads_key(product_id))
+    if version is not None and entry is not None and entry['version'] == version:
+        return entry['payloads']
+
+    if version is None:
+        version = current_version(product_id)
+    payloads = load(product_id)
+    cache.set(
+        payloads_key(product_id),
+        {'version' : version, 'payloads' : payloads},
+        timeout=DETAIL_CACHE_TIMEOUT
+    )
+    return payloads
+
+def get_sku_product(sku : str) -> int | None:
+    """ Product id last seen for a sku, None if unknown """
+    return cache.get(sku_key(sku))
+
+def set_sku_product(sku : str, product_id : int) -> None:
+    """
+    Remember the product of a sku. The hint is only used to find the payloads
+    of the product, which are checked to still hold the sku.
+    """
+    cache.set(sku_key(sku), product_id, timeout=DETAIL_CACHE_TIMEOUT)
+
+def invalidate_products(product_ids) -> None:
+    """
+    Make the cached details of products stale once the current transaction commits.
+
+    Args:
+        product_ids (iterable): primary keys of the changed products
+    """
+    keys = {version_key(product_id) : uuid.uuid4().hex for product_id in set(product_ids)}
+    if keys:
+        transaction.on_commit(lambda : cache.set_many(keys, timeout=None))
+
+def record_facet_change(variant_ids = (), value_ids = ()) -> None:
+    """
+    Append a change to the facet changelog once the current transaction
+    commits. A rolled back change leaves the indexes as they are.
+
+    Args:
+        variant_ids (iterable, optional): variants whose price, values or product status changed
+        value_ids (iterable, optional): attribute values whose label changed
+    """
+    change = {'variants' : sorted(set(variant_ids)), 'values' : sorted(set(value_ids))}
+    if not change['variants'] and not change['values']:
+        return
+
+    def publish():
+        try:
+            sequence = cache.incr(FACET_SEQUENCE_KEY)
+        except ValueError: # no changelog yet, or evicted
+            _new_facet_epoch()
+            sequence = cache.incr(FACET_SEQUENCE_KEY)
+        epoch = _current_token(FACET_EPOCH_KEY)
+        cache.set(facet_change_key(epoch, sequence), change, timeout=FACET_CHANGE_TIMEOUT)
+
+    transaction.on_commit(publish)
@@ -0,0 +1,408 @@
+"""
+Faceted filtering of variants by attribute values and price.
+
+The FacetIndex keeps, for every attribute value, a bitmap of the variants
+carrying it (bit n set for the variant of primary key n) and the price of every
+variant of a published product. Filtering and facet counts are then bitwise
+ANDs and bit counts in memory : no GROUP BY over VariantAttribute is run on
+request. The index is loaded on first use, then kept up to date in every
+process by replaying the facet changelog of the shared cache : the variants
+and attribute values changed by each committed transaction (see the signals
+in apps/products/signals.py). Only the changed variants are read again.
+
+Facets are disjunctive : values of the same attribute are combined with OR,
+attributes and the price range with AND, and the counts of an attribute ignore
+the values selected in that same attribute, so that they tell how many
+variants selecting one more value would add.
+"""
+import bisect
+import heapq
+import threading
+from .cache import current_facet_position
+from .cache import facet_changes
+from .models import AttributeValue
+from .models import ProductVariant
+from .models import VariantAttribute
+
+def to_bitmap(ids) -> int:
+    """ Bitmap with the bit of every id set """
+    ids = list(ids)
+    if not ids:
+        return 0
+    buffer = bytearray(max(ids) // 8 + 1)
+    for item in ids:
+        buffer[item >> 3] |= 1 << (item & 7)
+    return int.from_bytes(buffer, 'little')
+
+def from_bitmap(bitmap : int) -> list:
+    """ Ids of the bits set in a bitmap, in increasing order """
+    output = []
+    for position, byte in enumerate(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')):
+        if byte:
+            output.extend(position * 8 + bit for bit in range(8) if byte >> bit & 1)
+    return output
+
+class BitmapMembership:
+    """ Constant time membership test of ids in a bitmap """
+    def __init__(self, bitmap : int):
+        self._bytes = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+
+    def __contains__(self, item : int) -> bool:
+        position = item >> 3
+        return position < len(self._bytes) and bool(self._bytes[position] >> (item & 7) & 1)
+
+
+class FacetIndex:
+    """
+    In-memory facet index of the variants of published products.
+
+    The index lives in the current process, like the in-memory search backend.
+
+    Methods:
+        put(variant_id : int, price : Decimal, value_ids : iterable) :
+            Index (or re-index) a variant
+
+        put_many(variants : iterable) :
+            Index many variants at once
+
+        remove(variant_id : int) :
+            Remove a variant from the index
+
+        set_label(value_id : int, attribute_id : int, attribute_name : str, value : str) :
+            Register the attribute and display value of an attribute value
+
+        remove_label(value_id : int) :
+            Forget a deleted attribute value
+
+        variant_values(variant_id : int) -> set :
+            Returns the attribute values of a variant
+
+        labels(value_ids : iterable) -> dict :
+            Returns the attribute and display value of attribute values
+
+        query(value_ids : list, min_price : Decimal, max_price : Decimal, offset : int, limit : int) -> dict :
+            Returns one page of matching variant ids, their number and the facet counts
+
+    """
+    def __init__(self):
+        self._variants = 0 # bitmap of every indexed variant
+        self._prices = {} # variant_id -> price
+        self._price_order = [] # sorted (price, variant_id)
+        self._price_ids = [] # variant ids of _price_order, sliced without unpacking tuples
+        self._variant_values = {} # variant_id -> value ids
+        self._value_variants = {} # value_id -> bitmap of variants
+        self._labels = {} # value_id -> (attribute_id, attribute name, value)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._prices)
+
+    def put(self, variant_id : int, price, value_ids) -> None:
+        """
+        Index a variant, replacing its previous price and values.
+
+        Args:
+            variant_id (int): variant primary key
+            price (Decimal): variant price
+            value_ids (iterable): primary keys of the variant's attribute values
+        """
+        with self._lock:
+            self._remove(variant_id)
+            bit = 1 << variant_id
+            self._variants |= bit
+            self._prices[variant_id] = price
+            position = bisect.bisect_left(self._price_order, (price, variant_id))
+            self._price_order.insert(position, (price, variant_id))
+            self._price_ids.insert(position, variant_id)
+            self._variant_values[variant_id] = set(value_ids)
+            for value_id in self._variant_values[variant_id]:
+                self._value_variants[value_id] = self._value_variants.get(value_id, 0) | bit
+
+    def put_many(self, variants) -> None:
+        """
+        Index many variants at once, building bitmaps and sorting prices a single time.
+
+        Args:
+            variants (iterable): (variant_id, price, value_ids) tuples
+        """
+        with self._lock:
+            value_variants = {}
+            for variant_id, price, value_ids in variants:
+                self._remove(variant_id)
+                self._prices[variant_id] = price
+                self._variant_values[variant_id] = set(value_ids)
+                for value_id in self._variant_values[variant_id]:
+                    value_variants.setdefault(value_id, []).append(variant_id)
+            for value_id, variant_ids in value_variants.items():
+                self._value_variants[value_id] = self._value_variants.get(value_id, 0) | to_bitmap(variant_ids)
+            self._variants = to_bitmap(self._prices)
+            self._price_order = sorted((price, variant_id) for variant_id, price in self._prices.items())
+            self._price_ids = [variant_id for _, variant_id in self._price_order]
+
+    def remove(self, variant_id : int) -> None:
+        """ Remove a variant from the index, unknown ids are ignored """
+        with self._lock:
+            self._remove(variant_id)
+
+    def _remove(self, variant_id : int) -> None:
+        if variant_id not in self._prices:
+            return
+        mask = ~(1 << variant_id)
+        self._variants &= mask
+        price = self._prices.pop(variant_id)
+        position = bisect.bisect_left(self._price_order, (price, variant_id))
+        del self._price_order[position]
+        del self._price_ids[position]
+        for value_id in self._variant_values.pop(variant_id):
+            self._value_variants[value_id] &= mask
+            if not self._value_variants[value_id]:
+                del self._value_variants[value_id]
+
+    def set_label(self, value_id : int, attribute_id : int, attribute_name : str, value : str) -> None:
+        """ Register the attribute and display value of an attribute value """
+        self._labels[value_id] = (attribute_id, attribute_name, value)
+
+    def remove_label(self, value_id : int) -> None:
+        """ Forget a deleted attribute value, unknown ids are ignored """
+        self._labels.pop(value_id, None)
+
+    def query(self, value_ids = (), min_price = None, max_price = None, offset : int = 0, limit : int = 24) -> dict:
+        """
+        Filter variants and count facets of the result set.
+
+        Args:
+            value_ids (iterable, optional): selected attribute values
+            min_price (Decimal, optional): lowest price, inclusive
+            max_price (Decimal, optional): highest price, inclusive
+            offset (int, optional): number of results to skip. Defaults to 0.
+            limit (int, optional): maximum number of results. Defaults to 24.
+
+        Returns:
+            dict : {
+                'variant_ids' : one page of matching variant ids, by price then id,
+                'total' : number of matching variants,
+                'facets' : {attribute_id : {value_id : count}},
+                'price_range' : (lowest price, highest price) ignoring the price filter,
+                    None if no variant matches
+            }
+
+        Raises:
+            ValueError : if an attribute value is unknown
+        """
+        value_ids = set(value_ids)
+        with self._lock:
+            selected = {} # attribute_id -> bitmap of the variants having one of the selected values
+            for value_id in value_ids:
+                if value_id not in self._labels:
+                    raise ValueError(f"Unknown attribute value '{value_id}'")
+                attribute_id = self._labels[value_id][0]
+                selected[attribute_id] = selected.get(attribute_id, 0) | self._value_variants.get(value_id, 0)
+
+            price_filter = None
+            window = (0, len(self._price_ids)) # positions of the filtered prices in _price_order
+            if min_price is not None or max_price is not None:
+                window = self._price_window(min_price, max_price)
+                price_filter = self._price_between(*window)
+
+            def matching(*excluded):
+                bitmap = self._variants
+                for attribute_id, variants in selected.items():
+                    if attribute_id not in excluded:
+                        bitmap &= variants
+                if price_filter is not None and 'price' not in excluded:
+                    bitmap &= price_filter
+                return bitmap
+
+            result = matching()
+            # an attribute with selected values is counted without its own selection
+            attribute_matches = {attribute_id : matching(attribute_id) for attribute_id in selected}
+            facets = {}
+            for value_id, variants in self._value_variants.items():
+                attribute_id = self._labels[value_id][0]
+                count = (attribute_matches.get(attribute_id, result) & variants).bit_count()
+                if count or value_id in value_ids:
+                    facets.setdefault(attribute_id, {})[value_id] = count
+            for value_id in value_ids:
+                facets.setdefault(self._labels[value_id][0], {}).setdefault(value_id, 0)
+
+            total = result.bit_count()
+            return {
+                'variant_ids' : self._ordered_page(result, total, offset + limit, window)[offset:],
+                'total' : total,
+                'facets' : facets,
+                'price_range' : self._price_range(matching('price'))
+            }
+
+    def variant_values(self, variant_id : int) -> set:
+        """ Attribute values of an indexed variant """
+        return set(self._variant_values.get(variant_id, ()))
+
+    def labels(self, value_ids) -> dict:
+        """ {value_id : (attribute_id, attribute name, value)} of the given values """
+        return {value_id : self._labels[value_id] for value_id in value_ids if value_id in self._labels}
+
+    def _is_sparse(self, count : int) -> bool:
+        """ Whether listing `count` variants is cheaper than walking every price """
+        return count * 64 < len(self._prices)
+
+    def _price_window(self, min_price, max_price) -> tuple:
+        """ (start, end) positions of the prices between min_price and max_price """
+        start = 0 if min_price is None else bisect.bisect_left(self._price_order, (min_price,))
+        end = len(self._price_order)
+        if max_price is not None:
+            # (price, inf) sorts after every variant of that price
+            end = bisect.bisect_right(self._price_order, (max_price, float('inf')))
+        return start, max(start, end)
+
+    def _price_between(self, start : int, end : int) -> int:
+        """ Bitmap of the variants between two positions of _price_order """
+        if (end - start) * 2 <= len(self._price_ids):
+            return to_bitmap(self._price_ids[start:end])
+        # wide range : build the smaller bitmap of the variants outside of it
+        return self._variants & ~to_bitmap(self._price_ids[:start] + self._price_ids[end:])
+
+    def _ordered_page(self, variants : int, total : int, count : int, window : tuple) -> list:
+        """ First `count` variants of a bitmap by price then id, all within the window of _price_order """
+        if self._is_sparse(total):
+            return heapq.nsmallest(
+                count,
+                from_bitmap(variants),
+                key=lambda variant_id : (self._prices[variant_id], variant_id)
+            )
+        members = BitmapMembership(variants)
+        output = []
+        for variant_id in self._price_ids[window[0]:window[1]]:
+            if len(output) >= count:
+                break
+            if variant_id in members:
+                output.append(variant_id)
+        return output
+
+    def _price_range(self, variants : int):
+        total = variants.bit_count()
+        if not total:
+            return None
+        if self._is_sparse(total):
+            prices = [self._prices[variant_id] for variant_id in from_bitmap(variants)]
+            return min(prices), max(prices)
+        members = BitmapMembership(variants)
+        lowest = next(price for price, variant_id in self._price_order if variant_id in members)
+        highest = next(price for price, variant_id in reversed(self._price_order) if variant_id in members)
+        return lowest, highest
+
+
+class FacetIndexLoader:
+    """
+    Lazily loaded FacetIndex of the current process.
+
+    The index is tagged with the position (epoch, sequence) of the facet
+    changelog of the shared cache read before loading it (see
+    apps/products/cache.py). On each access, the changes committed since by
+    any process are replayed : their variants are read again and put in, or
+    removed from, the index. The whole index is loaded again only when the
+    process is too far behind : more than MAX_REPLAYED_CHANGES changes, a new
+    epoch or a missing change.
+
+    Methods:
+        index -> FacetIndex : the index, loaded or brought up to date
+        reset()
+    """
+    MAX_REPLAYED_CHANGES = 500
+
+    def __init__(self):
+        self._index = None
+        self._position = None
+        self._lock = threading.Lock()
+
+    @property
+    def index(self) -> FacetIndex:
+        position = current_facet_position()
+        if self._index is None or self._position != position:
+            with self._lock:
+                if self._index is None or self._position != position:
+                    # position read before the database : a change committed
+                    # meanwhile is replayed again on the next access
+                    if not self._replay(position):
+                        self._index = self._load()
+                    self._position = position
+        return self._index
+
+    def _replay(self, position : tuple) -> bool:
+        """
+        Apply the changes up to a position of the changelog.
+
+        Returns:
+            bool : False if the index must be loaded again instead
+        """
+        if self._index is None or self._position[0] != position[0]:
+            return False
+        start, end = self._position[1], position[1]
+        if end < start or end - start > self.MAX_REPLAYED_CHANGES:
+            return False
+        changes = facet_changes(position[0], start, end)
+        if changes is None:
+            return False
+        variant_ids = {variant_id for change in changes for variant_id in change['variants']}
+        value_ids = {value_id for change in changes for value_id in change['values']}
+        self._apply(self._index, variant_ids, value_ids)
+        return True
+
+    def _apply(self, index : FacetIndex, variant_ids : set, value_ids : set) -> None:
+        """ Read changed variants and attribute values again into the index """
+        labels = {
+            value_id : (attribute_id, attribute_name, value)
+            for value_id, attribute_id, attribute_name, value in AttributeValue.objects.filter(
+                pk__in=value_ids
+            ).values_list('id', 'attribute_id', 'attribute__name', 'value')
+        }
+        for value_id in value_ids:
+            if value_id in labels:
+                index.set_label(value_id, *labels[value_id])
+            else:
+                index.remove_label(value_id)
+
+        values = {}
+        for variant_id, value_id in VariantAttribute.objects.filter(
+            variant_id__in=variant_ids
+        ).values_list('variant_id', 'value_id'):
+            values.setdefault(variant_id, []).append(value_id)
+        prices = dict(ProductVariant.objects.filter(
+            pk__in=variant_ids, product__status='published'
+        ).values_list('id', 'price'))
+        for variant_id in variant_ids:
+            if variant_id in prices:
+                index.put(variant_id, prices[variant_id], values.get(variant_id, ()))
+            else: # deleted, or its product isn't published
+                index.remove(variant_id)
+
+    def _load(self) -> FacetIndex:
+        index = FacetIndex()
+        for value_id, attribute_id, attribute_name, value in AttributeValue.objects.values_list(
+            'id', 'attribute_id', 'attribute__name', 'value'
+        ):
+            index.set_label(value_id, attribute_id, attribute_name, value)
+
+        values = {}
+        for variant_id, value_id in VariantAttribute.objects.filter(
+            variant__product__status='published'
+        ).values_list('variant_id', 'value_id'):
+            values.setdefault(variant_id, []).append(value_id)
+        index.put_many(
+            (variant_id, price, values.get(variant_id, ()))
+            for variant_id, price in ProductVariant.objects.filter(
+                product__status='published'
+            ).values_list('id', 'price')
+        )
+        return index
+
+    def reset(self) -> None:
+        """ Drop the index, it's loaded again on next use """
+        self._index = None
+        self._position = None
+
+
+_facet_index = FacetIndexLoader()
+
+def get_facet_index() -> FacetIndexLoader:
+    """ Facet index of the current process """
+    return _facet_index
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_sku_registry(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductVariant = apps.get_model('products', 'ProductVariant')
+    SkuRegistry = apps.get_model('products', 'SkuRegistry')
+    entries = [
+        SkuRegistry(sku=sku, product_type='base', product_id=pk)
+        for pk, sku in Product.objects.values_list('id', 'sku')
+    ]
+    entries += [
+        SkuRegistry(sku=sku, product_type='variant', variant_id=pk)
+        for pk, sku in ProductVariant.objects.values_list('id', 'sku')
+    ]
+    SkuRegistry.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0030_alter_productvariant_identifiant_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SkuRegistry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sku', models.CharField(db_index=True, max_length=100)),
+                ('product_type', models.CharField(choices=[('base', 'Base'), ('variant', 'Variant')], max_length=10)),
+                ('product', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sku_entry', to='products.product')),
+                ('variant', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sku_entry', to='products.productvariant')),
+            ],
+            options={
+                'verbose_name_plural': 'SKU registry',
+            },
+        ),
+        migrations.RunPython(backfill_sku_registry, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Copy of apps.products.search.SEARCH_VECTOR_SQL when this migration was written
+SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(keywords, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(body, '')), 'C')"
+)
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return # other databases use the in-memory search backend
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS product_search_vector_idx '
+        f'ON products_productsearchdocument USING GIN (({SEARCH_VECTOR_SQL}))'
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS product_search_vector_idx')
+
+
+def backfill_search_documents(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductVariant = apps.get_model('products', 'ProductVariant')
+    VariantAttribute = apps.get_model('products', 'VariantAttribute')
+    ProductSearchDocument = apps.get_model('products', 'ProductSearchDocument')
+    keywords = {}
+    for product_id, identifiant in ProductVariant.objects.values_list('product_id', 'identifiant'):
+        keywords.setdefault(product_id, []).append(identifiant)
+    for product_id, value in VariantAttribute.objects.values_list('variant__product_id', 'value__value'):
+        keywords.setdefault(product_id, []).append(value)
+
+    documents = [
+        ProductSearchDocument(
+            product_id=product.id,
+            title=product.name,
+            keywords=' '.join(([product.category.name] if product.category_id else []) + keywords.get(product.id, [])),
+            body=product.description,
+            is_published=product.status == 'published'
+        )
+        for product in Product.objects.select_related('category')
+    ]
+    ProductSearchDocument.objects.bulk_create(documents, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0032_product_listing_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='products.product')),
+                ('title', models.CharField(max_length=255)),
+                ('keywords', models.TextField(blank=True)),
+                ('body', models.TextField(blank=True)),
+                ('is_published', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_search_documents, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:34
+
+from django.db import migrations, models
+
+
+def fill_null_discounts(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    Product.objects.filter(discount__isnull=True).update(discount=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0033_productsearchdocument'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_null_discounts, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='discount',
+            field=models.DecimalField(blank=True, decimal_places=2, default=0.0, max_digits=10),
+        ),
+    ]
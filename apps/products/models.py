@@ -38,13 +38,18 @@ class Product(models.Model):
 
     class Meta:
         ordering = ['-discount']
+        indexes = [
+            # keyset pagination of the published listing, discount is never
+            # NULL so the index order is the listing order
+            models.Index(fields=['status', '-discount', 'id'], name='product_listing_idx')
+        ]
 
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     slug = models.SlugField(unique=True, blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2, default=0.0)
     old_price = models.DecimalField(max_digits=10, decimal_places=2, default=0.0)
-    discount = models.DecimalField(max_digits=10, default=0.0, blank=True, null=True, decimal_places=2)
+    discount = models.DecimalField(max_digits=10, default=0.0, blank=True, decimal_places=2)
     stock = models.PositiveIntegerField(default=0)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='products')
     sku = models.CharField(max_length=100, unique=True, blank=True)
@@ -129,3 +134,51 @@ class VariantAttribute(models.Model):
     def __str__(self):
         return f"{self.variant} | {self.attribute.name} = {self.value.value}"
 
+
+class SkuRegistry(models.Model):
+    """
+    Denormalized SKU lookup table shared by base products and variants.
+
+    Every Product and ProductVariant owns exactly one row, kept in sync by the
+    signals in apps/products/signals.py, so that resolving a SKU is a single
+    indexed lookup instead of one query per product table.
+    """
+    PRODUCT_TYPES = [
+        ('base', 'Base'),
+        ('variant', 'Variant')
+    ]
+
+    sku = models.CharField(max_length=100, db_index=True)
+    product_type = models.CharField(max_length=10, choices=PRODUCT_TYPES)
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, null=True, blank=True, related_name='sku_entry')
+    variant = models.OneToOneField(ProductVariant, on_delete=models.CASCADE, null=True, blank=True, related_name='sku_entry')
+
+    class Meta:
+        verbose_name_plural = 'SKU registry'
+
+    def resolve(self):
+        """ Returns the Product or ProductVariant this entry points to """
+        return self.product if self.product_type == 'base' else self.variant
+
+    def __str__(self):
+        return f'{self.sku} ({self.product_type})'
+
+
+class ProductSearchDocument(models.Model):
+    """
+    Searchable text of a product, one row per product.
+
+    Name, category, variants and descriptions are spread over several tables;
+    this row flattens them so that the search index never has to join them.
+    Rows are rebuilt by the signals in apps/products/signals.py and read by the
+    search backends in apps/products/search.py.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    title = models.CharField(max_length=255) # product name
+    keywords = models.TextField(blank=True) # category, variants and attribute values
+    body = models.TextField(blank=True) # product description
+    is_published = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Search document of {self.title}'
@@ -0,0 +1,74 @@
+"""
+Keyset (cursor) pagination helpers for product listings.
+
+Listings are ordered by discount (highest first) with the primary key as a
+stable tiebreaker. A cursor encodes the (discount, id) pair of the last product
+of a page, so the next page is read with an indexed range filter instead of an
+OFFSET that grows with the page number.
+
+Ranked search results have no stable sort key to build a cursor from, so they
+are paginated by page number instead (see clean_page).
+"""
+from decimal import Decimal
+from decimal import InvalidOperation
+from apps import pagination
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+def encode_cursor(discount, pk : int) -> str:
+    """
+    Encode the position of a product inside the listing.
+
+    Args:
+        discount (Decimal): product discount
+        pk (int): product primary key
+
+    Returns:
+        str : url-safe cursor
+    """
+    return pagination.encode_cursor(str(discount), pk)
+
+def decode_cursor(cursor : str) -> tuple:
+    """
+    Decode a cursor built by encode_cursor.
+
+    Args:
+        cursor (str): cursor sent by the client
+
+    Returns:
+        tuple : (discount as Decimal, primary key)
+
+    Raises:
+        ValueError : if the cursor is malformed
+    """
+    discount, pk = pagination.decode_cursor(cursor, 2)
+    try:
+        return (Decimal(discount), int(pk))
+    except (TypeError, ValueError, InvalidOperation):
+        raise ValueError(f"Invalid cursor '{cursor}'")
+
+def clean_page_size(page_size) -> int:
+    """
+    Parse a page size sent by the client.
+
+    Returns:
+        int : page size between 1 and MAX_PAGE_SIZE, DEFAULT_PAGE_SIZE if invalid
+    """
+    try:
+        page_size = int(page_size)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return min(max(page_size, 1), MAX_PAGE_SIZE)
+
+def clean_page(page) -> int:
+    """
+    Parse a page number sent by the client.
+
+    Returns:
+        int : page number starting at 1, 1 if invalid
+    """
+    try:
+        return max(int(page), 1)
+    except (TypeError, ValueError):
+        return 1
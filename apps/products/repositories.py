@@ -3,7 +3,19 @@ from .models import ProductVariant
 from .models import Category
 from .models import VariantImage
 from .models import VariantAttribute
+from .models import SkuRegistry
+from .models import ProductImage
 from django.db.models import QuerySet
+from django.db.models import OuterRef
+from django.db.models import Subquery
+from django.db.models.functions import Coalesce
+from .pagination import DEFAULT_PAGE_SIZE
+from .pagination import encode_cursor
+from .pagination import decode_cursor
+from .search import get_search_backend
+from .facets import get_facet_index
+from django.db.models import Prefetch
+from django.db.models import prefetch_related_objects
 
 class ProductRepository:
     """
@@ -15,8 +27,15 @@ class ProductRepository:
 
     Methods:
         get_all_products () -> QuerySet[Product]
-        get_all_categories() -> QuerySet[Product]
+        get_all_categories() -> QuerySet[Category]
+        get_listing_products(category_name, cursor, page_size) -> dict
+        search_products(query, page, page_size) -> dict
+        filter_variants(value_ids, min_price, max_price, page, page_size) -> dict
+        get_product_detail(slug : str) -> dict
         get_by_category(category : str) -> QuerySet[Product]
+        get_by_sku(sku : str) -> dict
+        get_many_by_sku(skus : list) -> dict
+        get_stock_snapshot(skus : list) -> dict
     
     """
     def get_all_products(self) -> QuerySet[Product]:
@@ -30,17 +49,293 @@ class ProductRepository:
         products = Product.objects.select_related('category').filter(status='published')
         return products
 
-    def get_all_category(self,) -> QuerySet[Product]:
+    def get_all_category(self,) -> QuerySet[Category]:
         """
-        Retrieves all category from the database
+        Retrieves all category from the database.
+        Products are not loaded, categories only carry their own fields.
         
         Returns:
             QuerySet : All categories that exists in the database
 
         """
-        categories = Category.objects.prefetch_related('products').all()
+        categories = Category.objects.all()
         return categories
 
+    def get_listing_products(
+        self,
+        category_name : str | None = None,
+        cursor : str | None = None,
+        page_size : int = DEFAULT_PAGE_SIZE
+        ) -> dict:
+        """
+        Listing read-model : one page of published products with their featured image url.
+
+        Category and featured image are loaded within the product query itself,
+        so rendering a page costs the same number of queries whatever the
+        number of products. The featured image is the image flagged as featured
+        or, if none, the first uploaded one.
+
+        Pages follow the '-discount' ordering of Product with the id as tiebreaker
+        and are read with keyset pagination (see apps/products/pagination.py).
+
+        Args:
+            category_name (str, optional) : restrict the listing to this category
+            cursor (str, optional) : next_cursor of the previous page
+            page_size (int, optional) : number of products per page
+
+        Returns :
+            dict : {
+                'products' : Product objects with an extra `featured_image_url` attribute,
+                'next_cursor' : cursor of the next page or None on the last page
+            }
+
+        Raises:
+            Category.DoesNotExist: If the specified category does not exists
+            ValueError : If the cursor is malformed
+
+        """
+        products = self._listing_queryset()
+
+        if category_name is not None:
+            category = Category.objects.get(name=category_name)
+            products = products.filter(category=category)
+
+        if cursor:
+            # two range reads of product_listing_idx rather than one OR filter
+            # the database would sort : the products left at the discount of
+            # the cursor, then the lower discounts
+            discount, pk = decode_cursor(cursor)
+            rows = list(products.filter(discount=discount, id__gt=pk)[:page_size + 1])
+            if len(rows) <= page_size:
+                rows += products.filter(discount__lt=discount)[:page_size + 1 - len(rows)]
+        else:
+            rows = list(products[:page_size + 1])
+        page = rows[:page_size]
+        next_cursor = None
+        if len(rows) > page_size:
+            next_cursor = encode_cursor(page[-1].discount, page[-1].id)
+
+        self._attach_featured_image_urls(page)
+        return {'products' : page, 'next_cursor' : next_cursor}
+
+    def search_products(self, query : str, page : int = 1, page_size : int = DEFAULT_PAGE_SIZE) -> dict:
+        """
+        Ranked full-text search over published products.
+
+        Matching ids come from the search backend (see apps/products/search.py),
+        then the page is loaded with the listing read-model in a single query.
+
+        Args:
+            query (str) : search query
+            page (int, optional) : page number, starting at 1
+            page_size (int, optional) : number of products per page
+
+        Returns :
+            dict : {
+                'products' : Product objects by relevance with an extra `featured_image_url` attribute,
+                'total' : number of matching products
+            }
+
+        """
+        product_ids, total = get_search_backend().search(
+            query,
+            offset=(page - 1) * page_size,
+            limit=page_size
+        )
+        products = self._listing_queryset().in_bulk(product_ids)
+        page_products = [products[pk] for pk in product_ids if pk in products]
+        self._attach_featured_image_urls(page_products)
+        return {'products' : page_products, 'total' : total}
+
+    def filter_variants(
+        self,
+        value_ids = (),
+        min_price = None,
+        max_price = None,
+        page : int = 1,
+        page_size : int = DEFAULT_PAGE_SIZE
+        ) -> dict:
+        """
+        Variants of published products filtered by attribute values and price, with facet counts.
+
+        Filtering and counting run on the facet index (see apps/products/facets.py),
+        then the page of variants is loaded in a single query.
+
+        Args:
+            value_ids (iterable, optional) : selected attribute values primary keys
+            min_price (Decimal, optional) : lowest price, inclusive
+            max_price (Decimal, optional) : highest price, inclusive
+            page (int, optional) : page number, starting at 1
+            page_size (int, optional) : number of variants per page
+
+        Returns :
+            dict : {
+                'variants' : ProductVariant objects by price, with their product,
+                'total' : number of matching variants,
+                'facets' : {attribute_id : {value_id : count}},
+                'price_range' : (lowest, highest) price of the matching variants
+                    whatever the price filter, None if no variant matches,
+                'variant_values' : {variant_id : value ids} of the page,
+                'labels' : {value_id : (attribute_id, attribute name, value)}
+            }
+
+        Raises :
+            ValueError : if an attribute value doesn't exist
+
+        """
+        index = get_facet_index().index
+        result = index.query(
+            value_ids,
+            min_price=min_price,
+            max_price=max_price,
+            offset=(page - 1) * page_size,
+            limit=page_size
+        )
+        variants = ProductVariant.objects.select_related('product').in_bulk(result['variant_ids'])
+        variant_values = {pk : index.variant_values(pk) for pk in result['variant_ids']}
+        displayed_values = set().union(*variant_values.values(), *result['facets'].values())
+        return {
+            'variants' : [variants[pk] for pk in result['variant_ids'] if pk in variants],
+            'total' : result['total'],
+            'facets' : result['facets'],
+            'price_range' : result['price_range'],
+            'variant_values' : variant_values,
+            'labels' : index.labels(displayed_values)
+        }
+
+    def _listing_queryset(self) -> QuerySet[Product]:
+        """ Published products in listing order, with category and featured image """
+        featured_image = ProductImage.objects.filter(
+            product=OuterRef('pk')
+        ).order_by('-is_featured', 'id').values('image')[:1]
+        return Product.objects.select_related('category').filter(
+            status='published'
+        ).annotate(
+            featured_image=Subquery(featured_image)
+        ).order_by('-discount', 'id')
+
+    def _attach_featured_image_urls(self, products) -> None:
+        """ Turn the featured_image annotation into a `featured_image_url` attribute """
+        storage = ProductImage._meta.get_field('image').storage
+        for product in products:
+            product.featured_image_url = storage.url(product.featured_image) if product.featured_image else ''
+
+    def _detail_queryset(self) -> QuerySet[Product]:
+        """
+        Products with everything their detail page and variant picker need :
+        category, images, variants with their images. Attributes are loaded
+        with get_variant_attributes_map().
+        """
+        return Product.objects.select_related('category').prefetch_related(
+            Prefetch('images', queryset=ProductImage.objects.order_by('id')),
+            Prefetch(
+                'variants',
+                queryset=ProductVariant.objects.order_by('id').prefetch_related(
+                    Prefetch('variant_image', queryset=VariantImage.objects.order_by('id'))
+                )
+            )
+        )
+
+    def _build_variant_payloads(self, product : Product) -> dict:
+        """
+        Variant picker payloads of a product fetched with _detail_queryset().
+
+        Args:
+            product (Product) : product with its images and variants prefetched
+
+        Returns:
+            dict : {sku : payload} for the base product and each of its variants
+        """
+        images = [str(image.image.url) for image in product.images.all() if image.image]
+        base_image = images[0] if images else ''
+        payloads = {
+            product.sku : {
+                'product_type' : 'base',
+                'title' : product.name,
+                'price' : product.price,
+                'stock' : product.stock,
+                'old_price' : product.old_price,
+                'image' : base_image
+            }
+        }
+        variants = list(product.variants.all())
+        attributes = self.get_variant_attributes_map([variant.id for variant in variants])
+        for variant in variants:
+            variant_images = [str(image.image.url) for image in variant.variant_image.all() if image.image]
+            payloads[variant.sku] = {
+                'product_type' : 'variant',
+                'title' : str(variant),
+                'price' : variant.price,
+                'stock' : variant.stock,
+                'old_price' : variant.old_price,
+                'attributes' : attributes[variant.id],
+                'image' : variant_images[0] if variant_images else base_image
+            }
+        return payloads
+
+    def get_variant_payloads(self, product_id : int) -> dict:
+        """
+        Payloads of the variant picker of a product, computed with a constant
+        number of queries whatever its number of variants.
+
+        Args:
+            product_id (int) : primary key of the product
+
+        Returns:
+            dict : {sku : payload} for the base product and each of its variants
+
+        Raises :
+            Product.DoesNotExist : if there is no product with this id
+        """
+        return self._build_variant_payloads(self._detail_queryset().get(id=product_id))
+
+    def get_product_detail(self, slug : str) -> dict:
+        """
+        Detail page read-model of a product : plain data only, so that it can be
+        cached and rendered without touching the database.
+
+        Args:
+            slug (str) : product slug
+
+        Returns :
+            dict : product fields, category name, image urls, variants, the
+                attributes of the first variant and the variant picker payloads
+
+        Raises :
+            Product.DoesNotExist : if there is no product with this slug
+
+        """
+        product = self._detail_queryset().get(slug=slug)
+        variants = list(product.variants.all())
+        images = [str(image.image.url) for image in product.images.all() if image.image]
+        variant_payloads = self._build_variant_payloads(product)
+
+        return {
+            'id' : product.id,
+            'name' : product.name,
+            'slug' : product.slug,
+            'sku' : product.sku,
+            'description' : product.description,
+            'category' : product.category.name if product.category else '',
+            'price' : product.price,
+            'old_price' : product.old_price,
+            'stock' : product.stock,
+            'image_url' : images[0] if images else '',
+            'images' : images,
+            'variants' : [
+                {
+                    'sku' : variant.sku,
+                    'identifiant' : variant.identifiant,
+                    'price' : variant.price,
+                    'old_price' : variant.old_price,
+                    'stock' : variant.stock
+                }
+                for variant in variants
+            ],
+            'attributes' : variant_payloads[variants[0].sku]['attributes'] if variants else {},
+            'variant_payloads' : variant_payloads
+        }
+
     def get_by_category(self, category_name : str) -> QuerySet[Product] | str:
         """
         Retrieve all active products belonging to a specific category.
@@ -62,6 +357,9 @@ class ProductRepository:
     def get_by_sku(self, sku : str) -> str | dict:
         """
         Retrieve a product (base or variant) by SKU.
+
+        The lookup goes through the SKU registry, so base products and variants
+        are resolved with a single indexed query.
         
         Args:
             sku (str) : product' sku
@@ -74,18 +372,103 @@ class ProductRepository:
 
         """
         sku = str(sku).strip()
-        product = Product.objects.filter(sku=sku).first() \
-                or ProductVariant.objects.filter(sku=sku).first()
-        if not product:
+        entry = self._registry_entries([sku]).first()
+        if not entry:
             raise ValueError(f"Product with SKU '{sku}' not found")
         
-        try:
-            name = product.name
-            return {'product_type':'base', 'product':product}
-        except AttributeError:
-            pass 
+        return {'product_type':entry.product_type, 'product':entry.resolve()}
+
+    def get_many_by_sku(self, skus : list) -> dict:
+        """
+        Retrieve many products (base or variant) by SKU in one round trip.
+
+        Args:
+            skus (list) : products' skus
+
+        Returns :
+            dict : {sku : {'product_type' : str, 'product' : Product | ProductVariant}}.
+                Unknown SKUs are left out of the mapping.
+
+        """
+        skus = {str(sku).strip() for sku in skus}
+        if not skus:
+            return {}
+
+        output = {}
+        for entry in self._registry_entries(skus):
+            # entries are ordered base first, so a base product wins a SKU clash
+            output.setdefault(entry.sku, {'product_type':entry.product_type, 'product':entry.resolve()})
+        return output
+
+    def get_stock_snapshot(self, skus : list) -> dict:
+        """
+        Stock, price and status of many products (base or variant) by SKU,
+        read as plain rows in a single query.
+
+        Args:
+            skus (list) : products' skus
+
+        Returns :
+            dict : {sku : row} where row contains sku, product_type, product_id
+                (the base product of a variant), variant_id, title, price, old_price,
+                discount, stock and status (of the base product for a variant). Unknown SKUs are
+                left out of the mapping.
+        """
+        skus = {str(sku).strip() for sku in skus}
+        if not skus:
+            return {}
+
+        rows = SkuRegistry.objects.filter(sku__in=skus).order_by('product_type').values(
+            'sku',
+            'product_type',
+            'variant_id',
+            product_ref=Coalesce('product_id', 'variant__product_id'),
+            title=Coalesce('product__name', 'variant__identifiant'),
+            price=Coalesce('product__price', 'variant__price'),
+            old_price=Coalesce('product__old_price', 'variant__old_price'),
+            discount=Coalesce('product__discount', 'variant__discount'),
+            stock=Coalesce('product__stock', 'variant__stock'),
+            status=Coalesce('product__status', 'variant__product__status'),
+        )
+        output = {}
+        for row in rows:
+            row['product_id'] = row.pop('product_ref')
+            # rows are ordered base first, so a base product wins a SKU clash
+            output.setdefault(row['sku'], row)
+        return output
+
+    def prefetch_line_details(self, product_dicts) -> None:
+        """
+        Load images and attributes of already resolved products in bulk.
+
+        Runs a fixed number of queries whatever the number of products, so that
+        images can then be read without touching the database.
+
+        Args:
+            product_dicts (iterable) : dicts returned by get_by_sku / get_many_by_sku
+
+        Returns:
+            dict : attributes of the variants, see get_variant_attributes_map()
+        """
+        product_dicts = list(product_dicts)
+        bases = [item['product'] for item in product_dicts if item['product_type'] == 'base']
+        variants = [item['product'] for item in product_dicts if item['product_type'] == 'variant']
+        ordered_images = ProductImage.objects.order_by('id')
+        
+        prefetch_related_objects(bases, Prefetch('images', queryset=ordered_images))
+        prefetch_related_objects(
+            variants,
+            Prefetch('variant_image', queryset=VariantImage.objects.order_by('id')),
+            Prefetch('product__images', queryset=ordered_images)
+        )
+        return self.get_variant_attributes_map([variant.id for variant in variants])
 
-        return {'product_type':'variant', 'product':product}
+    def _registry_entries(self, skus) -> QuerySet[SkuRegistry]:
+        """ Registry rows for the given SKUs joined with their product data """
+        return SkuRegistry.objects.select_related(
+            'product__category',
+            'variant__product__category'
+        ).filter(sku__in=skus).order_by('product_type')
 
     def get_product_image(self, sku : str) -> QuerySet[Product]:
         product = self.get_by_sku(sku)['product']
@@ -108,6 +491,28 @@ class ProductRepository:
         output = str(product.images.first().image.url)
         return output
 
+    def get_variant_attributes_map(self, variant_ids) -> dict:
+        """
+        Returns attributes of many variant products with a single joined query
+
+        Args:
+            variant_ids (iterable): primary keys of variant products
+
+        Returns:
+            output (dict) : {variant_id : {attribute name : value}}, variants
+                without attributes are mapped to an empty dict
+        """
+        output = {variant_id : {} for variant_id in variant_ids}
+        if not output:
+            return output
+
+        attributes = VariantAttribute.objects.filter(
+            variant_id__in=output.keys()
+        ).order_by('id').values_list('variant_id', 'attribute__name', 'value__value')
+        for variant_id, name, value in attributes:
+            output[variant_id][name] = value
+        return output
+
     def get_variant_attribute(self, product_variant_id):
         """
         Returns attributes of a variant product 
@@ -120,12 +525,6 @@ class ProductRepository:
         """
         
         try:
-            attributes = VariantAttribute.objects.filter(variant_id=product_variant_id)
+            return self.get_variant_attributes_map([product_variant_id])[product_variant_id]
         except ValueError:
             return {}
-        output = {}
-        for attr in attributes:
-            output[attr.attribute.name] = attr.value.value
-        return output
-
-
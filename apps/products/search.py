@@ -0,0 +1,414 @@
+"""
+Full-text product search.
+
+Every product owns a ProductSearchDocument holding its flattened searchable
+text in three weighted fields :
+    - title : product name (weight 1.0)
+    - keywords : category name, variant names and attribute values (weight 0.4)
+    - body : product description (weight 0.2)
+
+Two backends answer ranked, prefix-matched queries over these documents :
+    - PostgresSearchBackend : to_tsvector / to_tsquery served by a GIN expression
+        index (see migration 0033), used in production.
+    - InMemorySearchBackend : process-local inverted index, used on any other
+        database (SQLite in development and tests).
+
+Both backends follow the same rules : every query term must match (AND), terms
+of two characters or more also match as a prefix ('lap' finds 'laptop') and
+results are ranked by weighted relevance, then by product id.
+"""
+import bisect
+import heapq
+import math
+import re
+import threading
+from collections import defaultdict
+from django.db import connection
+from django.db.models import BooleanField
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+from .models import Product
+from .models import ProductSearchDocument
+from .models import VariantAttribute
+
+TOKEN_PATTERN = re.compile(r'[^\W_]+')
+MIN_PREFIX_LENGTH = 2
+PREFIX_MATCH_FACTOR = 0.8 # a prefix match ranks below the same exact match
+FIELD_WEIGHTS = {
+    'title' : 1.0,
+    'keywords' : 0.4,
+    'body' : 0.2
+}
+
+# Same expression in the GIN index (copied in migration 0033) and in the queries,
+# otherwise postgres won't use the index
+SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(keywords, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(body, '')), 'C')"
+)
+
+def tokenize(text : str) -> list:
+    """
+    Split a text into lowercase alphanumeric tokens.
+
+    Args:
+        text (str): text to split
+
+    Returns:
+        list : tokens in order of appearance
+    """
+    return TOKEN_PATTERN.findall(str(text or '').lower())
+
+def parse_query(query : str) -> list:
+    """ Distinct tokens of a search query, in order of appearance """
+    return list(dict.fromkeys(tokenize(query)))
+
+def build_document_fields(product : Product) -> dict:
+    """
+    Collect the searchable text of a product.
+
+    Args:
+        product (Product): indexed product
+
+    Returns:
+        dict : title, keywords, body and is_published of the search document
+    """
+    keywords = [product.category.name] if product.category_id else []
+    for variant in product.variants.all():
+        keywords.append(variant.identifiant)
+    attributes = VariantAttribute.objects.filter(
+        variant__product=product
+    ).values_list('value__value', flat=True)
+    keywords.extend(attributes)
+
+    return {
+        'title' : product.name,
+        'keywords' : ' '.join(keywords),
+        'body' : product.description,
+        'is_published' : product.is_published()
+    }
+
+def index_product(product : Product, create : bool = True) -> None:
+    """
+    Rebuild the search document of a product and push it to the search backend.
+
+    Args:
+        product (Product): product to index
+        create (bool, optional): create the document if it is missing. Defaults to True.
+            Deletion signals pass False : the product may be deleted in the same
+            transaction and its document must not be created again.
+    """
+    fields = build_document_fields(product)
+    if create:
+        document, _ = ProductSearchDocument.objects.update_or_create(product=product, defaults=fields)
+    else:
+        if not ProductSearchDocument.objects.filter(product=product).update(**fields):
+            return
+        document = ProductSearchDocument(product=product, **fields)
+    get_search_backend().update(document)
+
+
+class InMemoryIndex:
+    """
+    Inverted index of search documents.
+
+    Each token maps to the weighted frequency of the token in every document
+    containing it. Documents of a token are also grouped by weight, so that
+    queries rank whole groups of documents with set operations instead of
+    scoring documents one by one. Prefix queries walk a sorted copy of the
+    vocabulary, rebuilt only after new tokens were added.
+
+    Methods:
+        add(doc_id : int, fields : dict) :
+            Index (or re-index) a document
+
+        remove(doc_id : int) :
+            Remove a document from the index
+
+        search(query : str, offset : int, limit : int) -> tuple :
+            Returns one page of ranked document ids and the number of matches
+
+    """
+    def __init__(self):
+        self._postings = {} # token -> {doc_id : weight}
+        self._levels = {} # token -> {weight : set of doc_ids}
+        self._doc_tokens = {} # doc_id -> tokens of the document
+        self._vocabulary = []
+        self._vocabulary_stale = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._doc_tokens)
+
+    def add(self, doc_id : int, fields : dict) -> None:
+        """
+        Index a document, replacing its previous version.
+
+        Args:
+            doc_id (int): document id
+            fields (dict): text of each field of FIELD_WEIGHTS
+        """
+        counts = defaultdict(lambda : defaultdict(int))
+        for field in FIELD_WEIGHTS:
+            for token in tokenize(fields.get(field)):
+                counts[token][field] += 1
+
+        with self._lock:
+            self._remove(doc_id)
+            for token, fields_count in counts.items():
+                if token not in self._postings:
+                    self._postings[token] = {}
+                    self._levels[token] = {}
+                    self._vocabulary_stale = True
+                weight = sum(
+                    FIELD_WEIGHTS[field] * (1 + math.log(count)) for field, count in fields_count.items()
+                )
+                self._postings[token][doc_id] = weight
+                self._levels[token].setdefault(weight, set()).add(doc_id)
+            self._doc_tokens[doc_id] = tuple(counts)
+
+    def remove(self, doc_id : int) -> None:
+        """ Remove a document from the index, unknown ids are ignored """
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id : int) -> None:
+        for token in self._doc_tokens.pop(doc_id, ()):
+            weight = self._postings[token].pop(doc_id)
+            levels = self._levels[token]
+            levels[weight].discard(doc_id)
+            if not levels[weight]:
+                del levels[weight]
+            if not levels:
+                del self._postings[token]
+                del self._levels[token]
+                self._vocabulary_stale = True
+
+    def search(self, query : str, offset : int = 0, limit : int = 20) -> tuple:
+        """
+        Ranked search over the indexed documents.
+
+        Args:
+            query (str): search query
+            offset (int, optional): number of results to skip. Defaults to 0.
+            limit (int, optional): maximum number of results. Defaults to 20.
+
+        Returns:
+            tuple : (list of document ids, total number of matching documents)
+        """
+        terms = parse_query(query)
+        if not terms:
+            return [], 0
+
+        with self._lock:
+            terms_levels = [self._term_levels(term) for term in terms]
+        if not all(levels for levels, _ in terms_levels):
+            return [], 0
+
+        total = len(set.intersection(*[matches for _, matches in terms_levels]))
+        ranked = self._top_documents([levels for levels, _ in terms_levels], offset + limit)
+        return ranked[offset:], total
+
+    def _term_levels(self, term : str) -> tuple:
+        """
+        Documents matching a query term, grouped by score.
+
+        A document matching the term through several tokens (or with several
+        weights) only keeps its best score.
+
+        Returns:
+            tuple : (list of (score, set of doc_ids) by decreasing score, set of every matching doc_id)
+        """
+        documents_count = len(self._doc_tokens)
+        candidates = []
+        for token in self._matching_tokens(term):
+            factor = math.log(1 + documents_count / len(self._postings[token]))
+            if token != term:
+                factor *= PREFIX_MATCH_FACTOR
+            for weight, doc_ids in self._levels[token].items():
+                candidates.append((weight * factor, doc_ids))
+        candidates.sort(key=lambda item : item[0], reverse=True)
+
+        levels = []
+        matches = set()
+        for score, doc_ids in candidates:
+            doc_ids = doc_ids - matches # copy, the index keeps changing after the lock is released
+            if doc_ids:
+                levels.append((score, doc_ids))
+                matches |= doc_ids
+        return levels, matches
+
+    def _top_documents(self, terms_levels : list, count : int) -> list:
+        """
+        Best `count` documents matching every term, by decreasing score then by id.
+
+        The score of a document is the sum of its score for each term, so
+        documents sharing a level in every term form a cell of equal score.
+        Cells are visited by decreasing score until enough documents are found.
+        """
+        def cell_score(position):
+            return sum(levels[index][0] for levels, index in zip(terms_levels, position))
+
+        start = (0,) * len(terms_levels)
+        heap = [(-cell_score(start), start)]
+        visited = {start}
+        output = []
+        tied = [] # documents of the cells sharing the current score
+        tied_score = None
+        while heap:
+            negative_score, position = heapq.heappop(heap)
+            if tied and negative_score != tied_score:
+                output.extend(heapq.nsmallest(count - len(output), set().union(*tied)))
+                tied = []
+                if len(output) >= count:
+                    break
+
+            doc_ids = set.intersection(*[levels[index][1] for levels, index in zip(terms_levels, position)])
+            if doc_ids:
+                tied.append(doc_ids)
+                tied_score = negative_score
+
+            for term_index, levels in enumerate(terms_levels):
+                if position[term_index] + 1 < len(levels):
+                    following = position[:term_index] + (position[term_index] + 1,) + position[term_index + 1:]
+                    if following not in visited:
+                        visited.add(following)
+                        heapq.heappush(heap, (-cell_score(following), following))
+
+        if tied:
+            output.extend(heapq.nsmallest(count - len(output), set().union(*tied)))
+        return output
+
+    def _matching_tokens(self, term : str) -> list:
+        if len(term) < MIN_PREFIX_LENGTH:
+            return [term] if term in self._postings else []
+
+        if self._vocabulary_stale:
+            self._vocabulary = sorted(self._postings)
+            self._vocabulary_stale = False
+        output = []
+        position = bisect.bisect_left(self._vocabulary, term)
+        while position < len(self._vocabulary) and self._vocabulary[position].startswith(term):
+            output.append(self._vocabulary[position])
+            position += 1
+        return output
+
+
+class InMemorySearchBackend:
+    """
+    Search backend keeping an InMemoryIndex of published products.
+
+    The index is loaded from the search documents on the first query and then
+    kept up to date by the product signals of the current process. It's meant
+    for development and tests; production uses PostgresSearchBackend.
+
+    Methods:
+        search(query : str, offset : int, limit : int) -> tuple
+        update(document : ProductSearchDocument)
+        remove(product_id : int)
+        reset()
+    """
+    def __init__(self):
+        self._index = None
+        self._lock = threading.Lock()
+
+    @property
+    def index(self) -> InMemoryIndex:
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    index = InMemoryIndex()
+                    documents = ProductSearchDocument.objects.filter(
+                        is_published=True
+                    ).values('product_id', 'title', 'keywords', 'body')
+                    for document in documents:
+                        index.add(document['product_id'], document)
+                    self._index = index
+        return self._index
+
+    def search(self, query : str, offset : int = 0, limit : int = 20) -> tuple:
+        return self.index.search(query, offset=offset, limit=limit)
+
+    def update(self, document : ProductSearchDocument) -> None:
+        if self._index is None:
+            return # loaded with the current documents on the first query
+        if document.is_published:
+            self._index.add(document.product_id, {field : getattr(document, field) for field in FIELD_WEIGHTS})
+        else:
+            self._index.remove(document.product_id)
+
+    def remove(self, product_id : int) -> None:
+        if self._index is not None:
+            self._index.remove(product_id)
+
+    def reset(self) -> None:
+        """ Drop the index, it's loaded again on the next query """
+        self._index = None
+
+
+class PostgresSearchBackend:
+    """
+    Search backend querying the search documents with PostgreSQL full-text search.
+
+    Documents are matched with the GIN expression index created by migration
+    0033 and ranked with ts_rank. The documents table is the index, so updates
+    need no extra work.
+
+    Methods:
+        search(query : str, offset : int, limit : int) -> tuple
+        update(document : ProductSearchDocument)
+        remove(product_id : int)
+        reset()
+    """
+    def search(self, query : str, offset : int = 0, limit : int = 20) -> tuple:
+        terms = parse_query(query)
+        if not terms:
+            return [], 0
+
+        tsquery = ' & '.join(
+            f'{term}:*' if len(term) >= MIN_PREFIX_LENGTH else term for term in terms
+        )
+        matches = ProductSearchDocument.objects.filter(is_published=True).alias(
+            matched=RawSQL(
+                f"({SEARCH_VECTOR_SQL}) @@ to_tsquery('simple', %s)",
+                [tsquery],
+                output_field=BooleanField()
+            )
+        ).filter(matched=True)
+        page = matches.annotate(
+            rank=RawSQL(
+                f"ts_rank({SEARCH_VECTOR_SQL}, to_tsquery('simple', %s))",
+                [tsquery],
+                output_field=FloatField()
+            )
+        ).order_by('-rank', 'product_id').values_list('product_id', flat=True)
+
+        return list(page[offset:offset + limit]), matches.count()
+
+    def update(self, document : ProductSearchDocument) -> None:
+        pass
+
+    def remove(self, product_id : int) -> None:
+        pass
+
+    def reset(self) -> None:
+        pass
+
+
+_backend = None
+
+def get_search_backend():
+    """
+    Search backend matching the database in use.
+
+    Returns:
+        PostgresSearchBackend | InMemorySearchBackend
+    """
+    global _backend
+    if _backend is None:
+        if connection.vendor == 'postgresql':
+            _backend = PostgresSearchBackend()
+        else:
+            _backend = InMemorySearchBackend()
+    return _backend
@@ -1,6 +1,31 @@
+from decimal import Decimal
+from decimal import InvalidOperation
 from django.urls import reverse
 from apps.products.models import Category
+from apps.products import cache as product_cache
 from apps.utils import get_full_image_url
+from apps.products.pagination import clean_page_size
+from apps.products.pagination import clean_page
+
+def parse_price(price) -> Decimal | None:
+    """
+    Parse a price sent by the client.
+
+    Returns:
+        Decimal : the price, None if no price was sent
+
+    Raises:
+        ValueError : if the price is not a positive number
+    """
+    if price is None or str(price).strip() == '':
+        return None
+    try:
+        output = Decimal(str(price).strip())
+    except InvalidOperation:
+        raise ValueError(f"Invalid price '{price}'")
+    if not output.is_finite() or output < 0:
+        raise ValueError(f"Invalid price '{price}'")
+    return output
 
 class ProductService:
     """
@@ -17,12 +42,21 @@ class ProductService:
             database interactions.
 
     Methods:
-        filter_products_by_category(category : str) :
-            Returns products filtered by the specified category
+        filter_products_by_category(category : str, cursor : str, page_size : int) :
+            Returns a page of products filtered by the specified category
         
-        list_products() :
-            Returns list of all active products
+        list_products(cursor : str, page_size : int) :
+            Returns a page of active products
+
+        search_products(query : str, page : int, page_size : int) :
+            Returns a page of products matching a full-text query
+
+        filter_variants(value_ids : list, min_price : str, max_price : str, page : int, page_size : int) :
+            Returns a page of variants matching attribute values and a price range, with facet counts
         
+        get_product_detail(slug : str) :
+            Returns the detail page data of a product, cached
+
         update_product_variant(request, sku : str):
             Returns product variant details with its attributes
         
@@ -33,60 +67,238 @@ class ProductService:
     def __init__(self, product_repo):
         self.repository = product_repo
     
-    def filter_products_by_category(self, category : str) -> list | str:
+    def filter_products_by_category(
+        self,
+        category : str,
+        cursor : str | None = None,
+        page_size = None
+        ) -> dict | str:
         """
-        Filter products belonging to a specific product.
+        Filter products belonging to a specific category, one page at a time.
 
         Args:
-            category (str): product category
+            category (str): product category, 'All' for every category
+            cursor (str, optional): next_cursor of the previous page
+            page_size (int, optional): number of products per page
 
         Returns:
-            list : list of products
+            dict : {
+                'products' : list of serialized products,
+                'next_cursor' : cursor of the next page or None
+            }
+            str : 'Error' if the category doesn't exist
+        
+        Raises:
+            ValueError : if the cursor is malformed
         """
-        if category == 'All':
-            products = self.repository.get_all_products()
-        else:
-            try:
-                products = self.repository.get_by_category(category)
-            except Category.DoesNotExist:
-                return 'Error'
+        try:
+            page = self.repository.get_listing_products(
+                None if category == 'All' else category,
+                cursor=cursor,
+                page_size=clean_page_size(page_size)
+            )
+        except Category.DoesNotExist:
+            return 'Error'
                     
-        product_data = []
-        for product in products:
-            product_data.append({
-                'id' : product.id,
-                'name' :  product.name,
-                'category' : product.category.name,
-                'stock' : product.stock,
-                'price' : product.price,
-                'old_price' : product.old_price,
-                'discount' : product.discount,
-                'image_url' : product.images.first().image.url,
-                'product-url' : f'{reverse('products')}{product.slug}'
+        product_data = [self.serialize_listing_product(product) for product in page['products']]
+        return {'products' : product_data, 'next_cursor' : page['next_cursor']}
+    
+    def search_products(self, query : str, page = None, page_size = None) -> dict:
+        """
+        Ranked full-text search over published products, one page at a time.
+
+        Args:
+            query (str): search query, matched against product names, categories,
+                variants, attribute values and descriptions
+            page (int, optional): page number, starting at 1
+            page_size (int, optional): number of products per page
+
+        Returns:
+            dict : {
+                'products' : list of serialized products by relevance,
+                'total' : number of matching products,
+                'page' : current page number,
+                'next_page' : number of the next page or None on the last page
+            }
+        """
+        page = clean_page(page)
+        page_size = clean_page_size(page_size)
+        results = self.repository.search_products(str(query or ''), page=page, page_size=page_size)
+        return {
+            'products' : [self.serialize_listing_product(product) for product in results['products']],
+            'total' : results['total'],
+            'page' : page,
+            'next_page' : page + 1 if page * page_size < results['total'] else None
+        }
+
+    def filter_variants(
+        self,
+        value_ids = (),
+        min_price = None,
+        max_price = None,
+        page = None,
+        page_size = None
+        ) -> dict:
+        """
+        Faceted navigation : variants matching attribute values and a price range.
+
+        Values of the same attribute are combined with OR, attributes and price
+        with AND. Each facet value carries the number of variants the result
+        would have if it were selected too.
+
+        Args:
+            value_ids (list, optional): selected attribute values primary keys
+            min_price (str, optional): lowest price, inclusive
+            max_price (str, optional): highest price, inclusive
+            page (int, optional): page number, starting at 1
+            page_size (int, optional): number of variants per page
+
+        Returns:
+            dict : {
+                'variants' : list of serialized variants by price,
+                'total' : number of matching variants,
+                'page' : current page number,
+                'next_page' : number of the next page or None on the last page,
+                'facets' : list of {'attribute', 'values' : [{'id', 'value', 'count', 'selected'}]},
+                'price_range' : {'min', 'max'} price of the matching variants
+                    whatever the price filter, None if no variant matches
+            }
+
+        Raises:
+            ValueError : if an attribute value or a price is invalid
+        """
+        selected = set()
+        for value_id in value_ids or ():
+            try:
+                selected.add(int(value_id))
+            except (TypeError, ValueError):
+                raise ValueError(f"Invalid attribute value '{value_id}'")
+        min_price, max_price = parse_price(min_price), parse_price(max_price)
+        if min_price is not None and max_price is not None and min_price > max_price:
+            raise ValueError('min_price must be lower than max_price')
+
+        page = clean_page(page)
+        page_size = clean_page_size(page_size)
+        result = self.repository.filter_variants(
+            selected,
+            min_price=min_price,
+            max_price=max_price,
+            page=page,
+            page_size=page_size
+        )
+        labels = result['labels']
+
+        variants = []
+        for variant in result['variants']:
+            variants.append({
+                'sku' : variant.sku,
+                'title' : variant.identifiant,
+                'product' : variant.product.name,
+                'price' : variant.price,
+                'old_price' : variant.old_price,
+                'stock' : variant.stock,
+                'attributes' : {
+                    labels[value_id][1] : labels[value_id][2]
+                    for value_id in sorted(result['variant_values'][variant.id])
+                },
+                'product-url' : f'{reverse('products')}{variant.product.slug}'
             })
 
-        return product_data
-    
-    def list_products(self) -> dict:
+        facets = {}
+        for attribute_id, counts in result['facets'].items():
+            values = [
+                {
+                    'id' : value_id,
+                    'value' : labels[value_id][2],
+                    'count' : count,
+                    'selected' : value_id in selected
+                }
+                for value_id, count in counts.items()
+            ]
+            facets[attribute_id] = {
+                'attribute' : labels[next(iter(counts))][1],
+                'values' : sorted(values, key=lambda value : (value['value'], value['id']))
+            }
+
+        price_range = result['price_range']
+        return {
+            'variants' : variants,
+            'total' : result['total'],
+            'page' : page,
+            'next_page' : page + 1 if page * page_size < result['total'] else None,
+            'facets' : sorted(facets.values(), key=lambda facet : facet['attribute']),
+            'price_range' : {'min' : price_range[0], 'max' : price_range[1]} if price_range else None
+        }
+
+    def serialize_listing_product(self, product) -> dict:
         """
-        List of all active products inside database with all categories
+        JSON representation of a product of the listing read-model.
+
+        Args:
+            product (Product): product returned by get_listing_products or search_products
+
+        Returns:
+            dict : product data displayed by the product cards
+        """
+        return {
+            'id' : product.id,
+            'name' :  product.name,
+            'category' : product.category.name,
+            'stock' : product.stock,
+            'price' : product.price,
+            'old_price' : product.old_price,
+            'discount' : product.discount,
+            'image_url' : product.featured_image_url,
+            'product-url' : f'{reverse('products')}{product.slug}'
+        }
+
+    def list_products(self, cursor : str | None = None, page_size = None) -> dict:
+        """
+        One page of active products inside database with all categories
+
+        Args:
+            cursor (str, optional): next_cursor of the previous page
+            page_size (int, optional): number of products per page
 
         Returns:
             dict with the following format : 
                 {
-                    'products' : list of all products,
-                    'categories' : list of all categories 
+                    'products' : list of products of the page,
+                    'categories' : list of all categories,
+                    'next_cursor' : cursor of the next page or None,
+                    'page_size' : number of products per page
                 }
+
+        Raises:
+            ValueError : if the cursor is malformed
         """
-        products = self.repository.get_all_products()
+        page_size = clean_page_size(page_size)
+        page = self.repository.get_listing_products(cursor=cursor, page_size=page_size)
         categories = self.repository.get_all_category()
         data = {
-            'products' : products,
-            'categories' : categories
+            'products' : page['products'],
+            'categories' : categories,
+            'next_cursor' : page['next_cursor'],
+            'page_size' : page_size
         }
 
         return data
 
+    def get_product_detail(self, slug : str) -> dict:
+        """
+        Product detail page data, served from the versioned cache (see apps/products/cache.py).
+
+        Args:
+            slug (str): product slug
+
+        Returns:
+            dict : product detail read-model
+
+        Raises:
+            Product.DoesNotExist : if there is no product with this slug
+        """
+        return product_cache.get_product_detail(slug, self.repository.get_product_detail)
+
     def calculate_discount(self, product : object) -> float:
         """
         Calculate product discount
@@ -100,44 +312,49 @@ class ProductService:
         output = 100 - (product.price * 100) / product.old_price
         return output 
 
+    def get_variant_payloads(self, product_id : int) -> dict:
+        """
+        Variant picker payloads of a product, served from the versioned cache.
+
+        Args:
+            product_id (int): primary key of the product
+
+        Returns:
+            dict : {sku : payload} for the base product and each of its variants
+        """
+        return product_cache.get_variant_payloads(product_id, self.repository.get_variant_payloads)
+
     def update_product_variant(self, sku : str) -> dict:
         """
         Update product detail page with selected product.
         Show additional attributes for variant.
 
+        Payloads are precomputed for the whole product and cached, a warm
+        variant switch doesn't touch the database.
+
         Args:
             sku (str): product sku
 
         Returns:
             dict : products informations
+
+        Raises:
+            ValueError : if there is no product with this sku
         """
-        product_dict = self.repository.get_by_sku(sku)
-        product_variant = product_dict['product']
-        if product_dict['product_type'] == 'variant':
-            variant_images = self.repository.get_product_image(sku)
-            attributes = self.repository.get_variant_attribute(product_variant)
-        
-            full_image_url = variant_images    
-            data = {
-                'product_type' : 'variant',
-                'title' : str(product_variant),
-                'price' : product_variant.price,
-                'stock' : product_variant.stock,
-                'old_price' : product_variant.old_price,
-                'attributes' : attributes,
-                'image' : full_image_url
-            }
-            
-        else:
-            product = product_variant
-            data = {
-                'product_type' : 'base',
-                'title' : product.name,
-                'price' : product.price,
-                'stock' : product.stock,
-                'old_price' : product.old_price,
-                'image' : self.repository.get_product_image(sku)
-            }
+        sku = str(sku).strip()
+        product_id = product_cache.get_sku_product(sku)
+        if product_id is not None:
+            payload = self.get_variant_payloads(product_id).get(sku)
+            if payload is not None:
+                return dict(payload)
 
-        return data
+        product_dict = self.repository.get_by_sku(sku)
+        product = product_dict['product']
+        product_id = product.product_id if product_dict['product_type'] == 'variant' else product.id
+        product_cache.set_sku_product(sku, product_id)
+        payload = self.get_variant_payloads(product_id).get(sku)
+        if payload is None:
+            # the sku was added after the cached payloads, their invalidation is pending
+            payload = self.repository.get_variant_payloads(product_id)[sku]
+        return dict(payload)
             
\ No newline at end of file
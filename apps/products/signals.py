@@ -0,0 +1,142 @@
+from django.db.models.signals import post_save
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from .models import (
+    Attribute,
+    AttributeValue,
+    Category,
+    Product,
+    ProductImage,
+    ProductVariant,
+    SkuRegistry,
+    VariantImage,
+    VariantAttribute
+)
+from .search import index_product
+from .search import get_search_backend
+from .cache import record_facet_change
+from .cache import invalidate_products
+
+@receiver(post_save, sender=Product)
+def register_product_sku(sender, instance, **kwargs):
+    """ Keep the SKU registry entry of a base product in sync with its SKU """
+    SkuRegistry.objects.update_or_create(
+        product=instance,
+        defaults={'sku' : instance.sku, 'product_type' : 'base'}
+    )
+
+@receiver(post_save, sender=ProductVariant)
+def register_variant_sku(sender, instance, **kwargs):
+    """ Keep the SKU registry entry of a variant in sync with its SKU """
+    SkuRegistry.objects.update_or_create(
+        variant=instance,
+        defaults={'sku' : instance.sku, 'product_type' : 'variant'}
+    )
+
+### Search index ###
+
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance, **kwargs):
+    """ Rebuild the search document of a saved product """
+    index_product(instance)
+
+@receiver(post_delete, sender=Product)
+def unindex_deleted_product(sender, instance, **kwargs):
+    """ Remove a deleted product from the search backend, its document is deleted in cascade """
+    get_search_backend().remove(instance.pk)
+
+def reindex_products(products, create : bool) -> None:
+    """ Rebuild the search documents of products reached through a related object """
+    for product in products.select_related('category'):
+        index_product(product, create=create)
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def index_variant_product(sender, instance, signal, **kwargs):
+    """ Variant names are part of the search document of their product """
+    reindex_products(
+        Product.objects.filter(pk=instance.product_id),
+        create=signal is post_save
+    )
+
+@receiver(post_save, sender=VariantAttribute)
+@receiver(post_delete, sender=VariantAttribute)
+def index_attribute_product(sender, instance, signal, **kwargs):
+    """ Attribute values are part of the search document of the variant's product """
+    reindex_products(
+        Product.objects.filter(variants=instance.variant_id),
+        create=signal is post_save
+    )
+
+@receiver(post_save, sender=Category)
+def index_category_products(sender, instance, created, **kwargs):
+    """ Category names are part of the search documents of their products """
+    if not created:
+        reindex_products(instance.products.all(), create=True)
+
+### Facet index ###
+
+@receiver(post_save, sender=Product)
+def record_product_facets(sender, instance, **kwargs):
+    """ Variants of a product are only indexed while it's published """
+    record_facet_change(variant_ids=instance.variants.values_list('id', flat=True))
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def record_variant_facets(sender, instance, **kwargs):
+    """ Variants of a deleted product are deleted in cascade, one by one """
+    record_facet_change(variant_ids=[instance.pk])
+
+@receiver(post_save, sender=VariantAttribute)
+@receiver(post_delete, sender=VariantAttribute)
+def record_variant_attribute_facets(sender, instance, **kwargs):
+    record_facet_change(variant_ids=[instance.variant_id])
+
+@receiver(post_save, sender=AttributeValue)
+@receiver(post_delete, sender=AttributeValue)
+def record_value_facets(sender, instance, **kwargs):
+    record_facet_change(value_ids=[instance.pk])
+
+@receiver(post_save, sender=Attribute)
+def record_attribute_facets(sender, instance, created, **kwargs):
+    """ The attribute name is part of the label of its values """
+    if not created:
+        record_facet_change(value_ids=instance.values.values_list('id', flat=True))
+
+### Product detail cache ###
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_detail(sender, instance, **kwargs):
+    invalidate_products([instance.pk])
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def invalidate_product_detail_of_related(sender, instance, **kwargs):
+    """ Variants and images belong to the detail page of their product """
+    invalidate_products([instance.product_id])
+
+@receiver(post_save, sender=VariantAttribute)
+@receiver(post_delete, sender=VariantAttribute)
+@receiver(post_save, sender=VariantImage)
+@receiver(post_delete, sender=VariantImage)
+def invalidate_product_detail_of_variant(sender, instance, **kwargs):
+    """ Attributes and images of a variant belong to the detail page of its product """
+    invalidate_products(
+        ProductVariant.objects.filter(pk=instance.variant_id).values_list('product_id', flat=True)
+    )
+
+@receiver(post_save, sender=Category)
+def invalidate_product_detail_of_category(sender, instance, created, **kwargs):
+    """ The category name is displayed on the detail page """
+    if not created:
+        invalidate_products(instance.products.values_list('id', flat=True))
+
+@receiver(post_save, sender=AttributeValue)
+def invalidate_product_detail_of_value(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_products(
+            ProductVariant.objects.filter(attributes__value=instance).values_list('product_id', flat=True)
+        )
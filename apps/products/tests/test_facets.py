@@ -0,0 +1,291 @@
+import os
+import json
+import random
+import time
+import pytest
+from decimal import Decimal
+from django.urls import reverse
+from apps.container import container
+from apps.conftest import pytestmark
+from apps.factories import (
+    ProductFactory,
+    ProductVariantFactory,
+    AttributeFactory,
+    AttributeValueFactory,
+    VariantAttributeFactory,
+    CategoryFactory
+)
+from django.core.cache import cache
+from apps.products.cache import FACET_SEQUENCE_KEY
+from apps.products.cache import current_facet_position
+from apps.products.cache import facet_change_key
+from apps.products.cache import record_facet_change
+from apps.products.facets import FacetIndex
+from apps.products.models import ProductVariant
+from apps.products.facets import to_bitmap
+from apps.products.facets import from_bitmap
+
+@pytest.fixture
+def facet_catalog():
+    """
+    Variants of two products :
+        - 'Red S' (10$), 'Red XL' (20$), 'Blue S' (30$) of a published product
+        - 'Blue XL' (40$) of a draft product
+    """
+    category = CategoryFactory(name='Clothe', slug='clothe')
+    color, size = AttributeFactory(name='Color'), AttributeFactory(name='Size')
+    values = {
+        'Red' : AttributeValueFactory(attribute=color, value='Red'),
+        'Blue' : AttributeValueFactory(attribute=color, value='Blue'),
+        'S' : AttributeValueFactory(attribute=size, value='S'),
+        'XL' : AttributeValueFactory(attribute=size, value='XL'),
+    }
+    published = ProductFactory(name='Hoodie', category=category, status='published')
+    draft = ProductFactory(name='Jacket', category=category, status='draft')
+    variants = {}
+    for product, color_name, size_name, price in [
+        (published, 'Red', 'S', 10),
+        (published, 'Red', 'XL', 20),
+        (published, 'Blue', 'S', 30),
+        (draft, 'Blue', 'XL', 40),
+    ]:
+        variant = ProductVariantFactory(product=product, identifiant=f'{color_name} {size_name}', price=price)
+        VariantAttributeFactory(variant=variant, attribute=color, value=values[color_name])
+        VariantAttributeFactory(variant=variant, attribute=size, value=values[size_name])
+        variants[variant.identifiant] = variant
+    return {'values' : values, 'variants' : variants, 'draft' : draft}
+
+def facet_counts(result):
+    """ {attribute : {value : count}} of a filter_variants result """
+    return {
+        facet['attribute'] : {value['value'] : value['count'] for value in facet['values']}
+        for facet in result['facets']
+    }
+
+def value_ids(facet_catalog, *names):
+    return [facet_catalog['values'][name].id for name in names]
+
+class TestFacetIndex:
+    @pytest.fixture
+    def index(self):
+        index = FacetIndex()
+        index.set_label(1, 1, 'Color', 'Red')
+        index.set_label(2, 1, 'Color', 'Blue')
+        index.set_label(3, 2, 'Size', 'S')
+        index.put_many([(10, Decimal('5'), [1, 3]), (11, Decimal('15'), [2, 3])])
+        index.put(12, Decimal('25'), [2])
+        return index
+
+    def test_bitmaps(self):
+        assert to_bitmap([0, 3, 9]) == 0b1000001001
+        assert from_bitmap(0b1000001001) == [0, 3, 9]
+        assert (to_bitmap([]), from_bitmap(0)) == (0, [])
+
+    def test_query_all(self, index):
+        result = index.query()
+        assert (result['variant_ids'], result['total']) == ([10, 11, 12], 3)
+        assert result['facets'] == {1 : {1 : 1, 2 : 2}, 2 : {3 : 2}}
+        assert result['price_range'] == (Decimal('5'), Decimal('25'))
+
+    def test_query_disjunctive_counts(self, index):
+        result = index.query([2])
+        assert result['variant_ids'] == [11, 12]
+        # Color counts ignore the selected color, Size counts follow it
+        assert result['facets'] == {1 : {1 : 1, 2 : 2}, 2 : {3 : 1}}
+
+    def test_query_price_range(self, index):
+        result = index.query(min_price=Decimal('10'), max_price=Decimal('25'))
+        assert result['variant_ids'] == [11, 12]
+        assert result['price_range'] == (Decimal('5'), Decimal('25'))
+        assert index.query(min_price=Decimal('30'))['total'] == 0
+
+    def test_query_page(self, index):
+        assert index.query(offset=1, limit=1)['variant_ids'] == [11]
+
+    def test_query_unknown_value(self, index):
+        with pytest.raises(ValueError) as exc_info:
+            index.query([99])
+        assert str(exc_info.value) == "Unknown attribute value '99'"
+
+    def test_put_replaces_and_remove(self, index):
+        index.put(10, Decimal('50'), [2])
+        assert index.query([1])['total'] == 0
+        assert index.query()['variant_ids'] == [11, 12, 10]
+        index.remove(10)
+        index.remove(99)
+        assert len(index) == 2
+
+class TestFilterVariantsService:
+    def test_filter_variants_all(self, facet_catalog):
+        result = container.product_service.filter_variants()
+        assert [variant['title'] for variant in result['variants']] == ['Red S', 'Red XL', 'Blue S']
+        assert result['variants'][0]['attributes'] == {'Color' : 'Red', 'Size' : 'S'}
+        assert facet_counts(result) == {'Color' : {'Blue' : 1, 'Red' : 2}, 'Size' : {'S' : 2, 'XL' : 1}}
+        assert result['price_range'] == {'min' : Decimal('10'), 'max' : Decimal('30')}
+
+    def test_filter_variants_by_values(self, facet_catalog):
+        result = container.product_service.filter_variants(value_ids(facet_catalog, 'Red', 'Blue', 'S'))
+        assert [variant['title'] for variant in result['variants']] == ['Red S', 'Blue S']
+        assert facet_counts(result) == {'Color' : {'Blue' : 1, 'Red' : 1}, 'Size' : {'S' : 2, 'XL' : 1}}
+        assert all(value['selected'] for value in result['facets'][0]['values'])
+
+    def test_filter_variants_by_price(self, facet_catalog):
+        result = container.product_service.filter_variants(min_price='15', max_price='30')
+        assert [variant['title'] for variant in result['variants']] == ['Red XL', 'Blue S']
+        assert result['price_range'] == {'min' : Decimal('10'), 'max' : Decimal('30')}
+
+    def test_filter_variants_pages(self, facet_catalog):
+        first = container.product_service.filter_variants(page_size=2)
+        last = container.product_service.filter_variants(page=2, page_size=2)
+        assert (first['total'], first['next_page']) == (3, 2)
+        assert [variant['title'] for variant in last['variants']] == ['Blue S']
+        assert last['next_page'] is None
+
+    @pytest.mark.parametrize('params, message', [
+        ({'value_ids' : ['abc']}, "Invalid attribute value 'abc'"),
+        ({'value_ids' : ['0']}, "Unknown attribute value '0'"),
+        ({'min_price' : 'cheap'}, "Invalid price 'cheap'"),
+        ({'min_price' : '-1'}, "Invalid price '-1'"),
+        ({'min_price' : '20', 'max_price' : '10'}, 'min_price must be lower than max_price'),
+    ])
+    def test_filter_variants_invalid(self, facet_catalog, params, message):
+        with pytest.raises(ValueError) as exc_info:
+            container.product_service.filter_variants(**params)
+        assert str(exc_info.value) == message
+
+    def test_filter_variants_single_query(self, django_assert_num_queries, facet_catalog):
+        container.product_service.filter_variants()
+        with django_assert_num_queries(1):
+            container.product_service.filter_variants(value_ids(facet_catalog, 'XL'), min_price='5')
+
+class TestFacetIndexUpdates:
+    def test_index_follows_price_and_attributes(self, mocker, django_capture_on_commit_callbacks, facet_index, facet_catalog):
+        container.product_service.filter_variants() # load the index
+        load = mocker.spy(facet_index, '_load')
+        red_s = facet_catalog['variants']['Red S']
+        with django_capture_on_commit_callbacks(execute=True):
+            red_s.price = 35
+            red_s.save()
+            red_s.attributes.filter(attribute__name='Size').delete()
+        result = container.product_service.filter_variants()
+        assert [variant['title'] for variant in result['variants']] == ['Red XL', 'Blue S', 'Red S']
+        assert facet_counts(result)['Size'] == {'S' : 1, 'XL' : 1}
+        assert load.call_count == 0 # changes replayed, catalog not read again
+
+    def test_replay_reads_changed_variants(self, django_assert_num_queries, django_capture_on_commit_callbacks, facet_index, facet_catalog):
+        facet_index.index
+        with django_capture_on_commit_callbacks(execute=True):
+            record_facet_change(variant_ids=[facet_catalog['variants']['Red S'].pk])
+        # attribute values of the variant and its price, whatever the size of the catalog
+        with django_assert_num_queries(2):
+            facet_index.index
+
+    def test_index_follows_product_status(self, mocker, django_capture_on_commit_callbacks, facet_index, facet_catalog):
+        container.product_service.filter_variants()
+        load = mocker.spy(facet_index, '_load')
+        draft = facet_catalog['draft']
+        with django_capture_on_commit_callbacks(execute=True):
+            draft.status = 'published'
+            draft.save()
+        assert container.product_service.filter_variants()['total'] == 4
+        with django_capture_on_commit_callbacks(execute=True):
+            draft.delete()
+        assert container.product_service.filter_variants()['total'] == 3
+        assert load.call_count == 0
+
+    def test_index_follows_renamed_values(self, django_capture_on_commit_callbacks, facet_catalog):
+        container.product_service.filter_variants()
+        red = facet_catalog['values']['Red']
+        with django_capture_on_commit_callbacks(execute=True):
+            red.value = 'Crimson'
+            red.save()
+            red.attribute.name = 'Colour'
+            red.attribute.save()
+        assert facet_counts(container.product_service.filter_variants())['Colour'] == {'Blue' : 1, 'Crimson' : 2}
+
+    def test_uncommitted_change_not_indexed(self, django_capture_on_commit_callbacks, facet_catalog):
+        container.product_service.filter_variants()
+        draft = facet_catalog['draft']
+        with django_capture_on_commit_callbacks(execute=False): # rolled back
+            draft.status = 'published'
+            draft.save()
+        assert container.product_service.filter_variants()['total'] == 3
+
+    def test_change_of_another_process(self, django_capture_on_commit_callbacks, facet_catalog):
+        container.product_service.filter_variants()
+        red_s = facet_catalog['variants']['Red S'].pk
+        with django_capture_on_commit_callbacks(execute=True):
+            ProductVariant.objects.filter(pk=red_s).update(price=35) # no signal here
+            record_facet_change(variant_ids=[red_s]) # recorded by the other process
+        result = container.product_service.filter_variants()
+        assert [variant['title'] for variant in result['variants']] == ['Red XL', 'Blue S', 'Red S']
+
+    @pytest.mark.parametrize('behind', ['too_far', 'missing_change', 'new_epoch'])
+    def test_load_when_behind(self, mocker, django_capture_on_commit_callbacks, facet_index, facet_catalog, behind):
+        facet_index.index
+        with django_capture_on_commit_callbacks(execute=True):
+            record_facet_change(variant_ids=[facet_catalog['variants']['Red S'].pk])
+            record_facet_change(variant_ids=[facet_catalog['variants']['Red XL'].pk])
+        epoch, sequence = current_facet_position()
+        if behind == 'too_far':
+            mocker.patch.object(facet_index, 'MAX_REPLAYED_CHANGES', 1)
+        elif behind == 'missing_change':
+            cache.delete(facet_change_key(epoch, sequence)) # evicted
+        else:
+            cache.delete(FACET_SEQUENCE_KEY) # evicted, the next change starts a new epoch
+            with django_capture_on_commit_callbacks(execute=True):
+                record_facet_change(variant_ids=[facet_catalog['variants']['Blue S'].pk])
+        load = mocker.spy(facet_index, '_load')
+        assert len(facet_index.index) == 3
+        assert load.call_count == 1
+
+class TestFacetView:
+    def test_filter_facets_view(self, client, facet_catalog):
+        response = client.get(reverse('filter-facets'), {'value' : value_ids(facet_catalog, 'XL')})
+        json_response = json.loads(response.content.decode())
+        assert response.status_code == 200
+        assert json_response['total'] == 1
+        assert json_response['variants'][0]['title'] == 'Red XL'
+
+    def test_filter_facets_view_invalid(self, client, facet_catalog):
+        response = client.get(reverse('filter-facets'), {'value' : 'abc'})
+        json_response = json.loads(response.content.decode())
+        assert response.status_code == 400
+        assert json_response['message'] == "Invalid attribute value 'abc'"
+
+@pytest.mark.skipif(
+    not os.getenv('FACET_BENCHMARK'),
+    reason='benchmark, run with FACET_BENCHMARK=1'
+)
+def test_facet_latency_benchmark():
+    """
+    p95 latency of facet queries over 100k variants with 5 attributes of 20 values.
+
+    Run with : FACET_BENCHMARK=1 pytest apps/products/tests/test_facets.py -k benchmark -s
+    """
+    catalog_size = int(os.getenv('FACET_BENCHMARK_SIZE', 100_000))
+    randomizer = random.Random(42)
+    index = FacetIndex()
+    for attribute_id in range(5):
+        for value in range(20):
+            index.set_label(attribute_id * 20 + value, attribute_id, f'Attribute {attribute_id}', f'Value {value}')
+    index.put_many(
+        (
+            variant_id,
+            Decimal(randomizer.randint(100, 100_000)) / 100,
+            [attribute_id * 20 + randomizer.randrange(20) for attribute_id in range(5)]
+        )
+        for variant_id in range(catalog_size)
+    )
+
+    latencies = []
+    for _ in range(300):
+        selected = randomizer.sample(range(100), randomizer.randint(0, 4))
+        low, high = sorted(Decimal(randomizer.randint(1, 1000)) for _ in range(2))
+        start = time.perf_counter()
+        index.query(selected, min_price=low if randomizer.random() < 0.5 else None, max_price=high)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000
+    print(f'\n{catalog_size} variants, {len(latencies)} queries : p95 = {p95:.2f} ms, max = {latencies[-1] * 1000:.2f} ms')
+    assert p95 < 50
@@ -0,0 +1,67 @@
+import pytest
+from django.db import connection
+from apps.conftest import pytestmark
+from apps.container import container
+from apps.products.models import Category
+from apps.products.models import Product
+from apps.products.models import ProductImage
+from apps.query_plans import assert_no_full_scans
+from apps.query_plans import sorts
+
+PRODUCTS = 2000 # enough for the planner to prefer the indexes over a scan
+DISCOUNTS = 20 # distinct discounts, each shared by many products
+
+@pytest.fixture
+def seeded():
+    """ Catalog filled like in production : many products per discount, a few drafts """
+    category = Category.objects.create(name='Seed')
+    products = Product.objects.bulk_create([
+        Product(
+            name=f'Seed {index}', slug=f'seed-{index}', sku=f'SKU-SEED-{index:05}', category=category,
+            price=10, old_price=20, discount=index % DISCOUNTS * 5,
+            status='draft' if index % 20 == 0 else 'published'
+        )
+        for index in range(PRODUCTS)
+    ])
+    ProductImage.objects.bulk_create([
+        ProductImage(product=product, image=f'products/{product.slug}.jpg', is_featured=index % 2 == 0)
+        for index, product in enumerate(products) for _ in range(2)
+    ])
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    return products
+
+def test_sort_detected(seeded):
+    assert sorts("SELECT * FROM products_product WHERE status = 'published' ORDER BY price")
+    assert not sorts("SELECT * FROM products_product WHERE status = 'published' ORDER BY discount DESC, id")
+    assert not sorts("UPDATE products_product SET stock = 1 WHERE id = 1")
+
+def test_assert_no_full_scans_fails_on_sort(seeded):
+    with pytest.raises(AssertionError, match='rows sorted'):
+        with assert_no_full_scans(allow_sorts=False):
+            list(Product.objects.filter(status='published').order_by('price')[:24])
+
+class TestListingPlans:
+    # the seed has a single category, read whole like any one-row table
+    IGNORED = ('products_category',)
+
+    def test_pages(self, seeded):
+        with assert_no_full_scans(ignore=self.IGNORED, allow_sorts=False) as queries:
+            page = container.product_repo.get_listing_products()
+            for _ in range(PRODUCTS // 24 // 2):
+                page = container.product_repo.get_listing_products(cursor=page['next_cursor'])
+        # a page ending on the last product of a discount reads the lower discounts too
+        assert len(queries) < 2 * (PRODUCTS // 24 // 2) + 1
+
+    def test_pages_cover_listing(self, seeded):
+        expected = list(
+            Product.objects.filter(status='published').order_by('-discount', 'id').values_list('id', flat=True)
+        )
+        seen, cursor = [], None
+        while True:
+            page = container.product_repo.get_listing_products(cursor=cursor, page_size=30)
+            seen += [product.id for product in page['products']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        assert seen == expected
@@ -3,7 +3,8 @@ from apps.products.models import (
     Category, 
     Product, 
     ProductVariant, 
-    VariantImage
+    VariantImage,
+    SkuRegistry
 )
 from apps.conftest import(
     sample_products,
@@ -13,6 +14,12 @@ from apps.conftest import(
     variant_sku,
     pytestmark
 )
+from apps.factories import (
+    ProductImageFactory,
+    ProductVariantFactory,
+    AttributeFactory,
+    VariantAttributeFactory
+)
 from django.db.models import QuerySet
 from apps.container import container
 @pytest.mark.django_db
@@ -94,4 +101,130 @@ class TestProductRepository:
     def test_get_variant_image(self, variant_sku, variant_product):
         result = container.product_repo.get_product_image(variant_sku)
         assert result == VariantImage.objects.filter(variant=variant_product)[0].image.url
-    
\ No newline at end of file
+    
+@pytest.mark.django_db
+class TestSkuRegistry:
+    def test_get_by_sku_single_query(self, django_assert_num_queries, sku, product, variant_sku, variant_product):
+        with django_assert_num_queries(1):
+            base = container.product_repo.get_by_sku(sku)
+            base['product'].category.name
+        with django_assert_num_queries(1):
+            variant = container.product_repo.get_by_sku(variant_sku)
+            variant['product'].product.category
+        assert base == {'product_type':'base', 'product':product}
+        assert variant == {'product_type':'variant', 'product':variant_product}
+
+    def test_get_many_by_sku(self, django_assert_num_queries, sku, product, variant_sku, variant_product):
+        with django_assert_num_queries(1):
+            result = container.product_repo.get_many_by_sku([sku, variant_sku, 'invalid_sku'])
+        assert set(result.keys()) == {sku, variant_sku}
+        assert result[sku]['product_type'] == 'base'
+        assert result[sku]['product'] == product
+        assert result[variant_sku]['product_type'] == 'variant'
+        assert result[variant_sku]['product'] == variant_product
+
+    def test_get_many_by_sku_empty(self, django_assert_num_queries):
+        with django_assert_num_queries(0):
+            assert container.product_repo.get_many_by_sku([]) == {}
+
+    def test_get_stock_snapshot(self, django_assert_num_queries, sku, product, variant_sku, variant_product):
+        with django_assert_num_queries(1):
+            result = container.product_repo.get_stock_snapshot([sku, variant_sku, 'invalid_sku'])
+        assert set(result.keys()) == {sku, variant_sku}
+        assert result[sku] == {
+            'sku' : sku, 'product_type' : 'base', 'variant_id' : None, 'product_id' : product.id,
+            'title' : 'Blue Jeans', 'price' : product.price, 'old_price' : product.old_price,
+            'discount' : product.discount, 'stock' : 12, 'status' : 'published'
+        }
+        variant = result[variant_sku]
+        assert (variant['product_id'], variant['variant_id'], variant['title']) == (
+            variant_product.product_id, variant_product.id, 'Red T-Shirt Coton'
+        )
+        assert (variant['stock'], variant['status']) == (variant_product.stock, variant_product.product.status)
+
+    def test_registry_follows_sku_update(self, sku, product):
+        product.sku = 'SKU-RENAMED1'
+        product.save()
+        assert container.product_repo.get_by_sku('SKU-RENAMED1')['product'] == product
+        with pytest.raises(ValueError):
+            container.product_repo.get_by_sku(sku)
+        assert SkuRegistry.objects.filter(product=product).count() == 1
+
+    def test_registry_follows_delete(self, variant_sku, variant_product):
+        variant_product.delete()
+        with pytest.raises(ValueError):
+            container.product_repo.get_by_sku(variant_sku)
+        assert not SkuRegistry.objects.filter(sku=variant_sku).exists()
+
+@pytest.mark.django_db
+class TestListingReadModel:
+    def test_get_listing_products(self, django_assert_num_queries, sample_products):
+        with django_assert_num_queries(1):
+            products = container.product_repo.get_listing_products()['products']
+            for product in products:
+                product.category.name
+        assert len(products) == 5
+        for product in products:
+            assert product.featured_image_url == product.images.first().image.url
+
+    def test_get_listing_products_featured_first(self, product):
+        featured = ProductImageFactory(product=product, is_featured=True)
+        listed = container.product_repo.get_listing_products()['products'][0]
+        assert listed.featured_image_url == featured.image.url
+
+    def test_get_listing_products_by_category(self, sample_products):
+        products = container.product_repo.get_listing_products('Food')['products']
+        assert [product.name for product in products] == ['Yogurt', 'Red Velvet Cake']
+        with pytest.raises(Category.DoesNotExist):
+            container.product_repo.get_listing_products('unknown')
+
+    def test_get_all_category_without_products(self, django_assert_num_queries, sample_products):
+        with django_assert_num_queries(1):
+            names = [category.name for category in container.product_repo.get_all_category()]
+        assert sorted(names) == ['Clothe', 'Food', 'High-Tech']
+
+    def test_get_listing_products_keyset_pages(self, sample_products):
+        for product, old_price in zip(sample_products, [0, 50, 50, 0, 2000]):
+            product.old_price = old_price
+            product.save()
+        expected = [
+            product.id for product in sorted(
+                Product.objects.all(),
+                key=lambda product: (-product.discount, product.id)
+            )
+        ]
+        seen, cursor = [], None
+        while True:
+            page = container.product_repo.get_listing_products(cursor=cursor, page_size=2)
+            seen += [product.id for product in page['products']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        assert seen == expected
+
+    def test_get_listing_products_invalid_cursor(self, sample_products):
+        with pytest.raises(ValueError) as exc_info:
+            container.product_repo.get_listing_products(cursor='%%%')
+        assert "Invalid cursor '%%%'" == str(exc_info.value)
+
+@pytest.mark.django_db
+class TestVariantAttributesMap:
+    def test_get_variant_attributes_map(self, variant_product, product):
+        bare_variant = ProductVariantFactory(product=product)
+        result = container.product_repo.get_variant_attributes_map([variant_product.id, bare_variant.id])
+        assert result == {
+            variant_product.id : {'Color':'Red', 'Size':'XL', 'Material':'Coton'},
+            bare_variant.id : {}
+        }
+        assert container.product_repo.get_variant_attributes_map([]) == {}
+
+    @pytest.mark.parametrize('variant_count', [1, 50])
+    def test_get_variant_attributes_map_single_query(self, django_assert_num_queries, product, variant_count):
+        attributes = [AttributeFactory(name='Color'), AttributeFactory(name='Size')]
+        variants = ProductVariantFactory.create_batch(variant_count, product=product)
+        for variant in variants:
+            for attribute in attributes:
+                VariantAttributeFactory(variant=variant, attribute=attribute, value__attribute=attribute)
+        with django_assert_num_queries(1):
+            result = container.product_repo.get_variant_attributes_map([variant.id for variant in variants])
+        assert all(len(attributes) == 2 for attributes in result.values())
@@ -0,0 +1,200 @@
+import os
+import itertools
+import json
+import random
+import time
+import pytest
+from django.urls import reverse
+from apps.container import container
+from apps.conftest import (
+    product,
+    variant_product,
+    sku,
+    variant_sku,
+    sample_products,
+    pytestmark
+)
+from apps.factories import (
+    ProductFactory,
+    ProductVariantFactory,
+    CategoryFactory
+)
+from apps.products.models import ProductSearchDocument
+from apps.products.search import InMemoryIndex
+from apps.products.search import tokenize
+
+def search_names(query, **kwargs):
+    results = container.product_service.search_products(query, **kwargs)
+    return [item['name'] for item in results['products']]
+
+class TestInMemoryIndex:
+    @pytest.fixture
+    def index(self):
+        index = InMemoryIndex()
+        index.add(1, {'title' : 'Laptop Lenovo', 'keywords' : 'High-Tech', 'body' : 'A light laptop'})
+        index.add(2, {'title' : 'Laptop bag', 'keywords' : 'Accessories', 'body' : ''})
+        index.add(3, {'title' : 'Black Jeans', 'keywords' : 'Clothe', 'body' : 'Fits any laptop bag'})
+        return index
+
+    def test_tokenize(self):
+        assert tokenize('T-Shirt, Coton_100%') == ['t', 'shirt', 'coton', '100']
+        assert tokenize(None) == []
+
+    def test_prefix_match(self, index):
+        assert index.search('lap')[0] == [1, 2, 3]
+        assert index.search('LENO') == ([1], 1)
+
+    def test_every_term_must_match(self, index):
+        assert index.search('laptop bag') == ([2, 3], 2)
+        assert index.search('laptop unknown') == ([], 0)
+
+    def test_title_ranks_above_body(self, index):
+        ids, _ = index.search('jeans laptop')
+        assert ids == [3]
+        assert index.search('laptop')[0][-1] == 3
+
+    def test_exact_match_ranks_above_prefix(self):
+        index = InMemoryIndex()
+        index.add(1, {'title' : 'Cakes'})
+        index.add(2, {'title' : 'Cake'})
+        assert index.search('cake')[0] == [2, 1]
+
+    def test_single_character_terms_match_exactly(self, index):
+        index.add(4, {'title' : 'T-Shirt'})
+        assert index.search('t')[0] == [4]
+
+    def test_pagination(self, index):
+        assert index.search('lap', offset=0, limit=2) == ([1, 2], 3)
+        assert index.search('lap', offset=2, limit=2) == ([3], 3)
+
+    def test_reindex_and_remove(self, index):
+        index.add(2, {'title' : 'Backpack'})
+        assert index.search('laptop')[0] == [1, 3]
+        index.remove(1)
+        index.remove(99)
+        assert index.search('laptop')[0] == [3]
+        assert len(index) == 2
+
+class TestSearchDocuments:
+    def test_document_created_with_product(self, variant_product):
+        document = ProductSearchDocument.objects.get(product=variant_product.product)
+        assert document.title == 'T-Shirt'
+        assert 'Red T-Shirt Coton' in document.keywords
+        assert 'XL' in document.keywords
+
+    def test_search_follows_product_updates(self, product):
+        assert search_names('blue') == ['Blue Jeans']
+        product.name = 'Green Trousers'
+        product.save()
+        assert search_names('blue') == []
+        assert search_names('trou') == ['Green Trousers']
+
+    def test_search_follows_variants_and_attributes(self, product):
+        assert search_names('blue') == ['Blue Jeans']
+        variant = ProductVariantFactory(product=product, identifiant='Slim Fit')
+        assert search_names('slim') == ['Blue Jeans']
+        variant.delete()
+        assert search_names('slim') == []
+
+    def test_search_follows_category_rename(self, product):
+        category = product.category
+        category.name = 'Denim'
+        category.save()
+        assert search_names('denim') == ['Blue Jeans']
+
+    def test_unpublished_and_deleted_products_are_hidden(self, product):
+        assert search_names('jeans') == ['Blue Jeans']
+        product.status = 'draft'
+        product.save()
+        assert search_names('jeans') == []
+        product.status = 'published'
+        product.save()
+        product.delete()
+        assert search_names('jeans') == []
+
+    def test_index_loaded_from_documents(self, search_index, sample_products):
+        search_index.reset()
+        assert search_names('yog') == ['Yogurt']
+
+class TestSearchService:
+    def test_search_products(self, django_assert_max_num_queries, sample_products):
+        search_names('warm up')
+        with django_assert_max_num_queries(1):
+            results = container.product_service.search_products('cake')
+        assert results['total'] == 1
+        assert results['products'][0]['name'] == 'Red Velvet Cake'
+        assert results['products'][0]['image_url'] != ''
+        assert results['next_page'] is None
+
+    def test_search_products_pages(self, sample_products):
+        category = CategoryFactory(name='Books', slug='books')
+        for index in range(5):
+            ProductFactory(name=f'Python book {index}', category=category, status='published')
+        first = container.product_service.search_products('python', page_size=2)
+        last = container.product_service.search_products('python', page=3, page_size=2)
+        assert (first['total'], first['next_page']) == (5, 2)
+        assert (len(last['products']), last['next_page']) == (1, None)
+
+    def test_search_products_empty_query(self, sample_products):
+        results = container.product_service.search_products('  ')
+        assert (results['products'], results['total']) == ([], 0)
+
+class TestSearchView:
+    def test_search_view(self, client, sample_products):
+        response = client.get(reverse('search-products'), {'q' : 'black jea'})
+        json_response = json.loads(response.content.decode())
+        assert response.status_code == 200
+        assert json_response['total'] == 1
+        assert json_response['products'][0]['name'] == 'Black Jeans'
+
+    def test_search_view_invalid_page(self, client, sample_products):
+        response = client.get(reverse('search-products'), {'q' : 'yogurt', 'page' : 'abc'})
+        json_response = json.loads(response.content.decode())
+        assert json_response['page'] == 1
+        assert json_response['total'] == 1
+
+@pytest.mark.skipif(
+    not os.getenv('SEARCH_BENCHMARK'),
+    reason='benchmark, run with SEARCH_BENCHMARK=1'
+)
+def test_search_latency_benchmark():
+    """
+    p95 latency of ranked prefix queries over a 100k products catalog.
+
+    Run with : SEARCH_BENCHMARK=1 pytest apps/products/tests/test_search.py -k benchmark -s
+    Only the index is measured, loading the page of products afterwards is a
+    single primary key query whatever the size of the catalog.
+    """
+    catalog_size = int(os.getenv('SEARCH_BENCHMARK_SIZE', 100_000))
+    randomizer = random.Random(42)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    vocabulary = sorted({
+        ''.join(randomizer.choices(letters, k=randomizer.randint(4, 10))) for _ in range(5_000)
+    })
+    randomizer.shuffle(vocabulary)
+    # word frequencies follow a Zipf law, like real product names and descriptions
+    cum_frequencies = list(itertools.accumulate(1 / rank for rank in range(1, len(vocabulary) + 1)))
+    categories = vocabulary[:50]
+    index = InMemoryIndex()
+    for doc_id in range(catalog_size):
+        index.add(doc_id, {
+            'title' : ' '.join(randomizer.choices(vocabulary, cum_weights=cum_frequencies, k=3)),
+            'keywords' : ' '.join([randomizer.choice(categories)] + randomizer.choices(vocabulary, cum_weights=cum_frequencies, k=4)),
+            'body' : ' '.join(randomizer.choices(vocabulary, cum_weights=cum_frequencies, k=20))
+        })
+
+    queries = []
+    for _ in range(500):
+        words = randomizer.choices(vocabulary, cum_weights=cum_frequencies, k=randomizer.randint(1, 2))
+        queries.append(' '.join(word[:randomizer.randint(3, len(word))] for word in words))
+    queries += [category[:3] for category in categories]
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query, offset=0, limit=24)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000
+    print(f'\n{catalog_size} products, {len(queries)} queries : p95 = {p95:.2f} ms, max = {latencies[-1] * 1000:.2f} ms')
+    assert p95 < 50
@@ -30,10 +30,12 @@ class TestProductService:
         if isinstance(result, str):
             assert result == expected_count
         else:
-            item = result[0]
-            assert isinstance(result, list)
-            assert len(result) == expected_count
+            products = result['products']
+            item = products[0]
+            assert isinstance(products, list)
+            assert len(products) == expected_count
             assert len(item.keys()) == 9
+            assert result['next_cursor'] is None
     
     def test_list_products(self, sample_products):
         result = container.product_service.list_products()
@@ -42,6 +44,21 @@ class TestProductService:
         assert 'categories' in result.keys()
         assert len(result['products']) == 5
         assert len(result['categories']) == 3
+        assert result['next_cursor'] is None
+
+    def test_filter_by_category_pages(self, sample_products):
+        first_page = container.product_service.filter_products_by_category('All', page_size=2)
+        assert len(first_page['products']) == 2
+        second_page = container.product_service.filter_products_by_category(
+            'All', cursor=first_page['next_cursor'], page_size=2
+        )
+        assert len(second_page['products']) == 2
+        first_ids = {product['id'] for product in first_page['products']}
+        assert first_ids.isdisjoint(product['id'] for product in second_page['products'])
+
+    def test_filter_by_category_invalid_cursor(self, sample_products):
+        with pytest.raises(ValueError):
+            container.product_service.filter_products_by_category('All', cursor='not-a-cursor')
 
     def test_calculate_discount(self, product):
         product.old_price = 18.00
@@ -1,6 +1,8 @@
 import pytest
 import json
+import factory
 from django.urls import reverse
+from django.core.cache import cache
 from apps.conftest import \
 (
     variant_sku,
@@ -10,6 +12,15 @@ from apps.conftest import \
     sample_products,
     pytestmark
 )
+from apps.container import container
+from apps.products.pagination import DEFAULT_PAGE_SIZE
+from apps.products.cache import version_key
+from apps.factories import (
+    ProductFactory,
+    ProductImageFactory,
+    ProductVariantFactory,
+    CategoryFactory
+)
 
 @pytest.fixture
 def product_url():
@@ -77,4 +88,151 @@ class TestProductDetailView:
         assert 'attributes' in json_response
         assert attributes['Color'] == 'Red'
         assert attributes['Size'] == 'XL'
-        assert attributes['Material'] == 'Coton'
\ No newline at end of file
+        assert attributes['Material'] == 'Coton'
+class TestListProductViewQueries:
+    @pytest.mark.parametrize('catalog_size', [1, 25])
+    def test_list_product_constant_queries(self, client, django_assert_num_queries, product_url, catalog_size):
+        category = CategoryFactory(name='Catalog', slug='catalog')
+        for index in range(catalog_size):
+            product = ProductFactory(name=f'Product {index}', slug=f'product-{index}', category=category, status='published')
+            ProductImageFactory(product=product, image=factory.django.ImageField(color='red'))
+        # one query for the products with their image, one for the categories
+        with django_assert_num_queries(2):
+            response = client.get(product_url)
+        assert response.status_code == 200
+        assert len(response.context['products']) == min(catalog_size, DEFAULT_PAGE_SIZE)
+
+    @pytest.mark.parametrize('catalog_size', [1, 25])
+    def test_category_filter_constant_queries(self, client, django_assert_num_queries, catalog_size):
+        category = CategoryFactory(name='Shoes', slug='shoes')
+        for index in range(catalog_size):
+            product = ProductFactory(name=f'Product {index}', slug=f'product-{index}', category=category, status='published')
+            ProductImageFactory(product=product, image=factory.django.ImageField(color='red'))
+        with django_assert_num_queries(2):
+            response = client.post(reverse('filter-category', kwargs={'category':'Shoes'}))
+        assert len(json.loads(response.content.decode())['products']) == min(catalog_size, DEFAULT_PAGE_SIZE)
+
+class TestListingPagination:
+    def test_list_product_next_page(self, client, product_url, sample_products):
+        response = client.get(product_url, {'page_size' : 3})
+        next_cursor = response.context['next_cursor']
+        assert len(response.context['products']) == 3
+        assert next_cursor is not None
+        assert f'cursor={next_cursor}' in response.content.decode()
+
+        response = client.get(product_url, {'page_size' : 3, 'cursor' : next_cursor})
+        assert len(response.context['products']) == 2
+        assert response.context['next_cursor'] is None
+        assert 'First page' in response.content.decode()
+
+    def test_list_product_invalid_cursor(self, client, product_url, sample_products):
+        response = client.get(product_url, {'cursor' : 'invalid'})
+        assert response.status_code == 302
+        assert response.url == product_url
+
+    def test_category_filter_next_cursor(self, client, sample_products):
+        url = reverse('filter-category', kwargs={'category':'All'})
+        first_page = json.loads(client.post(url + '?page_size=4').content.decode())
+        assert len(first_page['products']) == 4
+        second_page = json.loads(client.post(url + f"?page_size=4&cursor={first_page['next_cursor']}").content.decode())
+        assert len(second_page['products']) == 1
+        assert second_page['next_cursor'] is None
+
+    def test_category_filter_invalid_cursor(self, client, sample_products):
+        response = client.post(reverse('filter-category', kwargs={'category':'All'}) + '?cursor=invalid')
+        assert response.status_code == 400
+        assert json.loads(response.content.decode())['status'] == 'error'
+
+class TestProductDetailCache:
+    def get_detail(self, client, slug):
+        return client.get(reverse('product-detail', kwargs={'slug' : slug}))
+
+    def test_cache_hit_without_queries(self, client, django_assert_num_queries, variant_product):
+        product = variant_product.product
+        self.get_detail(client, product.slug)
+        with django_assert_num_queries(0):
+            response = self.get_detail(client, product.slug)
+        html = response.content.decode('utf-8')
+        assert response.context['product']['name'] == 'T-Shirt'
+        assert response.context['attributes'] == {'Color' : 'Red', 'Size' : 'XL', 'Material' : 'Coton'}
+        assert 'Red T-Shirt Coton' in html
+
+    def test_product_save_invalidates(self, client, django_capture_on_commit_callbacks, product):
+        self.get_detail(client, product.slug)
+        with django_capture_on_commit_callbacks(execute=True):
+            product.price = 99
+            product.save()
+        assert self.get_detail(client, product.slug).context['product']['price'] == 99
+
+    def test_variant_and_image_changes_invalidate(self, client, django_capture_on_commit_callbacks, product):
+        self.get_detail(client, product.slug)
+        with django_capture_on_commit_callbacks(execute=True):
+            ProductVariantFactory(product=product, identifiant='Slim Fit')
+            ProductImageFactory(product=product, image=factory.django.ImageField(color='blue'))
+        detail = self.get_detail(client, product.slug).context['product']
+        assert [variant['identifiant'] for variant in detail['variants']] == ['Slim Fit']
+        assert len(detail['images']) == 2
+
+    def test_attribute_change_invalidates(self, client, django_capture_on_commit_callbacks, variant_product):
+        slug = variant_product.product.slug
+        self.get_detail(client, slug)
+        with django_capture_on_commit_callbacks(execute=True):
+            variant_product.attributes.get(attribute__name='Size').delete()
+        assert 'Size' not in self.get_detail(client, slug).context['attributes']
+
+    def test_invalidation_waits_for_commit(self, client, django_assert_num_queries, product):
+        self.get_detail(client, product.slug)
+        product.price = 99
+        product.save()
+        with django_assert_num_queries(0):
+            self.get_detail(client, product.slug)
+
+    def test_evicted_version_is_a_miss(self, client, django_assert_max_num_queries, product):
+        self.get_detail(client, product.slug)
+        cache.delete(version_key(product.id))
+        with django_assert_max_num_queries(5) as context:
+            self.get_detail(client, product.slug)
+        assert len(context.captured_queries) > 0
+
+class TestVariantPayloads:
+    def switch_variant(self, client, sku):
+        response = client.get(reverse('update-variant', kwargs={'product_sku' : sku}))
+        return json.loads(response.content.decode())
+
+    def test_warm_switch_without_queries(self, client, django_assert_num_queries, variant_product, variant_sku):
+        self.switch_variant(client, variant_sku)
+        self.switch_variant(client, variant_product.product.sku)
+        with django_assert_num_queries(0):
+            variant = self.switch_variant(client, variant_sku)
+            base = self.switch_variant(client, variant_product.product.sku)
+        assert (variant['message'], variant['title'], variant['price']) == ('variant', 'Red T-Shirt Coton', '31.00')
+        assert variant['attributes'] == {'Color' : 'Red', 'Size' : 'XL', 'Material' : 'Coton'}
+        assert (base['message'], base['title']) == ('no-variant', 'T-Shirt')
+
+    @pytest.mark.parametrize('variant_count', [1, 20])
+    def test_payloads_constant_queries(self, django_assert_num_queries, product, variant_count):
+        for index in range(variant_count):
+            ProductVariantFactory(product=product, identifiant=f'Variant {index}')
+        # product, images, variants, variant images, variant attributes
+        with django_assert_num_queries(5):
+            payloads = container.product_service.repository.get_variant_payloads(product.id)
+        assert len(payloads) == variant_count + 1
+        # variants without image show the image of the product
+        assert payloads[product.sku]['image'] != ''
+        assert {payload['image'] for payload in payloads.values()} == {payloads[product.sku]['image']}
+
+    def test_payloads_embedded_in_detail_page(self, client, variant_product, variant_sku):
+        response = client.get(reverse('product-detail', kwargs={'slug' : variant_product.product.slug}))
+        payloads = response.context['product']['variant_payloads']
+        assert payloads[variant_sku]['attributes']['Size'] == 'XL'
+        assert 'id="variant-payloads"' in response.content.decode('utf-8')
+
+    def test_attribute_change_invalidates(self, client, django_capture_on_commit_callbacks, variant_product, variant_sku):
+        self.switch_variant(client, variant_sku)
+        with django_capture_on_commit_callbacks(execute=True):
+            variant_product.attributes.get(attribute__name='Size').delete()
+            variant_product.price = 45
+            variant_product.save()
+        variant = self.switch_variant(client, variant_sku)
+        assert variant['attributes'] == {'Color' : 'Red', 'Material' : 'Coton'}
+        assert variant['price'] == '45.00'
@@ -2,6 +2,8 @@ from django.urls import path
 from .views import (
     ListProductsView,
     filter_category,
+    search_products,
+    filter_facets,
     ProductDetail,
     update_variant
 )
@@ -9,6 +11,8 @@ from .views import (
 urlpatterns = [
     path('', ListProductsView.as_view(), name='products'),
     path('filter-category/<category>', filter_category, name = 'filter-category'),
+    path('search/', search_products, name='search-products'),
+    path('facets/', filter_facets, name='filter-facets'),
     path('<slug>', ProductDetail.as_view(), name='product-detail'),
     path('update-variant/<product_sku>', update_variant, name='update-variant')
 ]
\ No newline at end of file
@@ -4,7 +4,9 @@ from django.views.generic import DetailView
 from .models import *
 from django.http import HttpResponse
 from django.shortcuts import render
+from django.shortcuts import redirect
 from apps.container import container
+from apps.cart.cart import Cart
 
 def filter_category(request, category : str):
     """
@@ -16,16 +18,32 @@ def filter_category(request, category : str):
         category (str): The category name used to filter products.
         Must match an existing category in the database.
 
+    Query parameters:
+        cursor (str, optional): next_cursor of the previous page
+        page_size (int, optional): number of products per page
+
     Returns:
-        - A JSON response containing the list of filtered products if successful.
-        If category is All , returns all products inside database.
+        - A JSON response containing one page of filtered products and the
+        next_cursor to request the following page (null on the last page).
+        If category is All , returns products of every category.
         
-        - A JSON response with a message error if category doesn't exists in database.
+        - A JSON response with a message error if category doesn't exists in database
+        or if the cursor is invalid.
     
         
     """
     if request.method == 'POST' or request.method == 'GET':
-        products = container.product_service.filter_products_by_category(category)
+        try:
+            products = container.product_service.filter_products_by_category(
+                category,
+                cursor=request.GET.get('cursor'),
+                page_size=request.GET.get('page_size')
+            )
+        except ValueError as error:
+            return JsonResponse({
+                'status' : 'error',
+                'message' : str(error)
+            }, status=400)
         if products == 'Error':
             return JsonResponse({
                 'status' : 'error',
@@ -34,9 +52,71 @@ def filter_category(request, category : str):
         else:
             return JsonResponse({
             'status' : 'success',
-            'products' : products
+            'products' : products['products'],
+            'next_cursor' : products['next_cursor']
          })
 
+def search_products(request):
+    """
+    Full-text search over published products.
+
+    Query parameters:
+        q (str): search query, every word must match. Words of two characters
+            or more also match as a prefix.
+        page (int, optional): page number, starting at 1
+        page_size (int, optional): number of products per page
+
+    Returns:
+        A JSON response containing one page of products ranked by relevance,
+        the total number of matches and the next page number (null on the last page).
+    """
+    results = container.product_service.search_products(
+        request.GET.get('q', ''),
+        page=request.GET.get('page'),
+        page_size=request.GET.get('page_size')
+    )
+    return JsonResponse({
+        'status' : 'success',
+        'products' : results['products'],
+        'total' : results['total'],
+        'page' : results['page'],
+        'next_page' : results['next_page']
+    })
+
+def filter_facets(request):
+    """
+    Faceted navigation over variants of published products.
+
+    Query parameters:
+        value (int, repeatable): selected attribute value primary keys. Values of
+            the same attribute are combined with OR, attributes with AND.
+        min_price, max_price (decimal, optional): price range, inclusive
+        page (int, optional): page number, starting at 1
+        page_size (int, optional): number of variants per page
+
+    Returns:
+        - A JSON response containing one page of matching variants, the total
+        number of matches, the facets with the count of each attribute value and
+        the price range of the matching variants.
+
+        - A JSON response with a message error (status 400) if an attribute value
+        or a price is invalid.
+    """
+    try:
+        results = container.product_service.filter_variants(
+            request.GET.getlist('value'),
+            min_price=request.GET.get('min_price'),
+            max_price=request.GET.get('max_price'),
+            page=request.GET.get('page'),
+            page_size=request.GET.get('page_size')
+        )
+    except ValueError as error:
+        return JsonResponse({
+            'status' : 'error',
+            'message' : str(error)
+        }, status=400)
+    return JsonResponse({'status' : 'success', **results})
+
 class ListProductsView(ListView):
     """
     Display a list of active products with optional filtering.
@@ -52,21 +132,31 @@ class ListProductsView(ListView):
 
     Method:
         get(request) :
-            Handles GET requests and return a list of products
+            Handles GET requests and return a page of products.
+            Accepts `cursor` and `page_size` query parameters.
     """
     model = Product
     context_object_name = 'products'
     template_name = 'products.html'
 
     def get(self, request): 
-        data = container.product_service.list_products()
+        try:
+            data = container.product_service.list_products(
+                cursor=request.GET.get('cursor'),
+                page_size=request.GET.get('page_size')
+            )
+        except ValueError:
+            return redirect('products')
         return render(
             request, 
             self.template_name , 
             {
                 'products' : data['products'],
                 'categories' : data['categories'],
-                'count' : len(request.session.get('cart', {})),
+                'next_cursor' : data['next_cursor'],
+                'page_size' : data['page_size'],
+                'is_first_page' : not request.GET.get('cursor'),
+                'count' : len(Cart.from_request(request)),
             }
         )
 
@@ -75,8 +165,9 @@ class ProductDetail(DetailView):
     Display a product with all its attributes.
 
     This Class Based View retrieves all products attributes from database.
-    It also retrieves variants if latter exists. The view supports both
-    HTML and JSON responses depending on the request type
+    It also retrieves variants if latter exists. The product data is served
+    from a versioned cache, so hot pages are rendered without any query.
+    The view supports both HTML and JSON responses depending on the request type
 
     Attributes:
         model (Product) : database model for products retrieval
@@ -92,21 +183,18 @@ class ProductDetail(DetailView):
 
     def get(self, request : HttpResponse, slug : str):
         try:
-            product = Product.objects.get(slug=slug)
+            product = container.product_service.get_product_detail(slug)
         except Product.DoesNotExist:
             return JsonResponse({'message' : f'Product with slug "{slug}" does\'t exist'})
 
-        variants = ProductVariant.objects.filter(product=product)
-        attributes = container.product_repo.get_variant_attribute(variants[0].id) if len(variants) > 0 else None
-        cart = request.session.get('cart', {})
         output = {
             'product' : product,
-            'variants' : variants,
-            'count' : len(cart)
+            'variants' : product['variants'],
+            'count' : len(Cart.from_request(request)) # lines counted without being loaded
         }
         
-        if attributes:
-            output['attributes'] = attributes
+        if product['attributes']:
+            output['attributes'] = product['attributes']
         return render(
             request, 
             self.template_name, 
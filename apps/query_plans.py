@@ -0,0 +1,143 @@
+"""
+Query plans of the SQL run by the repositories.
+
+A query served by a sequential (full) scan gets slower as its table grows,
+whatever the number of rows it returns, and so does a page whose rows are
+sorted after they are read instead of coming in the order of an index. These
+helpers run EXPLAIN on the queries captured while a block of code runs and
+report the tables the database reads in full and, on demand, the queries
+sorting their rows :
+
+    with assert_no_full_scans():
+        container.order_repo.retrieve_order_history(user)
+
+    with assert_no_full_scans(allow_sorts=False):
+        container.product_repo.get_listing_products(cursor=cursor)
+
+SQLite (tests) and PostgreSQL (production) plans are both understood.
+"""
+import re
+from contextlib import contextmanager
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+EXPLAIN = {
+    'sqlite' : 'EXPLAIN QUERY PLAN ',
+    'postgresql' : 'EXPLAIN ',
+}
+# SQLite : "SCAN orders_order" unless "USING [COVERING] INDEX" follows, and
+# "SEARCH orders_order USING INTEGER PRIMARY KEY (rowid>?)" which reads the
+# table from a primary key to its end (keyset batches filtered on other columns)
+# PostgreSQL : "Seq Scan on orders_order"
+FULL_SCAN = {
+    'sqlite' : [
+        re.compile(r'^SCAN (?!CONSTANT ROW)(?:TABLE )?(\w+)(?!.*USING (?:COVERING )?INDEX)'),
+        re.compile(r'^SEARCH (\w+) USING INTEGER PRIMARY KEY \(rowid>\?\)$'),
+    ],
+    'postgresql' : [re.compile(r'Seq Scan on (\w+)')],
+}
+# rows sorted after they are read because no index gives the ORDER BY
+# SQLite : "USE TEMP B-TREE FOR ORDER BY" of the outer query
+# PostgreSQL : "Sort" or "Incremental Sort" node before the first subplan
+SORT = {
+    'sqlite' : re.compile(r'^USE TEMP B-TREE FOR (?:RIGHT PART OF )?ORDER BY'),
+    'postgresql' : re.compile(r'^(?:->\s+)?(?:Incremental )?Sort\b'),
+}
+SUBPLAN = re.compile(r'^(?:SubPlan|InitPlan)\b')
+EXPLAINED = ('SELECT', 'UPDATE', 'DELETE')
+
+def explain(sql : str) -> list:
+    """
+    Plan of a query.
+
+    Args:
+        sql (str): query with its parameters inlined, as captured by CaptureQueriesContext
+
+    Returns:
+        list : lines of the plan
+
+    Raises:
+        ValueError : If the database isn't SQLite or PostgreSQL
+    """
+    return [str(row[-1]).strip() for row in _plan_rows(sql)]
+
+def _plan_rows(sql : str) -> list:
+    """ Rows returned by EXPLAIN, SQLite rows carry the id of their parent node """
+    if connection.vendor not in EXPLAIN:
+        raise ValueError(f'Query plans of {connection.vendor} are not supported')
+    with connection.cursor() as cursor:
+        cursor.execute(EXPLAIN[connection.vendor] + sql)
+        return cursor.fetchall()
+
+def full_scans(sql : str) -> list:
+    """
+    Tables read in full by a query.
+
+    Args:
+        sql (str): query with its parameters inlined
+
+    Returns:
+        list : names of the tables scanned sequentially, empty if the query
+            only uses indexes (or isn't a read, update or delete)
+    """
+    if not sql.lstrip().upper().startswith(EXPLAINED):
+        return []
+    tables = set(connection.introspection.table_names())
+    scans = [
+        match.group(1) for line in explain(sql) for pattern in FULL_SCAN[connection.vendor]
+        if (match := pattern.search(line))
+    ]
+    # subqueries are scanned too, their rows come from the plan lines above
+    return [table for table in scans if table in tables]
+
+def sorts(sql : str) -> bool:
+    """
+    Whether a query sorts the rows it reads instead of reading them in index order.
+
+    Sorts done by subqueries aren't reported, only the one of the outer query.
+
+    Args:
+        sql (str): query with its parameters inlined
+
+    Returns:
+        bool : True if the ORDER BY of the query isn't served by an index
+    """
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return False
+    rows = _plan_rows(sql)
+    if connection.vendor == 'sqlite':
+        # (id, parent, notused, detail) : the outer query nodes have no parent
+        return any(row[1] == 0 and SORT['sqlite'].search(row[-1]) for row in rows)
+    for row in rows:
+        line = str(row[-1]).strip()
+        if SUBPLAN.search(line):
+            return False
+        if SORT['postgresql'].search(line):
+            return True
+    return False
+
+@contextmanager
+def assert_no_full_scans(ignore : tuple = (), allow_sorts : bool = True):
+    """
+    Fail if a query run inside the block reads a table in full.
+
+    Args:
+        ignore (tuple, optional): tables allowed to be scanned (small lookup tables)
+        allow_sorts (bool, optional): if False, also fail if a query sorts its
+            rows instead of reading them in the order of an index (keyset pages)
+
+    Raises:
+        AssertionError : listing every query scanning a table or sorting and its plan
+    """
+    with CaptureQueriesContext(connection) as queries:
+        yield queries
+    failures = []
+    for query in queries.captured_queries:
+        problems = [f'{table} scanned' for table in full_scans(query['sql']) if table not in ignore]
+        if not allow_sorts and sorts(query['sql']):
+            problems.append('rows sorted')
+        if problems:
+            plan = '\n    '.join(explain(query['sql']))
+            failures.append(f"{', '.join(problems)} by {query['sql']}\n    {plan}")
+    if failures:
+        raise AssertionError('Unindexed queries :\n' + '\n'.join(failures))
@@ -32,6 +32,9 @@ export DJANGO_SETTINGS_MODULE=shop_ai.settings.production
 echo "Applying database migrations..."
 python manage.py migrate --noinput --settings=shop_ai.settings.production
 
+echo "Creating the cache table..."
+python manage.py createcachetable --settings=shop_ai.settings.production
+
 echo "Collecting static files..."
 python manage.py collectstatic --noinput --clear --settings=shop_ai.settings.production
 
@@ -42,6 +42,7 @@ INSTALLED_APPS = [
     'apps.cart',
     'apps.checkout',
     'apps.orders',
+    'apps.pricing',
     'crispy_forms',
     'crispy_bootstrap5',
     'social_django',
@@ -90,6 +91,29 @@ DATABASES = {
     )
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/ref/settings/#caches
+# The cache must be shared by every process (gunicorn workers, process_webhooks,
+# reconcile_payments) : the version tokens of the product, facet and pricing
+# caches and the Stripe call counters only reach the other processes through it.
+# REDIS_URL selects Redis (redis package), the database cache is used otherwise,
+# its table is created by `python manage.py createcachetable`.
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'django_cache',
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -188,11 +212,26 @@ EMAIL_HOST_USER = 'ratremarakoto@gmail.com'
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 
 CART_SESSION_ID = "cart"
+# 'session' : whole cart in the session, 'database' : sku -> quantity rows (apps/cart/storage.py)
+CART_STORAGE = os.getenv('CART_STORAGE', 'session')
+# default VAT in percent and flat shipping fee, when no TaxRate / ShippingRate applies (apps/pricing)
+CART_VAT_RATE = os.getenv('CART_VAT_RATE', '20')
+CART_SHIPPING_FEE = os.getenv('CART_SHIPPING_FEE', '120')
+# seconds the stock of an unpaid order stays reserved, the Stripe session expires with it (30 minutes at least)
+STOCK_RESERVATION_TTL = int(os.getenv('STOCK_RESERVATION_TTL', 30 * 60))
 
 # STRIPE CREDENTIALS
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
 STRIPE_PUB_KEY = os.getenv('STRIPE_PUB_KEY')
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
+# seconds a Stripe checkout session read is reused along the payment success path
+STRIPE_SESSION_CACHE_TIMEOUT = int(os.getenv('STRIPE_SESSION_CACHE_TIMEOUT', 60))
+# seconds a Stripe payment stays pending before reconcile_payments reads its session
+PAYMENT_RECONCILE_MIN_AGE = int(os.getenv('PAYMENT_RECONCILE_MIN_AGE', 10 * 60))
+# local directory of the stored receipts of paid orders (apps/orders/receipts.py),
+# PDF receipts need WeasyPrint
+RECEIPT_ROOT = os.getenv('RECEIPT_ROOT', str(BASE_DIR / 'receipts'))
+RECEIPT_PDF = os.getenv('RECEIPT_PDF', 'false').lower() == 'true'
 
 # Admin credentials
 ADMIN_USER = os.getenv('ADMIN_USER')
@@ -50,6 +50,7 @@ INSTALLED_APPS = [
     'apps.cart',
     'apps.checkout',
     'apps.orders',
+    'apps.pricing',
     'crispy_forms',
     'crispy_bootstrap5',
     'social_django',
@@ -108,6 +109,29 @@ DATABASES = {
 
 print(f"--- FINAL ATTEMPT ENGINE: {DATABASES['default']['ENGINE']} ---")
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/ref/settings/#caches
+# The cache must be shared by every process (gunicorn workers, process_webhooks,
+# reconcile_payments) : the version tokens of the product, facet and pricing
+# caches and the Stripe call counters only reach the other processes through it.
+# REDIS_URL selects Redis (redis package), the database cache is used otherwise,
+# its table is created by `python manage.py createcachetable`.
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'django_cache',
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -207,6 +231,13 @@ EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 EMAIL_TIMEOUT = 15
 
 CART_SESSION_ID = "cart"
+# 'session' : whole cart in the session, 'database' : sku -> quantity rows (apps/cart/storage.py)
+CART_STORAGE = os.getenv('CART_STORAGE', 'session')
+# default VAT in percent and flat shipping fee, when no TaxRate / ShippingRate applies (apps/pricing)
+CART_VAT_RATE = os.getenv('CART_VAT_RATE', '20')
+CART_SHIPPING_FEE = os.getenv('CART_SHIPPING_FEE', '120')
+# seconds the stock of an unpaid order stays reserved, the Stripe session expires with it (30 minutes at least)
+STOCK_RESERVATION_TTL = int(os.getenv('STOCK_RESERVATION_TTL', 30 * 60))
 
 # STRIPE CREDENTIALS
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
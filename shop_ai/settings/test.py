@@ -38,4 +38,11 @@ DATABASES = {
     }
 }
 
+# 7. Tests run in a single process, a local memory cache is shared enough
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 DOMAIN_URL = 'http://localhost:8000/'
\ No newline at end of file
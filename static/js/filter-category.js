@@ -5,34 +5,41 @@ let form = document.getElementById('form-category');
 if (category && form) {
     const csrftoken = getCookie('csrftoken');
 
-    category.onchange = (e) => {
+    // Fetch one page of the selected category, append it when a cursor is given
+    const loadCategory = (cursor) => {
+        const params = new URLSearchParams();
+        if (cursor) {
+            params.set('cursor', cursor);
+        }
 
         const request = new Request(
-            `filter-category/${category.value}`,
+            `filter-category/${category.value}?${params.toString()}`,
             {
                 method: 'POST',
                 headers: {
                     'X-CSRFToken': csrftoken,
-                    'Content-Type': 'application/json' 
+                    'Content-Type': 'application/json'
                 },
-                mode: 'same-origin', 
+                mode: 'same-origin',
                 body: JSON.stringify({ 'category' : category.value})
             }
         );
-        
+
 
         fetch(request)
             .then(response => response.json())
             .then(data => {
                 const container = document.getElementById('productContainer');
-                container.innerHTML = '';
+                if (!cursor) {
+                    container.innerHTML = '';
+                }
                 if (data.status == 'success'){
-                
+
                     data.products.forEach(product => {
-                        
+
                         const discountBadge = product.discount > 0 ? `<span class="badge-discount">-${product.discount}%</span>` : '';
                         const oldPrice = product.old_price > 0 ? `<span class="old-price">$${product.old_price}</span>` : '';
-    
+
                         const productHTML = `
               <div class="product-card position-relative">
                 ${discountBadge}
@@ -46,31 +53,50 @@ if (category && form) {
                     ${oldPrice}
                   </div>
                 </div>
-                
+
                 <button stlyle="padding-left:15px" class="btn btn-primary btn-sm">
                     <a href="${product['product-url']}" class="text-white text-decoration-none">
                     View product
-                    </a> 
+                    </a>
                     <i class="bi bi-eye text-white"></i>
                 </button>
                 <br>
                 <br>
               </div>
             `;
-    
+
                 container.insertAdjacentHTML('beforeend', productHTML);
 
                     });
-                
-                    
+
+                    renderPageControls(data.next_cursor);
                 }
 
             })
             .catch(error => {
                 console.error('Error:', error);
             });
-        
+    };
 
+    // Replace the listing page links by a "Load more" button for the filtered listing
+    const renderPageControls = (nextCursor) => {
+        const controls = document.getElementById('pageControls');
+        if (!controls) {
+            return;
+        }
+        controls.innerHTML = '';
+        if (nextCursor) {
+            const loadMore = document.createElement('button');
+            loadMore.className = 'btn btn-primary btn-sm';
+            loadMore.type = 'button';
+            loadMore.textContent = 'Load more';
+            loadMore.onclick = () => loadCategory(nextCursor);
+            controls.appendChild(loadMore);
+        }
     };
-       
-}
\ No newline at end of file
+
+    category.onchange = (e) => {
+        loadCategory(null);
+    };
+
+}
@@ -29,6 +29,77 @@ document.querySelectorAll('.thumbnail').forEach(thumbnail => {
 let formVariant = document.getElementById("form-variant");
 let productVariantSelect = document.getElementById('variantSelect');
 
+// payloads of every variant, embedded in the page : switching needs no request
+const variantPayloadsElement = document.getElementById('variant-payloads');
+const variantPayloads = variantPayloadsElement ? JSON.parse(variantPayloadsElement.textContent) : {};
+
+function renderVariant(data){
+    let product_title = document.getElementById('product-title');
+    let product_price = document.getElementById('product-price');
+    let product_old_price = document.getElementById('old-price');
+    let product_stock = document.getElementById('stock');
+    let product_image = document.getElementById('image-active');
+    let product_images = document.getElementById('thumbnail-carousel img').firstElementChild;
+    
+    const liste = document.getElementById('variant-list');
+    
+    if (parseInt(data['old_price']) == 0){
+        product_old_price.innerHTML = "";
+    }
+    else{    
+        product_old_price.innerHTML = "";
+        product_old_price.innerHTML = `$${data['old_price']}`;
+    
+    }
+
+    if (data['product_type'] == "variant"){
+    
+    product_image.src = data['image'];
+    product_images.src = data['image'];
+    product_title.innerHTML = data['title'];
+    product_price.innerHTML = `$${data['price']}`;
+    product_stock.innerHTML = `In Stock - ${data['stock']} available`;   
+    if (data['stock'] == 0){
+        product_stock.innerHTML = 'Out of stock';
+        product_stock.style.color = '#f44336';
+        document.getElementById("add-to-cart").style.display = "none";
+    }
+    else {
+        product_stock.style.color = 'green';
+        document.getElementById("add-to-cart").style.display = 'block';
+    }
+    //
+    document.getElementById("product-quantity").value = 1;
+    liste.innerHTML = '';
+    let attributes = Object.entries(data.attributes);
+    
+    for (let attr of attributes){;
+        const elementHTML = `
+        
+            <li class="list-group-item d-flex justify-content-between align-items-center">
+                <p>${attr[0]}</p>
+                <span id="attribute-value" class="badge rounded-pill bg-warning" >${attr[1]}</span>
+            </li>
+
+        `
+        liste.insertAdjacentHTML('beforeend', elementHTML);
+    
+    };
+
+    }
+
+    else {
+
+        product_title.innerHTML = data['title'];
+        product_price.innerHTML = `\$${data['price']}`;
+        product_stock.innerHTML = `In Stock - ${data['stock']} available`;    
+        product_image.src = data['image'];
+        product_images.src = data['image'];
+        liste.innerHTML = '';
+
+    }
+}
+
 if (productVariantSelect){
 
     productVariantSelect.onchange = (event) => {
@@ -36,6 +107,11 @@ if (productVariantSelect){
         const csrftoken = getCookie('csrftoken');
         let productSku = productVariantSelect.value;
         productSkutoSend.value = productSku;
+
+        if (variantPayloads[productSku]){
+            renderVariant(variantPayloads[productSku]);
+            return;
+        }
         
         const request = new Request(
             `update-variant/${productSku}`,
@@ -53,76 +129,7 @@ if (productVariantSelect){
         
         fetch(request)
                 .then(response => response.json())
-                .then(data => {
-                    let product_title = document.getElementById('product-title');
-                    let product_price = document.getElementById('product-price');
-                    let product_old_price = document.getElementById('old-price');
-                    let product_stock = document.getElementById('stock');
-                    let product_image = document.getElementById('image-active');
-                    let product_images = document.getElementById('thumbnail-carousel img').firstElementChild;
-                    
-                    const liste = document.getElementById('variant-list');
-                    
-                    if (parseInt(data['old_price']) == 0){
-                        product_old_price.innerHTML = "";
-                    }
-                    else{    
-                        product_old_price.innerHTML = "";
-                        product_old_price.innerHTML = `$${data['old_price']}`;
-                    
-                    }
-
-                    if (data['message'] == "variant"){
-                    
-                    product_image.src = data['image'];
-                    product_images.src = data['image'];
-                    product_title.innerHTML = data['title'];
-                    product_price.innerHTML = `$${data['price']}`;
-                    product_stock.innerHTML = `In Stock - ${data['stock']} available`;   
-                    if (data['stock'] == 0){
-                        product_stock.innerHTML = 'Out of stock';
-                        product_stock.style.color = '#f44336';
-                        document.getElementById("add-to-cart").style.display = "none";
-                    }
-                    else {
-                        product_stock.style.color = 'green';
-                        document.getElementById("add-to-cart").style.display = 'block';
-                    }
-                    //
-                    document.getElementById("product-quantity").value = 1;
-                    liste.innerHTML = '';
-                    let attributes = Object.entries(data.attributes);
-                    
-                    for (let attr of attributes){;
-                        const elementHTML = `
-                        
-                            <li class="list-group-item d-flex justify-content-between align-items-center">
-                                <p>${attr[0]}</p>
-                                <span id="attribute-value" class="badge rounded-pill bg-warning" >${attr[1]}</span>
-                            </li>
-    
-                        `
-                        liste.insertAdjacentHTML('beforeend', elementHTML);
-                    
-                    };
-    
-                }
-    
-                else {
-    
-                    product_title.innerHTML = data['title'];
-                    product_price.innerHTML = `\$${data['price']}`;
-                    product_stock.innerHTML = `In Stock - ${data['stock']} available`;    
-                    product_image.src = data['image'];
-                    product_images.src = data['image'];
-                    liste.innerHTML = '';
-    
-                }
-                
-    
-                });
-    
-    
+                .then(data => renderVariant(data));
     
     }
     